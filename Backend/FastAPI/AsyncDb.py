@@ -0,0 +1,185 @@
+from fastapi import FastAPI, Request
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Optional, Tuple
+import os
+import asyncio
+
+try:
+    from .RequestDb import count_checkout
+except ImportError:
+    from RequestDb import count_checkout
+
+try:
+    import psycopg
+    from psycopg_pool import AsyncConnectionPool
+except Exception:
+    psycopg = None
+    AsyncConnectionPool = None
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(str(os.getenv(name, "") or "").strip() or default)
+    except Exception:
+        return default
+
+
+class AsyncDb:
+    """Acesso assíncrono ao PostgreSQL para rotas `async def`.
+
+    Mantém um `AsyncConnectionPool` por DSN (criado na primeira conexão) e resolve o
+    tenant pelo header X-Tenant como `get_conn_for_request`: captar ou tenant sem DSN
+    usam o banco central. A conexão faz commit na saída do bloco e rollback em erro.
+    O tenant vem do `TenantResolver`; só uma falta no cache dele sai do event loop.
+    Com `budget` (o `PoolManager`), cada pool reserva seu `max_size` no mesmo
+    DB_POOL_MAX_TOTAL dos pools síncronos e pode ser criado menor se o orçamento acabar.
+    """
+
+    def __init__(
+        self,
+        default_dsn: str,
+        db_schema: str,
+        tenant_resolver: Any,
+        fallback_dsn: Optional[str] = None,
+        budget: Optional[Any] = None,
+    ):
+        self.default_dsn = default_dsn
+        self._budget = budget
+        self._tenant_resolver = tenant_resolver
+        self.fallback_dsn = fallback_dsn
+        self._schema = str(db_schema or "captar").replace('"', '""')
+        self.max_size = max(1, _env_int("ASYNC_DB_POOL_MAX", 10))
+        self.timeout = max(1, _env_int("ASYNC_DB_POOL_TIMEOUT", 30))
+        self._central: Optional[str] = None
+        self._pools: Dict[str, Tuple[Any, Any]] = {}
+        self._lock: Optional[asyncio.Lock] = None
+        self._lock_loop: Any = None
+
+    @property
+    def available(self) -> bool:
+        return AsyncConnectionPool is not None
+
+    async def _configure(self, conn) -> None:
+        await conn.set_autocommit(True)
+        await conn.execute(f'SET search_path TO "{self._schema}", public')
+        await conn.set_autocommit(False)
+
+    async def _pool(self, dsn: str):
+        loop = asyncio.get_running_loop()
+        ent = self._pools.get(dsn)
+        if ent and ent[1] is loop:
+            return ent[0]
+        if self._lock is None or self._lock_loop is not loop:
+            self._lock, self._lock_loop = asyncio.Lock(), loop
+        async with self._lock:
+            ent = self._pools.get(dsn)
+            if ent and ent[1] is loop:
+                return ent[0]
+            max_size = self.max_size
+            if self._budget is not None:
+                max_size = await asyncio.to_thread(self._budget.reserve, f"async:{dsn}", self.max_size)
+            pool = AsyncConnectionPool(
+                dsn,
+                min_size=1,
+                max_size=max_size,
+                timeout=self.timeout,
+                open=False,
+                configure=self._configure,
+                name=f"async:{len(self._pools)}",
+            )
+            await pool.open(wait=False)
+            self._pools[dsn] = (pool, loop)
+            return pool
+
+    async def _central_dsn(self) -> str:
+        if self._central is None:
+            self._central = self.default_dsn
+            if self.fallback_dsn:
+                try:
+                    conn = await psycopg.AsyncConnection.connect(self.default_dsn, connect_timeout=5)
+                    await conn.close()
+                except Exception:
+                    self._central = self.fallback_dsn
+        return self._central
+
+    @asynccontextmanager
+    async def connection(self, dsn: Optional[str] = None):
+        if not self.available:
+            raise RuntimeError("psycopg_pool.AsyncConnectionPool indisponível")
+        use_dsn = dsn.strip() if (dsn and dsn.strip()) else await self._central_dsn()
+        pool = await self._pool(use_dsn)
+        async with pool.connection() as conn:
+            count_checkout()
+            yield conn
+
+    async def _tenant(self, slug: Any):
+        hit, ctx = self._tenant_resolver.cached(slug)
+        if hit:
+            return ctx
+        return await asyncio.to_thread(self._tenant_resolver.resolve, slug)
+
+    async def tenant_dsn(self, slug: str) -> Optional[str]:
+        ctx = await self._tenant(slug)
+        return ctx.dsn if ctx else None
+
+    async def dsn_for_request(self, request: Optional[Request]) -> Optional[str]:
+        slug = str((request and request.headers.get("X-Tenant")) or "captar").lower()
+        if slug == "captar":
+            return None
+        return await self.tenant_dsn(slug)
+
+    @asynccontextmanager
+    async def connection_for_request(self, request: Optional[Request]):
+        async with self.connection(await self.dsn_for_request(request)) as conn:
+            yield conn
+
+    @asynccontextmanager
+    async def tenant_connection(self, request: Optional[Request]):
+        """(id do tenant, conexão) com uma só resolução do tenant e uma só retirada do
+        pool; equivale a `tenant_id_for_request` + `connection_for_request`."""
+        slug = str((request and request.headers.get("X-Tenant")) or "captar").lower()
+        ctx = await self._tenant(slug)
+        dsn = ctx.dsn if (ctx is not None and slug != "captar") else None
+        async with self.connection(dsn) as conn:
+            yield (ctx.id if ctx else 1), conn
+
+    async def tenant_id_for_request(self, request: Optional[Request]) -> int:
+        """Mesmo resultado de `_tenant_id_from_header` (1 quando o slug não existe)."""
+        ctx = await self._tenant((request and request.headers.get("X-Tenant")) or "captar")
+        return ctx.id if ctx else 1
+
+    async def close(self) -> None:
+        items = list(self._pools.items())
+        self._pools.clear()
+        for dsn, (pool, _loop) in items:
+            try:
+                await pool.close()
+            except Exception:
+                pass
+            if self._budget is not None:
+                self._budget.release(f"async:{dsn}")
+
+    def snapshot(self) -> Dict[str, Any]:
+        pools = []
+        for dsn, (pool, _loop) in list(self._pools.items()):
+            try:
+                stats = pool.get_stats()
+            except Exception:
+                stats = {}
+            pools.append({
+                "central": dsn == self._central,
+                "size": stats.get("pool_size"),
+                "available": stats.get("pool_available"),
+                "waiting": stats.get("requests_waiting"),
+            })
+        return {"available": self.available, "max_size": self.max_size, "pools": pools}
+
+
+def register_async_db(app: FastAPI, async_db: AsyncDb):
+    @app.on_event("shutdown")
+    async def close_async_db():
+        await async_db.close()
+
+    @app.get("/api/admin/async-db")
+    async def admin_async_db():
+        return async_db.snapshot()
@@ -0,0 +1,298 @@
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+import json
+
+try:
+    from .SimNaoIndex import phone_key
+except ImportError:
+    from SimNaoIndex import phone_key
+
+
+_PHONE_KEYS = ("whatsapp", "celular", "telefone", "phone", "numero", "Número", "Numero", "destino", "Destinatario", "destinatario", "to")
+_NAME_KEYS = ("nome", "Nome", "NOME", "nome_destinatario", "nomeDestinatario", "nome_destino", "destinatario_nome")
+
+
+def _first(c: Dict[str, Any], keys: Tuple[str, ...]) -> Any:
+    for k in keys:
+        v = c.get(k)
+        if v:
+            return v
+    return None
+
+
+def _parse_ts(v: Any) -> Optional[datetime]:
+    if isinstance(v, datetime):
+        dt = v
+    else:
+        s = str(v or "").strip()
+        if not s:
+            return None
+        try:
+            dt = datetime.fromisoformat(s.replace("Z", "+00:00"))
+        except Exception:
+            return None
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
+
+
+def _resposta(c: Dict[str, Any]) -> Optional[int]:
+    v = c.get("resposta")
+    if v in (1, 2, "1", "2") and not isinstance(v, bool):
+        return int(v)
+    return None
+
+
+def contato_row(c: Dict[str, Any]) -> Tuple[str, str, Optional[str], Optional[str], Optional[datetime], Optional[int], Optional[datetime]]:
+    """(Numero, Chave, Nome, Status, EnviadoEm, Resposta, RespondidoEm) de um contato do anexo."""
+    numero = "".join([ch for ch in str(_first(c, _PHONE_KEYS) or "") if ch.isdigit()])
+    nome = str(_first(c, _NAME_KEYS) or "").strip() or None
+    status = str(c.get("status") or "").strip() or None
+    enviado = _parse_ts(c.get("enviado_em") or c.get("enviadoEm") or c.get("sent_at") or c.get("sentAt"))
+    respondido = _parse_ts(c.get("respondido_em") or c.get("respondidoEm") or c.get("replied_at") or c.get("repliedAt"))
+    return numero, phone_key(numero), nome, status, enviado, _resposta(c), respondido
+
+
+def split_anexo_contacts(anexo: Any) -> Tuple[Any, Optional[List[Dict[str, Any]]]]:
+    """Separa a lista de contatos do AnexoJSON. Retorna (anexo sem "contacts", contatos ou None)."""
+    obj = anexo
+    if isinstance(obj, (str, bytes)):
+        try:
+            obj = json.loads(obj)
+        except Exception:
+            return anexo, None
+    if isinstance(obj, list):
+        return {}, [x for x in obj if isinstance(x, dict)]
+    if isinstance(obj, dict) and isinstance(obj.get("contacts"), list):
+        rest = {k: v for k, v in obj.items() if k != "contacts"}
+        return rest, [x for x in obj["contacts"] if isinstance(x, dict)]
+    return obj, None
+
+
+def contato_json_sql(alias: str = "cc") -> str:
+    """Contato como JSON: o registro original com o estado atual (envio/resposta) por cima."""
+    return (
+        f'{alias}."Dados" || JSONB_STRIP_NULLS(JSONB_BUILD_OBJECT('
+        f"'status', {alias}.\"Status\", 'enviado_em', {alias}.\"EnviadoEm\", "
+        f"'resposta', {alias}.\"Resposta\", 'respondido_em', {alias}.\"RespondidoEm\"))"
+    )
+
+
+def ensure_campanha_contatos(cur, db_schema: str) -> List[str]:
+    """Cria "CampanhaContatos" e migra as listas de contatos ainda guardadas em
+    "Campanhas"."AnexoJSON". Deve rodar com autocommit, depois de "Campanhas"."""
+    actions: List[str] = []
+    cur.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS "{db_schema}"."CampanhaContatos" (
+            "IdTenant" INT NOT NULL,
+            "IdCampanha" INT NOT NULL REFERENCES "{db_schema}"."Campanhas" ("IdCampanha") ON DELETE CASCADE,
+            "Ordem" INT NOT NULL,
+            "Numero" TEXT NOT NULL DEFAULT '',
+            "Chave" TEXT NOT NULL DEFAULT '',
+            "Nome" TEXT,
+            "Dados" JSONB NOT NULL DEFAULT '{{}}'::jsonb,
+            "Status" TEXT,
+            "EnviadoEm" TIMESTAMP,
+            "Resposta" SMALLINT,
+            "RespondidoEm" TIMESTAMP,
+            PRIMARY KEY ("IdTenant", "IdCampanha", "Ordem")
+        )
+        """
+    )
+    try:
+        cur.execute(f'CREATE INDEX IF NOT EXISTS "idx_campanha_contatos_chave" ON "{db_schema}"."CampanhaContatos" ("IdTenant", "IdCampanha", "Chave")')
+    except Exception:
+        pass
+    actions.append("CampanhaContatos ensured")
+    cur.execute(
+        f"""
+        SELECT "IdCampanha", "IdTenant"
+        FROM "{db_schema}"."Campanhas"
+        WHERE "IdTenant" IS NOT NULL
+          AND (JSONB_TYPEOF("AnexoJSON") = 'array' OR JSONB_TYPEOF("AnexoJSON"->'contacts') = 'array')
+        ORDER BY "IdCampanha"
+        """
+    )
+    pendentes = cur.fetchall() or []
+    migrados = 0
+    for campanha_id, tid in pendentes:
+        try:
+            cur.execute(f'SELECT "AnexoJSON" FROM "{db_schema}"."Campanhas" WHERE "IdCampanha" = %s', (int(campanha_id),))
+            row = cur.fetchone()
+            rest, contatos = split_anexo_contacts(row[0] if row else None)
+            if contatos is None:
+                continue
+            save_campanha_contatos(cur, db_schema, int(tid), int(campanha_id), contatos, replace=False)
+            cur.execute(
+                f'UPDATE "{db_schema}"."Campanhas" SET "AnexoJSON" = %s::jsonb WHERE "IdCampanha" = %s',
+                (json.dumps(rest, ensure_ascii=False), int(campanha_id)),
+            )
+            migrados += 1
+        except Exception as e:
+            actions.append(f"CampanhaContatos backfill campanha {campanha_id}: {str(e)}")
+    if pendentes:
+        actions.append(f"CampanhaContatos backfill: {migrados} campanhas")
+    return actions
+
+
+def save_campanha_contatos(cur, db_schema: str, tid: int, campanha_id: int, contatos: List[Dict[str, Any]], replace: bool = False) -> int:
+    """Grava a lista de contatos da campanha (posição = "Ordem").
+
+    Com replace=True a lista anterior é descartada (novo arquivo). Sem replace as linhas são
+    atualizadas por posição e a resposta já registrada é mantida quando o telefone é o mesmo.
+    """
+    if replace:
+        cur.execute(
+            f'DELETE FROM "{db_schema}"."CampanhaContatos" WHERE "IdTenant" = %s AND "IdCampanha" = %s',
+            (int(tid), int(campanha_id)),
+        )
+    rows: List[Tuple[Any, ...]] = []
+    for ordem, c in enumerate(contatos):
+        numero, chave, nome, status, enviado, resposta, respondido = contato_row(c)
+        rows.append((int(tid), int(campanha_id), ordem, numero, chave, nome, json.dumps(c, ensure_ascii=False, default=str), status, enviado, resposta, respondido))
+    if rows:
+        cur.executemany(
+            f"""
+            INSERT INTO "{db_schema}"."CampanhaContatos" AS cc
+            ("IdTenant", "IdCampanha", "Ordem", "Numero", "Chave", "Nome", "Dados", "Status", "EnviadoEm", "Resposta", "RespondidoEm")
+            VALUES (%s, %s, %s, %s, %s, %s, %s::jsonb, %s, %s, %s, %s)
+            ON CONFLICT ("IdTenant", "IdCampanha", "Ordem") DO UPDATE
+            SET "Numero" = EXCLUDED."Numero",
+                "Chave" = EXCLUDED."Chave",
+                "Nome" = EXCLUDED."Nome",
+                "Dados" = EXCLUDED."Dados",
+                "Status" = COALESCE(EXCLUDED."Status", CASE WHEN cc."Chave" = EXCLUDED."Chave" THEN cc."Status" END),
+                "EnviadoEm" = COALESCE(EXCLUDED."EnviadoEm", CASE WHEN cc."Chave" = EXCLUDED."Chave" THEN cc."EnviadoEm" END),
+                "Resposta" = COALESCE(EXCLUDED."Resposta", CASE WHEN cc."Chave" = EXCLUDED."Chave" THEN cc."Resposta" END),
+                "RespondidoEm" = COALESCE(EXCLUDED."RespondidoEm", CASE WHEN cc."Chave" = EXCLUDED."Chave" THEN cc."RespondidoEm" END)
+            """,
+            rows,
+        )
+    if not replace:
+        cur.execute(
+            f'DELETE FROM "{db_schema}"."CampanhaContatos" WHERE "IdTenant" = %s AND "IdCampanha" = %s AND "Ordem" >= %s',
+            (int(tid), int(campanha_id), len(rows)),
+        )
+    return len(rows)
+
+
+def list_campanha_contatos(cur, db_schema: str, tid: int, campanha_id: int, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    cur.execute(
+        f"""
+        SELECT {contato_json_sql("cc")}
+        FROM "{db_schema}"."CampanhaContatos" cc
+        WHERE cc."IdTenant" = %s AND cc."IdCampanha" = %s
+        ORDER BY cc."Ordem"
+        LIMIT %s
+        """,
+        (int(tid), int(campanha_id), int(limit) if limit is not None else None),
+    )
+    out: List[Dict[str, Any]] = []
+    for (rec,) in cur.fetchall() or []:
+        if isinstance(rec, str):
+            rec = json.loads(rec)
+        if isinstance(rec, dict):
+            out.append(rec)
+    return out
+
+
+def _campanhas_contatos_query(db_schema: str, tid: int, campanha_ids: List[int]) -> Tuple[str, Tuple[Any, ...]]:
+    sql = f"""
+        SELECT cc."IdCampanha", JSONB_AGG({contato_json_sql("cc")} ORDER BY cc."Ordem")
+        FROM "{db_schema}"."CampanhaContatos" cc
+        WHERE cc."IdTenant" = %s AND cc."IdCampanha" = ANY(%s)
+        GROUP BY cc."IdCampanha"
+        """
+    return sql, (int(tid), [int(x) for x in campanha_ids])
+
+
+def campanhas_contatos_json(cur, db_schema: str, tid: int, campanha_ids: List[int]) -> Dict[int, Any]:
+    """Listas de contatos (JSON) de várias campanhas em uma consulta."""
+    if not campanha_ids:
+        return {}
+    cur.execute(*_campanhas_contatos_query(db_schema, tid, campanha_ids))
+    return {int(r[0]): r[1] for r in cur.fetchall() or []}
+
+
+async def campanhas_contatos_json_async(cur, db_schema: str, tid: int, campanha_ids: List[int]) -> Dict[int, Any]:
+    """Versão de `campanhas_contatos_json` para cursores assíncronos."""
+    if not campanha_ids:
+        return {}
+    await cur.execute(*_campanhas_contatos_query(db_schema, tid, campanha_ids))
+    return {int(r[0]): r[1] for r in await cur.fetchall() or []}
+
+
+def with_contacts(anexo: Any, contatos: Any) -> Any:
+    """Reconstrói o formato { ...config, "contacts": [...] } esperado pelo frontend."""
+    obj = anexo
+    if isinstance(obj, (str, bytes)):
+        try:
+            obj = json.loads(obj)
+        except Exception:
+            obj = None
+    if not isinstance(obj, dict):
+        obj = {}
+    return {**obj, "contacts": contatos if isinstance(contatos, list) else []}
+
+
+def mark_contato_envio(cur, db_schema: str, tid: int, campanha_id: int, numero: Any, enviado: bool) -> int:
+    cur.execute(
+        f"""
+        UPDATE "{db_schema}"."CampanhaContatos"
+        SET "Status" = %s,
+            "EnviadoEm" = NOW() AT TIME ZONE 'UTC'
+        WHERE "IdTenant" = %s AND "IdCampanha" = %s AND "Chave" = %s
+        """,
+        ("success" if enviado else "error", int(tid), int(campanha_id), phone_key(numero)),
+    )
+    return int(cur.rowcount or 0)
+
+
+def record_contato_resposta(
+    cur,
+    db_schema: str,
+    tid: int,
+    campanha_id: int,
+    numero: Any,
+    resposta: int,
+    respondido_em: Optional[datetime] = None,
+) -> bool:
+    """Registra SIM (1) / NÃO (2) no primeiro contato da campanha com esse telefone e
+    incrementa os contadores. Retorna False se não houver contato ou se ele já respondeu."""
+    cur.execute(
+        f"""
+        WITH alvo AS (
+          UPDATE "{db_schema}"."CampanhaContatos"
+          SET "Resposta" = %s,
+              "RespondidoEm" = %s
+          WHERE "IdTenant" = %s AND "IdCampanha" = %s
+            AND "Ordem" = (
+              SELECT MIN("Ordem") FROM "{db_schema}"."CampanhaContatos"
+              WHERE "IdTenant" = %s AND "IdCampanha" = %s AND "Chave" = %s
+            )
+            AND "Resposta" IS NULL
+          RETURNING 1
+        )
+        UPDATE "{db_schema}"."Campanhas"
+        SET "Positivos" = COALESCE("Positivos", 0) + %s,
+            "Negativos" = COALESCE("Negativos", 0) + %s,
+            "Aguardando" = GREATEST(0, COALESCE("Enviados", 0) - (COALESCE("Positivos", 0) + COALESCE("Negativos", 0) + 1)),
+            "Atualizacao" = NOW()
+        WHERE "IdCampanha" = %s AND "IdTenant" = %s AND EXISTS (SELECT 1 FROM alvo)
+        """,
+        (
+            int(resposta),
+            respondido_em or datetime.utcnow(),
+            int(tid),
+            int(campanha_id),
+            int(tid),
+            int(campanha_id),
+            phone_key(numero),
+            1 if int(resposta) == 1 else 0,
+            1 if int(resposta) == 2 else 0,
+            int(campanha_id),
+            int(tid),
+        ),
+    )
+    return (cur.rowcount or 0) > 0
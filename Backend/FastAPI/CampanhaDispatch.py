@@ -0,0 +1,872 @@
+from fastapi import FastAPI, HTTPException, Request
+from pydantic import BaseModel
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import os
+import re
+import json
+import random
+import asyncio
+import traceback
+
+try:
+    from .HttpSessions import http_session
+except ImportError:
+    from HttpSessions import http_session
+
+try:
+    from .CampanhaContatos import mark_contato_envio
+except ImportError:
+    from CampanhaContatos import mark_contato_envio
+
+
+class CampanhaDisparoIniciarIn(BaseModel):
+    evolution_api_id: Optional[str] = None
+    evolution_api_ids: Optional[List[str]] = None
+    distribuicao: Optional[str] = None
+    proxima_execucao: Optional[str] = None
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(str(os.getenv(name, "") or "").strip() or default)
+    except Exception:
+        return default
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(str(os.getenv(name, "") or "").strip() or default)
+    except Exception:
+        return default
+
+
+def _digits_only(s: Any) -> str:
+    try:
+        return re.sub(r"\D+", "", str(s or ""))
+    except Exception:
+        return ""
+
+
+def _utcnow() -> datetime:
+    return datetime.utcnow().replace(microsecond=0)
+
+
+def _anexo_obj(raw: Any) -> Any:
+    if isinstance(raw, (dict, list)):
+        return raw
+    try:
+        return json.loads(raw) if raw else None
+    except Exception:
+        return None
+
+
+def _anexo_config(anexo_obj: Any) -> Dict[str, Any]:
+    if isinstance(anexo_obj, dict) and isinstance(anexo_obj.get("config"), dict):
+        return anexo_obj.get("config") or {}
+    return {}
+
+
+def _config_provider(cfg: Dict[str, Any]) -> str:
+    p = str(cfg.get("provider") or "").strip().lower()
+    if p in ("twilio", "meta"):
+        return p
+    return "evolution"
+
+
+def _config_evolution_ids(cfg: Dict[str, Any]) -> List[str]:
+    raw = cfg.get("evolution_api_ids")
+    if raw is None:
+        raw = cfg.get("evolution_api_id")
+    arr = raw if isinstance(raw, list) else ([raw] if raw is not None else [])
+    return [str(x).strip() for x in arr if str(x or "").strip()]
+
+
+def _render_mensagem(texto: Any, contato: Dict[str, Any], *, sim_nao: bool, question: str) -> str:
+    nome = str(contato.get("nome") or "")
+    if nome == "—":
+        nome = ""
+    numero = str(contato.get("numero") or "")
+    msg = str(texto or "")
+    msg = re.sub(r"\((NOME|NAME)\)|\{(NOME|NAME)\}", lambda _m: nome, msg, flags=re.IGNORECASE)
+    msg = re.sub(r"\((WHATSAPP|PHONE)\)|\{(WHATSAPP|PHONE)\}", lambda _m: numero, msg, flags=re.IGNORECASE)
+    if sim_nao:
+        parts = [msg.strip()]
+        if question:
+            parts.append(question)
+        parts.append("RESPONDA:\n1 - SIM\n2 - NÃO")
+        msg = "\n\n".join([p for p in parts if p])
+    return msg
+
+
+def _proxima_execucao(blocos_por_dia: int, now: Optional[datetime] = None) -> datetime:
+    base = now or _utcnow()
+    per_day = int(blocos_por_dia or 1)
+    if per_day <= 1:
+        return base + timedelta(days=1)
+    return base + timedelta(minutes=max(1, 1440 // per_day))
+
+
+def register_campanha_dispatch_routes(
+    app: FastAPI,
+    get_db_connection: Callable[..., Any],
+    get_conn_for_request: Callable[[Request], Any],
+    db_schema: str,
+    tenant_id_from_header: Callable[[Request], int],
+    get_dsn_by_slug: Callable[[str], Optional[str]],
+    list_tenants_with_dsn: Callable[[], List[Tuple[str, str, str, int]]],
+    campanha_contacts: Callable[..., List[Dict[str, Any]]],
+    anexo_question: Callable[[Any], str],
+    evolution: Dict[str, Any],
+    retry_queue: Optional[Any] = None,
+):
+    DB_SCHEMA = str(db_schema or "captar").replace('"', '""')
+    POLL_SECONDS = _env_float("CAMPANHA_DISPATCH_POLL_SECONDS", 15.0)
+    STALE_SECONDS = _env_int("CAMPANHA_DISPATCH_STALE_SECONDS", 60)
+    CLAIM_LEASE_SECONDS = max(STALE_SECONDS, _env_int("CAMPANHA_DISPATCH_CLAIM_LEASE_SECONDS", 300))
+    MAX_CONTACTS = _env_int("CAMPANHA_DISPATCH_MAX_CONTACTS", 200000)
+    MAX_RUNNING = max(1, _env_int("CAMPANHA_DISPATCH_MAX_RUNNING", 8))
+    HEARTBEAT_SECONDS = 20.0
+    SHUTDOWN_GRACE_SECONDS = _env_float("CAMPANHA_DISPATCH_SHUTDOWN_GRACE_SECONDS", 10.0)
+
+    _running: Dict[Tuple[str, int], asyncio.Task] = {}
+    _stops: Dict[Tuple[str, int], asyncio.Event] = {}
+    _wake = asyncio.Event()
+    _loop_task: Dict[str, Optional[asyncio.Task]] = {"task": None}
+
+    def _request_dsn(request: Request) -> str:
+        slug = str(request.headers.get("X-Tenant") or "captar").strip().lower() or "captar"
+        if slug == "captar":
+            return ""
+        return str(get_dsn_by_slug(slug) or "")
+
+    def _dispatch_targets() -> List[str]:
+        out = [""]
+        for _slug, _nome, dsn, _idt in list_tenants_with_dsn() or []:
+            d = str(dsn or "").strip()
+            if d and d not in out:
+                out.append(d)
+        return out
+
+    def _claim_due(dsn: str, limit: int) -> List[Tuple[int, int]]:
+        if limit <= 0:
+            return []
+        with get_db_connection(dsn or None) as conn:
+            cur = conn.cursor()
+            cur.execute(
+                f"""
+                UPDATE "{DB_SCHEMA}"."Campanhas" c
+                SET "DisparoStatus" = 'EM_ANDAMENTO',
+                    "DisparoHeartbeat" = NOW() AT TIME ZONE 'UTC'
+                WHERE c."IdCampanha" IN (
+                    SELECT "IdCampanha"
+                    FROM "{DB_SCHEMA}"."Campanhas"
+                    WHERE ("DisparoStatus" = 'AGENDADO'
+                           AND COALESCE("ProximaExecucao", NOW() AT TIME ZONE 'UTC') <= NOW() AT TIME ZONE 'UTC')
+                       OR ("DisparoStatus" = 'EM_ANDAMENTO'
+                           AND COALESCE("DisparoHeartbeat", 'epoch'::timestamp) < (NOW() AT TIME ZONE 'UTC') - make_interval(secs => %s))
+                    ORDER BY "ProximaExecucao" ASC NULLS FIRST
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING c."IdCampanha", c."IdTenant"
+                """,
+                (int(STALE_SECONDS), int(limit)),
+            )
+            rows = cur.fetchall() or []
+            conn.commit()
+        return [(int(r[0]), int(r[1] or 0)) for r in rows]
+
+    def _heartbeat(dsn: str, campanha_id: int) -> bool:
+        with get_db_connection(dsn or None) as conn:
+            cur = conn.cursor()
+            cur.execute(
+                f"""
+                UPDATE "{DB_SCHEMA}"."Campanhas"
+                SET "DisparoHeartbeat" = NOW() AT TIME ZONE 'UTC'
+                WHERE "IdCampanha" = %s AND "DisparoStatus" = 'EM_ANDAMENTO'
+                """,
+                (int(campanha_id),),
+            )
+            ok = (cur.rowcount or 0) > 0
+            conn.commit()
+        return ok
+
+    def _fail_campanha(dsn: str, campanha_id: int, erro: str) -> None:
+        try:
+            with get_db_connection(dsn or None) as conn:
+                cur = conn.cursor()
+                cur.execute(
+                    f"""
+                    UPDATE "{DB_SCHEMA}"."Campanhas"
+                    SET "DisparoStatus" = 'ERRO', "DisparoErro" = %s, "DisparoHeartbeat" = NULL, "Atualizacao" = NOW()
+                    WHERE "IdCampanha" = %s
+                    """,
+                    (str(erro or "")[:2000], int(campanha_id)),
+                )
+                conn.commit()
+        except Exception:
+            pass
+
+    def _reconcile_claims(conn, cur, campanha_id: int, enviados: set) -> Tuple[int, int]:
+        """Resolve contatos presos em ENVIANDO por um worker que caiu entre o claim e o commit.
+
+        Passado CLAIM_LEASE_SECONDS, se já existe envio em Disparos/DisparosRetry o contato é
+        marcado ENVIADO; senão o claim é apagado e o contato volta para a fila. Um envio que
+        chegou ao provedor mas não foi registrado pode então sair de novo (pelo menos uma vez)."""
+        cur.execute(
+            f"""
+            SELECT "Numero"
+            FROM "{DB_SCHEMA}"."CampanhaDisparoCursor"
+            WHERE "IdCampanha" = %s AND "Status" = 'ENVIANDO'
+              AND "AtualizadoEm" < (NOW() AT TIME ZONE 'UTC') - make_interval(secs => %s)
+            FOR UPDATE SKIP LOCKED
+            """,
+            (int(campanha_id), int(CLAIM_LEASE_SECONDS)),
+        )
+        presos = [str(r[0]) for r in (cur.fetchall() or []) if r and r[0]]
+        if not presos:
+            return 0, 0
+        feitos = [n for n in presos if _digits_only(n) in enviados]
+        refazer = [n for n in presos if _digits_only(n) not in enviados]
+        if feitos:
+            cur.execute(
+                f"""
+                UPDATE "{DB_SCHEMA}"."CampanhaDisparoCursor"
+                SET "Status" = 'ENVIADO', "AtualizadoEm" = NOW() AT TIME ZONE 'UTC'
+                WHERE "IdCampanha" = %s AND "Numero" = ANY(%s) AND "Status" = 'ENVIANDO'
+                """,
+                (int(campanha_id), feitos),
+            )
+        if refazer:
+            cur.execute(
+                f"""
+                DELETE FROM "{DB_SCHEMA}"."CampanhaDisparoCursor"
+                WHERE "IdCampanha" = %s AND "Numero" = ANY(%s) AND "Status" = 'ENVIANDO'
+                """,
+                (int(campanha_id), refazer),
+            )
+        conn.commit()
+        print(f"Campanha dispatch: campanha={campanha_id} claims expirados enviados={len(feitos)} reenfileirados={len(refazer)}")
+        return len(feitos), len(refazer)
+
+    def _load_block(dsn: str, campanha_id: int, tid: int) -> Optional[Dict[str, Any]]:
+        with get_db_connection(dsn or None) as conn:
+            cur = conn.cursor()
+            cur.execute(
+                f"""
+                SELECT "Texto", "Imagem", "AnexoJSON", COALESCE("RecorrenciaAtiva", FALSE),
+                       COALESCE("TotalBlocos", 5), COALESCE("MensagensPorBloco", 500), COALESCE("BlocosPorDia", 1),
+                       COALESCE("IntervaloMinSeg", 5), COALESCE("IntervaloMaxSeg", 120), COALESCE("BlocoAtual", 0),
+                       COALESCE("DisparoCursor", 0)
+                FROM "{DB_SCHEMA}"."Campanhas"
+                WHERE "IdCampanha" = %s AND "IdTenant" = %s
+                LIMIT 1
+                """,
+                (int(campanha_id), int(tid)),
+            )
+            row = cur.fetchone()
+            if not row:
+                return None
+            anexo = _anexo_obj(row[2])
+            contatos = campanha_contacts(cur, tid=int(tid), campanha_id=int(campanha_id), anexo_obj=anexo, limit=MAX_CONTACTS)
+            cur.execute(
+                f"""
+                SELECT DISTINCT "Numero"
+                FROM "{DB_SCHEMA}"."Disparos"
+                WHERE "IdTenant" = %s AND "IdCampanha" = %s
+                  AND COALESCE(NULLIF("Direcao", ''), 'OUT') = 'OUT'
+                  AND COALESCE(NULLIF("Canal", ''), 'WHATSAPP') = 'WHATSAPP'
+                  AND UPPER(COALESCE("Status", '')) IN ('ENVIADO', 'ENTREGUE', 'VISUALIZADO')
+                UNION
+                SELECT "Numero"
+                FROM "{DB_SCHEMA}"."DisparosRetry"
+                WHERE "IdTenant" = %s AND "IdCampanha" = %s
+                  AND "Status" IN ('PENDENTE', 'PROCESSANDO')
+                """,
+                (int(tid), int(campanha_id), int(tid), int(campanha_id)),
+            )
+            enviados = {_digits_only(r[0]) for r in (cur.fetchall() or []) if r and r[0]}
+            _reconcile_claims(conn, cur, campanha_id, enviados)
+            cur.execute(
+                f'SELECT "Numero" FROM "{DB_SCHEMA}"."CampanhaDisparoCursor" WHERE "IdCampanha" = %s',
+                (int(campanha_id),),
+            )
+            enviados.update(_digits_only(r[0]) for r in (cur.fetchall() or []) if r and r[0])
+            pendentes = [c for c in contatos if _digits_only(c.get("numero")) not in enviados]
+            cfg = _anexo_config(anexo)
+            intervalo_min = max(1, min(int(row[7]), int(row[8])))
+            intervalo_max = max(1, max(int(row[7]), int(row[8])))
+            recorrencia = bool(row[3])
+            por_bloco = max(1, int(row[5] or 500))
+            cursor_bloco = max(0, int(row[10] or 0))
+            lote = pendentes[:max(0, por_bloco - cursor_bloco)] if recorrencia else pendentes
+            ctxs: List[Dict[str, Any]] = []
+            media = None
+            erro = ""
+            distribuicao = evolution["shard_strategy"](cfg.get("distribuicao"))
+            if _config_provider(cfg) != "evolution":
+                erro = "Disparo automático disponível apenas para a Evolution API."
+            else:
+                ids = _config_evolution_ids(cfg)
+                try:
+                    if len(ids) > 1 or (cfg.get("distribuicao") and not ids):
+                        ctxs = evolution["send_contexts"](conn, ids)
+                    else:
+                        ctxs = [evolution["send_context"](conn, ids[0] if ids else None)]
+                    media = evolution["resolve_media"](row[1], "image", ctxs[0]["base_candidates"], None) if row[1] else None
+                except HTTPException as he:
+                    erro = str(he.detail)
+            return {
+                "texto": row[0],
+                "recorrencia": recorrencia,
+                "total_blocos": int(row[4] or 0),
+                "blocos_por_dia": int(row[6] or 1),
+                "intervalo_min": intervalo_min,
+                "intervalo_max": intervalo_max,
+                "bloco_atual": int(row[9] or 0),
+                "cursor": cursor_bloco,
+                "lote": lote,
+                "restantes": max(0, len(pendentes) - len(lote)),
+                "sim_nao": str(cfg.get("response_mode") or "").strip().upper() == "SIM_NAO",
+                "question": anexo_question(anexo),
+                "text_position": str(cfg.get("text_position") or "bottom"),
+                "ctxs": ctxs,
+                "distribuicao": distribuicao,
+                "media": media,
+                "erro": erro,
+            }
+
+    def _claim_contato(dsn: str, campanha_id: int, tid: int, numero: str, bloco: int) -> str:
+        with get_db_connection(dsn or None) as conn:
+            cur = conn.cursor()
+            cur.execute(
+                f"""
+                UPDATE "{DB_SCHEMA}"."Campanhas"
+                SET "DisparoHeartbeat" = NOW() AT TIME ZONE 'UTC'
+                WHERE "IdCampanha" = %s AND "IdTenant" = %s AND "DisparoStatus" = 'EM_ANDAMENTO'
+                """,
+                (int(campanha_id), int(tid)),
+            )
+            if (cur.rowcount or 0) <= 0:
+                conn.rollback()
+                return "PARAR"
+            cur.execute(
+                f"""
+                INSERT INTO "{DB_SCHEMA}"."CampanhaDisparoCursor"
+                ("IdCampanha","Numero","IdTenant","Bloco","Status","AtualizadoEm")
+                VALUES (%s,%s,%s,%s,'ENVIANDO',NOW() AT TIME ZONE 'UTC')
+                ON CONFLICT ("IdCampanha","Numero") DO NOTHING
+                """,
+                (int(campanha_id), numero, int(tid), int(bloco)),
+            )
+            claimed = (cur.rowcount or 0) > 0
+            conn.commit()
+        return "ENVIAR" if claimed else "PULAR"
+
+    def _commit_contato(
+        dsn: str,
+        campanha_id: int,
+        tid: int,
+        numero: str,
+        status: str,
+        rows: List[Dict[str, Any]],
+        sim_nao: bool,
+    ) -> None:
+        ok = 1 if status == "ENVIADO" else 0
+        with get_db_connection(dsn or None) as conn:
+            cur = conn.cursor()
+            evolution["insert_disparos"](conn, int(tid), rows, commit=False)
+            cur.execute(
+                f"""
+                UPDATE "{DB_SCHEMA}"."CampanhaDisparoCursor"
+                SET "Status" = %s, "AtualizadoEm" = NOW() AT TIME ZONE 'UTC'
+                WHERE "IdCampanha" = %s AND "Numero" = %s
+                """,
+                (status, int(campanha_id), numero),
+            )
+            mark_contato_envio(cur, DB_SCHEMA, int(tid), int(campanha_id), numero, bool(ok))
+            cur.execute(
+                f"""
+                UPDATE "{DB_SCHEMA}"."Campanhas"
+                SET "Enviados" = COALESCE("Enviados", 0) + %s,
+                    "NaoEnviados" = COALESCE("NaoEnviados", 0) + %s,
+                    "Aguardando" = COALESCE("Aguardando", 0) + %s,
+                    "DisparoCursor" = COALESCE("DisparoCursor", 0) + 1,
+                    "DisparoHeartbeat" = NOW() AT TIME ZONE 'UTC'
+                WHERE "IdCampanha" = %s AND "IdTenant" = %s
+                """,
+                (ok, 1 - ok, ok if sim_nao else 0, int(campanha_id), int(tid)),
+            )
+            conn.commit()
+
+    def _enqueue_retry(
+        dsn: str,
+        exc: BaseException,
+        ctx: Dict[str, Any],
+        campanha_id: int,
+        tid: int,
+        contato: Dict[str, Any],
+        mensagem: str,
+        media: Optional[Dict[str, Any]],
+        text_position: str,
+    ) -> Optional[str]:
+        if retry_queue is None:
+            return None
+        job = evolution["retry_job"](
+            exc,
+            ctx,
+            tid=int(tid),
+            campanha_id=int(campanha_id),
+            numero=contato.get("numero"),
+            nome=contato.get("nome"),
+            mensagem=mensagem,
+            media=media,
+            text_position=text_position,
+        )
+        if job is None:
+            return None
+        try:
+            return retry_queue.enqueue(dsn, job)
+        except Exception as e:
+            print(f"Campanha dispatch: falha ao enfileirar retry: {e}")
+            return None
+
+    def _finish_block(dsn: str, campanha_id: int, tid: int, plan: Dict[str, Any], processados: int) -> None:
+        avancou = processados + int(plan["cursor"]) > 0
+        bloco_atual = int(plan["bloco_atual"]) + (1 if avancou else 0)
+        restantes = int(plan["restantes"]) + (len(plan["lote"]) - processados)
+        if restantes > 0 and plan["recorrencia"] and bloco_atual < int(plan["total_blocos"] or 0):
+            novo_status = "AGENDADO"
+            proxima = _proxima_execucao(int(plan["blocos_por_dia"] or 1))
+        else:
+            novo_status = "CONCLUIDO"
+            proxima = None
+        with get_db_connection(dsn or None) as conn:
+            cur = conn.cursor()
+            cur.execute(
+                f"""
+                UPDATE "{DB_SCHEMA}"."Campanhas"
+                SET "BlocoAtual" = %s,
+                    "DisparoCursor" = 0,
+                    "ProximaExecucao" = CASE WHEN %s::text IS NULL THEN "ProximaExecucao" ELSE %s::timestamp END,
+                    "DisparoStatus" = %s,
+                    "DisparoHeartbeat" = NULL,
+                    "DisparoErro" = NULL,
+                    "Atualizacao" = NOW()
+                WHERE "IdCampanha" = %s AND "IdTenant" = %s AND "DisparoStatus" = 'EM_ANDAMENTO'
+                """,
+                (
+                    int(bloco_atual) if plan["recorrencia"] else int(plan["bloco_atual"]),
+                    proxima,
+                    proxima,
+                    novo_status,
+                    int(campanha_id),
+                    int(tid),
+                ),
+            )
+            conn.commit()
+
+    def _release_campanha(dsn: str, campanha_id: int) -> None:
+        try:
+            with get_db_connection(dsn or None) as conn:
+                cur = conn.cursor()
+                cur.execute(
+                    f"""
+                    UPDATE "{DB_SCHEMA}"."Campanhas"
+                    SET "DisparoStatus" = 'AGENDADO',
+                        "DisparoHeartbeat" = NULL,
+                        "ProximaExecucao" = NOW() AT TIME ZONE 'UTC'
+                    WHERE "IdCampanha" = %s AND "DisparoStatus" = 'EM_ANDAMENTO'
+                    """,
+                    (int(campanha_id),),
+                )
+                conn.commit()
+        except Exception:
+            pass
+
+    async def _run_campanha(dsn: str, campanha_id: int, tid: int, stop: asyncio.Event) -> None:
+        try:
+            plan = await asyncio.to_thread(_load_block, dsn, campanha_id, tid)
+            if not plan:
+                return
+            if plan["erro"]:
+                await asyncio.to_thread(_fail_campanha, dsn, campanha_id, plan["erro"])
+                return
+            ctxs = plan["ctxs"]
+            media = plan["media"]
+            strategy = plan["distribuicao"]
+            state = {"ok": 0, "falhas": 0, "processados": 0}
+            print(f"Campanha dispatch: campanha={campanha_id} tenant={tid} lote={len(plan['lote'])} cursor={plan['cursor']} restantes={plan['restantes']} instancias={[c['instance'] for c in ctxs]} distribuicao={strategy}")
+
+            lanes: Dict[str, asyncio.Queue] = {c["instance"]: asyncio.Queue() for c in ctxs}
+            shared: asyncio.Queue = asyncio.Queue()
+            for seq, contato in enumerate(plan["lote"]):
+                if strategy == "least_loaded":
+                    shared.put_nowait(contato)
+                else:
+                    ctx = evolution["pick_shard"](strategy, ctxs, phone=contato.get("numero"), seq=seq)
+                    lanes[ctx["instance"]].put_nowait(contato)
+
+            async def _pause(seconds: float) -> None:
+                try:
+                    await asyncio.wait_for(stop.wait(), timeout=seconds)
+                except asyncio.TimeoutError:
+                    pass
+
+            async def _heartbeat_loop() -> None:
+                while not stop.is_set():
+                    await _pause(HEARTBEAT_SECONDS)
+                    if stop.is_set():
+                        return
+                    try:
+                        if not await asyncio.to_thread(_heartbeat, dsn, campanha_id):
+                            stop.set()
+                    except Exception:
+                        pass
+
+            async def _lane(session, ctx: Dict[str, Any]) -> None:
+                queue = shared if strategy == "least_loaded" else lanes[ctx["instance"]]
+                first = True
+                while not queue.empty() and not stop.is_set():
+                    try:
+                        contato = queue.get_nowait()
+                    except asyncio.QueueEmpty:
+                        return
+                    numero = _digits_only(contato.get("numero"))
+                    if not numero:
+                        state["processados"] += 1
+                        continue
+                    if not first:
+                        await _pause(random.uniform(plan["intervalo_min"], plan["intervalo_max"]))
+                        if stop.is_set():
+                            return
+                    claim = await asyncio.to_thread(_claim_contato, dsn, campanha_id, tid, numero, int(plan["bloco_atual"]))
+                    if claim == "PARAR":
+                        stop.set()
+                        return
+                    state["processados"] += 1
+                    if claim == "PULAR":
+                        continue
+                    first = False
+                    msg = _render_mensagem(plan["texto"], contato, sim_nao=plan["sim_nao"], question=plan["question"])
+                    sent: List[Dict[str, Any]] = []
+                    try:
+                        await evolution["deliver"](
+                            session,
+                            ctx,
+                            phone=contato.get("numero"),
+                            message=msg,
+                            media=media,
+                            text_position=plan["text_position"],
+                            on_sent=sent.append,
+                            rate_capped=False,
+                        )
+                        state["ok"] += 1
+                        erro = None
+                    except HTTPException as he:
+                        state["falhas"] += 1
+                        erro = str(he.detail)
+                        falha = he
+                    except Exception as e:
+                        state["falhas"] += 1
+                        erro = str(e)
+                        falha = e
+                    rows = [
+                        {
+                            "campanha_id": campanha_id,
+                            "numero": contato.get("numero"),
+                            "nome": contato.get("nome"),
+                            "mensagem": p.get("mensagem"),
+                            "imagem": p.get("imagem"),
+                            "payload": p.get("resp"),
+                            "message_id": p.get("message_id"),
+                            "instance": ctx["instance"],
+                        }
+                        for p in sent
+                    ]
+                    status = "ENVIADO"
+                    if erro is not None:
+                        fail_payload: Dict[str, Any] = {"error": erro}
+                        retry_key = await asyncio.to_thread(_enqueue_retry, dsn, falha, ctx, campanha_id, tid, contato, msg, media, plan["text_position"])
+                        status = "RETRY" if retry_key else "FALHA"
+                        if retry_key:
+                            fail_payload["retry_key"] = retry_key
+                        rows.append(
+                            {
+                                "campanha_id": campanha_id,
+                                "numero": contato.get("numero"),
+                                "nome": contato.get("nome"),
+                                "mensagem": msg,
+                                "imagem": (media or {}).get("url"),
+                                "status": "FALHA",
+                                "payload": fail_payload,
+                                "instance": ctx["instance"],
+                            }
+                        )
+                    try:
+                        await asyncio.to_thread(_commit_contato, dsn, campanha_id, tid, numero, status, rows, plan["sim_nao"])
+                    except Exception as e:
+                        print(f"Campanha dispatch: falha ao registrar contato {numero}: {e}")
+
+            hb = asyncio.create_task(_heartbeat_loop())
+            try:
+                async with http_session("evolution") as session:
+                    await asyncio.gather(*[_lane(session, c) for c in ctxs])
+            finally:
+                hb.cancel()
+                await asyncio.gather(hb, return_exceptions=True)
+            interrompido = stop.is_set()
+            if not interrompido:
+                await asyncio.to_thread(_finish_block, dsn, campanha_id, tid, plan, state["processados"])
+            print(f"Campanha dispatch: campanha={campanha_id} enviados={state['ok']} falhas={state['falhas']} interrompido={interrompido}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            traceback.print_exc()
+            await asyncio.to_thread(_fail_campanha, dsn, campanha_id, str(e))
+
+    def _reap_finished() -> None:
+        for key in [k for k, t in _running.items() if t.done()]:
+            _running.pop(key, None)
+            _stops.pop(key, None)
+
+    async def _dispatch_tick() -> None:
+        _reap_finished()
+        for dsn in await asyncio.to_thread(_dispatch_targets):
+            livres = MAX_RUNNING - len(_running)
+            if livres <= 0:
+                return
+            try:
+                claimed = await asyncio.to_thread(_claim_due, dsn, livres)
+            except Exception:
+                continue
+            for campanha_id, tid in claimed:
+                key = (dsn, campanha_id)
+                if key in _running:
+                    continue
+                _stops[key] = asyncio.Event()
+                _running[key] = asyncio.create_task(_run_campanha(dsn, campanha_id, tid, _stops[key]))
+
+    async def _dispatch_loop() -> None:
+        while True:
+            try:
+                await _dispatch_tick()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                traceback.print_exc()
+            try:
+                await asyncio.wait_for(_wake.wait(), timeout=POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            _wake.clear()
+
+    def _signal_stop(dsn: str, campanha_id: int) -> None:
+        ev = _stops.get((dsn, int(campanha_id)))
+        if ev is not None:
+            ev.set()
+
+    @app.on_event("startup")
+    async def start_campanha_dispatch():
+        if str(os.getenv("CAMPANHA_DISPATCH_ENABLED", "1")).strip().lower() in ("0", "false", "no", "off"):
+            return
+        if _loop_task["task"] is None:
+            _loop_task["task"] = asyncio.create_task(_dispatch_loop())
+
+    @app.on_event("shutdown")
+    async def stop_campanha_dispatch():
+        if _loop_task["task"] is not None:
+            _loop_task["task"].cancel()
+            await asyncio.gather(_loop_task["task"], return_exceptions=True)
+        _loop_task["task"] = None
+        for ev in _stops.values():
+            ev.set()
+        running = dict(_running)
+        if running:
+            _done, pendentes = await asyncio.wait(list(running.values()), timeout=SHUTDOWN_GRACE_SECONDS)
+            for t in pendentes:
+                t.cancel()
+            if pendentes:
+                await asyncio.gather(*pendentes, return_exceptions=True)
+        for dsn, campanha_id in running.keys():
+            await asyncio.to_thread(_release_campanha, dsn, campanha_id)
+        _running.clear()
+        _stops.clear()
+
+    @app.post("/api/campanhas/{id}/disparo/iniciar")
+    async def campanhas_disparo_iniciar(id: int, request: Request, body: Optional[CampanhaDisparoIniciarIn] = None):
+        try:
+            tid = tenant_id_from_header(request)
+            body = body or CampanhaDisparoIniciarIn()
+            with get_conn_for_request(request) as conn:
+                cur = conn.cursor()
+                cur.execute(
+                    f'SELECT "AnexoJSON", "DisparoStatus" FROM "{DB_SCHEMA}"."Campanhas" WHERE "IdCampanha" = %s AND "IdTenant" = %s LIMIT 1',
+                    (int(id), int(tid)),
+                )
+                row = cur.fetchone()
+                if not row:
+                    raise HTTPException(status_code=404, detail="Campanha não encontrada")
+                if str(row[1] or "").upper() == "EM_ANDAMENTO":
+                    raise HTTPException(status_code=409, detail="Campanha já está em disparo")
+                anexo = _anexo_obj(row[0])
+                cfg = _anexo_config(anexo)
+                if _config_provider(cfg) != "evolution":
+                    raise HTTPException(status_code=400, detail="Disparo automático disponível apenas para a Evolution API.")
+                if (body.evolution_api_id or body.evolution_api_ids is not None or body.distribuicao) and isinstance(anexo, dict):
+                    cfg = dict(cfg)
+                    if body.evolution_api_ids is not None:
+                        cfg["evolution_api_ids"] = [str(x).strip() for x in body.evolution_api_ids if str(x or "").strip()]
+                        cfg.pop("evolution_api_id", None)
+                    elif body.evolution_api_id:
+                        cfg["evolution_api_id"] = str(body.evolution_api_id).strip()
+                        cfg.pop("evolution_api_ids", None)
+                    if body.distribuicao:
+                        cfg["distribuicao"] = evolution["shard_strategy"](body.distribuicao)
+                    anexo = dict(anexo)
+                    anexo["config"] = cfg
+                    cur.execute(
+                        f'UPDATE "{DB_SCHEMA}"."Campanhas" SET "AnexoJSON" = %s::jsonb WHERE "IdCampanha" = %s AND "IdTenant" = %s',
+                        (json.dumps(anexo, ensure_ascii=False), int(id), int(tid)),
+                    )
+                cur.execute(
+                    f"""
+                    UPDATE "{DB_SCHEMA}"."Campanhas"
+                    SET "DisparoStatus" = 'AGENDADO',
+                        "DisparoErro" = NULL,
+                        "DisparoHeartbeat" = NULL,
+                        "ProximaExecucao" = COALESCE(%s::timestamp, NOW() AT TIME ZONE 'UTC'),
+                        "Atualizacao" = NOW()
+                    WHERE "IdCampanha" = %s AND "IdTenant" = %s
+                    """,
+                    (body.proxima_execucao or None, int(id), int(tid)),
+                )
+                conn.commit()
+            _wake.set()
+            return {"id": id, "status": "AGENDADO"}
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+
+    def _set_disparo_status(request: Request, id: int, novo: str, de: Tuple[str, ...]) -> str:
+        tid = tenant_id_from_header(request)
+        with get_conn_for_request(request) as conn:
+            cur = conn.cursor()
+            cur.execute(
+                f"""
+                UPDATE "{DB_SCHEMA}"."Campanhas"
+                SET "DisparoStatus" = %s,
+                    "DisparoHeartbeat" = NULL,
+                    "ProximaExecucao" = CASE WHEN %s::text = 'AGENDADO' THEN NOW() AT TIME ZONE 'UTC' ELSE "ProximaExecucao" END,
+                    "Atualizacao" = NOW()
+                WHERE "IdCampanha" = %s AND "IdTenant" = %s AND COALESCE("DisparoStatus", '') = ANY(%s)
+                RETURNING "IdCampanha"
+                """,
+                (novo, novo, int(id), int(tid), list(de)),
+            )
+            if cur.fetchone() is None:
+                cur.execute(
+                    f'SELECT "DisparoStatus" FROM "{DB_SCHEMA}"."Campanhas" WHERE "IdCampanha" = %s AND "IdTenant" = %s LIMIT 1',
+                    (int(id), int(tid)),
+                )
+                row = cur.fetchone()
+                conn.rollback()
+                if not row:
+                    raise HTTPException(status_code=404, detail="Campanha não encontrada")
+                raise HTTPException(status_code=409, detail=f"Campanha está com status {row[0] or 'sem disparo'}")
+            if novo == "CANCELADO":
+                cur.execute(
+                    f"""
+                    UPDATE "{DB_SCHEMA}"."DisparosRetry"
+                    SET "Status" = 'CANCELADO', "AtualizadoEm" = NOW() AT TIME ZONE 'UTC'
+                    WHERE "IdCampanha" = %s AND "IdTenant" = %s AND "Status" = 'PENDENTE'
+                    """,
+                    (int(id), int(tid)),
+                )
+            conn.commit()
+        return novo
+
+    @app.post("/api/campanhas/{id}/disparo/pausar")
+    async def campanhas_disparo_pausar(id: int, request: Request):
+        try:
+            status = _set_disparo_status(request, id, "PAUSADO", ("AGENDADO", "EM_ANDAMENTO"))
+            _signal_stop(_request_dsn(request), id)
+            return {"id": id, "status": status}
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+
+    @app.post("/api/campanhas/{id}/disparo/retomar")
+    async def campanhas_disparo_retomar(id: int, request: Request):
+        try:
+            status = _set_disparo_status(request, id, "AGENDADO", ("PAUSADO", "ERRO"))
+            _wake.set()
+            return {"id": id, "status": status}
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+
+    @app.post("/api/campanhas/{id}/disparo/cancelar")
+    async def campanhas_disparo_cancelar(id: int, request: Request):
+        try:
+            status = _set_disparo_status(request, id, "CANCELADO", ("AGENDADO", "EM_ANDAMENTO", "PAUSADO", "ERRO"))
+            _signal_stop(_request_dsn(request), id)
+            return {"id": id, "status": status}
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+
+    @app.get("/api/campanhas/{id}/disparo")
+    async def campanhas_disparo_status(id: int, request: Request):
+        try:
+            tid = tenant_id_from_header(request)
+            with get_conn_for_request(request) as conn:
+                cur = conn.cursor()
+                cur.execute(
+                    f"""
+                    SELECT "DisparoStatus", "DisparoErro", "DisparoHeartbeat", "ProximaExecucao",
+                           "BlocoAtual", "TotalBlocos", "MensagensPorBloco", "Enviados", "NaoEnviados",
+                           COALESCE("DisparoCursor", 0)
+                    FROM "{DB_SCHEMA}"."Campanhas"
+                    WHERE "IdCampanha" = %s AND "IdTenant" = %s
+                    LIMIT 1
+                    """,
+                    (int(id), int(tid)),
+                )
+                row = cur.fetchone()
+                if not row:
+                    raise HTTPException(status_code=404, detail="Campanha não encontrada")
+                cur.execute(
+                    f'SELECT COUNT(*) FROM "{DB_SCHEMA}"."CampanhaDisparoCursor" WHERE "IdCampanha" = %s',
+                    (int(id),),
+                )
+                processados = int((cur.fetchone() or [0])[0] or 0)
+            return {
+                "id": id,
+                "status": row[0],
+                "erro": row[1],
+                "heartbeat": row[2].isoformat() + "Z" if row[2] else None,
+                "proxima_execucao": row[3].isoformat() + "Z" if row[3] else None,
+                "bloco_atual": row[4],
+                "total_blocos": row[5],
+                "mensagens_por_bloco": row[6],
+                "enviados": row[7],
+                "nao_enviados": row[8],
+                "cursor_bloco": row[9],
+                "processados": processados,
+                "em_execucao": (_request_dsn(request), int(id)) in _running,
+            }
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+
+    return {
+        "load_block": _load_block,
+        "run_campanha": _run_campanha,
+    }
@@ -0,0 +1,143 @@
+from typing import List
+
+
+def _message_ids_fn_sql(db_schema: str) -> str:
+    return f"""
+    CREATE OR REPLACE FUNCTION "{db_schema}"."disparos_message_ids"(p_message_id TEXT, p_payload JSONB)
+    RETURNS TEXT[]
+    LANGUAGE sql IMMUTABLE
+    AS $fn$
+      SELECT COALESCE(ARRAY_AGG(DISTINCT v), '{{}}'::text[])
+      FROM (
+        SELECT NULLIF(x, '') AS v
+        FROM UNNEST(ARRAY[
+          p_message_id,
+          p_payload->>'keyId',
+          p_payload->'key'->>'id',
+          p_payload->'data'->>'keyId',
+          p_payload->'data'->'key'->>'id',
+          p_payload->>'messageId',
+          p_payload->'data'->>'messageId',
+          p_payload->>'id',
+          p_payload->'data'->>'id',
+          p_payload->>'sid'
+        ]) AS x
+        UNION ALL
+        SELECT NULLIF(e, '')
+        FROM JSONB_ARRAY_ELEMENTS_TEXT(
+          CASE WHEN JSONB_TYPEOF(p_payload->'message_ids') = 'array' THEN p_payload->'message_ids' ELSE '[]'::jsonb END
+        ) AS e
+      ) s
+      WHERE v IS NOT NULL
+    $fn$
+    """
+
+
+def ensure_disparos_message_ids(cur, db_schema: str) -> List[str]:
+    """Cria a tabela "DisparosMessageIds" (todo id de mensagem conhecido de cada disparo),
+    os gatilhos que a mantêm a cada INSERT/COPY/UPDATE em "Disparos" e faz o backfill
+    enquanto a tabela estiver vazia. Deve rodar com autocommit, depois das colunas de "Disparos".
+    """
+    actions: List[str] = []
+    cur.execute(f"""SELECT to_regclass('"{db_schema}"."DisparosMessageIds"')""")
+    row = cur.fetchone()
+    needs_backfill = not (row and row[0])
+    if not needs_backfill:
+        cur.execute(f'SELECT NOT EXISTS (SELECT 1 FROM "{db_schema}"."DisparosMessageIds")')
+        row = cur.fetchone()
+        needs_backfill = bool(row and row[0])
+    cur.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS "{db_schema}"."DisparosMessageIds" (
+            "IdTenant" INT NOT NULL,
+            "MessageId" TEXT NOT NULL,
+            "IdDisparo" INT NOT NULL REFERENCES "{db_schema}"."Disparos" ("IdDisparo") ON DELETE CASCADE,
+            PRIMARY KEY ("IdTenant", "MessageId", "IdDisparo")
+        )
+        """
+    )
+    try:
+        cur.execute(f'CREATE INDEX IF NOT EXISTS "idx_disparos_message_ids_disparo" ON "{db_schema}"."DisparosMessageIds" ("IdDisparo")')
+    except Exception:
+        pass
+    cur.execute(_message_ids_fn_sql(db_schema))
+    cur.execute(
+        f"""
+        CREATE OR REPLACE FUNCTION "{db_schema}"."disparos_message_ids_ins"()
+        RETURNS trigger
+        LANGUAGE plpgsql
+        AS $fn$
+        BEGIN
+          INSERT INTO "{db_schema}"."DisparosMessageIds" ("IdTenant", "MessageId", "IdDisparo")
+          SELECT n."IdTenant", v, n."IdDisparo"
+          FROM novos n
+          CROSS JOIN LATERAL UNNEST("{db_schema}"."disparos_message_ids"(n."MessageId", n."Payload")) AS v
+          WHERE n."IdTenant" IS NOT NULL
+          ON CONFLICT DO NOTHING;
+          RETURN NULL;
+        END
+        $fn$
+        """
+    )
+    cur.execute(
+        f"""
+        CREATE OR REPLACE FUNCTION "{db_schema}"."disparos_message_ids_upd"()
+        RETURNS trigger
+        LANGUAGE plpgsql
+        AS $fn$
+        BEGIN
+          IF NEW."IdTenant" IS NOT NULL THEN
+            INSERT INTO "{db_schema}"."DisparosMessageIds" ("IdTenant", "MessageId", "IdDisparo")
+            SELECT NEW."IdTenant", v, NEW."IdDisparo"
+            FROM UNNEST("{db_schema}"."disparos_message_ids"(NEW."MessageId", NEW."Payload")) AS v
+            ON CONFLICT DO NOTHING;
+          END IF;
+          RETURN NULL;
+        END
+        $fn$
+        """
+    )
+    cur.execute(
+        f"""
+        CREATE OR REPLACE TRIGGER "trg_disparos_message_ids_ins"
+        AFTER INSERT ON "{db_schema}"."Disparos"
+        REFERENCING NEW TABLE AS novos
+        FOR EACH STATEMENT
+        EXECUTE FUNCTION "{db_schema}"."disparos_message_ids_ins"()
+        """
+    )
+    cur.execute(
+        f"""
+        CREATE OR REPLACE TRIGGER "trg_disparos_message_ids_upd"
+        AFTER UPDATE OF "MessageId", "Payload", "IdTenant" ON "{db_schema}"."Disparos"
+        FOR EACH ROW
+        WHEN (
+          NEW."MessageId" IS DISTINCT FROM OLD."MessageId"
+          OR NEW."Payload" IS DISTINCT FROM OLD."Payload"
+          OR NEW."IdTenant" IS DISTINCT FROM OLD."IdTenant"
+        )
+        EXECUTE FUNCTION "{db_schema}"."disparos_message_ids_upd"()
+        """
+    )
+    actions.append('DisparosMessageIds ensured')
+    if needs_backfill:
+        cur.execute(
+            f"""
+            INSERT INTO "{db_schema}"."DisparosMessageIds" ("IdTenant", "MessageId", "IdDisparo")
+            SELECT d."IdTenant", v, d."IdDisparo"
+            FROM "{db_schema}"."Disparos" d
+            CROSS JOIN LATERAL UNNEST("{db_schema}"."disparos_message_ids"(d."MessageId", d."Payload")) AS v
+            WHERE d."IdTenant" IS NOT NULL
+            ON CONFLICT DO NOTHING
+            """
+        )
+        actions.append(f'DisparosMessageIds backfill: {int(cur.rowcount or 0)} ids')
+    return actions
+
+
+def disparos_by_message_ids_sql(db_schema: str, column: str = '"IdDisparo"') -> str:
+    """Filtro indexado por id de mensagem; espera os parâmetros (id_tenant, [ids])."""
+    return (
+        f'{column} IN (SELECT m."IdDisparo" FROM "{db_schema}"."DisparosMessageIds" m '
+        f'WHERE m."IdTenant" = %s AND m."MessageId" = ANY(%s))'
+    )
@@ -0,0 +1,412 @@
+from fastapi import FastAPI, HTTPException, Request
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import os
+import json
+import uuid
+import random
+import asyncio
+import traceback
+
+import aiohttp
+
+try:
+    from .HttpSessions import http_session
+except ImportError:
+    from HttpSessions import http_session
+
+try:
+    from .CampanhaContatos import mark_contato_envio
+except ImportError:
+    from CampanhaContatos import mark_contato_envio
+
+
+_RETRY_COLUMNS = (
+    "IdRetry",
+    "IdTenant",
+    "IdCampanha",
+    "Chave",
+    "Numero",
+    "Nome",
+    "Mensagem",
+    "Midia",
+    "TextPosition",
+    "EvolutionApiId",
+    "EvolutionInstance",
+    "Tentativas",
+    "MaxTentativas",
+)
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(str(os.getenv(name, "") or "").strip() or default)
+    except Exception:
+        return default
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(str(os.getenv(name, "") or "").strip() or default)
+    except Exception:
+        return default
+
+
+class DisparosRetryQueue:
+    def __init__(
+        self,
+        get_db_connection: Callable[..., Any],
+        db_schema: str,
+        dsn_for_request: Callable[[Request], Optional[str]],
+    ):
+        self._get_db_connection = get_db_connection
+        self._schema = str(db_schema or "captar").replace('"', '""')
+        self._dsn_for_request = dsn_for_request
+        self.max_attempts = max(1, _env_int("DISPAROS_RETRY_MAX_ATTEMPTS", 5))
+        self.base_delay = max(1.0, _env_float("DISPAROS_RETRY_BASE_SECONDS", 30.0))
+        self.max_delay = max(self.base_delay, _env_float("DISPAROS_RETRY_MAX_DELAY_SECONDS", 3600.0))
+
+    @staticmethod
+    def retryable(exc: BaseException) -> bool:
+        if isinstance(exc, HTTPException):
+            code = int(exc.status_code or 0)
+            return code in (408, 425, 429) or code >= 500
+        return isinstance(exc, (aiohttp.ClientError, asyncio.TimeoutError, OSError))
+
+    @staticmethod
+    def new_key() -> str:
+        return uuid.uuid4().hex
+
+    def backoff(self, tentativas: int) -> float:
+        delay = min(self.max_delay, self.base_delay * (2 ** max(0, int(tentativas))))
+        return random.uniform(delay / 2.0, delay)
+
+    def enqueue_many(self, dsn: Optional[str], jobs: List[Dict[str, Any]]) -> List[str]:
+        if not jobs:
+            return []
+        agora = datetime.utcnow()
+        chaves: List[str] = []
+        params: List[tuple] = []
+        for job in jobs:
+            chave = str(job.get("chave") or self.new_key())
+            chaves.append(chave)
+            params.append(
+                (
+                    job.get("tid"),
+                    job.get("campanha_id"),
+                    chave,
+                    job.get("numero"),
+                    (job.get("nome") or None),
+                    (job.get("mensagem") or ''),
+                    json.dumps(job.get("midia"), ensure_ascii=False) if job.get("midia") else None,
+                    str(job.get("text_position") or "bottom"),
+                    (str(job.get("evolution_api_id")) if job.get("evolution_api_id") is not None else None),
+                    (job.get("instance") or None),
+                    int(job.get("max_tentativas") or self.max_attempts),
+                    agora + timedelta(seconds=self.backoff(0)),
+                    (str(job.get("erro") or "") or None),
+                )
+            )
+        with self._get_db_connection(dsn or None) as conn:
+            cur = conn.cursor()
+            cur.executemany(
+                f"""
+                INSERT INTO "{self._schema}"."DisparosRetry"
+                ("IdTenant","IdCampanha","Chave","Provider","Numero","Nome","Mensagem","Midia","TextPosition",
+                 "EvolutionApiId","EvolutionInstance","Tentativas","MaxTentativas","ProximaTentativa","Status","UltimoErro")
+                VALUES (%s,%s,%s,'evolution',%s,%s,%s,%s::jsonb,%s,%s,%s,0,%s,%s,'PENDENTE',%s)
+                ON CONFLICT ("Chave") DO NOTHING
+                """,
+                params,
+            )
+            conn.commit()
+        return chaves
+
+    def enqueue(self, dsn: Optional[str], job: Dict[str, Any]) -> str:
+        return self.enqueue_many(dsn, [job])[0]
+
+    def enqueue_for_request(self, request: Request, job: Dict[str, Any]) -> str:
+        return self.enqueue(self._dsn_for_request(request), job)
+
+    def enqueue_many_for_request(self, request: Request, jobs: List[Dict[str, Any]]) -> List[str]:
+        return self.enqueue_many(self._dsn_for_request(request), jobs)
+
+    def claim(self, dsn: Optional[str], limit: int, stale_seconds: int) -> List[Dict[str, Any]]:
+        cols = ", ".join(f'r."{c}"' for c in _RETRY_COLUMNS)
+        with self._get_db_connection(dsn or None) as conn:
+            cur = conn.cursor()
+            cur.execute(
+                f"""
+                UPDATE "{self._schema}"."DisparosRetry" r
+                SET "Status" = 'PROCESSANDO',
+                    "AtualizadoEm" = NOW() AT TIME ZONE 'UTC'
+                WHERE r."IdRetry" IN (
+                    SELECT "IdRetry"
+                    FROM "{self._schema}"."DisparosRetry" q
+                    WHERE (("Status" = 'PENDENTE' AND "ProximaTentativa" <= NOW() AT TIME ZONE 'UTC')
+                           OR ("Status" = 'PROCESSANDO'
+                               AND "AtualizadoEm" < (NOW() AT TIME ZONE 'UTC') - make_interval(secs => %s)))
+                      AND NOT EXISTS (
+                          SELECT 1 FROM "{self._schema}"."Campanhas" c
+                          WHERE c."IdCampanha" = q."IdCampanha"
+                            AND c."DisparoStatus" IN ('PAUSADO', 'CANCELADO')
+                      )
+                    ORDER BY "ProximaTentativa" ASC
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING {cols}
+                """,
+                (int(stale_seconds), int(limit)),
+            )
+            rows = cur.fetchall() or []
+            conn.commit()
+        return [dict(zip(_RETRY_COLUMNS, r)) for r in rows]
+
+    def complete(self, dsn: Optional[str], job: Dict[str, Any], sent: List[Dict[str, Any]]) -> None:
+        first = sent[0] if sent else {}
+        tentativas = int(job.get("Tentativas") or 0) + 1
+        with self._get_db_connection(dsn or None) as conn:
+            cur = conn.cursor()
+            cur.execute(
+                f"""
+                UPDATE "{self._schema}"."Disparos"
+                SET "Status" = 'ENVIADO',
+                    "DataHora" = NOW() AT TIME ZONE 'UTC',
+                    "MessageId" = %s,
+                    "Mensagem" = COALESCE(%s, "Mensagem"),
+                    "Imagem" = %s,
+                    "EvolutionInstance" = COALESCE(%s, "EvolutionInstance"),
+                    "Payload" = COALESCE("Payload", '{{}}'::jsonb) || %s::jsonb
+                WHERE "IdTenant" = %s
+                  AND "Payload" ? 'retry_key'
+                  AND "Payload"->>'retry_key' = %s
+                  AND "Status" = 'FALHA'
+                """,
+                (
+                    first.get("message_id"),
+                    first.get("mensagem"),
+                    first.get("imagem"),
+                    job.get("instance"),
+                    json.dumps({"retry_tentativas": tentativas, "retry_status": "CONCLUIDO", "resp": first.get("resp")}, ensure_ascii=False, default=str),
+                    job.get("IdTenant"),
+                    job.get("Chave"),
+                ),
+            )
+            cur.execute(
+                f"""
+                UPDATE "{self._schema}"."DisparosRetry"
+                SET "Status" = 'CONCLUIDO',
+                    "Tentativas" = %s,
+                    "UltimoErro" = NULL,
+                    "AtualizadoEm" = NOW() AT TIME ZONE 'UTC'
+                WHERE "IdRetry" = %s
+                """,
+                (tentativas, int(job["IdRetry"])),
+            )
+            if job.get("IdCampanha") is not None:
+                mark_contato_envio(cur, self._schema, int(job.get("IdTenant") or 1), int(job["IdCampanha"]), job.get("Numero"), True)
+            conn.commit()
+
+    def reschedule(self, dsn: Optional[str], job: Dict[str, Any], erro: str, retryable: bool) -> str:
+        tentativas = int(job.get("Tentativas") or 0) + 1
+        max_tentativas = int(job.get("MaxTentativas") or self.max_attempts)
+        if retryable and tentativas < max_tentativas:
+            status = "PENDENTE"
+            proxima = datetime.utcnow() + timedelta(seconds=self.backoff(tentativas))
+        else:
+            status = "ESGOTADO"
+            proxima = None
+        with self._get_db_connection(dsn or None) as conn:
+            cur = conn.cursor()
+            cur.execute(
+                f"""
+                UPDATE "{self._schema}"."DisparosRetry"
+                SET "Status" = %s,
+                    "Tentativas" = %s,
+                    "ProximaTentativa" = COALESCE(%s, "ProximaTentativa"),
+                    "UltimoErro" = %s,
+                    "AtualizadoEm" = NOW() AT TIME ZONE 'UTC'
+                WHERE "IdRetry" = %s
+                """,
+                (status, tentativas, proxima, erro, int(job["IdRetry"])),
+            )
+            if status == "ESGOTADO":
+                cur.execute(
+                    f"""
+                    UPDATE "{self._schema}"."Disparos"
+                    SET "Payload" = COALESCE("Payload", '{{}}'::jsonb) || %s::jsonb
+                    WHERE "IdTenant" = %s
+                      AND "Payload" ? 'retry_key'
+                      AND "Payload"->>'retry_key' = %s
+                      AND "Status" = 'FALHA'
+                    """,
+                    (
+                        json.dumps({"retry_tentativas": tentativas, "retry_status": status, "error": erro}, ensure_ascii=False),
+                        job.get("IdTenant"),
+                        job.get("Chave"),
+                    ),
+                )
+            conn.commit()
+        return status
+
+
+def register_disparos_retry_worker(
+    app: FastAPI,
+    get_db_connection: Callable[..., Any],
+    get_conn_for_request: Callable[[Request], Any],
+    db_schema: str,
+    tenant_id_from_header: Callable[[Request], int],
+    list_tenants_with_dsn: Callable[[], List[Tuple[str, str, str, int]]],
+    retry_queue: DisparosRetryQueue,
+    evolution: Dict[str, Any],
+):
+    DB_SCHEMA = str(db_schema or "captar").replace('"', '""')
+    POLL_SECONDS = _env_float("DISPAROS_RETRY_POLL_SECONDS", 10.0)
+    BATCH = max(1, _env_int("DISPAROS_RETRY_BATCH", 50))
+    WORKERS = max(1, _env_int("DISPAROS_RETRY_WORKERS", 4))
+    STALE_SECONDS = _env_int("DISPAROS_RETRY_STALE_SECONDS", 600)
+    _loop_task: Dict[str, Optional[asyncio.Task]] = {"task": None}
+
+    def _retry_targets() -> List[str]:
+        out = [""]
+        for _slug, _nome, dsn, _idt in list_tenants_with_dsn() or []:
+            d = str(dsn or "").strip()
+            if d and d not in out:
+                out.append(d)
+        return out
+
+    def _send_context(dsn: str, job: Dict[str, Any]) -> Dict[str, Any]:
+        with get_db_connection(dsn or None) as conn:
+            return evolution["send_context"](conn, job.get("EvolutionApiId") or None)
+
+    async def _retry_one(session, dsn: str, job: Dict[str, Any]) -> None:
+        sent: List[Dict[str, Any]] = []
+        try:
+            ctx = await asyncio.to_thread(_send_context, dsn, job)
+            job["instance"] = ctx["instance"]
+            await evolution["deliver"](
+                session,
+                ctx,
+                phone=job.get("Numero"),
+                message=job.get("Mensagem"),
+                media=job.get("Midia") or None,
+                text_position=job.get("TextPosition") or "bottom",
+                on_sent=sent.append,
+            )
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            erro = str(e.detail) if isinstance(e, HTTPException) else str(e)
+            if sent:
+                await asyncio.to_thread(_log_extra_parts, dsn, job, sent)
+            status = await asyncio.to_thread(retry_queue.reschedule, dsn, job, erro, retry_queue.retryable(e))
+            print(f"Disparos retry: id={job['IdRetry']} numero={job.get('Numero')} status={status} erro={erro}")
+            return
+        await asyncio.to_thread(retry_queue.complete, dsn, job, sent)
+        if len(sent) > 1:
+            await asyncio.to_thread(_log_extra_parts, dsn, job, sent[1:])
+
+    def _log_extra_parts(dsn: str, job: Dict[str, Any], parts: List[Dict[str, Any]]) -> None:
+        try:
+            evolution["log_disparos"](
+                dsn,
+                int(job.get("IdTenant") or 1),
+                [
+                    {
+                        "campanha_id": job.get("IdCampanha"),
+                        "numero": job.get("Numero"),
+                        "nome": job.get("Nome"),
+                        "mensagem": p.get("mensagem"),
+                        "imagem": p.get("imagem"),
+                        "payload": p.get("resp"),
+                        "message_id": p.get("message_id"),
+                        "instance": job.get("instance"),
+                    }
+                    for p in parts
+                ],
+            )
+        except Exception as e:
+            print(f"Disparos retry: falha ao registrar Disparos: {e}")
+
+    async def _retry_tick() -> int:
+        total = 0
+        for dsn in await asyncio.to_thread(_retry_targets):
+            try:
+                jobs = await asyncio.to_thread(retry_queue.claim, dsn, BATCH, STALE_SECONDS)
+            except Exception:
+                continue
+            if not jobs:
+                continue
+            await asyncio.to_thread(evolution["flush_disparos"])
+            sem = asyncio.Semaphore(WORKERS)
+
+            async def _guarded(session, job):
+                async with sem:
+                    await _retry_one(session, dsn, job)
+
+            async with http_session("evolution") as session:
+                await asyncio.gather(*[_guarded(session, j) for j in jobs], return_exceptions=True)
+            total += len(jobs)
+        return total
+
+    async def _retry_loop() -> None:
+        while True:
+            try:
+                processed = await _retry_tick()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                traceback.print_exc()
+                processed = 0
+            if processed < BATCH:
+                await asyncio.sleep(POLL_SECONDS)
+
+    @app.on_event("startup")
+    async def start_disparos_retry():
+        if str(os.getenv("DISPAROS_RETRY_ENABLED", "1")).strip().lower() in ("0", "false", "no", "off"):
+            return
+        if _loop_task["task"] is None:
+            _loop_task["task"] = asyncio.create_task(_retry_loop())
+
+    @app.on_event("shutdown")
+    async def stop_disparos_retry():
+        task = _loop_task["task"]
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        _loop_task["task"] = None
+
+    @app.get("/api/disparos/retry")
+    async def disparos_retry_resumo(request: Request, campanha_id: Optional[int] = None):
+        try:
+            tid = tenant_id_from_header(request)
+            where = '"IdTenant" = %s'
+            params: List[Any] = [tid]
+            if campanha_id is not None:
+                where += ' AND "IdCampanha" = %s'
+                params.append(int(campanha_id))
+            with get_conn_for_request(request) as conn:
+                cur = conn.cursor()
+                cur.execute(
+                    f'SELECT "Status", COUNT(*) FROM "{DB_SCHEMA}"."DisparosRetry" WHERE {where} GROUP BY "Status"',
+                    tuple(params),
+                )
+                por_status = {str(r[0]): int(r[1]) for r in cur.fetchall() or []}
+                cur.execute(
+                    f"""
+                    SELECT "IdRetry","IdCampanha","Numero","Tentativas","MaxTentativas","ProximaTentativa","Status","UltimoErro"
+                    FROM "{DB_SCHEMA}"."DisparosRetry"
+                    WHERE {where} AND "Status" IN ('PENDENTE','PROCESSANDO','ESGOTADO')
+                    ORDER BY "AtualizadoEm" DESC
+                    LIMIT 100
+                    """,
+                    tuple(params),
+                )
+                cols = [d[0] for d in cur.description]
+                itens = [dict(zip(cols, r)) for r in cur.fetchall() or []]
+            return {"por_status": por_status, "itens": itens}
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
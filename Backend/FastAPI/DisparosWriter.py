@@ -0,0 +1,222 @@
+from fastapi import FastAPI, Request
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional
+import os
+import json
+import time
+import asyncio
+import threading
+import traceback
+
+
+_DISPAROS_COLUMNS = (
+    "IdTenant",
+    "IdCampanha",
+    "Canal",
+    "Direcao",
+    "Numero",
+    "Nome",
+    "Mensagem",
+    "Imagem",
+    "Status",
+    "DataHora",
+    "Payload",
+    "MessageId",
+    "EvolutionInstance",
+)
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(str(os.getenv(name, "") or "").strip() or default)
+    except Exception:
+        return default
+
+
+class DisparosWriter:
+    def __init__(
+        self,
+        get_db_connection: Callable[..., Any],
+        db_schema: str,
+        dsn_for_request: Callable[[Request], Optional[str]],
+        max_rows: Optional[int] = None,
+        flush_interval: Optional[float] = None,
+    ):
+        self._get_db_connection = get_db_connection
+        self._schema = str(db_schema or "captar").replace('"', '""')
+        self._dsn_for_request = dsn_for_request
+        self.max_rows = int(max_rows or _env_float("DISPAROS_WRITER_MAX_ROWS", 500))
+        self.flush_interval = float(flush_interval or _env_float("DISPAROS_WRITER_FLUSH_SECONDS", 0.5))
+        self._buffer: Dict[str, List[tuple]] = {}
+        self._pending_ids: set = set()
+        self._size = 0
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+        self.stats: Dict[str, Any] = {"rows": 0, "flushes": 0, "errors": 0, "dropped": 0, "last_flush_ms": 0.0}
+
+    def _row_tuple(self, row: Dict[str, Any]) -> tuple:
+        payload = row.get("Payload")
+        if payload is not None and not isinstance(payload, str):
+            payload = json.dumps(payload, ensure_ascii=False, default=str)
+        data_hora = row.get("DataHora") or datetime.utcnow()
+        return (
+            row.get("IdTenant"),
+            row.get("IdCampanha"),
+            row.get("Canal") or "WHATSAPP",
+            row.get("Direcao") or "OUT",
+            row.get("Numero"),
+            row.get("Nome"),
+            row.get("Mensagem"),
+            row.get("Imagem"),
+            row.get("Status"),
+            data_hora,
+            payload,
+            row.get("MessageId"),
+            row.get("EvolutionInstance"),
+        )
+
+    def add_many(self, dsn: Optional[str], rows: Iterable[Dict[str, Any]]) -> None:
+        items = [self._row_tuple(r) for r in rows or []]
+        if not items:
+            return
+        key = str(dsn or "")
+        with self._cond:
+            self._buffer.setdefault(key, []).extend(items)
+            self._size += len(items)
+            for it in items:
+                if it[11]:
+                    self._pending_ids.add(str(it[11]))
+            if self._size >= self.max_rows:
+                self._cond.notify()
+        if self._thread is None:
+            self.flush()
+
+    def add(self, dsn: Optional[str], row: Dict[str, Any]) -> None:
+        self.add_many(dsn, [row])
+
+    def add_for_request(self, request: Request, rows: Iterable[Dict[str, Any]]) -> None:
+        self.add_many(self._dsn_for_request(request), rows)
+
+    def flush_pending(self, message_ids: Iterable[Any]) -> None:
+        ids = {str(x) for x in (message_ids or []) if x}
+        if not ids:
+            return
+        with self._cond:
+            hit = bool(ids & self._pending_ids)
+        if hit:
+            self.flush()
+
+    def _copy_rows(self, dsn: str, rows: List[tuple]) -> None:
+        cols = ", ".join(f'"{c}"' for c in _DISPAROS_COLUMNS)
+        with self._get_db_connection(dsn or None) as conn:
+            cur = conn.cursor()
+            try:
+                with cur.copy(f'COPY "{self._schema}"."Disparos" ({cols}) FROM STDIN') as cp:
+                    for r in rows:
+                        cp.write_row(r)
+                conn.commit()
+                return
+            except Exception:
+                try:
+                    conn.rollback()
+                except Exception:
+                    pass
+            placeholders = ",".join("%s::jsonb" if c == "Payload" else "%s" for c in _DISPAROS_COLUMNS)
+            sql = f'INSERT INTO "{self._schema}"."Disparos" ({cols}) VALUES ({placeholders})'
+            try:
+                cur.executemany(sql, rows)
+                conn.commit()
+                return
+            except Exception:
+                try:
+                    conn.rollback()
+                except Exception:
+                    pass
+            for r in rows:
+                try:
+                    cur.execute(sql, r)
+                    conn.commit()
+                except Exception as e:
+                    self.stats["dropped"] += 1
+                    print(f"DisparosWriter: linha descartada ({e})")
+                    try:
+                        conn.rollback()
+                    except Exception:
+                        pass
+
+    def flush(self) -> int:
+        with self._flush_lock:
+            with self._cond:
+                batch = self._buffer
+                self._buffer = {}
+                self._size = 0
+                self._pending_ids = set()
+            total = 0
+            started = time.perf_counter()
+            for dsn, rows in batch.items():
+                if not rows:
+                    continue
+                try:
+                    self._copy_rows(dsn, rows)
+                    total += len(rows)
+                except Exception:
+                    self.stats["errors"] += 1
+                    self.stats["dropped"] += len(rows)
+                    traceback.print_exc()
+            if total:
+                self.stats["rows"] += total
+                self.stats["flushes"] += 1
+                self.stats["last_flush_ms"] = round((time.perf_counter() - started) * 1000.0, 2)
+            return total
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                if not self._stopping and self._size < self.max_rows:
+                    self._cond.wait(timeout=self.flush_interval)
+                stopping = self._stopping
+            try:
+                self.flush()
+            except Exception:
+                traceback.print_exc()
+            if stopping:
+                return
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="disparos-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        th = self._thread
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        if th is not None:
+            th.join(timeout=30)
+        self._thread = None
+        self.flush()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._cond:
+            buffered = self._size
+        return {**self.stats, "buffered": buffered, "max_rows": self.max_rows, "flush_interval": self.flush_interval}
+
+
+def register_disparos_writer(app: FastAPI, disparos_writer: DisparosWriter):
+    @app.on_event("startup")
+    async def start_disparos_writer():
+        disparos_writer.start()
+
+    @app.on_event("shutdown")
+    async def stop_disparos_writer():
+        # stop() faz join da thread (até 30s) e um flush final: fora do event loop.
+        await asyncio.to_thread(disparos_writer.stop)
+
+    @app.get("/api/admin/disparos-writer")
+    async def admin_disparos_writer():
+        return disparos_writer.snapshot()
@@ -27,6 +27,21 @@ from urllib.parse import urlparse, urlunparse
 
 import aiohttp
 
+try:
+    from .HttpSessions import http_session
+except ImportError:
+    from HttpSessions import http_session
+
+try:
+    from .SimNaoIndex import SimNaoIndex
+except ImportError:
+    from SimNaoIndex import SimNaoIndex
+
+try:
+    from .CampanhaContatos import list_campanha_contatos, mark_contato_envio, record_contato_resposta
+except ImportError:
+    from CampanhaContatos import list_campanha_contatos, mark_contato_envio, record_contato_resposta
+
 try:
     _MANAUS_TZ = ZoneInfo("America/Manaus") if ZoneInfo else timezone(timedelta(hours=-4))
 except Exception:
@@ -105,6 +120,41 @@ def _is_loopback_url(u: str) -> bool:
     except Exception:
         return True
 
+_SHARD_STRATEGIES = ("round_robin", "least_loaded", "sticky")
+
+def _phone_shard_key(v: Any) -> str:
+    dd = re.sub(r"\D+", "", str(v or ""))
+    if len(dd) == 13 and dd.startswith("55") and dd[4] == "9":
+        dd = dd[:4] + dd[5:]
+    elif len(dd) == 11 and dd[2] == "9":
+        dd = dd[:2] + dd[3:]
+    return dd[-10:]
+
+def _normalize_shard_strategy(raw: Any) -> str:
+    s = str(raw or "").strip().lower().replace("-", "_")
+    if s in ("rr", "roundrobin"):
+        s = "round_robin"
+    if s in ("least", "leastloaded"):
+        s = "least_loaded"
+    return s if s in _SHARD_STRATEGIES else "round_robin"
+
+def _pick_evolution_shard(
+    strategy: str,
+    ctxs: List[Dict[str, Any]],
+    *,
+    phone: Any = None,
+    seq: int = 0,
+) -> Dict[str, Any]:
+    # least_loaded não é decidido aqui: quem envia usa uma fila compartilhada entre as
+    # instâncias; sem ela, cai no round_robin.
+    if len(ctxs) == 1:
+        return ctxs[0]
+    if strategy == "sticky":
+        key = _phone_shard_key(phone)
+        return max(ctxs, key=lambda c: hashlib.md5(f"{key}:{c['instance']}".encode("utf-8")).hexdigest())
+    return ctxs[int(seq) % len(ctxs)]
+
+
 
 def register_evolution_routes(
     app: FastAPI,
@@ -114,8 +164,17 @@ def register_evolution_routes(
     get_redis_client: Callable[[], Any],
     get_dsn_by_slug: Callable[[str], Optional[str]],
     mask_key: Callable[[str], str],
+    rate_limiter: Optional[Any] = None,
+    disparos_writer: Optional[Any] = None,
+    retry_queue: Optional[Any] = None,
+    webhook_queue: Optional[Any] = None,
+    sim_nao_index: Optional[SimNaoIndex] = None,
+    webhook_dedup: Optional[Any] = None,
+    tenant_resolver: Optional[Any] = None,
 ):
     DB_SCHEMA = db_schema
+    if sim_nao_index is None:
+        sim_nao_index = SimNaoIndex(db_schema, lambda request: None)
     _get_dsn_by_slug = get_dsn_by_slug
     _EVOLUTION_INSTANCE_COLS: Tuple[List[str], float] = ([], 0.0)
 
@@ -129,7 +188,12 @@ def register_evolution_routes(
             return "captar"
 
     def _tenant_id_from_header(request: Request) -> int:
-        slug = _tenant_slug_from_header(request)
+        return _tenant_id_for_slug(_tenant_slug_from_header(request))
+
+    def _tenant_id_for_slug(slug: str) -> int:
+        if tenant_resolver is not None:
+            ctx = tenant_resolver.resolve(slug)
+            return ctx.id if ctx else 1
         try:
             rc = get_redis_client()
         except Exception:
@@ -577,489 +641,778 @@ def register_evolution_routes(
         except Exception:
             return None
 
-    @app.post("/api/integrations/whatsapp/send")
-    async def send_whatsapp_message(data: WhatsAppSendRequest, request: Request):
-        try:
-            evo = None
-            with get_conn_for_request(request) as conn:
-                evo = _get_evolution_instance(conn, data.evolution_api_id)
-                base_url = _get_evolution_base_url(conn)
-            instance = evo["name"]
-            api_key = str(evo.get("token") or "").strip() or str(os.getenv("AUTHENTICATION_API_KEY", "") or "").strip()
-            if not api_key:
-                raise HTTPException(status_code=500, detail="Token da instância Evolution API não encontrado.")
-            normalized_phone = _digits_only(data.phone)
-            if not normalized_phone:
-                raise HTTPException(status_code=400, detail="Telefone inválido para envio.")
-            media_type = str(data.media_type or "image").strip().lower() or "image"
-            if media_type not in ("image", "document", "video", "audio"):
-                media_type = "image"
-            base_candidates = _evolution_base_url_candidates(base_url)
-            if not base_candidates:
-                raise HTTPException(status_code=500, detail="Configuração da Evolution API incompleta no servidor.")
-            
-            # 1.5. Resolve Media URL if local filename
-            final_media_url = data.media_url
-            if final_media_url:
-                s_media = str(final_media_url).strip()
-                if s_media.startswith("data:"):
+    def _evolution_send_context(conn, evolution_api_id: Optional[Union[str, int]] = None) -> Dict[str, Any]:
+        evo = _get_evolution_instance(conn, evolution_api_id)
+        base_url = _get_evolution_base_url(conn)
+        api_key = str(evo.get("token") or "").strip() or str(os.getenv("AUTHENTICATION_API_KEY", "") or "").strip()
+        if not api_key:
+            raise HTTPException(status_code=500, detail="Token da instância Evolution API não encontrado.")
+        base_candidates = _evolution_base_url_candidates(base_url)
+        if not base_candidates:
+            raise HTTPException(status_code=500, detail="Configuração da Evolution API incompleta no servidor.")
+        return {
+            "instance": evo["name"],
+            "instance_id": evo.get("id"),
+            "api_key": api_key,
+            "base_url": base_url,
+            "base_candidates": base_candidates,
+        }
+
+    def _evolution_send_contexts(conn, evolution_api_ids: Optional[List[Union[str, int]]] = None) -> List[Dict[str, Any]]:
+        ids = [str(x).strip() for x in (evolution_api_ids or []) if str(x or "").strip()]
+        if not ids:
+            rows = _list_evolution_instances(conn)
+            connected = [r["id"] for r in rows if str(r.get("connectionStatus") or "").upper() in ("CONNECTED", "OPEN")]
+            ids = connected or []
+        if not ids:
+            return [_evolution_send_context(conn, None)]
+        out: List[Dict[str, Any]] = []
+        last_err: Optional[HTTPException] = None
+        for iid in ids:
+            try:
+                ctx = _evolution_send_context(conn, iid)
+            except HTTPException as he:
+                last_err = he
+                continue
+            if all(c["instance"] != ctx["instance"] for c in out):
+                out.append(ctx)
+        if not out:
+            raise last_err or HTTPException(status_code=500, detail="Nenhuma instância Evolution API disponível.")
+        return out
+
+    def _resolve_evolution_media(
+        media_url: Optional[str],
+        media_type: Optional[str],
+        base_candidates: List[str],
+        request: Optional[Request] = None,
+    ) -> Dict[str, Any]:
+        media_type = str(media_type or "image").strip().lower() or "image"
+        if media_type not in ("image", "document", "video", "audio"):
+            media_type = "image"
+        final_media_url = media_url
+        if final_media_url:
+            s_media = str(final_media_url).strip()
+            if s_media.startswith("data:"):
+                try:
+                    m = re.match(r"^data:([^;]+);base64,(.+)$", s_media, flags=re.IGNORECASE | re.DOTALL)
+                    if m:
+                        mime = str(m.group(1) or "").strip().lower()
+                        b64 = str(m.group(2) or "").strip()
+                        b64 = re.sub(r"\s+", "", b64)
+                        if mime.startswith("image/") and b64:
+                            ext = ".bin"
+                            if mime in ("image/jpeg", "image/jpg"):
+                                ext = ".jpg"
+                            elif mime == "image/png":
+                                ext = ".png"
+                            elif mime == "image/webp":
+                                ext = ".webp"
+                            elif mime == "image/gif":
+                                ext = ".gif"
+                            h = hashlib.sha256(b64.encode("utf-8")).hexdigest()[:32]
+                            filename = f"inline_{h}{ext}"
+                            base_dir = os.path.join(os.path.dirname(__file__), "static", "campanhas", "_inline")
+                            os.makedirs(base_dir, exist_ok=True)
+                            file_path = os.path.join(base_dir, filename)
+                            if not os.path.isfile(file_path):
+                                raw = base64.b64decode(b64 + "===")
+                                with open(file_path, "wb") as f:
+                                    f.write(raw)
+                            final_media_url = f"/static/campanhas/_inline/{filename}"
+                            s_media = str(final_media_url).strip()
+                except Exception:
+                    pass
+            # If not http/https and not data: -> assume local file in static/campanhas
+            if not s_media.startswith('http') and not s_media.startswith('data:'):
+                evo_is_local = False
+                evo_container = False
+                try:
+                    evo_is_local = any(_is_localish_base_url(x) for x in (base_candidates or []))
+                except Exception:
+                    evo_is_local = False
+                try:
+                    db_host = str(os.getenv("DB_HOST", "") or "").strip().lower()
+                    ev_port = str(os.getenv("EV_API_HOST_PORT", "") or "").strip()
+                    if db_host in ("localhost", "127.0.0.1", "0.0.0.0") and ev_port.isdigit():
+                        evo_container = True
+                except Exception:
+                    evo_container = False
+
+                cfg_media_base_url = str(os.getenv("WHATSAPP_MEDIA_BASE_URL") or "").strip().rstrip("/")
+                req_public = _request_public_base_url(request) if request is not None else ""
+                public_base = str(os.getenv("PUBLIC_BASE_URL") or os.getenv("CAPTAR_PUBLIC_BASE_URL") or "").strip().rstrip("/")
+
+                media_base_url = ""
+                evo_hostnames: set[str] = set()
+                if not cfg_media_base_url:
                     try:
-                        m = re.match(r"^data:([^;]+);base64,(.+)$", s_media, flags=re.IGNORECASE | re.DOTALL)
-                        if m:
-                            mime = str(m.group(1) or "").strip().lower()
-                            b64 = str(m.group(2) or "").strip()
-                            b64 = re.sub(r"\s+", "", b64)
-                            if mime.startswith("image/") and b64:
-                                ext = ".bin"
-                                if mime in ("image/jpeg", "image/jpg"):
-                                    ext = ".jpg"
-                                elif mime == "image/png":
-                                    ext = ".png"
-                                elif mime == "image/webp":
-                                    ext = ".webp"
-                                elif mime == "image/gif":
-                                    ext = ".gif"
-                                h = hashlib.sha256(b64.encode("utf-8")).hexdigest()[:32]
-                                filename = f"inline_{h}{ext}"
-                                base_dir = os.path.join(os.path.dirname(__file__), "static", "campanhas", "_inline")
-                                os.makedirs(base_dir, exist_ok=True)
-                                file_path = os.path.join(base_dir, filename)
-                                if not os.path.isfile(file_path):
-                                    raw = base64.b64decode(b64 + "===")
-                                    with open(file_path, "wb") as f:
-                                        f.write(raw)
-                                final_media_url = f"/static/campanhas/_inline/{filename}"
-                                s_media = str(final_media_url).strip()
+                        evo_hostnames = {str(urlparse(x).hostname or "").strip().lower() for x in (base_candidates or [])}
+                        if "evolution_api" in evo_hostnames:
+                            cfg_media_base_url = "http://fastapi:8000"
                     except Exception:
                         pass
-                # If not http/https and not data: -> assume local file in static/campanhas
-                if not s_media.startswith('http') and not s_media.startswith('data:'):
-                    evo_is_local = False
-                    evo_container = False
+                if not evo_hostnames:
                     try:
-                        evo_is_local = any(_is_localish_base_url(x) for x in (base_candidates or []))
+                        evo_hostnames = {str(urlparse(x).hostname or "").strip().lower() for x in (base_candidates or [])}
                     except Exception:
-                        evo_is_local = False
+                        evo_hostnames = set()
+                evo_docker = ("evolution_api" in evo_hostnames)
+                if cfg_media_base_url:
+                    cfg_loopback = False
+                    evo_non_loopback = False
                     try:
-                        db_host = str(os.getenv("DB_HOST", "") or "").strip().lower()
-                        ev_port = str(os.getenv("EV_API_HOST_PORT", "") or "").strip()
-                        if db_host in ("localhost", "127.0.0.1", "0.0.0.0") and ev_port.isdigit():
-                            evo_container = True
+                        cfg_host = str(urlparse(cfg_media_base_url).hostname or "").strip().lower()
+                        if cfg_host in ("localhost", "127.0.0.1", "0.0.0.0"):
+                            cfg_loopback = True
                     except Exception:
-                        evo_container = False
-
-                    cfg_media_base_url = str(os.getenv("WHATSAPP_MEDIA_BASE_URL") or "").strip().rstrip("/")
-                    req_public = _request_public_base_url(request)
-                    public_base = str(os.getenv("PUBLIC_BASE_URL") or os.getenv("CAPTAR_PUBLIC_BASE_URL") or "").strip().rstrip("/")
-
-                    media_base_url = ""
-                    evo_hostnames: set[str] = set()
-                    if not cfg_media_base_url:
-                        try:
-                            evo_hostnames = {str(urlparse(x).hostname or "").strip().lower() for x in (base_candidates or [])}
-                            if "evolution_api" in evo_hostnames:
-                                cfg_media_base_url = "http://fastapi:8000"
-                        except Exception:
-                            pass
-                    if not evo_hostnames:
-                        try:
-                            evo_hostnames = {str(urlparse(x).hostname or "").strip().lower() for x in (base_candidates or [])}
-                        except Exception:
-                            evo_hostnames = set()
-                    evo_docker = ("evolution_api" in evo_hostnames)
-                    if cfg_media_base_url:
                         cfg_loopback = False
-                        evo_non_loopback = False
+                    if cfg_loopback:
                         try:
-                            cfg_host = str(urlparse(cfg_media_base_url).hostname or "").strip().lower()
-                            if cfg_host in ("localhost", "127.0.0.1", "0.0.0.0"):
-                                cfg_loopback = True
+                            for u in (base_candidates or []):
+                                h = str(urlparse(u).hostname or "").strip().lower()
+                                if h and h not in ("localhost", "127.0.0.1", "0.0.0.0"):
+                                    evo_non_loopback = True
+                                    break
                         except Exception:
-                            cfg_loopback = False
-                        if cfg_loopback:
+                            evo_non_loopback = False
+                    if cfg_loopback and evo_non_loopback:
+                        cfg_media_base_url = ""
+                    if cfg_loopback and evo_container:
+                        cfg_media_base_url = ""
+
+                    if cfg_media_base_url:
+                        if evo_is_local:
+                            media_base_url = cfg_media_base_url
+                        elif evo_docker and not _is_loopback_url(cfg_media_base_url):
+                            media_base_url = cfg_media_base_url
                             try:
-                                for u in (base_candidates or []):
-                                    h = str(urlparse(u).hostname or "").strip().lower()
-                                    if h and h not in ("localhost", "127.0.0.1", "0.0.0.0"):
-                                        evo_non_loopback = True
-                                        break
+                                cfg_p2 = urlparse(cfg_media_base_url)
+                                cfg_h2 = str(cfg_p2.hostname or "").strip().lower()
+                                if cfg_h2 == "fastapi":
+                                    hp = str(os.getenv("FASTAPI_HOST_PORT", "") or "").strip()
+                                    if hp.isdigit():
+                                        media_base_url = f"{str(cfg_p2.scheme or 'http').lower()}://host.docker.internal:{hp}"
                             except Exception:
-                                evo_non_loopback = False
-                        if cfg_loopback and evo_non_loopback:
-                            cfg_media_base_url = ""
-                        if cfg_loopback and evo_container:
-                            cfg_media_base_url = ""
-
-                        if cfg_media_base_url:
-                            if evo_is_local:
                                 media_base_url = cfg_media_base_url
-                            elif evo_docker and not _is_loopback_url(cfg_media_base_url):
-                                media_base_url = cfg_media_base_url
-                                try:
-                                    cfg_p2 = urlparse(cfg_media_base_url)
-                                    cfg_h2 = str(cfg_p2.hostname or "").strip().lower()
-                                    if cfg_h2 == "fastapi":
-                                        hp = str(os.getenv("FASTAPI_HOST_PORT", "") or "").strip()
-                                        if hp.isdigit():
-                                            media_base_url = f"{str(cfg_p2.scheme or 'http').lower()}://host.docker.internal:{hp}"
-                                except Exception:
-                                    media_base_url = cfg_media_base_url
-                            elif not _is_localish_base_url(cfg_media_base_url):
-                                media_base_url = cfg_media_base_url
-
-                    if not media_base_url and evo_container:
-                        fastapi_host_port = os.getenv("FASTAPI_HOST_PORT", "8000")
-                        media_base_url = f"http://host.docker.internal:{fastapi_host_port}"
-                    if not media_base_url and not evo_is_local and not evo_container:
-                        if public_base.startswith("http://") or public_base.startswith("https://"):
-                            media_base_url = public_base
-                        elif req_public:
-                            media_base_url = req_public
-
-                    if not media_base_url:
+                        elif not _is_localish_base_url(cfg_media_base_url):
+                            media_base_url = cfg_media_base_url
+
+                if not media_base_url and evo_container:
+                    fastapi_host_port = os.getenv("FASTAPI_HOST_PORT", "8000")
+                    media_base_url = f"http://host.docker.internal:{fastapi_host_port}"
+                if not media_base_url and not evo_is_local and not evo_container:
+                    if public_base.startswith("http://") or public_base.startswith("https://"):
+                        media_base_url = public_base
+                    elif req_public:
                         media_base_url = req_public
-                    if not media_base_url:
-                        try:
-                            media_base_url = _sanitize_media_base_url(request.base_url)
-                        except Exception:
-                            media_base_url = ""
-                    if not media_base_url:
-                        fastapi_host_port = os.getenv("FASTAPI_HOST_PORT", "8000")
-                        media_base_url = f"http://host.docker.internal:{fastapi_host_port}"
-                    media_base_url = str(media_base_url).rstrip("/")
-                    if s_media.startswith('/static/') or s_media.startswith('/'):
-                        final_media_url = f"{media_base_url}{s_media}"
-                    elif s_media.startswith('static/'):
-                        final_media_url = f"{media_base_url}/{s_media}"
-                    else:
-                        final_media_url = f"{media_base_url}/static/campanhas/{s_media}"
-                    print(f"Resolved local media path '{s_media}' to '{final_media_url}'")
 
-            media_mimetype = ""
-            media_filename = ""
-            if final_media_url:
-                try:
-                    u = str(final_media_url or "").strip()
-                    path = ""
+                if not media_base_url:
+                    media_base_url = req_public
+                if not media_base_url and request is not None:
                     try:
-                        if u.lower().startswith("http://") or u.lower().startswith("https://"):
-                            path = str(urlparse(u).path or "")
-                        else:
-                            path = u
+                        media_base_url = _sanitize_media_base_url(request.base_url)
                     except Exception:
+                        media_base_url = ""
+                if not media_base_url:
+                    fastapi_host_port = os.getenv("FASTAPI_HOST_PORT", "8000")
+                    media_base_url = f"http://host.docker.internal:{fastapi_host_port}"
+                media_base_url = str(media_base_url).rstrip("/")
+                if s_media.startswith('/static/') or s_media.startswith('/'):
+                    final_media_url = f"{media_base_url}{s_media}"
+                elif s_media.startswith('static/'):
+                    final_media_url = f"{media_base_url}/{s_media}"
+                else:
+                    final_media_url = f"{media_base_url}/static/campanhas/{s_media}"
+                print(f"Resolved local media path '{s_media}' to '{final_media_url}'")
+
+        media_mimetype = ""
+        media_filename = ""
+        if final_media_url:
+            try:
+                u = str(final_media_url or "").strip()
+                path = ""
+                try:
+                    if u.lower().startswith("http://") or u.lower().startswith("https://"):
+                        path = str(urlparse(u).path or "")
+                    else:
                         path = u
-                    base = os.path.basename(path or "")
-                    if base:
-                        media_filename = base
-                    guess_target = media_filename or path
-                    mt, _enc = mimetypes.guess_type(guess_target)
-                    if mt:
-                        media_mimetype = str(mt)
                 except Exception:
-                    media_mimetype = ""
-                    media_filename = ""
-                if not media_mimetype:
-                    if media_type == "image":
-                        media_mimetype = "image/jpeg"
-                    elif media_type == "video":
-                        media_mimetype = "video/mp4"
-                    elif media_type == "audio":
-                        media_mimetype = "audio/mpeg"
-                    else:
-                        media_mimetype = "application/octet-stream"
-                if not media_filename:
-                    ext = ".bin"
-                    if media_type == "image":
-                        ext = ".jpg"
-                    elif media_type == "video":
-                        ext = ".mp4"
-                    elif media_type == "audio":
-                        ext = ".mp3"
-                    media_filename = f"media{ext}"
+                    path = u
+                base = os.path.basename(path or "")
+                if base:
+                    media_filename = base
+                guess_target = media_filename or path
+                mt, _enc = mimetypes.guess_type(guess_target)
+                if mt:
+                    media_mimetype = str(mt)
+            except Exception:
+                media_mimetype = ""
+                media_filename = ""
+            if not media_mimetype:
+                if media_type == "image":
+                    media_mimetype = "image/jpeg"
+                elif media_type == "video":
+                    media_mimetype = "video/mp4"
+                elif media_type == "audio":
+                    media_mimetype = "audio/mpeg"
+                else:
+                    media_mimetype = "application/octet-stream"
+            if not media_filename:
+                ext = ".bin"
+                if media_type == "image":
+                    ext = ".jpg"
+                elif media_type == "video":
+                    ext = ".mp4"
+                elif media_type == "audio":
+                    ext = ".mp3"
+                media_filename = f"media{ext}"
+        return {
+            "url": final_media_url or None,
+            "type": media_type,
+            "mimetype": media_mimetype,
+            "filename": media_filename,
+        }
 
-            # 2. Call Evolution API
-            headers = {
-                "apikey": api_key,
-                "Content-Type": "application/json"
-            }
+    async def _evolution_post_json(session, url: str, payload: dict, headers: dict, label: str, media_url: Optional[str] = None) -> Any:
+        async with session.post(url, json=payload, headers=headers, timeout=30) as resp:
+            if resp.status not in (200, 201):
+                text = await resp.text()
+                print(f"Evolution API Error{label}: {resp.status} - {text}")
+                code = resp.status if resp.status < 500 else 502
+                if media_url:
+                    detail = f"Erro na API WhatsApp{label}: status={resp.status} url={url} media={media_url} resp={text}"
+                else:
+                    detail = f"Erro na API WhatsApp{label}: status={resp.status} url={url} resp={text}"
+                raise HTTPException(status_code=code, detail=detail)
+            try:
+                return await resp.json()
+            except Exception:
+                try:
+                    return {"raw": await resp.text()}
+                except Exception:
+                    return {"raw": ""}
 
-            async with aiohttp.ClientSession() as session:
-                last_conn_err = None
-                for base_try in base_candidates:
-                    try:
-                        if final_media_url and data.text_position == 'top':
-                            msg = str(data.message or '').strip()
-                            if msg:
-                                url_text = f"{base_try}/message/sendText/{instance}"
-                                payload_text = {
-                                    "number": normalized_phone,
-                                    "text": msg,
-                                    "delay": 1200,
-                                    "linkPreview": True
-                                }
-                                print(f"Sending WhatsApp TEXT (TOP) to URL: {url_text}")
-                                async with session.post(url_text, json=payload_text, headers=headers, timeout=30) as resp_text:
-                                    if resp_text.status not in (200, 201):
-                                        text = await resp_text.text()
-                                        print(f"Evolution API Error (Text): {resp_text.status} - {text}")
-                                        code = resp_text.status if resp_text.status < 500 else 502
-                                        raise HTTPException(status_code=code, detail=f"Erro na API WhatsApp (Texto): {text}")
-                                    try:
-                                        resp_text_json = await resp_text.json()
-                                    except Exception:
-                                        try:
-                                            resp_text_json = {"raw": await resp_text.text()}
-                                        except Exception:
-                                            resp_text_json = {"raw": ""}
-                                    try:
-                                        message_id_text = _extract_evolution_message_id(resp_text_json) or None
-                                        with get_conn_for_request(request) as conn_log:
-                                            cursor_log = conn_log.cursor()
-                                            tid_log = _tenant_id_from_header(request)
-                                            cursor_log.execute(
-                                                f"""
-                                                INSERT INTO "{DB_SCHEMA}"."Disparos"
-                                                ("IdTenant","IdCampanha","Canal","Direcao","Numero","Nome","Mensagem","Imagem","Status","DataHora","Payload","MessageId","EvolutionInstance")
-                                                VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,NOW() AT TIME ZONE 'UTC',%s::jsonb,%s,%s)
-                                                """,
-                                                (
-                                                    tid_log,
-                                                    data.campanha_id,
-                                                    'WHATSAPP',
-                                                    'OUT',
-                                                    _digits_only(data.phone),
-                                                    (data.contato_nome or None),
-                                                    msg,
-                                                    None,
-                                                    'ENVIADO',
-                                                    json.dumps(resp_text_json, ensure_ascii=False),
-                                                    message_id_text,
-                                                    str(instance or '').strip() or None,
-                                                ),
-                                            )
-                                            conn_log.commit()
-                                    except Exception:
-                                        pass
-                        
-                            url_media = f"{base_try}/message/sendMedia/{instance}"
-                            print(f"Sending WhatsApp MEDIA (TOP) to URL: {url_media}")
-                            payload_media = {
-                                "number": normalized_phone,
-                                "mediatype": media_type,
-                                "mimetype": media_mimetype,
-                                "fileName": media_filename,
-                                "media": final_media_url,
-                                "delay": 1200,
-                                "linkPreview": True
-                            }
-                            async with session.post(url_media, json=payload_media, headers=headers, timeout=30) as resp_media:
-                                if resp_media.status not in (200, 201):
-                                    text = await resp_media.text()
-                                    code = resp_media.status if resp_media.status < 500 else 502
-                                    raise HTTPException(
-                                        status_code=code,
-                                        detail=f"Erro na API WhatsApp (Mídia): status={resp_media.status} url={url_media} media={final_media_url} resp={text}",
-                                    )
-                                resp_json = await resp_media.json()
-                                try:
-                                    message_id = _extract_evolution_message_id(resp_json) or None
-                                    with get_conn_for_request(request) as conn_log:
-                                        cursor_log = conn_log.cursor()
-                                        tid_log = _tenant_id_from_header(request)
-                                        cursor_log.execute(
-                                            f"""
-                                            INSERT INTO "{DB_SCHEMA}"."Disparos"
-                                            ("IdTenant","IdCampanha","Canal","Direcao","Numero","Nome","Mensagem","Imagem","Status","DataHora","Payload","MessageId","EvolutionInstance")
-                                            VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,NOW() AT TIME ZONE 'UTC',%s::jsonb,%s,%s)
-                                            """,
-                                            (
-                                                tid_log,
-                                                data.campanha_id,
-                                                'WHATSAPP',
-                                                'OUT',
-                                                _digits_only(data.phone),
-                                                (data.contato_nome or None),
-                                                (data.message or ''),
-                                                (final_media_url or None),
-                                                'ENVIADO',
-                                                json.dumps(resp_json, ensure_ascii=False),
-                                                message_id,
-                                                str(instance or '').strip() or None,
-                                            ),
-                                        )
-                                        conn_log.commit()
-                                except Exception:
-                                    pass
-                                return resp_json
-
-                        if final_media_url:
-                            url = f"{base_try}/message/sendMedia/{instance}"
-                            print(f"Sending WhatsApp MEDIA (BOTTOM) to URL: {url} with Instance: {instance}")
-                            payload = {
-                                "number": normalized_phone,
-                                "mediatype": media_type,
-                                "mimetype": media_mimetype,
-                                "fileName": media_filename,
-                                "caption": data.message,
-                                "media": final_media_url,
-                                "delay": 1200,
-                                "linkPreview": True
-                            }
-                            async with session.post(url, json=payload, headers=headers, timeout=30) as response:
-                                if response.status not in (200, 201):
-                                    text = await response.text()
-                                    print(f"Evolution API Error: {response.status} - {text}")
-                                    code = response.status if response.status < 500 else 502
-                                    raise HTTPException(
-                                        status_code=code,
-                                        detail=f"Erro na API WhatsApp: status={response.status} url={url} media={final_media_url} resp={text}",
-                                    )
-                                resp_json = await response.json()
-                                try:
-                                    message_id = _extract_evolution_message_id(resp_json) or None
-                                    with get_conn_for_request(request) as conn_log:
-                                        cursor_log = conn_log.cursor()
-                                        tid_log = _tenant_id_from_header(request)
-                                        cursor_log.execute(
-                                            f"""
-                                            INSERT INTO "{DB_SCHEMA}"."Disparos"
-                                            ("IdTenant","IdCampanha","Canal","Direcao","Numero","Nome","Mensagem","Imagem","Status","DataHora","Payload","MessageId","EvolutionInstance")
-                                            VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,NOW() AT TIME ZONE 'UTC',%s::jsonb,%s,%s)
-                                            """,
-                                            (
-                                                tid_log,
-                                                data.campanha_id,
-                                                'WHATSAPP',
-                                                'OUT',
-                                                _digits_only(data.phone),
-                                                (data.contato_nome or None),
-                                                (data.message or ''),
-                                                (final_media_url or None),
-                                                'ENVIADO',
-                                                json.dumps(resp_json, ensure_ascii=False),
-                                                message_id,
-                                                str(instance or '').strip() or None,
-                                            ),
-                                        )
-                                        conn_log.commit()
-                                except Exception:
-                                    pass
-                                return resp_json
-                    
-                        url = f"{base_try}/message/sendText/{instance}"
-                        print(f"Sending WhatsApp TEXT to URL: {url} with Instance: {instance}")
-                        payload = {
+    async def _evolution_deliver(
+        session,
+        ctx: Dict[str, Any],
+        *,
+        phone: str,
+        message: str,
+        media: Optional[Dict[str, Any]] = None,
+        text_position: Optional[str] = "bottom",
+        on_sent: Optional[Callable[[Dict[str, Any]], None]] = None,
+        rate_capped: bool = True,
+    ) -> Any:
+        normalized_phone = _digits_only(phone)
+        if not normalized_phone:
+            raise HTTPException(status_code=400, detail="Telefone inválido para envio.")
+        instance = ctx["instance"]
+        headers = {
+            "apikey": ctx["api_key"],
+            "Content-Type": "application/json"
+        }
+        media = media or {}
+        final_media_url = media.get("url")
+        if rate_limiter is not None:
+            parts = 2.0 if (final_media_url and text_position == 'top' and str(message or '').strip()) else 1.0
+            await rate_limiter.acquire("evolution", instance, parts, capped=rate_capped)
+        text_sent = False
+        last_conn_err = None
+        for base_try in ctx["base_candidates"]:
+            try:
+                if final_media_url and text_position == 'top':
+                    msg = str(message or '').strip()
+                    if msg and not text_sent:
+                        url_text = f"{base_try}/message/sendText/{instance}"
+                        payload_text = {
                             "number": normalized_phone,
-                            "text": data.message,
+                            "text": msg,
                             "delay": 1200,
                             "linkPreview": True
                         }
-                        async with session.post(url, json=payload, headers=headers, timeout=30) as response:
-                            if response.status not in (200, 201):
-                                text = await response.text()
-                                print(f"Evolution API Error: {response.status} - {text}")
-                                code = response.status if response.status < 500 else 502
-                                raise HTTPException(
-                                    status_code=code,
-                                    detail=f"Erro na API WhatsApp: status={response.status} url={url} resp={text}",
-                                )
-                            resp_json = await response.json()
-                            try:
-                                message_id = _extract_evolution_message_id(resp_json) or None
-                                with get_conn_for_request(request) as conn_log:
-                                    cursor_log = conn_log.cursor()
-                                    tid_log = _tenant_id_from_header(request)
-                                    cursor_log.execute(
-                                        f"""
-                                        INSERT INTO "{DB_SCHEMA}"."Disparos"
-                                        ("IdTenant","IdCampanha","Canal","Direcao","Numero","Nome","Mensagem","Imagem","Status","DataHora","Payload","MessageId","EvolutionInstance")
-                                        VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,NOW() AT TIME ZONE 'UTC',%s::jsonb,%s,%s)
-                                        """,
-                                        (
-                                            tid_log,
-                                            data.campanha_id,
-                                            'WHATSAPP',
-                                            'OUT',
-                                            _digits_only(data.phone),
-                                            (data.contato_nome or None),
-                                            (data.message or ''),
-                                            None,
-                                            'ENVIADO',
-                                            json.dumps(resp_json, ensure_ascii=False),
-                                            message_id,
-                                            str(instance or '').strip() or None,
-                                        ),
-                                    )
-                                    conn_log.commit()
-                            except Exception:
-                                pass
-                            return resp_json
-                    except HTTPException:
-                        raise
-                    except (aiohttp.ClientConnectorError, aiohttp.ClientConnectionError, asyncio.TimeoutError, OSError) as ce:
-                        last_conn_err = ce
-                        continue
-                if last_conn_err:
-                    raise HTTPException(status_code=502, detail=f"Falha ao conectar na Evolution API. BaseUrl={base_url}. Tentativas={base_candidates}. Erro={str(last_conn_err)}")
-                raise HTTPException(status_code=502, detail="Falha ao enviar mensagem no WhatsApp.")
+                        print(f"Sending WhatsApp TEXT (TOP) to URL: {url_text}")
+                        resp_text_json = await _evolution_post_json(session, url_text, payload_text, headers, " (Texto)")
+                        text_sent = True
+                        if on_sent:
+                            on_sent({"mensagem": msg, "imagem": None, "resp": resp_text_json, "message_id": _extract_evolution_message_id(resp_text_json) or None})
+
+                    url_media = f"{base_try}/message/sendMedia/{instance}"
+                    print(f"Sending WhatsApp MEDIA (TOP) to URL: {url_media}")
+                    payload_media = {
+                        "number": normalized_phone,
+                        "mediatype": media.get("type") or "image",
+                        "mimetype": media.get("mimetype"),
+                        "fileName": media.get("filename"),
+                        "media": final_media_url,
+                        "delay": 1200,
+                        "linkPreview": True
+                    }
+                    resp_json = await _evolution_post_json(session, url_media, payload_media, headers, " (Mídia)", final_media_url)
+                    if on_sent:
+                        on_sent({"mensagem": (message or ''), "imagem": final_media_url, "resp": resp_json, "message_id": _extract_evolution_message_id(resp_json) or None})
+                    return resp_json
+
+                if final_media_url:
+                    url = f"{base_try}/message/sendMedia/{instance}"
+                    print(f"Sending WhatsApp MEDIA (BOTTOM) to URL: {url} with Instance: {instance}")
+                    payload = {
+                        "number": normalized_phone,
+                        "mediatype": media.get("type") or "image",
+                        "mimetype": media.get("mimetype"),
+                        "fileName": media.get("filename"),
+                        "caption": message,
+                        "media": final_media_url,
+                        "delay": 1200,
+                        "linkPreview": True
+                    }
+                    resp_json = await _evolution_post_json(session, url, payload, headers, "", final_media_url)
+                    if on_sent:
+                        on_sent({"mensagem": (message or ''), "imagem": final_media_url, "resp": resp_json, "message_id": _extract_evolution_message_id(resp_json) or None})
+                    return resp_json
+
+                url = f"{base_try}/message/sendText/{instance}"
+                print(f"Sending WhatsApp TEXT to URL: {url} with Instance: {instance}")
+                payload = {
+                    "number": normalized_phone,
+                    "text": message,
+                    "delay": 1200,
+                    "linkPreview": True
+                }
+                resp_json = await _evolution_post_json(session, url, payload, headers, "")
+                if on_sent:
+                    on_sent({"mensagem": (message or ''), "imagem": None, "resp": resp_json, "message_id": _extract_evolution_message_id(resp_json) or None})
+                return resp_json
+            except HTTPException:
+                raise
+            except (aiohttp.ClientConnectorError, aiohttp.ClientConnectionError, asyncio.TimeoutError, OSError) as ce:
+                last_conn_err = ce
+                continue
+        if last_conn_err:
+            raise HTTPException(status_code=502, detail=f"Falha ao conectar na Evolution API. BaseUrl={ctx.get('base_url')}. Tentativas={ctx['base_candidates']}. Erro={str(last_conn_err)}")
+        raise HTTPException(status_code=502, detail="Falha ao enviar mensagem no WhatsApp.")
+
+    def _disparos_out_rows(tid: int, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        return [
+            {
+                "IdTenant": tid,
+                "IdCampanha": r.get("campanha_id"),
+                "Canal": 'WHATSAPP',
+                "Direcao": 'OUT',
+                "Numero": _digits_only(r.get("numero")),
+                "Nome": (r.get("nome") or None),
+                "Mensagem": (r.get("mensagem") or ''),
+                "Imagem": (r.get("imagem") or None),
+                "Status": r.get("status") or 'ENVIADO',
+                "Payload": json.dumps(r.get("payload"), ensure_ascii=False),
+                "MessageId": r.get("message_id"),
+                "EvolutionInstance": (str(r.get("instance") or '').strip() or None),
+            }
+            for r in rows
+        ]
+
+    def _insert_disparos_out(conn, tid: int, rows: List[Dict[str, Any]], commit: bool = True) -> None:
+        if not rows:
+            return
+        cursor_log = conn.cursor()
+        cursor_log.executemany(
+            f"""
+            INSERT INTO "{DB_SCHEMA}"."Disparos"
+            ("IdTenant","IdCampanha","Canal","Direcao","Numero","Nome","Mensagem","Imagem","Status","DataHora","Payload","MessageId","EvolutionInstance")
+            VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,NOW() AT TIME ZONE 'UTC',%s::jsonb,%s,%s)
+            """,
+            [
+                (
+                    r["IdTenant"],
+                    r["IdCampanha"],
+                    r["Canal"],
+                    r["Direcao"],
+                    r["Numero"],
+                    r["Nome"],
+                    r["Mensagem"],
+                    r["Imagem"],
+                    r["Status"],
+                    r["Payload"],
+                    r["MessageId"],
+                    r["EvolutionInstance"],
+                )
+                for r in _disparos_out_rows(tid, rows)
+            ],
+        )
+        if commit:
+            conn.commit()
+
+    def _log_disparos_out(dsn: Optional[str], tid: int, rows: List[Dict[str, Any]]) -> None:
+        if not rows:
+            return
+        if disparos_writer is not None:
+            disparos_writer.add_many(dsn, _disparos_out_rows(tid, rows))
+            return
+        with get_db_connection(dsn or None) as conn_log:
+            _insert_disparos_out(conn_log, tid, rows)
+
+    def _flush_disparos_out() -> int:
+        if disparos_writer is None:
+            return 0
+        return disparos_writer.flush()
+
+    def _log_disparos_for_request(request: Request, tid: int, rows: List[Dict[str, Any]]) -> None:
+        if not rows:
+            return
+        if disparos_writer is not None:
+            disparos_writer.add_for_request(request, _disparos_out_rows(tid, rows))
+            return
+        with get_conn_for_request(request) as conn_log:
+            _insert_disparos_out(conn_log, tid, rows)
+
+    def _mark_contatos_for_request(request: Request, tid: int, campanha_id: Optional[int], resultados: List[Tuple[str, bool]]) -> None:
+        """Status de envio em "CampanhaContatos" para cada (numero, enviado) da campanha."""
+        if campanha_id is None or not resultados:
+            return
+        try:
+            with get_conn_for_request(request) as conn:
+                cur = conn.cursor()
+                for numero, enviado in resultados:
+                    mark_contato_envio(cur, DB_SCHEMA, int(tid), int(campanha_id), numero, bool(enviado))
+                conn.commit()
+        except Exception as e:
+            print(f"Error updating CampanhaContatos: {e}")
+
+    def _retry_job(
+        exc: BaseException,
+        ctx: Optional[Dict[str, Any]],
+        *,
+        tid: int,
+        campanha_id: Optional[int],
+        numero: str,
+        nome: Optional[str],
+        mensagem: Optional[str],
+        media: Optional[Dict[str, Any]],
+        text_position: Optional[str],
+    ) -> Optional[Dict[str, Any]]:
+        if retry_queue is None or ctx is None or not retry_queue.retryable(exc):
+            return None
+        return {
+            "chave": retry_queue.new_key(),
+            "tid": tid,
+            "campanha_id": campanha_id,
+            "numero": _digits_only(numero),
+            "nome": nome,
+            "mensagem": mensagem,
+            "midia": media if (media or {}).get("url") else None,
+            "text_position": text_position,
+            "evolution_api_id": ctx.get("instance_id"),
+            "instance": ctx.get("instance"),
+            "erro": str(exc.detail) if isinstance(exc, HTTPException) else str(exc),
+        }
+
+    def _enqueue_retry_for_request(request: Request, job: Optional[Dict[str, Any]]) -> Optional[str]:
+        if job is None:
+            return None
+        try:
+            return retry_queue.enqueue_for_request(request, job)
+        except Exception as e:
+            print(f"Error enqueueing whatsapp retry: {e}")
+            return None
+
+    def _send_context_for_request(request: Request, evolution_api_id: Optional[str]) -> Dict[str, Any]:
+        with get_conn_for_request(request) as conn:
+            return _evolution_send_context(conn, evolution_api_id)
+
+    def _sent_rows(data: WhatsAppSendRequest, instance: Optional[str], parts: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        return [
+            {
+                "campanha_id": data.campanha_id,
+                "numero": data.phone,
+                "nome": data.contato_nome,
+                "mensagem": part.get("mensagem"),
+                "imagem": part.get("imagem"),
+                "payload": part.get("resp"),
+                "message_id": part.get("message_id"),
+                "instance": instance,
+            }
+            for part in parts
+        ]
+
+    def _record_send_success(request: Request, data: WhatsAppSendRequest, instance: Optional[str], sent: List[Dict[str, Any]]) -> None:
+        try:
+            tid_log = _tenant_id_from_header(request)
+            _log_disparos_for_request(request, tid_log, _sent_rows(data, instance, sent))
+            _mark_contatos_for_request(request, tid_log, data.campanha_id, [(data.phone, True)])
+        except Exception:
+            pass
+
+    def _record_send_failure(
+        request: Request,
+        data: WhatsAppSendRequest,
+        ctx: Optional[Dict[str, Any]],
+        media: Optional[Dict[str, Any]],
+        exc: BaseException,
+        sent: List[Dict[str, Any]],
+    ) -> None:
+        try:
+            tid_log = _tenant_id_from_header(request)
+            retry_key = _enqueue_retry_for_request(
+                request,
+                _retry_job(
+                    exc,
+                    ctx,
+                    tid=tid_log,
+                    campanha_id=data.campanha_id,
+                    numero=data.phone,
+                    nome=data.contato_nome,
+                    mensagem=data.message,
+                    media=media,
+                    text_position=data.text_position,
+                ),
+            )
+            fail_payload: Dict[str, Any] = {"error": exc.detail if isinstance(exc, HTTPException) else str(exc)}
+            if retry_key:
+                fail_payload["retry_key"] = retry_key
+            _log_disparos_for_request(
+                request,
+                tid_log,
+                _sent_rows(data, (ctx or {}).get("instance"), sent)
+                + [
+                    {
+                        "campanha_id": data.campanha_id,
+                        "numero": data.phone,
+                        "nome": data.contato_nome,
+                        "mensagem": data.message,
+                        "imagem": data.media_url,
+                        "status": 'FALHA',
+                        "payload": fail_payload,
+                        "instance": (ctx or {}).get("instance"),
+                    }
+                ],
+            )
+            _mark_contatos_for_request(request, tid_log, data.campanha_id, [(data.phone, False)])
+        except Exception:
+            pass
+
+    @app.post("/api/integrations/whatsapp/send")
+    async def send_whatsapp_message(data: WhatsAppSendRequest, request: Request):
+        ctx: Optional[Dict[str, Any]] = None
+        media: Optional[Dict[str, Any]] = None
+        sent: List[Dict[str, Any]] = []
+        try:
+            # Consultas e gravações usam psycopg síncrono: rodam em threads, fora do event loop.
+            ctx = await asyncio.to_thread(_send_context_for_request, request, data.evolution_api_id)
+            if not _digits_only(data.phone):
+                raise HTTPException(status_code=400, detail="Telefone inválido para envio.")
+
+            # 1.5. Resolve Media URL if local filename
+            media = await asyncio.to_thread(_resolve_evolution_media, data.media_url, data.media_type, ctx["base_candidates"], request)
+
+            # 2. Call Evolution API
+            async with http_session("evolution") as session:
+                resp = await _evolution_deliver(
+                    session,
+                    ctx,
+                    phone=data.phone,
+                    message=data.message,
+                    media=media,
+                    text_position=data.text_position,
+                    on_sent=sent.append,
+                )
+            await asyncio.to_thread(_record_send_success, request, data, ctx["instance"], sent)
+            return resp
 
         except HTTPException as he:
-            try:
-                with get_conn_for_request(request) as conn_log:
-                    cursor_log = conn_log.cursor()
-                    tid_log = _tenant_id_from_header(request)
-                    cursor_log.execute(
-                        f"""
-                        INSERT INTO "{DB_SCHEMA}"."Disparos"
-                        ("IdTenant","IdCampanha","Canal","Direcao","Numero","Nome","Mensagem","Imagem","Status","DataHora","Payload")
-                        VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,NOW() AT TIME ZONE 'UTC',%s::jsonb)
-                        """,
-                        (
-                            tid_log,
-                            data.campanha_id,
-                            'WHATSAPP',
-                            'OUT',
-                            _digits_only(data.phone),
-                            (data.contato_nome or None),
-                            (data.message or ''),
-                            (data.media_url or None),
-                            'FALHA',
-                            json.dumps({"error": he.detail}, ensure_ascii=False),
-                        ),
-                    )
-                    conn_log.commit()
-            except Exception:
-                pass
+            await asyncio.to_thread(_record_send_failure, request, data, ctx, media, he, sent)
             raise he
         except Exception as e:
             print(f"Error sending whatsapp: {e}")
             traceback.print_exc()
+            await asyncio.to_thread(_record_send_failure, request, data, ctx, media, e, sent)
+            raise HTTPException(status_code=500, detail=str(e))
+
+    class WhatsAppBatchRecipient(BaseModel):
+        phone: str
+        nome: Optional[str] = None
+        message: Optional[str] = None
+
+    class WhatsAppBatchSendRequest(BaseModel):
+        recipients: List[WhatsAppBatchRecipient]
+        message: str = ""
+        media_url: Optional[str] = None
+        media_type: Optional[str] = "image"
+        text_position: Optional[str] = "bottom"
+        campanha_id: Optional[int] = None
+        evolution_api_id: Optional[str] = None
+        evolution_api_ids: Optional[List[str]] = None
+        distribuicao: Optional[str] = None
+
+    _BATCH_MAX_RECIPIENTS = int(os.getenv("WHATSAPP_BATCH_MAX_RECIPIENTS", "5000") or 5000)
+    _INSTANCE_CONCURRENCY = max(1, int(os.getenv("EVOLUTION_INSTANCE_CONCURRENCY", "4") or 4))
+    _instance_semaphores: Dict[str, asyncio.Semaphore] = {}
+
+    def _instance_semaphore(instance: str) -> asyncio.Semaphore:
+        sem = _instance_semaphores.get(instance)
+        if sem is None:
+            sem = asyncio.Semaphore(_INSTANCE_CONCURRENCY)
+            _instance_semaphores[instance] = sem
+        return sem
+
+    def _batch_send_setup(request: Request, data: WhatsAppBatchSendRequest) -> Tuple[int, List[Dict[str, Any]], Optional[Dict[str, Any]]]:
+        tid = _tenant_id_from_header(request)
+        with get_conn_for_request(request) as conn:
+            if data.evolution_api_ids is not None:
+                ctxs = _evolution_send_contexts(conn, data.evolution_api_ids)
+            else:
+                ctxs = [_evolution_send_context(conn, data.evolution_api_id)]
+        media = _resolve_evolution_media(data.media_url, data.media_type, ctxs[0]["base_candidates"], request)
+        return tid, ctxs, media
+
+    def _record_batch(
+        request: Request,
+        tid: int,
+        campanha_id: Optional[int],
+        log_rows: List[Dict[str, Any]],
+        retry_jobs: List[Dict[str, Any]],
+        results: List[Dict[str, Any]],
+    ) -> None:
+        if retry_jobs:
             try:
-                with get_conn_for_request(request) as conn_log:
-                    cursor_log = conn_log.cursor()
-                    tid_log = _tenant_id_from_header(request)
-                    cursor_log.execute(
-                        f"""
-                        INSERT INTO "{DB_SCHEMA}"."Disparos"
-                        ("IdTenant","IdCampanha","Canal","Direcao","Numero","Nome","Mensagem","Imagem","Status","DataHora","Payload")
-                        VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,NOW() AT TIME ZONE 'UTC',%s::jsonb)
-                        """,
-                        (
-                            tid_log,
-                            data.campanha_id,
-                            'WHATSAPP',
-                            'OUT',
-                            _digits_only(data.phone),
-                            (data.contato_nome or None),
-                            (data.message or ''),
-                            (data.media_url or None),
-                            'FALHA',
-                            json.dumps({"error": str(e)}, ensure_ascii=False),
-                        ),
+                retry_queue.enqueue_many_for_request(request, retry_jobs)
+            except Exception as e:
+                print(f"Error enqueueing whatsapp batch retries: {e}")
+                retry_keys = {j["chave"] for j in retry_jobs}
+                for row in log_rows:
+                    if (row.get("payload") or {}).get("retry_key") in retry_keys:
+                        row["payload"].pop("retry_key", None)
+                for r in results:
+                    r["retry"] = False
+        try:
+            _log_disparos_for_request(request, tid, log_rows)
+        except Exception as e:
+            print(f"Error logging whatsapp batch: {e}")
+        _mark_contatos_for_request(request, tid, campanha_id, [(r["phone"], r["ok"]) for r in results])
+
+    @app.post("/api/integrations/whatsapp/send-batch")
+    async def send_whatsapp_batch(data: WhatsAppBatchSendRequest, request: Request):
+        try:
+            if not data.recipients:
+                raise HTTPException(status_code=400, detail="Nenhum destinatário informado.")
+            if len(data.recipients) > _BATCH_MAX_RECIPIENTS:
+                raise HTTPException(status_code=400, detail=f"Máximo de {_BATCH_MAX_RECIPIENTS} destinatários por lote.")
+            tid, ctxs, media = await asyncio.to_thread(_batch_send_setup, request, data)
+            strategy = _normalize_shard_strategy(data.distribuicao)
+            log_rows: List[Dict[str, Any]] = []
+            retry_jobs: List[Dict[str, Any]] = []
+
+            # Uma fila por instância (round_robin/sticky) ou uma fila compartilhada
+            # (least_loaded): cada instância tem _INSTANCE_CONCURRENCY workers e, com a fila
+            # compartilhada, o próximo destinatário vai para a instância que ficou livre.
+            lanes: Dict[str, asyncio.Queue] = {c["instance"]: asyncio.Queue() for c in ctxs}
+            shared: asyncio.Queue = asyncio.Queue()
+            for seq, rcpt in enumerate(data.recipients):
+                if strategy == "least_loaded":
+                    shared.put_nowait((seq, rcpt))
+                else:
+                    lanes[_pick_evolution_shard(strategy, ctxs, phone=rcpt.phone, seq=seq)["instance"]].put_nowait((seq, rcpt))
+            results: List[Optional[Dict[str, Any]]] = [None] * len(data.recipients)
+
+            async def _send_one(session, ctx: Dict[str, Any], rcpt: WhatsAppBatchRecipient) -> Dict[str, Any]:
+                msg = rcpt.message if rcpt.message is not None else data.message
+                sent: List[Dict[str, Any]] = []
+                instance = ctx["instance"]
+                erro = None
+                code = 200
+                retry = None
+                try:
+                    async with _instance_semaphore(instance):
+                        await _evolution_deliver(
+                            session,
+                            ctx,
+                            phone=rcpt.phone,
+                            message=msg,
+                            media=media,
+                            text_position=data.text_position,
+                            on_sent=sent.append,
+                            rate_capped=False,
+                        )
+                except HTTPException as he:
+                    erro = str(he.detail)
+                    code = he.status_code
+                    retry = _retry_job(he, ctx, tid=tid, campanha_id=data.campanha_id, numero=rcpt.phone, nome=rcpt.nome, mensagem=msg, media=media, text_position=data.text_position)
+                except Exception as e:
+                    erro = str(e)
+                    code = 500
+                    retry = _retry_job(e, ctx, tid=tid, campanha_id=data.campanha_id, numero=rcpt.phone, nome=rcpt.nome, mensagem=msg, media=media, text_position=data.text_position)
+                for part in sent:
+                    log_rows.append(
+                        {
+                            "campanha_id": data.campanha_id,
+                            "numero": rcpt.phone,
+                            "nome": rcpt.nome,
+                            "mensagem": part.get("mensagem"),
+                            "imagem": part.get("imagem"),
+                            "payload": part.get("resp"),
+                            "message_id": part.get("message_id"),
+                            "instance": instance,
+                        }
                     )
-                    conn_log.commit()
-            except Exception:
-                pass
+                if erro is not None:
+                    fail_payload: Dict[str, Any] = {"error": erro}
+                    if retry is not None:
+                        retry_jobs.append(retry)
+                        fail_payload["retry_key"] = retry["chave"]
+                    log_rows.append(
+                        {
+                            "campanha_id": data.campanha_id,
+                            "numero": rcpt.phone,
+                            "nome": rcpt.nome,
+                            "mensagem": msg,
+                            "imagem": data.media_url,
+                            "status": "FALHA",
+                            "payload": fail_payload,
+                            "instance": instance,
+                        }
+                    )
+                message_id = next((p.get("message_id") for p in reversed(sent) if p.get("message_id")), None)
+                return {
+                    "phone": _digits_only(rcpt.phone),
+                    "ok": erro is None,
+                    "status_code": code,
+                    "message_id": message_id,
+                    "instance": instance,
+                    "error": erro,
+                    "retry": retry is not None,
+                }
+
+            async def _lane(session, ctx: Dict[str, Any]) -> None:
+                queue = shared if strategy == "least_loaded" else lanes[ctx["instance"]]
+                while True:
+                    try:
+                        seq, rcpt = queue.get_nowait()
+                    except asyncio.QueueEmpty:
+                        return
+                    results[seq] = await _send_one(session, ctx, rcpt)
+
+            async with http_session("evolution") as session:
+                await asyncio.gather(*[_lane(session, c) for c in ctxs for _ in range(_INSTANCE_CONCURRENCY)])
+
+            await asyncio.to_thread(_record_batch, request, tid, data.campanha_id, log_rows, retry_jobs, results)
+
+            enviados = sum(1 for r in results if r["ok"])
+            rate_limit = None
+            if rate_limiter is not None:
+                rate_limit = await asyncio.to_thread(lambda: [rate_limiter.capacity("evolution", c["instance"]) for c in ctxs])
+            return {
+                "instance": ctxs[0]["instance"] if len(ctxs) == 1 else None,
+                "instances": [c["instance"] for c in ctxs],
+                "distribuicao": strategy,
+                "total": len(results),
+                "enviados": enviados,
+                "falhas": len(results) - enviados,
+                "rows": results,
+                "rate_limit": rate_limit,
+            }
+        except HTTPException:
+            raise
+        except Exception as e:
+            print(f"Error sending whatsapp batch: {e}")
+            traceback.print_exc()
             raise HTTPException(status_code=500, detail=str(e))
 
     class WhatsAppNumbersCheckRequest(BaseModel):
@@ -1116,7 +1469,7 @@ def register_evolution_routes(
 
             headers = {"apikey": api_key, "Content-Type": "application/json"}
             last_err: Any = None
-            async with aiohttp.ClientSession() as session:
+            async with http_session("evolution") as session:
                 for base_try in base_candidates:
                     try:
                         url = f"{base_try}/chat/whatsappNumbers/{instance}"
@@ -1315,17 +1668,6 @@ def register_evolution_routes(
             or c.get('destinatario_nome')
         )
 
-    def _anexo_contacts_list(anexo_obj: Any) -> List[dict]:
-        if anexo_obj is None:
-            return []
-        if isinstance(anexo_obj, list):
-            return [x for x in anexo_obj if isinstance(x, dict)]
-        if isinstance(anexo_obj, dict):
-            contacts = anexo_obj.get('contacts')
-            if isinstance(contacts, list):
-                return [x for x in contacts if isinstance(x, dict)]
-        return []
-
     def _anexo_question(anexo_obj: Any) -> str:
         if not isinstance(anexo_obj, dict):
             return ''
@@ -1365,12 +1707,21 @@ def register_evolution_routes(
 
         out: List[Dict[str, Any]] = []
         seen: set[str] = set()
-        for c in _anexo_contacts_list(anexo_obj)[: int(limit)]:
-            numero = _digits_only(_contact_phone_raw(c))
+        cursor.execute(
+            f"""
+            SELECT "Nome", "Numero"
+            FROM "{DB_SCHEMA}"."CampanhaContatos"
+            WHERE "IdTenant" = %s AND "IdCampanha" = %s
+            ORDER BY "Ordem"
+            LIMIT %s
+            """,
+            (int(tid), int(campanha_id), int(limit)),
+        )
+        for nome_raw, numero in cursor.fetchall() or []:
             if not numero or numero in seen:
                 continue
             seen.add(numero)
-            nome = str(_contact_name_raw(c) or '').strip() or '—'
+            nome = str(nome_raw or '').strip() or '—'
             out.append({"nome": nome, "numero": numero})
         return out
 
@@ -1477,8 +1828,9 @@ def register_evolution_routes(
             ent = by_num_last11.get(k11)
             return ent if ent is not None else None
 
+        registros = list_campanha_contatos(cursor, DB_SCHEMA, tid, campanha_id, limit_contacts)
         try:
-            for c in _anexo_contacts_list(anexo_obj)[: int(limit_contacts)]:
+            for c in registros:
                 if not isinstance(c, dict):
                     continue
                 numero = _digits_only(_contact_phone_raw(c))
@@ -1534,18 +1886,7 @@ def register_evolution_routes(
                    "Mensagem" as mensagem,
                    "RespostaClassificacao" as resposta,
                    "EntregueEm" as entregue_em,
-                   "VisualizadoEm" as visualizado_em,
-                   COALESCE(
-                     NULLIF("Payload"->>'keyId',''),
-                     NULLIF("Payload"->'key'->>'id',''),
-                     NULLIF("Payload"->'data'->>'keyId',''),
-                     NULLIF("Payload"->'data'->'key'->>'id',''),
-                     NULLIF("MessageId",''),
-                     NULLIF("Payload"->>'messageId',''),
-                     NULLIF("Payload"->'data'->>'messageId',''),
-                     NULLIF("Payload"->>'id',''),
-                     NULLIF("Payload"->'data'->>'id','')
-                   ) as message_id
+                   "VisualizadoEm" as visualizado_em
             FROM "{DB_SCHEMA}"."Disparos"
             WHERE "IdTenant" = %s AND "IdCampanha" = %s
             ORDER BY "IdDisparo" ASC
@@ -1556,69 +1897,6 @@ def register_evolution_routes(
         disp_rows = cursor.fetchall()
         disp_cols = [d[0] for d in cursor.description]
 
-        delivered_ts: Dict[str, datetime] = {}
-        read_ts: Dict[str, datetime] = {}
-        try:
-            msg_ids_needed: List[str] = []
-            seen_mid: set[str] = set()
-            for r in disp_rows or []:
-                d0 = dict(zip(disp_cols, r))
-                if str(d0.get('direcao') or '').upper() != 'OUT':
-                    continue
-                mid = str(d0.get('message_id') or '').strip()
-                if not mid:
-                    continue
-                if d0.get('entregue_em') is not None and d0.get('visualizado_em') is not None:
-                    continue
-                if mid in seen_mid:
-                    continue
-                seen_mid.add(mid)
-                msg_ids_needed.append(mid)
-
-            if msg_ids_needed:
-                delivered_ts, read_ts = _load_messageupdate_receipts(cursor, msg_ids=msg_ids_needed)
-                _apply_receipts_to_disparos(cursor, tid=int(tid), delivered_ts=delivered_ts, read_ts=read_ts, campanha_id=int(campanha_id))
-                try:
-                    cursor.connection.commit()
-                except Exception:
-                    pass
-                cursor.execute(
-                    f"""
-                    SELECT "Direcao" as direcao,
-                           "Numero" as numero,
-                           "Nome" as nome,
-                           "Status" as status,
-                           "DataHora" as datahora,
-                           "Mensagem" as mensagem,
-                           "RespostaClassificacao" as resposta,
-                           "EntregueEm" as entregue_em,
-                           "VisualizadoEm" as visualizado_em,
-                           COALESCE(
-                             NULLIF("Payload"->>'keyId',''),
-                             NULLIF("Payload"->'key'->>'id',''),
-                             NULLIF("Payload"->'data'->>'keyId',''),
-                             NULLIF("Payload"->'data'->'key'->>'id',''),
-                             NULLIF("MessageId",''),
-                             NULLIF("Payload"->>'messageId',''),
-                             NULLIF("Payload"->'data'->>'messageId',''),
-                             NULLIF("Payload"->>'id',''),
-                             NULLIF("Payload"->'data'->>'id','')
-                           ) as message_id
-                    FROM "{DB_SCHEMA}"."Disparos"
-                    WHERE "IdTenant" = %s AND "IdCampanha" = %s
-                    ORDER BY "IdDisparo" ASC
-                    LIMIT %s
-                    """,
-                    (int(tid), int(campanha_id), int(limit_logs)),
-                )
-                disp_rows = cursor.fetchall()
-                disp_cols = [d[0] for d in cursor.description]
-        except Exception:
-            try:
-                cursor.connection.rollback()
-            except Exception:
-                pass
-
         for r in disp_rows or []:
             d = dict(zip(disp_cols, r))
             numero = _digits_only(d.get('numero'))
@@ -1653,21 +1931,6 @@ def register_evolution_routes(
                 d_vis = d.get('visualizado_em')
                 if isinstance(d_vis, datetime):
                     d_vis = _to_utc_naive(d_vis)
-                mid = str(d.get('message_id') or '').strip()
-                if mid and is_newer_send:
-                    rts = read_ts.get(mid)
-                    dts = delivered_ts.get(mid)
-                    if d_vis is None and rts is not None:
-                        d_vis = rts
-                    if d_ent is None:
-                        if dts is not None:
-                            d_ent = dts
-                        elif rts is not None:
-                            d_ent = rts
-                    if d_vis is not None and d_ent is not None and d_vis == d_ent and rts is not None and rts != d_vis:
-                        d_vis = rts
-                    if d_vis is not None and d_ent is not None and d_vis == d_ent and dts is not None and dts != d_ent:
-                        d_ent = dts
                 if is_newer_send and isinstance(ent.get('envio_datahora'), datetime):
                     envio_dt = _to_utc_naive(ent.get('envio_datahora'))
                     if isinstance(d_ent, datetime) and envio_dt and d_ent < envio_dt:
@@ -2370,103 +2633,6 @@ def register_evolution_routes(
         except Exception:
             return None
 
-    def _load_messageupdate_receipts(cursor, *, msg_ids: List[str]) -> Tuple[Dict[str, datetime], Dict[str, datetime]]:
-        delivered_ts: Dict[str, datetime] = {}
-        read_ts: Dict[str, datetime] = {}
-        if not msg_ids:
-            return delivered_ts, read_ts
-
-        def _cuid_dt(v: Any) -> Optional[datetime]:
-            try:
-                s = str(v or '').strip()
-                if not s.startswith('c') or len(s) < 10:
-                    return None
-                ts36 = s[1:9]
-                ts_ms = int(ts36, 36)
-                if ts_ms <= 0:
-                    return None
-                return datetime.fromtimestamp(ts_ms / 1000.0, tz=timezone.utc).replace(tzinfo=None)
-            except Exception:
-                return None
-
-        rows: List[Tuple[Any, Any, Any, Any, Any, Any]] = []
-        try:
-            cursor.execute(
-                """
-                SELECT mu.id, mu."keyId", mu."messageId", mu.status, m."messageTimestamp" as message_ts, mu."createdAt" as created_at
-                FROM "EvolutionAPI"."MessageUpdate" mu
-                LEFT JOIN "EvolutionAPI"."Message" m
-                  ON m.id = mu."messageId"
-                WHERE (mu."keyId" = ANY(%s) OR mu."messageId" = ANY(%s))
-                """,
-                (msg_ids, msg_ids),
-            )
-            rows = cursor.fetchall() or []
-        except Exception:
-            cursor.execute(
-                """
-                SELECT mu.id, mu."keyId", mu."messageId", mu.status, m."messageTimestamp" as message_ts
-                FROM "EvolutionAPI"."MessageUpdate" mu
-                LEFT JOIN "EvolutionAPI"."Message" m
-                  ON m.id = mu."messageId"
-                WHERE (mu."keyId" = ANY(%s) OR mu."messageId" = ANY(%s))
-                """,
-                (msg_ids, msg_ids),
-            )
-            rows = [(a, b, c, d, e, None) for (a, b, c, d, e) in (cursor.fetchall() or [])]
-        seen_mid = set([str(x or '').strip() for x in msg_ids if str(x or '').strip()])
-        for mu_id, key_id, message_id, st, message_ts, created_at in rows:
-            s = str(st or '').upper()
-            ts_dt: Optional[datetime] = None
-            if created_at is not None:
-                if isinstance(created_at, datetime):
-                    ts_dt = created_at.replace(tzinfo=None) if created_at.tzinfo is not None else created_at
-                else:
-                    ts_dt = _parse_iso_dt(created_at)
-            if ts_dt is None:
-                ts_dt = _cuid_dt(mu_id)
-            if ts_dt is None and isinstance(message_ts, (int, float)):
-                ts_val = float(message_ts)
-                if ts_val > 10_000_000_000:
-                    ts_val = ts_val / 1000.0
-                if ts_val > 0:
-                    ts_dt = datetime.fromtimestamp(ts_val, tz=timezone.utc).replace(tzinfo=None)
-            if not ts_dt:
-                continue
-            ids: List[str] = []
-            if isinstance(key_id, str) and key_id.strip() and key_id.strip() in seen_mid:
-                ids.append(key_id.strip())
-            if isinstance(message_id, str) and message_id.strip() and message_id.strip() in seen_mid:
-                ids.append(message_id.strip())
-            if not ids:
-                continue
-            ack: Optional[int] = None
-            if isinstance(st, (int, float)):
-                try:
-                    ack = int(st)
-                except Exception:
-                    ack = None
-            elif s.isdigit():
-                try:
-                    ack = int(s)
-                except Exception:
-                    ack = None
-
-            is_read = (ack is not None and ack >= 3) or ('READ' in s) or ('SEEN' in s) or ('VISUAL' in s)
-            is_delivered = (ack is not None and ack >= 2) or is_read or ('DELIVER' in s) or ('RECEIV' in s) or (s in ('DELIVERY_ACK', 'DELIVERED', 'DELIVERY'))
-            if not is_delivered and not is_read:
-                continue
-            for mid in ids:
-                if is_delivered:
-                    prev = delivered_ts.get(mid)
-                    if prev is None or ts_dt > prev:
-                        delivered_ts[mid] = ts_dt
-                if is_read:
-                    prev_r = read_ts.get(mid)
-                    if prev_r is None or ts_dt > prev_r:
-                        read_ts[mid] = ts_dt
-        return delivered_ts, read_ts
-
     def _apply_receipts_to_disparos(
         cursor,
         *,
@@ -2474,9 +2640,10 @@ def register_evolution_routes(
         delivered_ts: Dict[str, datetime],
         read_ts: Dict[str, datetime],
         campanha_id: Optional[int] = None,
-    ) -> None:
+    ) -> int:
         if not delivered_ts and not read_ts:
-            return
+            return 0
+        updated = 0
         read_list = list(sorted(read_ts.keys()))
         delivered_only = list(sorted(set(delivered_ts.keys()) - set(read_ts.keys())))
         if read_list:
@@ -2520,25 +2687,18 @@ def register_evolution_routes(
                       WHEN upd.read_ts IS NOT NULL THEN 'VISUALIZADO'
                       ELSE 'ENTREGUE'
                     END
-                FROM upd
-                WHERE d."IdTenant" = %s
+                FROM upd, "{DB_SCHEMA}"."DisparosMessageIds" m
+                WHERE m."MessageId" = upd.message_id
+                  AND m."IdTenant" = d."IdTenant"
+                  AND d."IdDisparo" = m."IdDisparo"
+                  AND d."IdTenant" = %s
                   AND d."Canal" = 'WHATSAPP'
                   AND d."Direcao" = 'OUT'
                   {where_campanha}
-                  AND (
-                    d."MessageId" = upd.message_id
-                    OR NULLIF(d."Payload"->>'keyId','') = upd.message_id
-                    OR NULLIF(d."Payload"->'key'->>'id','') = upd.message_id
-                    OR NULLIF(d."Payload"->'data'->>'keyId','') = upd.message_id
-                    OR NULLIF(d."Payload"->'data'->'key'->>'id','') = upd.message_id
-                    OR NULLIF(d."Payload"->>'messageId','') = upd.message_id
-                    OR NULLIF(d."Payload"->'data'->>'messageId','') = upd.message_id
-                    OR NULLIF(d."Payload"->>'id','') = upd.message_id
-                    OR NULLIF(d."Payload"->'data'->>'id','') = upd.message_id
-                  )
                 """,
                 tuple(params),
             )
+            updated += int(cursor.rowcount or 0)
         if delivered_only:
             delivered_times = [delivered_ts.get(x) for x in delivered_only]
             where_campanha = 'AND d."IdCampanha" = %s' if campanha_id is not None else ''
@@ -2569,423 +2729,256 @@ def register_evolution_routes(
                       WHEN UPPER(COALESCE(d."Status", '')) IN ('VISUALIZADO','ENTREGUE') THEN d."Status"
                       ELSE 'ENTREGUE'
                     END
-                FROM upd
-                WHERE d."IdTenant" = %s
+                FROM upd, "{DB_SCHEMA}"."DisparosMessageIds" m
+                WHERE m."MessageId" = upd.message_id
+                  AND m."IdTenant" = d."IdTenant"
+                  AND d."IdDisparo" = m."IdDisparo"
+                  AND d."IdTenant" = %s
                   AND d."Canal" = 'WHATSAPP'
                   AND d."Direcao" = 'OUT'
                   {where_campanha}
-                  AND (
-                    d."MessageId" = upd.message_id
-                    OR NULLIF(d."Payload"->>'keyId','') = upd.message_id
-                    OR NULLIF(d."Payload"->'key'->>'id','') = upd.message_id
-                    OR NULLIF(d."Payload"->'data'->>'keyId','') = upd.message_id
-                    OR NULLIF(d."Payload"->'data'->'key'->>'id','') = upd.message_id
-                    OR NULLIF(d."Payload"->>'messageId','') = upd.message_id
-                    OR NULLIF(d."Payload"->'data'->>'messageId','') = upd.message_id
-                    OR NULLIF(d."Payload"->>'id','') = upd.message_id
-                    OR NULLIF(d."Payload"->'data'->>'id','') = upd.message_id
-                  )
                 """,
                 tuple(params2),
             )
+            updated += int(cursor.rowcount or 0)
+        return updated
 
-    def _match_phone(stored: Any, incoming_digits: str) -> bool:
-        def norm_br(d: str) -> str:
-            if not d:
-                return d
-            dd = ''.join([c for c in str(d) if c.isdigit()])
-            if len(dd) == 13 and dd.startswith('55') and dd[4] == '9':
-                return dd[:4] + dd[5:]
-            if len(dd) == 11 and dd[2] == '9':
-                return dd[:2] + dd[3:]
-            return dd
-
-        a = _digits_only(stored)
-        b = _digits_only(incoming_digits)
-        if not a or not b:
-            return False
-        if a == b:
-            return True
-        if len(a) >= 10 and b.endswith(a[-10:]):
-            return True
-        if len(b) >= 10 and a.endswith(b[-10:]):
-            return True
-        an = norm_br(a)
-        bn = norm_br(b)
-        if an and bn:
-            if an == bn:
-                return True
-            if len(an) >= 10 and bn.endswith(an[-10:]):
-                return True
-            if len(bn) >= 10 and an.endswith(bn[-10:]):
-                return True
-        return False
+    def _evolution_event_key(ev: Dict[str, Any]) -> Optional[str]:
+        key_id = _extract_evolution_key_id(ev)
+        if not key_id:
+            return None
+        status_str, ack = _extract_evolution_status(ev)
+        return f"{key_id}|{status_str or ''}|{ack if ack is not None else ''}"
+
+    def _evolution_webhook_slug(raw_slug: Any) -> str:
+        if not isinstance(raw_slug, str):
+            raw_slug = 'captar'
+        raw_slug = raw_slug.strip() or 'captar'
+        return (raw_slug.split('/', 1)[0] or 'captar').strip() or 'captar'
+
+    def _claim_evolution_events(slug: str, events: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], List[str]]:
+        if webhook_dedup is None or not events:
+            return events, []
+        event_keys = [_evolution_event_key(ev) for ev in events]
+        fresh = webhook_dedup.claim("evolution", slug, event_keys)
+        claimed_keys = [k for k, ok in zip(event_keys, fresh) if ok and k]
+        return [ev for ev, ok in zip(events, fresh) if ok], claimed_keys
+
+    def _evolution_webhook_target(slug: str) -> Tuple[int, Optional[str]]:
+        tid = _tenant_id_for_slug(slug)
+        dsn = None
+        if str(slug).lower() != 'captar':
+            try:
+                dsn = _get_dsn_by_slug(str(slug).lower())
+            except Exception:
+                dsn = None
+        return tid, dsn
 
-    @app.post("/api/integrations/whatsapp/webhook")
-    async def whatsapp_webhook(payload: Dict[str, Any], request: Request, tenant: Optional[str] = None):
+    def _collect_evolution_receipts(
+        events: List[Dict[str, Any]],
+        tid: int,
+        delivered_ts: Dict[str, datetime],
+        read_ts: Dict[str, datetime],
+    ) -> int:
         try:
-            raw_slug = (request.headers.get('X-Tenant') or tenant or 'captar')
-            if not isinstance(raw_slug, str):
-                raw_slug = 'captar'
-            raw_slug = raw_slug.strip() or 'captar'
-            slug = (raw_slug.split('/', 1)[0] or 'captar').strip() or 'captar'
+            rc2 = get_redis_client()
+        except Exception:
+            rc2 = None
+        presence_updated = 0
+        for ev in events:
             try:
-                rc = get_redis_client()
-                cached = rc.get(f"tenant:id:{slug}") if rc else None
-                tid = int(cached) if cached else None
+                pres = _extract_presence_status(ev)
+                num_pres = _extract_evolution_number(ev)
+                if pres and num_pres and rc2:
+                    rc2.setex(f"wa:presence:{tid}:{_digits_only(num_pres)}", 86400, str(pres))
+                    presence_updated += 1
             except Exception:
-                tid = None
-            if not tid:
-                try:
-                    with get_db_connection() as conn_t:
-                        cur_t = conn_t.cursor()
-                        cur_t.execute(
-                            f"SELECT \"IdTenant\" FROM \"{DB_SCHEMA}\".\"Tenant\" WHERE LOWER(\"Slug\") = LOWER(%s) LIMIT 1",
-                            (slug,)
-                        )
-                        row = cur_t.fetchone()
-                        tid = int(row[0]) if row else 1
-                    try:
-                        if rc:
-                            rc.setex(f"tenant:id:{slug}", 300, str(tid))
-                    except Exception:
-                        pass
-                except Exception:
-                    tid = 1
-
-            dsn = None
-            if str(slug).lower() != 'captar':
-                try:
-                    dsn = _get_dsn_by_slug(str(slug).lower())
-                except Exception:
-                    dsn = None
+                pass
 
-            with get_db_connection(dsn) as conn:
-                cursor = conn.cursor()
-                events = _iter_evolution_events(payload)
-                if not events:
-                    return {"ok": True, "ignored": True, "reason": "no_events"}
+            try:
+                msg_id = _extract_evolution_message_id(ev)
+                key_id = _extract_evolution_key_id(ev)
+                status_str, ack = _extract_evolution_status(ev)
+                ids: List[str] = []
+                for x in (key_id, msg_id):
+                    if isinstance(x, str) and x.strip() and x.strip() not in ids:
+                        ids.append(x.strip())
+                if not ids:
+                    continue
+                dt_ev = _extract_evolution_datetime(ev) or datetime.utcnow()
+                delivered = False
+                seen = False
+                if ack is not None:
+                    delivered = ack >= 2
+                    seen = ack >= 3
+                if status_str:
+                    ss = str(status_str).upper()
+                    if 'DELIVER' in ss or 'RECEIV' in ss:
+                        delivered = True
+                    if 'READ' in ss or 'SEEN' in ss or 'VISUAL' in ss:
+                        delivered = True
+                        seen = True
+                if not delivered and not seen:
+                    continue
+                for mid in ids:
+                    if delivered and (mid not in delivered_ts or dt_ev > delivered_ts[mid]):
+                        delivered_ts[mid] = dt_ev
+                    if seen and (mid not in read_ts or dt_ev > read_ts[mid]):
+                        read_ts[mid] = dt_ev
+            except Exception:
+                pass
 
-                try:
-                    rc2 = get_redis_client()
-                except Exception:
-                    rc2 = None
+        return presence_updated
 
-                receipts_updated = 0
-                presence_updated = 0
-                for ev in events:
-                    try:
-                        pres = _extract_presence_status(ev)
-                        num_pres = _extract_evolution_number(ev)
-                        if pres and num_pres and rc2:
-                            rc2.setex(f"wa:presence:{tid}:{_digits_only(num_pres)}", 86400, str(pres))
-                            presence_updated += 1
-                    except Exception:
-                        pass
+    def _store_evolution_receipts(conn, cursor, tid: int, delivered_ts: Dict[str, datetime], read_ts: Dict[str, datetime]) -> int:
+        """Aplica os recibos numa transação. Em erro faz rollback e propaga, para o chamador
+        liberar as chaves de dedup e o evento voltar pelo retry do provedor ou da fila."""
+        if not delivered_ts and not read_ts:
+            return 0
+        try:
+            if disparos_writer is not None:
+                disparos_writer.flush_pending(list(set(delivered_ts) | set(read_ts)))
+            receipts_updated = _apply_receipts_to_disparos(cursor, tid=tid, delivered_ts=delivered_ts, read_ts=read_ts)
+            conn.commit()
+            return receipts_updated
+        except Exception:
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+            raise
 
-                    try:
-                        from_me = _extract_from_me(ev)
-                        msg_id = _extract_evolution_message_id(ev)
-                        key_id = _extract_evolution_key_id(ev)
-                        status_str, ack = _extract_evolution_status(ev)
-                        ids: List[str] = []
-                        for x in (key_id, msg_id):
-                            if isinstance(x, str) and x.strip() and x.strip() not in ids:
-                                ids.append(x.strip())
-                        if not ids:
-                            continue
-                        dt_ev = _extract_evolution_datetime(ev) or datetime.utcnow()
-                        delivered = False
-                        seen = False
-                        if ack is not None:
-                            delivered = ack >= 2
-                            seen = ack >= 3
-                        if status_str:
-                            ss = str(status_str).upper()
-                            if 'DELIVER' in ss or 'RECEIV' in ss:
-                                delivered = True
-                            if 'READ' in ss or 'SEEN' in ss or 'VISUAL' in ss:
-                                delivered = True
-                                seen = True
-                        if not delivered and not seen:
-                            continue
-                        delivered_dt = dt_ev if delivered else None
-                        seen_dt = dt_ev if seen else None
-                        next_status = None
-                        if seen:
-                            next_status = 'VISUALIZADO'
-                        elif delivered:
-                            next_status = 'ENTREGUE'
-                        cursor.execute(
-                            f"""
-                            UPDATE "{DB_SCHEMA}"."Disparos"
-                            SET "EntregueEm" = CASE
-                                  WHEN %s IS NULL THEN "EntregueEm"
-                                  WHEN "EntregueEm" IS NULL OR "EntregueEm" < GREATEST(%s, COALESCE("DataHora", %s)) THEN GREATEST(%s, COALESCE("DataHora", %s))
-                                  ELSE "EntregueEm"
-                                END,
-                                "VisualizadoEm" = CASE
-                                  WHEN %s IS NULL THEN "VisualizadoEm"
-                                  WHEN "VisualizadoEm" IS NULL OR "VisualizadoEm" < GREATEST(%s, COALESCE("DataHora", %s), COALESCE("EntregueEm", "DataHora", %s)) THEN GREATEST(%s, COALESCE("DataHora", %s), COALESCE("EntregueEm", "DataHora", %s))
-                                  ELSE "VisualizadoEm"
-                                END,
-                                "Status" = CASE
-                                  WHEN %s IS NULL THEN "Status"
-                                  WHEN UPPER(COALESCE("Status", '')) = 'FALHA' THEN "Status"
-                                  WHEN UPPER(COALESCE("Status", '')) = 'VISUALIZADO' THEN "Status"
-                                  ELSE %s
-                                END
-                            WHERE "IdTenant" = %s
-                              AND "Canal" = 'WHATSAPP'
-                              AND "Direcao" = 'OUT'
-                              AND (
-                                "MessageId" = ANY(%s)
-                                OR NULLIF("Payload"->>'keyId','') = ANY(%s)
-                                OR NULLIF("Payload"->'key'->>'id','') = ANY(%s)
-                                OR NULLIF("Payload"->'data'->>'keyId','') = ANY(%s)
-                                OR NULLIF("Payload"->'data'->'key'->>'id','') = ANY(%s)
-                                OR NULLIF("Payload"->>'messageId','') = ANY(%s)
-                                OR NULLIF("Payload"->'data'->>'messageId','') = ANY(%s)
-                                OR NULLIF("Payload"->>'id','') = ANY(%s)
-                                OR NULLIF("Payload"->'data'->>'id','') = ANY(%s)
-                              )
-                            """,
-                            (
-                                delivered_dt,
-                                delivered_dt, delivered_dt, delivered_dt, delivered_dt,
-                                seen_dt,
-                                seen_dt, seen_dt, seen_dt, seen_dt, seen_dt, seen_dt,
-                                next_status,
-                                next_status,
-                                tid,
-                                ids,
-                                ids,
-                                ids,
-                                ids,
-                                ids,
-                                ids,
-                                ids,
-                                ids,
-                                ids,
-                            ),
-                        )
-                        if cursor.rowcount:
-                            receipts_updated += int(cursor.rowcount or 0)
-                            conn.commit()
-                    except Exception:
-                        try:
-                            conn.rollback()
-                        except Exception:
-                            pass
+    def _handle_evolution_inbound(
+        conn,
+        cursor,
+        dsn: Optional[str],
+        tid: int,
+        events: List[Dict[str, Any]],
+        committed: Optional[List[Dict[str, Any]]] = None,
+    ) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """Grava as mensagens recebidas e aplica respostas SIM/NÃO. Uma falha no INSERT
+        propaga; os eventos já gravados são acrescentados a `committed`, para que o chamador
+        mantenha só as chaves de dedup deles e o retry não duplique as linhas IN."""
+        updated: List[Dict[str, Any]] = []
+        ignored: List[Dict[str, Any]] = []
+
+        for ev in events:
+            incoming_text = _extract_evolution_text(ev).strip()
+            incoming_digits = _extract_evolution_number(ev)
+            if not incoming_text or not incoming_digits:
+                ignored.append({"reason": "missing_text_or_number"})
+                continue
 
+            received_dt = _extract_evolution_datetime(ev) or datetime.utcnow()
+            inserted_in_id = None
+            try:
                 cursor.execute(
                     f"""
-                    SELECT d."IdDisparo", d."Numero", d."IdCampanha"
-                    FROM "{DB_SCHEMA}"."Disparos" d
-                    JOIN "{DB_SCHEMA}"."Campanhas" c
-                      ON c."IdTenant" = d."IdTenant"
-                     AND c."IdCampanha" = d."IdCampanha"
-                    WHERE d."IdTenant" = %s
-                      AND d."Canal" = 'WHATSAPP'
-                      AND d."Direcao" = 'OUT'
-                      AND d."Status" IN ('ENVIADO','ENTREGUE','VISUALIZADO')
-                      AND d."IdCampanha" IS NOT NULL
-                      AND COALESCE(c."AnexoJSON"->'config'->>'response_mode', '') = 'SIM_NAO'
-                    ORDER BY d."DataHora" DESC, d."IdDisparo" DESC
-                    LIMIT 500
+                    INSERT INTO "{DB_SCHEMA}"."Disparos"
+                    ("IdTenant","IdCampanha","Canal","Direcao","Numero","Nome","Mensagem","Imagem","Status","DataHora","Payload")
+                    VALUES (%s,NULL,%s,%s,%s,NULL,%s,NULL,%s,%s,%s::jsonb)
+                    RETURNING "IdDisparo"
                     """,
-                    (tid,),
+                    (
+                        tid,
+                        'WHATSAPP',
+                        'IN',
+                        str(incoming_digits),
+                        incoming_text,
+                        'RECEBIDO',
+                        received_dt,
+                        json.dumps(ev, ensure_ascii=False),
+                    ),
                 )
-                out_rows = cursor.fetchall() or []
+                row_in = cursor.fetchone()
+                inserted_in_id = int(row_in[0]) if row_in else None
+                conn.commit()
+            except Exception:
+                try:
+                    conn.rollback()
+                except Exception:
+                    pass
+                raise
+            if committed is not None:
+                committed.append(ev)
 
-                updated: List[Dict[str, Any]] = []
-                ignored: List[Dict[str, Any]] = []
+            resposta = _parse_sim_nao_response(incoming_text)
+            if resposta not in (1, 2):
+                ignored.append({"number": incoming_digits, "reason": "not_sim_nao"})
+                continue
 
-                for ev in events:
-                    incoming_text = _extract_evolution_text(ev).strip()
-                    incoming_digits = _extract_evolution_number(ev)
-                    if not incoming_text or not incoming_digits:
-                        ignored.append({"reason": "missing_text_or_number"})
-                        continue
+            candidates = sim_nao_index.lookup(cursor, dsn, tid, incoming_digits)
+            if not candidates:
+                ignored.append({"number": incoming_digits, "reason": "no_matching_out_disparo"})
+                continue
 
-                    received_dt = _extract_evolution_datetime(ev) or datetime.utcnow()
-                    inserted_in_id = None
+            applied = False
+            for out_id_raw, out_num, campanha_id in candidates:
+                if not record_contato_resposta(cursor, DB_SCHEMA, tid, campanha_id, incoming_digits, resposta, received_dt):
+                    try:
+                        conn.rollback()
+                    except Exception:
+                        pass
+                    continue
+
+                if inserted_in_id:
                     try:
                         cursor.execute(
                             f"""
-                            INSERT INTO "{DB_SCHEMA}"."Disparos"
-                            ("IdTenant","IdCampanha","Canal","Direcao","Numero","Nome","Mensagem","Imagem","Status","DataHora","Payload")
-                            VALUES (%s,NULL,%s,%s,%s,NULL,%s,NULL,%s,%s,%s::jsonb)
-                            RETURNING "IdDisparo"
+                            UPDATE "{DB_SCHEMA}"."Disparos"
+                            SET "IdCampanha" = %s,
+                                "RespostaClassificacao" = %s,
+                                "IdDisparoRef" = %s
+                            WHERE "IdDisparo" = %s AND "IdTenant" = %s
                             """,
                             (
+                                campanha_id,
+                                ('SIM' if resposta == 1 else 'NAO'),
+                                int(out_id_raw) if out_id_raw is not None else None,
+                                inserted_in_id,
                                 tid,
-                                'WHATSAPP',
-                                'IN',
-                                str(incoming_digits),
-                                incoming_text,
-                                'RECEBIDO',
-                                received_dt,
-                                json.dumps(ev, ensure_ascii=False),
                             ),
                         )
-                        row_in = cursor.fetchone()
-                        inserted_in_id = int(row_in[0]) if row_in else None
-                        conn.commit()
                     except Exception:
-                        try:
-                            conn.rollback()
-                        except Exception:
-                            pass
-
-                    resposta = _parse_sim_nao_response(incoming_text)
-                    if resposta not in (1, 2):
-                        ignored.append({"number": incoming_digits, "reason": "not_sim_nao"})
-                        continue
-
-                    candidates = [(out_id_raw, out_num, campanha_id) for (out_id_raw, out_num, campanha_id) in out_rows if _match_phone(out_num, incoming_digits)]
-                    if not candidates:
-                        ignored.append({"number": incoming_digits, "reason": "no_matching_out_disparo"})
-                        continue
-
-                    applied = False
-                    for out_id_raw, out_num, campanha_id in candidates:
-                        cursor.execute(
-                            f"""
-                            SELECT "AnexoJSON", "Positivos", "Negativos", "Enviados"
-                            FROM "{DB_SCHEMA}"."Campanhas"
-                            WHERE "IdCampanha" = %s AND "IdTenant" = %s
-                            FOR UPDATE
-                            """,
-                            (campanha_id, tid),
-                        )
-                        locked = cursor.fetchone()
-                        if not locked:
-                            try:
-                                conn.rollback()
-                            except Exception:
-                                pass
-                            continue
-
-                        anexo = locked[0]
-                        positivos = int(locked[1] or 0)
-                        negativos = int(locked[2] or 0)
-                        enviados = int(locked[3] or 0)
-
-                        if not anexo:
-                            try:
-                                conn.rollback()
-                            except Exception:
-                                pass
-                            continue
-
-                        anexo_obj: Any = anexo
-                        if isinstance(anexo_obj, str):
-                            try:
-                                anexo_obj = json.loads(anexo_obj)
-                            except Exception:
-                                try:
-                                    conn.rollback()
-                                except Exception:
-                                    pass
-                                continue
-
-                        if isinstance(anexo_obj, list):
-                            anexo_obj = {"contacts": anexo_obj, "config": {"response_mode": "SIM_NAO"}}
-
-                        if not isinstance(anexo_obj, dict):
-                            try:
-                                conn.rollback()
-                            except Exception:
-                                pass
-                            continue
-
-                        contacts = anexo_obj.get('contacts')
-                        if not isinstance(contacts, list):
-                            try:
-                                conn.rollback()
-                            except Exception:
-                                pass
-                            continue
-
-                        idx_match = -1
-                        for i, c in enumerate(contacts):
-                            if not isinstance(c, dict):
-                                continue
-                            phone = c.get('whatsapp') or c.get('celular') or c.get('telefone') or c.get('phone')
-                            if _match_phone(phone, incoming_digits):
-                                idx_match = i
-                                break
-
-                        if idx_match < 0:
-                            try:
-                                conn.rollback()
-                            except Exception:
-                                pass
-                            continue
-
-                        cur = contacts[idx_match]
-                        existing = cur.get('resposta') if isinstance(cur, dict) else None
-                        if existing in (1, 2, '1', '2'):
-                            try:
-                                conn.rollback()
-                            except Exception:
-                                pass
-                            continue
+                        pass
 
-                        cur['resposta'] = resposta
-                        cur['respondido_em'] = (received_dt or datetime.utcnow()).isoformat()
-                        contacts[idx_match] = cur
-                        anexo_obj['contacts'] = contacts
+                conn.commit()
+                updated.append({"number": incoming_digits, "campanha_id": campanha_id, "resposta": resposta})
+                applied = True
+                break
 
-                        if resposta == 1:
-                            positivos += 1
-                        else:
-                            negativos += 1
+            if not applied:
+                ignored.append({"number": incoming_digits, "reason": "no_applicable_campaign"})
+                continue
 
-                        aguardando = max(0, enviados - (positivos + negativos))
-                        cursor.execute(
-                            f"""
-                            UPDATE "{DB_SCHEMA}"."Campanhas"
-                            SET "AnexoJSON" = %s::jsonb,
-                                "Positivos" = %s,
-                                "Negativos" = %s,
-                                "Aguardando" = %s,
-                                "Atualizacao" = NOW()
-                            WHERE "IdCampanha" = %s AND "IdTenant" = %s
-                            """,
-                            (json.dumps(anexo_obj, ensure_ascii=False), positivos, negativos, aguardando, campanha_id, tid),
-                        )
+        return updated, ignored
 
-                        if inserted_in_id:
-                            try:
-                                cursor.execute(
-                                    f"""
-                                    UPDATE "{DB_SCHEMA}"."Disparos"
-                                    SET "IdCampanha" = %s,
-                                        "RespostaClassificacao" = %s,
-                                        "IdDisparoRef" = %s
-                                    WHERE "IdDisparo" = %s AND "IdTenant" = %s
-                                    """,
-                                    (
-                                        campanha_id,
-                                        ('SIM' if resposta == 1 else 'NAO'),
-                                        int(out_id_raw) if out_id_raw is not None else None,
-                                        inserted_in_id,
-                                        tid,
-                                    ),
-                                )
-                            except Exception:
-                                pass
+    def _release_evolution_claims(slug: str, claimed_keys: List[str], committed: List[Dict[str, Any]]) -> None:
+        """Libera as chaves de dedup após uma falha, exceto as dos eventos já gravados."""
+        if webhook_dedup is None or not claimed_keys:
+            return
+        kept = {_evolution_event_key(ev) for ev in committed}
+        webhook_dedup.release("evolution", slug, [k for k in claimed_keys if k not in kept])
 
-                        conn.commit()
-                        updated.append({"number": incoming_digits, "campanha_id": campanha_id, "resposta": resposta})
-                        applied = True
-                        break
+    def _process_whatsapp_webhook(payload: Dict[str, Any], slug: str) -> Dict[str, Any]:
+        claimed_keys: List[str] = []
+        committed: List[Dict[str, Any]] = []
+        try:
+            events = _iter_evolution_events(payload)
+            if not events:
+                return {"ok": True, "ignored": True, "reason": "no_events"}
+            events, claimed_keys = _claim_evolution_events(slug, events)
+            if not events:
+                return {"ok": True, "ignored": True, "reason": "duplicate"}
+            tid, dsn = _evolution_webhook_target(slug)
 
-                    if not applied:
-                        ignored.append({"number": incoming_digits, "reason": "no_applicable_campaign"})
-                        continue
+            with get_db_connection(dsn) as conn:
+                cursor = conn.cursor()
+                delivered_ts: Dict[str, datetime] = {}
+                read_ts: Dict[str, datetime] = {}
+                presence_updated = _collect_evolution_receipts(events, tid, delivered_ts, read_ts)
+                receipts_updated = _store_evolution_receipts(conn, cursor, tid, delivered_ts, read_ts)
+                updated, ignored = _handle_evolution_inbound(conn, cursor, dsn, tid, events, committed)
 
                 return {
                     "ok": True,
@@ -2997,12 +2990,71 @@ def register_evolution_routes(
                     "ignored": ignored,
                 }
         except Exception as e:
+            _release_evolution_claims(slug, claimed_keys, committed)
             try:
                 traceback.print_exc()
             except Exception:
                 pass
             raise HTTPException(status_code=500, detail=str(e))
 
+    @app.post("/api/integrations/whatsapp/webhook")
+    async def whatsapp_webhook(payload: Dict[str, Any], request: Request, tenant: Optional[str] = None):
+        if webhook_queue is not None and webhook_queue.should_enqueue(request):
+            if webhook_queue.enqueue("evolution", request, await request.body()):
+                return {"ok": True, "queued": True}
+        slug = _evolution_webhook_slug(request.headers.get('X-Tenant') or tenant or 'captar')
+        # Todo o processamento usa psycopg síncrono: roda numa thread, fora do event loop.
+        return await asyncio.to_thread(_process_whatsapp_webhook, payload, slug)
+
+    def _process_whatsapp_webhook_batch(items: List[Any]) -> List[str]:
+        """Consumidor da fila: um lote do XREADGROUP por vez, agrupado por tenant.
+
+        Os recibos de todos os eventos de um tenant viram uma única chamada a
+        `_apply_receipts_to_disparos`. Retorna os ids das entradas processadas (para ACK).
+        Se o banco falhar, as chaves de dedup do tenant são liberadas (menos as das mensagens
+        IN já gravadas) e as entradas ficam pendentes, para XCLAIM ou dead-letter."""
+        grupos: Dict[str, List[Tuple[str, List[Dict[str, Any]]]]] = {}
+        for item in items:
+            try:
+                payload = json.loads(item.body.decode("utf-8")) if item.body else {}
+            except Exception as e:
+                print(f"Evolution webhook: entrada {item.entry_id} inválida: {e}")
+                continue
+            slug = _evolution_webhook_slug(item.headers.get("x-tenant") or item.query.get("tenant") or "captar")
+            grupos.setdefault(slug, []).append((item.entry_id, _iter_evolution_events(payload)))
+        acked: List[str] = []
+        for slug, entradas in grupos.items():
+            claimed_keys: List[str] = []
+            committed: List[Dict[str, Any]] = []
+            try:
+                events: List[Dict[str, Any]] = []
+                for _entry_id, evs in entradas:
+                    fresh, keys = _claim_evolution_events(slug, evs)
+                    claimed_keys.extend(keys)
+                    events.extend(fresh)
+                if events:
+                    tid, dsn = _evolution_webhook_target(slug)
+                    with get_db_connection(dsn) as conn:
+                        cursor = conn.cursor()
+                        delivered_ts: Dict[str, datetime] = {}
+                        read_ts: Dict[str, datetime] = {}
+                        _collect_evolution_receipts(events, tid, delivered_ts, read_ts)
+                        _store_evolution_receipts(conn, cursor, tid, delivered_ts, read_ts)
+                        _handle_evolution_inbound(conn, cursor, dsn, tid, events, committed)
+                acked.extend(entry_id for entry_id, _evs in entradas)
+            except Exception as e:
+                _release_evolution_claims(slug, claimed_keys, committed)
+                print(f"Evolution webhook: lote do tenant {slug} falhou: {e}")
+        return acked
+
+    async def _replay_whatsapp_webhook(request: Request):
+        body = await request.body()
+        payload = json.loads(body.decode("utf-8")) if body else {}
+        return await whatsapp_webhook(payload, request, tenant=request.query_params.get("tenant"))
+
+    if webhook_queue is not None:
+        webhook_queue.register("evolution", _replay_whatsapp_webhook, batch_handler=_process_whatsapp_webhook_batch)
+
     @app.post("/api/webhook")
     async def whatsapp_webhook_compat(payload: Dict[str, Any], request: Request, tenant: Optional[str] = None):
         return await whatsapp_webhook(payload, request, tenant=tenant)
@@ -3055,3 +3107,15 @@ def register_evolution_routes(
             raise HTTPException(status_code=500, detail=str(e))
 
 
+    return {
+        "send_context": _evolution_send_context,
+        "send_contexts": _evolution_send_contexts,
+        "pick_shard": _pick_evolution_shard,
+        "shard_strategy": _normalize_shard_strategy,
+        "resolve_media": _resolve_evolution_media,
+        "deliver": _evolution_deliver,
+        "insert_disparos": _insert_disparos_out,
+        "log_disparos": _log_disparos_out,
+        "flush_disparos": _flush_disparos_out,
+        "retry_job": _retry_job,
+    }
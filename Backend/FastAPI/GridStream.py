@@ -0,0 +1,114 @@
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, TypeVar, Union
+import csv
+import io
+import itertools
+import json
+import os
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(str(os.getenv(name, "") or "").strip() or default)
+    except Exception:
+        return default
+
+
+STREAM_BATCH_ROWS = max(1, _env_int("STREAM_BATCH_ROWS", 500))
+
+NDJSON = "application/x-ndjson"
+
+L = TypeVar("L")
+R = TypeVar("R")
+Tail = Union[Dict[str, Any], Callable[[], Dict[str, Any]], None]
+
+
+def stream_format(request: Optional[Request], fmt: Optional[str] = None) -> Optional[str]:
+    """Formato de streaming pedido (?format=csv|ndjson ou Accept: application/x-ndjson), ou None."""
+    f = str(fmt or "").strip().lower()
+    if f in ("csv", "ndjson"):
+        return f
+    accept = str((request and request.headers.get("accept")) or "").lower()
+    if NDJSON in accept:
+        return "ndjson"
+    return None
+
+
+def _default(v: Any) -> Any:
+    if isinstance(v, (datetime, date)):
+        return v.isoformat()
+    if isinstance(v, Decimal):
+        return float(v)
+    return str(v)
+
+
+def _cell(v: Any) -> Any:
+    if v is None:
+        return ""
+    if isinstance(v, (datetime, date)):
+        return v.isoformat()
+    return v
+
+
+def merge_groups(left: Iterable[L], right: Iterable[R], left_key: Callable[[L], str], right_key: Callable[[R], str]) -> Iterator[Tuple[str, List[L], List[R]]]:
+    """Junta dois fluxos ordenados pela mesma chave (em ordem de bytes, ex. COLLATE "C").
+
+    Gera (chave, linhas de `left`, linhas de `right`) para cada chave de `left`, assim que o
+    grupo termina; linhas de `right` sem chave correspondente em `left` são descartadas."""
+    it = iter(right)
+    r = next(it, None)
+    for key, grupo in itertools.groupby(left, key=left_key):
+        pares: List[R] = []
+        while r is not None and right_key(r) < key:
+            r = next(it, None)
+        while r is not None and right_key(r) == key:
+            pares.append(r)
+            r = next(it, None)
+        yield key, list(grupo), pares
+
+
+def ndjson_lines(head: Optional[Dict[str, Any]], rows: Iterable[Dict[str, Any]], tail: Tail = None) -> Iterator[str]:
+    """Uma linha JSON para `head`, uma por linha de `rows` e uma para `tail`, em blocos de STREAM_BATCH_ROWS.
+    `tail` pode ser uma função, chamada depois da última linha (ex.: totais acumulados)."""
+    if head is not None:
+        yield json.dumps(head, default=_default, ensure_ascii=False) + "\n"
+    buf: List[str] = []
+    for row in rows:
+        buf.append(json.dumps(row, default=_default, ensure_ascii=False))
+        if len(buf) >= STREAM_BATCH_ROWS:
+            yield "\n".join(buf) + "\n"
+            buf = []
+    if buf:
+        yield "\n".join(buf) + "\n"
+    if callable(tail):
+        tail = tail()
+    if tail is not None:
+        yield json.dumps(tail, default=_default, ensure_ascii=False) + "\n"
+
+
+def csv_lines(columns: List[str], rows: Iterable[Dict[str, Any]]) -> Iterator[str]:
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(columns)
+    n = 0
+    for row in rows:
+        writer.writerow([_cell(row.get(c)) for c in columns])
+        n += 1
+        if n >= STREAM_BATCH_ROWS:
+            yield out.getvalue()
+            out.seek(0)
+            out.truncate()
+            n = 0
+    if out.tell():
+        yield out.getvalue()
+
+
+def stream_rows(fmt: str, columns: List[str], rows: Iterable[Dict[str, Any]], head: Optional[Dict[str, Any]] = None, tail: Tail = None, filename: str = "dados") -> StreamingResponse:
+    """Resposta em streaming no formato `fmt` ("csv" ou "ndjson")."""
+    if fmt == "csv":
+        headers = {"Content-Disposition": f'attachment; filename="{filename}.csv"'}
+        return StreamingResponse(csv_lines(columns, rows), media_type="text/csv; charset=utf-8", headers=headers)
+    return StreamingResponse(ndjson_lines(head, rows, tail), media_type=NDJSON)
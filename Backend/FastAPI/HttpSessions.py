@@ -0,0 +1,88 @@
+from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Tuple
+import os
+import asyncio
+
+import aiohttp
+
+
+_SESSIONS: Dict[str, Tuple[aiohttp.ClientSession, Any]] = {}
+_PROVIDERS = ("default", "evolution", "meta")
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(str(os.getenv(name, "") or "").strip() or default)
+    except Exception:
+        return default
+
+
+def _new_session() -> aiohttp.ClientSession:
+    connector = aiohttp.TCPConnector(
+        limit=_env_int("HTTP_POOL_LIMIT", 200),
+        limit_per_host=_env_int("HTTP_POOL_LIMIT_PER_HOST", 32),
+        ttl_dns_cache=_env_int("HTTP_DNS_CACHE_TTL", 300),
+        keepalive_timeout=_env_int("HTTP_KEEPALIVE_TIMEOUT", 30),
+    )
+    return aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=60))
+
+
+def get_http_session(name: str = "default") -> aiohttp.ClientSession:
+    loop = asyncio.get_running_loop()
+    ent = _SESSIONS.get(name)
+    if ent and not ent[0].closed and ent[1] is loop:
+        return ent[0]
+    session = _new_session()
+    _SESSIONS[name] = (session, loop)
+    return session
+
+
+@asynccontextmanager
+async def http_session(name: str = "default"):
+    yield get_http_session(name)
+
+
+async def close_http_sessions() -> None:
+    items = list(_SESSIONS.values())
+    _SESSIONS.clear()
+    for session, _loop in items:
+        try:
+            if not session.closed:
+                await session.close()
+        except Exception:
+            pass
+
+
+def http_sessions_stats() -> Dict[str, Any]:
+    out: Dict[str, Any] = {}
+    for name, (session, _loop) in list(_SESSIONS.items()):
+        conn = session.connector
+        try:
+            acquired = len(getattr(conn, "_acquired", []) or [])
+            idle = sum(len(v) for v in (getattr(conn, "_conns", {}) or {}).values())
+        except Exception:
+            acquired, idle = 0, 0
+        out[name] = {
+            "closed": session.closed,
+            "limit": getattr(conn, "limit", None),
+            "limit_per_host": getattr(conn, "limit_per_host", None),
+            "in_use": acquired,
+            "idle": idle,
+        }
+    return out
+
+
+def register_http_sessions(app: FastAPI):
+    @app.on_event("startup")
+    async def open_http_sessions():
+        for name in _PROVIDERS:
+            get_http_session(name)
+
+    @app.on_event("shutdown")
+    async def shutdown_http_sessions():
+        await close_http_sessions()
+
+    @app.get("/api/admin/http-sessions")
+    async def admin_http_sessions():
+        return {"sessions": http_sessions_stats()}
@@ -1,6 +1,6 @@
 from fastapi import FastAPI, HTTPException, Request, UploadFile, File
 from pydantic import BaseModel
-from typing import Optional, Any, Callable
+from typing import Optional, Any, Callable, List, Tuple
 import os
 import json
 import hmac
@@ -8,8 +8,51 @@ import hashlib
 import aiohttp
 from datetime import datetime, timedelta
 import re
+import asyncio
+import mimetypes
 import unicodedata
-from urllib.parse import urlencode
+from urllib.parse import urlencode, urlparse
+
+try:
+    from .HttpSessions import http_session
+except ImportError:
+    from HttpSessions import http_session
+
+try:
+    from .DisparosMessageIds import disparos_by_message_ids_sql
+except ImportError:
+    from DisparosMessageIds import disparos_by_message_ids_sql
+
+try:
+    from .SimNaoIndex import SimNaoIndex
+except ImportError:
+    from SimNaoIndex import SimNaoIndex
+
+try:
+    from .SchemaRegistry import SchemaRegistry
+except ImportError:
+    from SchemaRegistry import SchemaRegistry
+
+try:
+    from .CampanhaContatos import record_contato_resposta
+except ImportError:
+    from CampanhaContatos import record_contato_resposta
+
+
+# Erros da Graph API que indicam mídia inválida/expirada (e não destinatário, template ou
+# política): só nesses casos vale descartar o media id em cache e reenviar.
+_MEDIA_ERROR_CODES = {131052, 131053}
+_MEDIA_ERROR_SUBCODES = {(100, 33), (100, 2494102)}
+
+
+def _is_media_error(detail: Any) -> bool:
+    try:
+        err = (json.loads(detail) if isinstance(detail, str) else detail or {}).get("error") or {}
+        code = int(err.get("code") or 0)
+        subcode = int(err.get("error_subcode") or 0)
+    except Exception:
+        return False
+    return code in _MEDIA_ERROR_CODES or (code, subcode) in _MEDIA_ERROR_SUBCODES
 
 
 class MetaWhatsAppConfigIn(BaseModel):
@@ -90,8 +133,18 @@ def register_meta_whatsapp_routes(
     db_schema: str,
     mask_key: Callable[[str], str],
     tenant_id_from_header: Callable[[Request], int],
+    rate_limiter: Optional[Any] = None,
+    disparos_writer: Optional[Any] = None,
+    webhook_queue: Optional[Any] = None,
+    sim_nao_index: Optional[SimNaoIndex] = None,
+    webhook_dedup: Optional[Any] = None,
+    schema_registry: Optional[SchemaRegistry] = None,
 ):
     safe_schema = str(db_schema or "captar").replace('"', '""')
+    if sim_nao_index is None:
+        sim_nao_index = SimNaoIndex(db_schema, lambda request: None)
+    if schema_registry is None:
+        schema_registry = SchemaRegistry(get_db_connection, db_schema)
     table_name = "MetaWhatsappAPI"
     legacy_table_name = "MetaAPI"
     prefix = "meta"
@@ -134,113 +187,113 @@ def register_meta_whatsapp_routes(
                 return ""
         return s
 
-    def ensure_table(request: Optional[Request] = None):
-        def _conn_factory():
-            if request is not None:
-                return get_conn_for_request(request)
-            return get_db_connection()
+    def _create_config_table(cur) -> None:
+        cur.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS "{safe_schema}"."{table_name}" (
+                "Id" SERIAL PRIMARY KEY,
+                "IdTenant" INTEGER NOT NULL,
+                "TenantSlug" TEXT,
+                "BaseUrl" TEXT,
+                "ApiVersion" TEXT,
+                "PhoneNumberId" TEXT,
+                "WhatsappPhone" TEXT,
+                "BusinessAccountId" TEXT,
+                "Perfil" TEXT,
+                "AccessToken" TEXT,
+                "WebhookVerifyToken" TEXT,
+                "AppSecret" TEXT,
+                "ValidateSignature" BOOLEAN DEFAULT FALSE,
+                "Enabled" BOOLEAN DEFAULT TRUE,
+                "AppId" TEXT,
+                "ConfigurationId" TEXT,
+                "PartnerSolutionId" TEXT,
+                "RedirectUri" TEXT,
+                "CreatedAt" TIMESTAMP DEFAULT NOW(),
+                "UpdatedAt" TIMESTAMP DEFAULT NOW()
+            )
+            """
+        )
+        cur.execute(
+            f'CREATE INDEX IF NOT EXISTS "idx_{table_name}_IdTenant" ON "{safe_schema}"."{table_name}"("IdTenant")'
+        )
+        cur.execute(
+            f'CREATE INDEX IF NOT EXISTS "idx_{table_name}_TenantSlug" ON "{safe_schema}"."{table_name}"("TenantSlug")'
+        )
 
-        try:
-            with _conn_factory() as conn:
-                cur = conn.cursor()
-                cur.execute(
-                    f"""
-                    CREATE TABLE IF NOT EXISTS "{safe_schema}"."{table_name}" (
-                        "Id" SERIAL PRIMARY KEY,
-                        "IdTenant" INTEGER NOT NULL,
-                        "TenantSlug" TEXT,
-                        "BaseUrl" TEXT,
-                        "ApiVersion" TEXT,
-                        "PhoneNumberId" TEXT,
-                        "WhatsappPhone" TEXT,
-                        "BusinessAccountId" TEXT,
-                        "Perfil" TEXT,
-                        "AccessToken" TEXT,
-                        "WebhookVerifyToken" TEXT,
-                        "AppSecret" TEXT,
-                        "ValidateSignature" BOOLEAN DEFAULT FALSE,
-                        "Enabled" BOOLEAN DEFAULT TRUE,
-                        "AppId" TEXT,
-                        "ConfigurationId" TEXT,
-                        "PartnerSolutionId" TEXT,
-                        "RedirectUri" TEXT,
-                        "CreatedAt" TIMESTAMP DEFAULT NOW(),
-                        "UpdatedAt" TIMESTAMP DEFAULT NOW()
-                    )
-                    """
-                )
-                cur.execute(
-                    f'CREATE INDEX IF NOT EXISTS "idx_{table_name}_IdTenant" ON "{safe_schema}"."{table_name}"("IdTenant")'
-                )
-                cur.execute(
-                    f'CREATE INDEX IF NOT EXISTS "idx_{table_name}_TenantSlug" ON "{safe_schema}"."{table_name}"("TenantSlug")'
-                )
-                conn.commit()
-        except Exception:
-            pass
-        try:
-            with _conn_factory() as conn:
-                cur = conn.cursor()
-                cur.execute(f'ALTER TABLE "{safe_schema}"."{table_name}" ADD COLUMN IF NOT EXISTS "AppId" TEXT')
-                cur.execute(f'ALTER TABLE "{safe_schema}"."{table_name}" ADD COLUMN IF NOT EXISTS "ConfigurationId" TEXT')
-                cur.execute(f'ALTER TABLE "{safe_schema}"."{table_name}" ADD COLUMN IF NOT EXISTS "PartnerSolutionId" TEXT')
-                cur.execute(f'ALTER TABLE "{safe_schema}"."{table_name}" ADD COLUMN IF NOT EXISTS "RedirectUri" TEXT')
-                cur.execute(f'ALTER TABLE "{safe_schema}"."{table_name}" ADD COLUMN IF NOT EXISTS "Perfil" TEXT')
-                cur.execute(f'ALTER TABLE "{safe_schema}"."{table_name}" ADD COLUMN IF NOT EXISTS "WhatsappPhone" TEXT')
-                conn.commit()
-        except Exception:
-            pass
+    def _alter_config_table(cur) -> None:
+        cur.execute(f'ALTER TABLE "{safe_schema}"."{table_name}" ADD COLUMN IF NOT EXISTS "AppId" TEXT')
+        cur.execute(f'ALTER TABLE "{safe_schema}"."{table_name}" ADD COLUMN IF NOT EXISTS "ConfigurationId" TEXT')
+        cur.execute(f'ALTER TABLE "{safe_schema}"."{table_name}" ADD COLUMN IF NOT EXISTS "PartnerSolutionId" TEXT')
+        cur.execute(f'ALTER TABLE "{safe_schema}"."{table_name}" ADD COLUMN IF NOT EXISTS "RedirectUri" TEXT')
+        cur.execute(f'ALTER TABLE "{safe_schema}"."{table_name}" ADD COLUMN IF NOT EXISTS "Perfil" TEXT')
+        cur.execute(f'ALTER TABLE "{safe_schema}"."{table_name}" ADD COLUMN IF NOT EXISTS "WhatsappPhone" TEXT')
 
-        try:
-            with _conn_factory() as conn:
-                cur = conn.cursor()
-                cur.execute(
-                    f"""
-                    CREATE TABLE IF NOT EXISTS "{safe_schema}"."{legacy_table_name}" (
-                        "Id" SERIAL PRIMARY KEY,
-                        "IdTenant" INTEGER NOT NULL,
-                        "TenantSlug" TEXT,
-                        "BaseUrl" TEXT,
-                        "ApiVersion" TEXT,
-                        "PhoneNumberId" TEXT,
-                        "WhatsappPhone" TEXT,
-                        "BusinessAccountId" TEXT,
-                        "Perfil" TEXT,
-                        "AccessToken" TEXT,
-                        "WebhookVerifyToken" TEXT,
-                        "AppSecret" TEXT,
-                        "ValidateSignature" BOOLEAN DEFAULT FALSE,
-                        "Enabled" BOOLEAN DEFAULT TRUE,
-                        "AppId" TEXT,
-                        "ConfigurationId" TEXT,
-                        "PartnerSolutionId" TEXT,
-                        "RedirectUri" TEXT,
-                        "CreatedAt" TIMESTAMP DEFAULT NOW(),
-                        "UpdatedAt" TIMESTAMP DEFAULT NOW()
-                    )
-                    """
-                )
-                cur.execute(
-                    f'CREATE INDEX IF NOT EXISTS "idx_{legacy_table_name}_IdTenant" ON "{safe_schema}"."{legacy_table_name}"("IdTenant")'
-                )
-                cur.execute(
-                    f'CREATE INDEX IF NOT EXISTS "idx_{legacy_table_name}_TenantSlug" ON "{safe_schema}"."{legacy_table_name}"("TenantSlug")'
-                )
-                conn.commit()
-        except Exception:
-            pass
-        try:
-            with _conn_factory() as conn:
-                cur = conn.cursor()
-                cur.execute(f'ALTER TABLE "{safe_schema}"."{legacy_table_name}" ADD COLUMN IF NOT EXISTS "AppId" TEXT')
-                cur.execute(f'ALTER TABLE "{safe_schema}"."{legacy_table_name}" ADD COLUMN IF NOT EXISTS "ConfigurationId" TEXT')
-                cur.execute(f'ALTER TABLE "{safe_schema}"."{legacy_table_name}" ADD COLUMN IF NOT EXISTS "PartnerSolutionId" TEXT')
-                cur.execute(f'ALTER TABLE "{safe_schema}"."{legacy_table_name}" ADD COLUMN IF NOT EXISTS "RedirectUri" TEXT')
-                cur.execute(f'ALTER TABLE "{safe_schema}"."{legacy_table_name}" ADD COLUMN IF NOT EXISTS "Perfil" TEXT')
-                cur.execute(f'ALTER TABLE "{safe_schema}"."{legacy_table_name}" ADD COLUMN IF NOT EXISTS "WhatsappPhone" TEXT')
-                conn.commit()
-        except Exception:
-            pass
+    def _create_legacy_table(cur) -> None:
+        cur.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS "{safe_schema}"."{legacy_table_name}" (
+                "Id" SERIAL PRIMARY KEY,
+                "IdTenant" INTEGER NOT NULL,
+                "TenantSlug" TEXT,
+                "BaseUrl" TEXT,
+                "ApiVersion" TEXT,
+                "PhoneNumberId" TEXT,
+                "WhatsappPhone" TEXT,
+                "BusinessAccountId" TEXT,
+                "Perfil" TEXT,
+                "AccessToken" TEXT,
+                "WebhookVerifyToken" TEXT,
+                "AppSecret" TEXT,
+                "ValidateSignature" BOOLEAN DEFAULT FALSE,
+                "Enabled" BOOLEAN DEFAULT TRUE,
+                "AppId" TEXT,
+                "ConfigurationId" TEXT,
+                "PartnerSolutionId" TEXT,
+                "RedirectUri" TEXT,
+                "CreatedAt" TIMESTAMP DEFAULT NOW(),
+                "UpdatedAt" TIMESTAMP DEFAULT NOW()
+            )
+            """
+        )
+        cur.execute(
+            f'CREATE INDEX IF NOT EXISTS "idx_{legacy_table_name}_IdTenant" ON "{safe_schema}"."{legacy_table_name}"("IdTenant")'
+        )
+        cur.execute(
+            f'CREATE INDEX IF NOT EXISTS "idx_{legacy_table_name}_TenantSlug" ON "{safe_schema}"."{legacy_table_name}"("TenantSlug")'
+        )
+
+    def _alter_legacy_table(cur) -> None:
+        cur.execute(f'ALTER TABLE "{safe_schema}"."{legacy_table_name}" ADD COLUMN IF NOT EXISTS "AppId" TEXT')
+        cur.execute(f'ALTER TABLE "{safe_schema}"."{legacy_table_name}" ADD COLUMN IF NOT EXISTS "ConfigurationId" TEXT')
+        cur.execute(f'ALTER TABLE "{safe_schema}"."{legacy_table_name}" ADD COLUMN IF NOT EXISTS "PartnerSolutionId" TEXT')
+        cur.execute(f'ALTER TABLE "{safe_schema}"."{legacy_table_name}" ADD COLUMN IF NOT EXISTS "RedirectUri" TEXT')
+        cur.execute(f'ALTER TABLE "{safe_schema}"."{legacy_table_name}" ADD COLUMN IF NOT EXISTS "Perfil" TEXT')
+        cur.execute(f'ALTER TABLE "{safe_schema}"."{legacy_table_name}" ADD COLUMN IF NOT EXISTS "WhatsappPhone" TEXT')
+
+    def _create_media_cache_table(cur) -> None:
+        cur.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS "{safe_schema}"."MetaMediaCache" (
+                "IdConfig" INTEGER NOT NULL,
+                "PhoneNumberId" TEXT NOT NULL,
+                "Sha256" TEXT NOT NULL,
+                "MediaId" TEXT NOT NULL,
+                "MimeType" TEXT,
+                "Arquivo" TEXT,
+                "ExpiraEm" TIMESTAMP NOT NULL,
+                "CreatedAt" TIMESTAMP DEFAULT NOW(),
+                PRIMARY KEY ("IdConfig", "PhoneNumberId", "Sha256")
+            )
+            """
+        )
+
+    def ensure_table(request: Optional[Request] = None):
+        schema_registry.ensure_for_request(request, f"meta:{table_name}", _create_config_table)
+        schema_registry.ensure_for_request(request, f"meta:{table_name}:colunas", _alter_config_table)
+        schema_registry.ensure_for_request(request, f"meta:{legacy_table_name}", _create_legacy_table)
+        schema_registry.ensure_for_request(request, f"meta:{legacy_table_name}:colunas", _alter_legacy_table)
+        schema_registry.ensure_for_request(request, "meta:MetaMediaCache", _create_media_cache_table)
 
     def _tenant_slug(request: Request) -> str:
         try:
@@ -594,8 +647,8 @@ def register_meta_whatsapp_routes(
             pass
 
     def _graph_base(cfg_row: Any) -> str:
-        raw = ""
-        if cfg_row and len(cfg_row) > 3:
+        raw = str(os.getenv("META_GRAPH_BASE_URL") or "").strip()
+        if not raw and cfg_row and len(cfg_row) > 3:
             raw = str(cfg_row[3] or "").strip()
         base = raw or "https://graph.facebook.com"
         return base.rstrip("/")
@@ -700,7 +753,7 @@ def register_meta_whatsapp_routes(
         if redirect_uri is None:
             candidates.append({"client_id": app_id, "client_secret": app_secret, "code": code, "redirect_uri": ""})
         last_text = ""
-        async with aiohttp.ClientSession() as session:
+        async with http_session("meta") as session:
             for params in candidates:
                 qs = urlencode({k: v for k, v in params.items() if v is not None})
                 try:
@@ -735,7 +788,7 @@ def register_meta_whatsapp_routes(
     ) -> dict[str, Any]:
         url = f"{base}/{ver}/debug_token"
         qs = urlencode({"input_token": input_token, "access_token": f"{app_id}|{app_secret}"})
-        async with aiohttp.ClientSession() as session:
+        async with http_session("meta") as session:
             async with session.get(f"{url}?{qs}", timeout=timeout) as resp:
                 text = await resp.text()
                 if resp.status not in (200, 201):
@@ -756,7 +809,7 @@ def register_meta_whatsapp_routes(
         headers = {"Authorization": f"Bearer {token}"}
         if json_payload is not None:
             headers["Content-Type"] = "application/json"
-        async with aiohttp.ClientSession() as session:
+        async with http_session("meta") as session:
             async with session.request(
                 method.upper(),
                 url,
@@ -799,7 +852,7 @@ def register_meta_whatsapp_routes(
         form = aiohttp.FormData()
         form.add_field("messaging_product", "whatsapp")
         form.add_field("file", file_bytes, filename=filename, content_type=content_type)
-        async with aiohttp.ClientSession() as session:
+        async with http_session("meta") as session:
             async with session.post(url, headers=headers, data=form, timeout=timeout) as resp:
                 text = await resp.text()
                 if resp.status not in (200, 201):
@@ -823,6 +876,148 @@ def register_meta_whatsapp_routes(
                 except Exception:
                     return {"raw": text}
 
+    _media_hashes: dict[str, tuple[float, int, str]] = {}
+    _media_ids: dict[tuple[int, str, str], tuple[str, datetime]] = {}
+    _media_locks: dict[tuple[int, str, str], asyncio.Lock] = {}
+
+    def _media_ttl() -> timedelta:
+        try:
+            days = float(str(os.getenv("META_MEDIA_TTL_DAYS", "") or "").strip() or 29)
+        except Exception:
+            days = 29.0
+        return timedelta(days=max(0.01, days))
+
+    def _local_campanha_file(media_url: str) -> Optional[str]:
+        raw = str(media_url or "").strip()
+        if not raw:
+            return None
+        parsed = urlparse(raw)
+        path = parsed.path or ""
+        if "/static/campanhas/" in path:
+            name = path.rsplit("/", 1)[-1]
+        elif not parsed.scheme and "/" not in raw:
+            name = raw
+        else:
+            return None
+        name = os.path.basename(name)
+        if not name:
+            return None
+        full_path = os.path.join(os.getcwd(), "static", "campanhas", name)
+        return full_path if os.path.isfile(full_path) else None
+
+    def _file_sha256(full_path: str) -> str:
+        st = os.stat(full_path)
+        cached = _media_hashes.get(full_path)
+        if cached and cached[0] == st.st_mtime and cached[1] == st.st_size:
+            return cached[2]
+        h = hashlib.sha256()
+        with open(full_path, "rb") as fh:
+            for chunk in iter(lambda: fh.read(1024 * 1024), b""):
+                h.update(chunk)
+        digest = h.hexdigest()
+        _media_hashes[full_path] = (st.st_mtime, st.st_size, digest)
+        return digest
+
+    def _file_bytes(full_path: str) -> bytes:
+        with open(full_path, "rb") as fh:
+            return fh.read()
+
+    def _media_cache_get(request: Request, key: tuple[int, str, str]) -> Optional[str]:
+        now = datetime.utcnow()
+        hit = _media_ids.get(key)
+        if hit and hit[1] > now:
+            return hit[0]
+        try:
+            with get_conn_for_request(request) as conn:
+                cur = conn.cursor()
+                cur.execute(
+                    f"""
+                    SELECT "MediaId", "ExpiraEm"
+                    FROM "{safe_schema}"."MetaMediaCache"
+                    WHERE "IdConfig" = %s AND "PhoneNumberId" = %s AND "Sha256" = %s
+                    LIMIT 1
+                    """,
+                    key,
+                )
+                row = cur.fetchone()
+        except Exception:
+            row = None
+        if row and row[1] and row[1] > now:
+            _media_ids[key] = (str(row[0]), row[1])
+            return str(row[0])
+        return None
+
+    def _media_cache_put(request: Request, key: tuple[int, str, str], media_id: str, mime_type: str, arquivo: str) -> None:
+        expira = datetime.utcnow() + _media_ttl()
+        _media_ids[key] = (media_id, expira)
+        try:
+            with get_conn_for_request(request) as conn:
+                cur = conn.cursor()
+                cur.execute(
+                    f"""
+                    INSERT INTO "{safe_schema}"."MetaMediaCache"
+                    ("IdConfig","PhoneNumberId","Sha256","MediaId","MimeType","Arquivo","ExpiraEm","CreatedAt")
+                    VALUES (%s,%s,%s,%s,%s,%s,%s,NOW())
+                    ON CONFLICT ("IdConfig","PhoneNumberId","Sha256") DO UPDATE
+                    SET "MediaId" = EXCLUDED."MediaId",
+                        "MimeType" = EXCLUDED."MimeType",
+                        "Arquivo" = EXCLUDED."Arquivo",
+                        "ExpiraEm" = EXCLUDED."ExpiraEm",
+                        "CreatedAt" = NOW()
+                    """,
+                    (*key, media_id, mime_type, arquivo, expira),
+                )
+                conn.commit()
+        except Exception:
+            pass
+
+    def _media_cache_drop(request: Request, key: tuple[int, str, str]) -> None:
+        _media_ids.pop(key, None)
+        try:
+            with get_conn_for_request(request) as conn:
+                cur = conn.cursor()
+                cur.execute(
+                    f'DELETE FROM "{safe_schema}"."MetaMediaCache" WHERE "IdConfig" = %s AND "PhoneNumberId" = %s AND "Sha256" = %s',
+                    key,
+                )
+                conn.commit()
+        except Exception:
+            pass
+
+    async def _cached_media_id(request: Request, cfg_row: Any, media_url: str) -> tuple[Optional[str], Optional[tuple[int, str, str]]]:
+        full_path = _local_campanha_file(media_url)
+        if not full_path or not cfg_row:
+            return None, None
+        phone_number_id = _cfg_phone_number_id(cfg_row)
+        token = _cfg_access_token(cfg_row)
+        if not phone_number_id or not token:
+            return None, None
+        digest = await asyncio.to_thread(_file_sha256, full_path)
+        key = (int(cfg_row[0] or 0), phone_number_id, digest)
+        media_id = await asyncio.to_thread(_media_cache_get, request, key)
+        if media_id:
+            return media_id, key
+        lock = _media_locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            media_id = await asyncio.to_thread(_media_cache_get, request, key)
+            if media_id:
+                return media_id, key
+            content = await asyncio.to_thread(_file_bytes, full_path)
+            filename = os.path.basename(full_path)
+            mime_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+            res = await _graph_upload(
+                url=f"{_graph_base(cfg_row)}/{_graph_version(cfg_row)}/{phone_number_id}/media",
+                token=token,
+                file_bytes=content,
+                filename=filename,
+                content_type=mime_type,
+            )
+            media_id = str(res.get("id") or "").strip()
+            if not media_id:
+                return None, None
+            await asyncio.to_thread(_media_cache_put, request, key, media_id, mime_type, filename)
+            return media_id, key
+
     def _insert_disparo_log(
         request: Request,
         *,
@@ -836,6 +1031,25 @@ def register_meta_whatsapp_routes(
         message_id: Optional[str],
     ) -> None:
         try:
+            if disparos_writer is not None:
+                disparos_writer.add_for_request(
+                    request,
+                    [
+                        {
+                            "IdTenant": int(tenant_id_from_header(request) or 1),
+                            "IdCampanha": campanha_id,
+                            "Numero": numero,
+                            "Nome": nome,
+                            "Mensagem": mensagem,
+                            "Imagem": imagem,
+                            "Status": status,
+                            "Payload": json.dumps(payload, ensure_ascii=False) if payload is not None else None,
+                            "MessageId": message_id,
+                            "EvolutionInstance": "META",
+                        }
+                    ],
+                )
+                return
             with get_conn_for_request(request) as conn:
                 cur = conn.cursor()
                 tid = int(tenant_id_from_header(request) or 1)
@@ -1332,25 +1546,38 @@ def register_meta_whatsapp_routes(
             media_id = str(res.get("id") or "").strip()
             if not media_id:
                 raise HTTPException(status_code=502, detail=str(res))
-            return {"ok": True, "id": media_id}
+            digest = hashlib.sha256(content).hexdigest()
+            _media_cache_put(
+                request,
+                (int(row[0] or 0), phone_number_id, digest),
+                media_id,
+                str(file.content_type or "application/octet-stream"),
+                str(file.filename or "upload.bin"),
+            )
+            return {"ok": True, "id": media_id, "sha256": digest}
         except HTTPException:
             raise
         except Exception as e:
             raise HTTPException(status_code=500, detail=str(e))
 
+    def _send_config(request: Request, slug: str) -> Any:
+        ensure_table(request)
+        with get_conn_for_request(request) as conn:
+            tid = int(tenant_id_from_header(request) or 1)
+            cfg_id = _parse_config_id(request)
+            if cfg_id:
+                row = _get_config_by_id(conn, cfg_id)
+                _assert_cfg_matches(cfg_row=row, slug=slug, tid=tid)
+            else:
+                row = _get_latest_config(conn, slug=slug, tid=tid)
+        return row
+
     @app.post(f"/api/integracoes/{prefix}/send")
     async def meta_send(payload: MetaWhatsAppSendIn, request: Request):
-        ensure_table(request)
         slug = _tenant_slug(request)
         try:
-            with get_conn_for_request(request) as conn:
-                tid = int(tenant_id_from_header(request) or 1)
-                cfg_id = _parse_config_id(request)
-                if cfg_id:
-                    row = _get_config_by_id(conn, cfg_id)
-                    _assert_cfg_matches(cfg_row=row, slug=slug, tid=tid)
-                else:
-                    row = _get_latest_config(conn, slug=slug, tid=tid)
+            # Configuração, cache de mídia e log usam psycopg síncrono: rodam em threads.
+            row = await asyncio.to_thread(_send_config, request, slug)
             if not row:
                 raise HTTPException(status_code=400, detail="Meta WhatsApp não configurada.")
             if not _cfg_enabled(row):
@@ -1377,6 +1604,8 @@ def register_meta_whatsapp_routes(
 
             async def send_one(message_payload: dict[str, Any]) -> dict[str, Any]:
                 full = {"messaging_product": "whatsapp", "to": to_waid, **message_payload}
+                if rate_limiter is not None:
+                    await rate_limiter.acquire("meta", phone_number_id)
                 res = await _graph_json(method="POST", url=url, token=token, json_payload=full, timeout=40)
                 return res
 
@@ -1400,7 +1629,8 @@ def register_meta_whatsapp_routes(
                 except Exception:
                     message_id = None
                 ids = [message_id] if message_id else []
-                _insert_disparo_log(
+                await asyncio.to_thread(
+                    _insert_disparo_log,
                     request,
                     campanha_id=payload.campanha_id,
                     numero=to_waid,
@@ -1428,12 +1658,29 @@ def register_meta_whatsapp_routes(
                 if not (media_id or media_url):
                     return None
                 media_obj: dict[str, Any] = {}
+                cache_key = None
                 if media_id:
                     media_obj["id"] = media_id
                 else:
-                    media_obj["link"] = media_url
+                    cached_id = None
+                    try:
+                        cached_id, cache_key = await _cached_media_id(request, row, media_url)
+                    except HTTPException:
+                        cached_id, cache_key = None, None
+                    if cached_id:
+                        media_obj["id"] = cached_id
+                    else:
+                        media_obj["link"] = media_url
                 msg = {"type": media_type, media_type: media_obj}
-                res = await send_one(msg)
+                try:
+                    res = await send_one(msg)
+                except HTTPException as he:
+                    if cache_key is None or he.status_code != 400 or not _is_media_error(he.detail):
+                        raise
+                    await asyncio.to_thread(_media_cache_drop, request, cache_key)
+                    cached_id, cache_key = await _cached_media_id(request, row, media_url)
+                    msg = {"type": media_type, media_type: ({"id": cached_id} if cached_id else {"link": media_url})}
+                    res = await send_one(msg)
                 results.append(res)
                 try:
                     return str(((res.get("messages") or [])[0] or {}).get("id") or "").strip() or None
@@ -1456,7 +1703,8 @@ def register_meta_whatsapp_routes(
                 if mid1:
                     ids.append(mid1)
 
-            _insert_disparo_log(
+            await asyncio.to_thread(
+                _insert_disparo_log,
                 request,
                 campanha_id=payload.campanha_id,
                 numero=to_waid,
@@ -1669,11 +1917,42 @@ def register_meta_whatsapp_routes(
         except Exception as e:
             raise HTTPException(status_code=500, detail=str(e))
 
-    @app.post(f"/api/integracoes/{prefix}/webhook")
-    async def meta_webhook_event(request: Request):
+    def _drop_replayed_events(payload: Any, slug: str) -> Tuple[List[str], int]:
+        """Remove de `statuses`/`messages` os eventos já processados (mesmo id e status).
+        Retorna (chaves reservadas, quantidade de mudanças que ainda têm trabalho)."""
+        refs: List[Tuple[dict, str, dict, str]] = []
+        pendentes = 0
+        for ent in (payload.get("entry") if isinstance(payload, dict) else None) or []:
+            for ch in (ent.get("changes") if isinstance(ent, dict) else None) or []:
+                if not isinstance(ch, dict):
+                    continue
+                value = ch.get("value")
+                field = str(ch.get("field") or "").strip().lower()
+                if (field and field != "messages") or not isinstance(value, dict):
+                    pendentes += 1
+                    continue
+                for lista, prefixo in (("statuses", "st"), ("messages", "msg")):
+                    itens = value.get(lista)
+                    for item in itens if isinstance(itens, list) else []:
+                        mid = str(item.get("id") or "").strip() if isinstance(item, dict) else ""
+                        if not mid:
+                            pendentes += 1
+                            continue
+                        status = str(item.get("status") or "").strip().lower() if prefixo == "st" else ""
+                        refs.append((value, lista, item, f"{prefixo}:{mid}|{status}"))
+        if not refs:
+            return [], pendentes
+        fresh = webhook_dedup.claim(prefix, slug, [r[3] for r in refs])
+        drop = {id(r[2]) for r, ok in zip(refs, fresh) if not ok}
+        for value, lista, _item, _key in refs:
+            if drop and isinstance(value.get(lista), list):
+                value[lista] = [x for x in value[lista] if id(x) not in drop]
+        return [r[3] for r, ok in zip(refs, fresh) if ok], pendentes + (len(refs) - len(drop))
+
+    def _meta_webhook_event_sync(request: Request, raw: bytes):
         ensure_table(request)
         slug = _tenant_slug(request)
-        raw = await request.body()
+        claimed_keys: List[str] = []
         try:
             with get_conn_for_request(request) as conn:
                 cfg_id = _parse_config_id(request)
@@ -1688,11 +1967,18 @@ def register_meta_whatsapp_routes(
                     raise HTTPException(status_code=400, detail="App Secret não configurado para validar assinatura.")
                 if not _verify_webhook_signature(request, raw, secret):
                     raise HTTPException(status_code=403, detail="Assinatura inválida.")
+            if webhook_queue is not None and webhook_queue.should_enqueue(request):
+                if webhook_queue.enqueue(prefix, request, raw):
+                    return {"ok": True, "queued": True}
             payload = None
             try:
                 payload = json.loads(raw.decode("utf-8")) if raw else {}
             except Exception:
                 payload = {}
+            if webhook_dedup is not None:
+                claimed_keys, pendentes = _drop_replayed_events(payload, slug)
+                if pendentes == 0:
+                    return {"ok": True, "duplicate": True}
 
             try:
                 def _extract_meta_message_text(msg: Any) -> str:
@@ -1951,6 +2237,8 @@ def register_meta_whatsapp_routes(
                                 elif status in ("failed",):
                                     mapped = "FALHA"
                                 try:
+                                    if disparos_writer is not None:
+                                        disparos_writer.flush_pending([mid])
                                     with get_conn_for_request(request) as conn2:
                                         cur = conn2.cursor()
                                         tid = int(_tenant_id_for_request(request) or 1)
@@ -1961,10 +2249,7 @@ def register_meta_whatsapp_routes(
                                                 "EntregueEm" = CASE WHEN %s = 'ENTREGUE' THEN (TO_TIMESTAMP(%s)::timestamp) ELSE "EntregueEm" END,
                                                 "VisualizadoEm" = CASE WHEN %s = 'VISUALIZADO' THEN (TO_TIMESTAMP(%s)::timestamp) ELSE "VisualizadoEm" END
                                             WHERE "IdTenant" = %s
-                                              AND (
-                                                "MessageId" = %s
-                                                OR COALESCE("Payload"->'message_ids','[]'::jsonb) ? %s
-                                              )
+                                              AND {disparos_by_message_ids_sql(safe_schema)}
                                             """,
                                             (
                                                 mapped,
@@ -1973,8 +2258,8 @@ def register_meta_whatsapp_routes(
                                                 mapped,
                                                 int(ts or 0),
                                                 tid,
-                                                mid,
-                                                mid,
+                                                tid,
+                                                [mid],
                                             ),
                                         )
                                         try:
@@ -1988,7 +2273,6 @@ def register_meta_whatsapp_routes(
                             if not isinstance(messages, list):
                                 continue
                             tid = int(_tenant_id_for_request(request) or 1)
-                            out_rows: Optional[list[Any]] = None
                             for m in messages:
                                 if not isinstance(m, dict):
                                     continue
@@ -2021,42 +2305,27 @@ def register_meta_whatsapp_routes(
                                 if resposta not in (1, 2) or not inserted_in_id:
                                     continue
 
-                                if out_rows is None:
-                                    try:
-                                        with get_conn_for_request(request) as conn3:
-                                            cur3 = conn3.cursor()
-                                            cur3.execute(
-                                                f"""
-                                                SELECT d."IdDisparo", d."Numero", d."IdCampanha"
-                                                FROM "{safe_schema}"."Disparos" d
-                                                JOIN "{safe_schema}"."Campanhas" c
-                                                  ON c."IdTenant" = d."IdTenant"
-                                                 AND c."IdCampanha" = d."IdCampanha"
-                                                WHERE d."IdTenant" = %s
-                                                  AND d."Canal" = 'WHATSAPP'
-                                                  AND d."Direcao" = 'OUT'
-                                                  AND COALESCE(d."EvolutionInstance",'') = 'META'
-                                                  AND d."Status" IN ('ENVIADO','ENTREGUE','VISUALIZADO')
-                                                  AND d."IdCampanha" IS NOT NULL
-                                                  AND COALESCE(c."AnexoJSON"->'config'->>'response_mode', '') = 'SIM_NAO'
-                                                ORDER BY d."DataHora" DESC, d."IdDisparo" DESC
-                                                LIMIT 500
-                                                """,
-                                                (tid,),
-                                            )
-                                            out_rows = cur3.fetchall() or []
-                                    except Exception:
-                                        out_rows = []
+                                try:
+                                    with get_conn_for_request(request) as conn3:
+                                        candidates = sim_nao_index.lookup_for_request(
+                                            request, conn3.cursor(), tid, incoming_digits, meta_only=True
+                                        )
+                                except Exception:
+                                    candidates = []
 
-                                candidates = [
-                                    (out_id_raw, out_num, campanha_id)
-                                    for (out_id_raw, out_num, campanha_id) in (out_rows or [])
-                                    if _match_phone(out_num, incoming_digits)
-                                ]
                                 for (out_id_raw, _out_num, campanha_id) in candidates[:5]:
                                     try:
                                         with get_conn_for_request(request) as conn4:
                                             cur4 = conn4.cursor()
+                                            record_contato_resposta(
+                                                cur4,
+                                                safe_schema,
+                                                tid,
+                                                campanha_id,
+                                                incoming_digits,
+                                                resposta,
+                                                datetime.utcfromtimestamp(incoming_ts) if incoming_ts else None,
+                                            )
                                             cur4.execute(
                                                 f"""
                                                 UPDATE "{safe_schema}"."Disparos"
@@ -2087,8 +2356,16 @@ def register_meta_whatsapp_routes(
         except HTTPException:
             raise
         except Exception as e:
+            if webhook_dedup is not None:
+                webhook_dedup.release(prefix, slug, claimed_keys)
             raise HTTPException(status_code=500, detail=str(e))
 
+    @app.post(f"/api/integracoes/{prefix}/webhook")
+    async def meta_webhook_event(request: Request):
+        # Consultas psycopg síncronas: rodam fora do event loop que recebe os webhooks.
+        raw = await request.body()
+        return await asyncio.to_thread(_meta_webhook_event_sync, request, raw)
+
     @app.get(f"/api/integracoes/{prefix}/webhook/echo")
     async def meta_webhook_echo_verify(request: Request):
         try:
@@ -2108,6 +2385,9 @@ def register_meta_whatsapp_routes(
         except Exception as e:
             raise HTTPException(status_code=500, detail=str(e))
 
+    if webhook_queue is not None:
+        webhook_queue.register(prefix, meta_webhook_event)
+
     @app.post(f"/api/integracoes/{prefix}/webhook/echo")
     async def meta_webhook_echo_event(request: Request):
         raw = await request.body()
@@ -0,0 +1,55 @@
+from fastapi import HTTPException
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import base64
+import json
+
+
+def encode_cursor(sort: str, values: Sequence[Any]) -> str:
+    """Token opaco com a ordenação e os valores da chave (id por último) da última linha."""
+    raw = json.dumps({"s": sort, "v": list(values)}, separators=(",", ":"), default=str)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+# Tipos dos valores da chave de cada ordenação, na ordem do cursor (id por último).
+CURSOR_TYPES: Dict[str, Tuple[type, ...]] = {"id": (int,)}
+
+
+def _valid_values(sort: str, values: List[Any]) -> bool:
+    types = CURSOR_TYPES.get(sort)
+    if types is None:
+        return True
+    if len(values) != len(types):
+        return False
+    return all(isinstance(v, t) and not isinstance(v, bool) for v, t in zip(values, types))
+
+
+def decode_cursor(token: Optional[str], sort: str) -> Optional[List[Any]]:
+    """Valores da chave do `token`, ou None sem cursor. Token inválido, de outra ordenação ou
+    com valores do tipo errado (CURSOR_TYPES): 400."""
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(str(token) + "=" * (-len(str(token)) % 4))
+        d = json.loads(raw)
+        values = d["v"]
+        if d.get("s") != sort or not isinstance(values, list) or not values or not _valid_values(sort, values):
+            raise ValueError(sort)
+        return values
+    except Exception:
+        raise HTTPException(status_code=400, detail="cursor inválido")
+
+
+def keyset_page(rows: List[Dict[str, Any]], limit: int, sort: str, keys: Sequence[str]) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """Corta a página de `rows` (buscadas com LIMIT limit + 1) e monta o `next_cursor`."""
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(sort, [rows[-1].get(k) for k in keys])
+
+
+def page_limit(limit: Any, default: int, maximum: int) -> int:
+    try:
+        n = int(limit)
+    except Exception:
+        n = default
+    return max(1, min(n, maximum))
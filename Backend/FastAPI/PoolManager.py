@@ -0,0 +1,191 @@
+from collections import OrderedDict
+from typing import Any, Dict, List
+from urllib.parse import urlparse
+import os
+import time
+import threading
+
+try:
+    from psycopg_pool import ConnectionPool
+except Exception:
+    ConnectionPool = None
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(str(os.getenv(name, "") or "").strip() or default)
+    except Exception:
+        return default
+
+
+class PoolBudgetExceeded(RuntimeError):
+    pass
+
+
+class PoolManager:
+    """Um `ConnectionPool` por DSN durante toda a vida do processo.
+
+    Os pools ficam em ordem LRU. Um novo pool só é aberto se a soma dos `max_size`
+    (mais as reservas de pools externos, ver `reserve`) couber em DB_POOL_MAX_TOTAL. Se
+    não couber, os pools menos usados e sem conexões em uso são fechados; se ainda assim
+    faltar espaço, o novo pool recebe só o que sobrou do orçamento. Sem nenhuma sobra a
+    chamada espera até DB_POOL_TIMEOUT segundos e então levanta `PoolBudgetExceeded`.
+    Pools ociosos por mais de DB_POOL_IDLE_SECONDS também são fechados. O `search_path`
+    é definido uma vez por conexão, no hook `configure`.
+    """
+
+    def __init__(self, db_schema: str):
+        self._schema = str(db_schema or "captar").replace('"', '""')
+        self.max_total = max(1, _env_int("DB_POOL_MAX_TOTAL", 120))
+        self.max_per_dsn = max(1, _env_int("DB_POOL_MAX_PER_DSN", 10))
+        self.min_per_dsn = max(0, min(self.max_per_dsn, _env_int("DB_POOL_MIN_PER_DSN", 1)))
+        self.idle_seconds = max(30, _env_int("DB_POOL_IDLE_SECONDS", 600))
+        self.timeout = max(1, _env_int("DB_POOL_TIMEOUT", 30))
+        self._lock = threading.Lock()
+        self._pools: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._reservas: Dict[str, int] = {}
+        self._last_sweep = time.monotonic()
+        self._stats: Dict[str, int] = {"abertos": 0, "fechados_lru": 0, "fechados_ociosos": 0, "encerrados": 0, "reduzidos": 0, "recusados": 0}
+
+    def _configure(self, conn) -> None:
+        conn.autocommit = True
+        conn.execute(f'SET search_path TO "{self._schema}", public')
+        conn.autocommit = False
+
+    @staticmethod
+    def _reset(conn) -> None:
+        conn.autocommit = False
+
+    @staticmethod
+    def _in_use(pool) -> int:
+        try:
+            stats = pool.get_stats()
+            return max(0, int(stats.get("pool_size", 0)) - int(stats.get("pool_available", 0)))
+        except Exception:
+            return 1
+
+    def _budget_used(self) -> int:
+        return sum(int(ent["max_size"]) for ent in self._pools.values()) + sum(self._reservas.values())
+
+    def _close(self, dsn: str, motivo: str) -> None:
+        ent = self._pools.pop(dsn, None)
+        if ent is None:
+            return
+        self._stats[motivo] += 1
+        try:
+            ent["pool"].close(timeout=5.0)
+        except Exception as e:
+            print(f"Pool manager: falha ao fechar pool ({motivo}): {e}")
+
+    def _sweep(self, now: float) -> None:
+        self._last_sweep = now
+        for dsn, ent in list(self._pools.items()):
+            if now - ent["last_used"] >= self.idle_seconds and not self._in_use(ent["pool"]):
+                self._close(dsn, "fechados_ociosos")
+
+    def _grant(self, size: int, now: float) -> int:
+        """Fecha pools LRU ociosos até caber `size`; retorna quanto pode ser alocado (0 = nada)."""
+        for old in list(self._pools):
+            if self._budget_used() + size <= self.max_total:
+                break
+            ent = self._pools[old]
+            if now - ent["last_used"] >= 5 and not self._in_use(ent["pool"]):
+                self._close(old, "fechados_lru")
+        livre = self.max_total - self._budget_used()
+        if livre <= 0:
+            return 0
+        if livre < size:
+            self._stats["reduzidos"] += 1
+        return min(size, livre)
+
+    def _wait(self, deadline: float, motivo: str) -> None:
+        if time.monotonic() >= deadline:
+            self._stats["recusados"] += 1
+            raise PoolBudgetExceeded(f"DB_POOL_MAX_TOTAL={self.max_total} esgotado ({motivo})")
+        time.sleep(0.2)
+
+    def get(self, dsn: str):
+        """Pool do DSN, criando-o (dentro do orçamento global) na primeira chamada."""
+        if ConnectionPool is None:
+            return None
+        deadline = time.monotonic() + self.timeout
+        while True:
+            now = time.monotonic()
+            with self._lock:
+                ent = self._pools.get(dsn)
+                if ent is not None:
+                    ent["last_used"] = now
+                    self._pools.move_to_end(dsn)
+                    if now - self._last_sweep >= 30:
+                        self._sweep(now)
+                    return ent["pool"]
+                if now - self._last_sweep >= 30:
+                    self._sweep(now)
+                max_size = self._grant(self.max_per_dsn, now)
+                if max_size > 0:
+                    pool = ConnectionPool(
+                        dsn,
+                        min_size=min(self.min_per_dsn, max_size),
+                        max_size=max_size,
+                        timeout=self.timeout,
+                        max_idle=float(self.idle_seconds),
+                        open=True,
+                        configure=self._configure,
+                        reset=self._reset,
+                    )
+                    self._pools[dsn] = {"pool": pool, "max_size": max_size, "last_used": now}
+                    self._stats["abertos"] += 1
+                    return pool
+            self._wait(deadline, "pool síncrono")
+
+    def reserve(self, owner: str, size: int) -> int:
+        """Reserva até `size` conexões do orçamento para um pool criado fora daqui (ex.: os
+        `AsyncConnectionPool` do AsyncDb). Retorna o tamanho concedido; espera como `get`."""
+        deadline = time.monotonic() + self.timeout
+        while True:
+            with self._lock:
+                self._reservas.pop(owner, None)
+                granted = self._grant(max(1, int(size)), time.monotonic())
+                if granted > 0:
+                    self._reservas[owner] = granted
+                    return granted
+            self._wait(deadline, owner)
+
+    def release(self, owner: str) -> None:
+        with self._lock:
+            self._reservas.pop(owner, None)
+
+    def close_all(self) -> None:
+        with self._lock:
+            for dsn in list(self._pools):
+                self._close(dsn, "encerrados")
+
+    def snapshot(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            items = list(self._pools.items())
+            used = self._budget_used()
+            reservado = sum(self._reservas.values())
+        pools: List[Dict[str, Any]] = []
+        for dsn, ent in items:
+            try:
+                stats = ent["pool"].get_stats()
+            except Exception:
+                stats = {}
+            pools.append({
+                "db": urlparse(dsn).path.lstrip("/") or None,
+                "max_size": ent["max_size"],
+                "size": stats.get("pool_size"),
+                "available": stats.get("pool_available"),
+                "waiting": stats.get("requests_waiting"),
+                "idle_s": round(now - ent["last_used"], 1),
+            })
+        return {
+            "max_total": self.max_total,
+            "max_per_dsn": self.max_per_dsn,
+            "min_per_dsn": self.min_per_dsn,
+            "budget_used": used,
+            "reservado": reservado,
+            "stats": dict(self._stats),
+            "pools": pools,
+        }
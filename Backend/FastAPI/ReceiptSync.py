@@ -0,0 +1,284 @@
+from fastapi import FastAPI
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import os
+import re
+import time
+import asyncio
+import traceback
+
+
+_FONTE = "EvolutionAPI.MessageUpdate"
+# Prisma `@default(cuid())`: 'c' + 8 dígitos base36 de timestamp em ms + contador,
+# fingerprint e aleatório (25 caracteres no total).
+_CUID_RE = re.compile(r"^c[0-9a-z]{24}$")
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(str(os.getenv(name, "") or "").strip() or default)
+    except Exception:
+        return default
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(str(os.getenv(name, "") or "").strip() or default)
+    except Exception:
+        return default
+
+
+def is_cuid(v: Any) -> bool:
+    return isinstance(v, str) and _CUID_RE.match(v) is not None
+
+
+def cuid_floor(dt: datetime) -> str:
+    """Menor id cuid possível para o instante `dt` (UTC). Os ids de MessageUpdate são cuid
+    ('c' + timestamp em ms base36 com 8 dígitos), então a ordem do id acompanha a criação."""
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    ms = max(0, int(dt.timestamp() * 1000))
+    digits = "0123456789abcdefghijklmnopqrstuvwxyz"
+    out = ""
+    while ms:
+        ms, r = divmod(ms, 36)
+        out = digits[r] + out
+    return "c" + out.rjust(8, "0")
+
+
+def register_receipt_sync(
+    app: FastAPI,
+    get_db_connection: Callable[..., Any],
+    db_schema: str,
+    list_tenants_with_dsn: Callable[[], List[Tuple[str, str, str, int]]],
+    parse_receipts: Callable[..., Tuple[Dict[str, datetime], Dict[str, datetime]]],
+    apply_receipts: Callable[..., int],
+    disparos_writer: Optional[Any] = None,
+):
+    """Sincroniza em segundo plano os recibos de "EvolutionAPI"."MessageUpdate" para
+    "Disparos", avançando um watermark por id e por banco em "ReceiptSync".
+
+    O watermark é só o `id`: vale porque a Evolution cria os ids com `cuid()`, cujo
+    prefixo é o timestamp, e "createdAt" nem sempre existe na tabela. Se aparecer um id
+    fora desse formato (ex.: cuid2 ou uuid, que não seguem a ordem de criação) o ciclo
+    falha sem mover nenhum watermark, em vez de pular recibos em silêncio.
+
+    Retorna a função de um ciclo de sincronização (síncrona)."""
+    DB_SCHEMA = str(db_schema or "captar").replace('"', '""')
+    POLL_SECONDS = max(0.5, _env_float("RECEIPT_SYNC_POLL_SECONDS", 5.0))
+    BATCH = max(100, _env_int("RECEIPT_SYNC_BATCH", 2000))
+    MAX_BATCHES = max(1, _env_int("RECEIPT_SYNC_MAX_BATCHES", 20))
+    LAG_SECONDS = max(0.0, _env_float("RECEIPT_SYNC_LAG_SECONDS", 5.0))
+    BACKFILL_HOURS = max(0.0, _env_float("RECEIPT_SYNC_BACKFILL_HOURS", 72.0))
+    _state: Dict[str, Any] = {"task": None, "has_created_at": None, "last_tick": None, "last_rows": 0, "last_updated": 0, "last_error": None, "last_failures": {}}
+
+    def _source_ready(cur) -> bool:
+        cur.execute("""SELECT to_regclass('"EvolutionAPI"."MessageUpdate"')""")
+        row = cur.fetchone()
+        if not (row and row[0]):
+            return False
+        if _state["has_created_at"] is None:
+            cur.execute(
+                """
+                SELECT 1 FROM information_schema.columns
+                WHERE table_schema = 'EvolutionAPI' AND table_name = 'MessageUpdate' AND column_name = 'createdAt'
+                """
+            )
+            _state["has_created_at"] = cur.fetchone() is not None
+        # Menor e maior id pelo índice da PK: um id não-cuid em qualquer ponta fica fora
+        # da faixa lida (ou nunca é alcançado) pelo watermark.
+        cur.execute(
+            """
+            SELECT (SELECT id FROM "EvolutionAPI"."MessageUpdate" ORDER BY id ASC LIMIT 1),
+                   (SELECT id FROM "EvolutionAPI"."MessageUpdate" ORDER BY id DESC LIMIT 1)
+            """
+        )
+        for v in cur.fetchone() or ():
+            _check_cuid(v)
+        return True
+
+    def _check_cuid(v: Any) -> None:
+        if v is not None and not is_cuid(v):
+            raise RuntimeError(f'"EvolutionAPI"."MessageUpdate".id fora do formato cuid ({str(v)[:40]!r}); o watermark por id não é confiável')
+
+    def _targets() -> List[Tuple[str, Optional[str]]]:
+        """(fonte, dsn) de cada banco que recebe os recibos; dsn None é o banco principal.
+        Cada um tem o seu watermark em "ReceiptSync" ("Fonte" = fonte)."""
+        out: List[Tuple[str, Optional[str]]] = [(_FONTE, None)]
+        seen: List[str] = []
+        for slug, _nome, dsn, _idt in list_tenants_with_dsn() or []:
+            d = str(dsn or "").strip()
+            if not d or d in seen:
+                continue
+            seen.append(d)
+            out.append((f"{_FONTE}@{str(slug or '').strip().lower()[:50]}", d))
+        return out
+
+    def _watermarks(cur, fontes: List[str]) -> Tuple[Dict[str, str], List[str]]:
+        """Watermark de cada fonte e as que ainda não têm linha em "ReceiptSync"."""
+        cur.execute(f'SELECT "Fonte", "UltimoId" FROM "{DB_SCHEMA}"."ReceiptSync" WHERE "Fonte" = ANY(%s)', (list(fontes),))
+        marks = {str(r[0]): str(r[1]) for r in cur.fetchall() or [] if r[1]}
+        # Tenant sem watermark próprio parte do principal (instalações anteriores tinham um só).
+        default = marks.get(_FONTE) or cuid_floor(datetime.utcnow() - timedelta(hours=BACKFILL_HOURS))
+        return {f: marks.get(f) or default for f in fontes}, [f for f in fontes if f not in marks]
+
+    def _save_watermark(conn, fonte: str, ultimo_id: str, processados: int) -> None:
+        cur = conn.cursor()
+        cur.execute(
+            f"""
+            INSERT INTO "{DB_SCHEMA}"."ReceiptSync" ("Fonte", "UltimoId", "Processados", "AtualizadoEm")
+            VALUES (%s, %s, %s, NOW() AT TIME ZONE 'UTC')
+            ON CONFLICT ("Fonte") DO UPDATE
+            SET "UltimoId" = EXCLUDED."UltimoId",
+                "Processados" = "{DB_SCHEMA}"."ReceiptSync"."Processados" + EXCLUDED."Processados",
+                "AtualizadoEm" = EXCLUDED."AtualizadoEm"
+            """,
+            (fonte, ultimo_id, int(processados)),
+        )
+        conn.commit()
+
+    def _fetch(cur, after_id: str, until_id: str) -> List[Tuple[Any, ...]]:
+        created_col = 'mu."createdAt"' if _state["has_created_at"] else "NULL"
+        cur.execute(
+            f"""
+            SELECT mu.id, mu."keyId", mu."messageId", mu.status, m."messageTimestamp", {created_col}
+            FROM "EvolutionAPI"."MessageUpdate" mu
+            LEFT JOIN "EvolutionAPI"."Message" m
+              ON m.id = mu."messageId"
+            WHERE mu.id > %s AND mu.id < %s
+            ORDER BY mu.id
+            LIMIT %s
+            """,
+            (after_id, until_id, BATCH),
+        )
+        return cur.fetchall() or []
+
+    def _apply_to(dsn: Optional[str], delivered_ts: Dict[str, datetime], read_ts: Dict[str, datetime]) -> int:
+        with get_db_connection(dsn) as conn:
+            try:
+                n = int(apply_receipts(conn.cursor(), tid=None, delivered_ts=delivered_ts, read_ts=read_ts) or 0)
+                conn.commit()
+                return n
+            except Exception:
+                conn.rollback()
+                raise
+
+    def _sync_tick() -> int:
+        """Um ciclo de sincronização. Bancos com o mesmo watermark são atendidos pela mesma
+        leitura; um banco que falha sai do grupo e fica com o watermark parado até voltar."""
+        if disparos_writer is not None:
+            disparos_writer.flush()
+        processed = 0
+        updated = 0
+        falhas: Dict[str, str] = {}
+        with get_db_connection() as conn:
+            cur = conn.cursor()
+            if not _source_ready(cur):
+                conn.rollback()
+                return 0
+            targets = _targets()
+            marks, novos = _watermarks(cur, [f for f, _dsn in targets])
+            until_id = cuid_floor(datetime.utcnow() - timedelta(seconds=LAG_SECONDS))
+            conn.rollback()
+            # Grava o ponto de partida antes de aplicar: se o banco falhar, retoma daqui.
+            for fonte in novos:
+                _save_watermark(conn, fonte, marks[fonte], 0)
+            grupos: Dict[str, List[Tuple[str, Optional[str]]]] = {}
+            for fonte, dsn in targets:
+                grupos.setdefault(marks[fonte], []).append((fonte, dsn))
+            for after_id in sorted(grupos):
+                ativos = grupos[after_id]
+                for _ in range(MAX_BATCHES):
+                    rows = _fetch(cur, after_id, until_id)
+                    conn.rollback()
+                    if not rows:
+                        break
+                    for r in rows:
+                        _check_cuid(r[0])
+                    delivered_ts, read_ts = parse_receipts(rows)
+                    ok: List[Tuple[str, Optional[str]]] = []
+                    for fonte, dsn in ativos:
+                        if delivered_ts or read_ts:
+                            try:
+                                updated += _apply_to(dsn, delivered_ts, read_ts)
+                            except Exception as e:
+                                falhas[fonte] = str(e)
+                                print(f"Receipt sync: falha ao aplicar recibos em {fonte}: {e}")
+                                continue
+                        ok.append((fonte, dsn))
+                    after_id = str(rows[-1][0])
+                    for fonte, _dsn in ok:
+                        _save_watermark(conn, fonte, after_id, len(rows))
+                    processed += len(rows)
+                    ativos = ok
+                    if not ativos or len(rows) < BATCH:
+                        break
+        _state["last_rows"] = processed
+        _state["last_updated"] = updated
+        _state["last_failures"] = falhas
+        return processed
+
+    async def _sync_loop() -> None:
+        while True:
+            try:
+                processed = await asyncio.to_thread(_sync_tick)
+                _state["last_error"] = None
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                traceback.print_exc()
+                _state["last_error"] = str(e)
+                processed = 0
+            _state["last_tick"] = time.time()
+            if processed < BATCH * MAX_BATCHES:
+                await asyncio.sleep(POLL_SECONDS)
+
+    @app.on_event("startup")
+    async def start_receipt_sync():
+        if str(os.getenv("RECEIPT_SYNC_ENABLED", "1")).strip().lower() in ("0", "false", "no", "off"):
+            return
+        if _state["task"] is None:
+            _state["task"] = asyncio.create_task(_sync_loop())
+
+    @app.on_event("shutdown")
+    async def stop_receipt_sync():
+        task = _state["task"]
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        _state["task"] = None
+
+    @app.get("/api/admin/receipt-sync")
+    async def admin_receipt_sync():
+        def _read() -> Dict[str, Any]:
+            with get_db_connection() as conn:
+                cur = conn.cursor()
+                cur.execute(
+                    f'SELECT "Fonte", "UltimoId", "Processados", "AtualizadoEm" FROM "{DB_SCHEMA}"."ReceiptSync" WHERE "Fonte" = %s OR "Fonte" LIKE %s',
+                    (_FONTE, f"{_FONTE}@%"),
+                )
+                rows = cur.fetchall() or []
+            out: Dict[str, Any] = {}
+            for fonte, ultimo_id, processados, atualizado_em in rows:
+                item = {"ultimo_id": ultimo_id, "processados": int(processados or 0), "atualizado_em": atualizado_em}
+                if fonte == _FONTE:
+                    out.update(item)
+                else:
+                    out.setdefault("tenants", {})[str(fonte).split("@", 1)[1]] = item
+            return out
+
+        try:
+            watermark = await asyncio.to_thread(_read)
+        except Exception as e:
+            watermark = {"error": str(e)}
+        return {
+            "enabled": _state["task"] is not None,
+            "watermark": watermark,
+            "last_tick": _state["last_tick"],
+            "last_rows": _state["last_rows"],
+            "last_updated": _state["last_updated"],
+            "last_error": _state["last_error"],
+            "last_failures": _state["last_failures"],
+        }
+
+    return _sync_tick
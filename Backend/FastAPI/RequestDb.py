@@ -0,0 +1,109 @@
+from fastapi import FastAPI, Request
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Optional
+import threading
+
+
+_checkouts: ContextVar[Optional[Dict[str, int]]] = ContextVar("db_checkouts", default=None)
+
+
+def count_checkout() -> None:
+    """Chamado a cada conexão retirada de um pool; soma no contador da requisição atual."""
+    counter = _checkouts.get()
+    if counter is not None:
+        counter["n"] += 1
+
+
+class RequestDb:
+    """Conexões de uma requisição, abertas sob demanda e devolvidas ao fim dela.
+
+    `conn` é a conexão do tenant do header X-Tenant e `central` a do banco central (a
+    mesma conexão quando o tenant é o captar). Os helpers recebem este objeto em vez de
+    abrir conexões próprias. Commit ou rollback acontecem no fim da requisição, salvo
+    commits explícitos do handler.
+    """
+
+    def __init__(self, get_db_connection: Callable[..., Any], dsn: Optional[str]):
+        self._get_db_connection = get_db_connection
+        self.dsn = dsn
+        self._stack = ExitStack()
+        self._conns: Dict[str, Any] = {}
+
+    def _open(self, dsn: Optional[str]):
+        key = str(dsn or "")
+        conn = self._conns.get(key)
+        if conn is None:
+            conn = self._stack.enter_context(self._get_db_connection(dsn))
+            self._conns[key] = conn
+        return conn
+
+    @property
+    def conn(self):
+        return self._open(self.dsn)
+
+    @property
+    def central(self):
+        return self._open(None)
+
+    @contextmanager
+    def connection(self, central: bool = False):
+        """Substitui `with get_conn_for_request(request) as conn` sem nova retirada do pool."""
+        yield self.central if central else self.conn
+
+    def close(self, exc: Optional[BaseException] = None) -> None:
+        if exc is None:
+            self._stack.close()
+        else:
+            self._stack.__exit__(type(exc), exc, exc.__traceback__)
+
+
+class CheckoutStats:
+    def __init__(self, max_paths: int = 200):
+        self.max_paths = max_paths
+        self._lock = threading.Lock()
+        self._total = {"requests": 0, "checkouts": 0}
+        self._paths: Dict[str, Dict[str, int]] = {}
+
+    def record(self, path: str, n: int) -> None:
+        with self._lock:
+            self._total["requests"] += 1
+            self._total["checkouts"] += n
+            ent = self._paths.get(path)
+            if ent is None:
+                if len(self._paths) >= self.max_paths:
+                    return
+                ent = self._paths[path] = {"requests": 0, "checkouts": 0, "max": 0}
+            ent["requests"] += 1
+            ent["checkouts"] += n
+            ent["max"] = max(ent["max"], n)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            paths = sorted(self._paths.items(), key=lambda kv: kv[1]["checkouts"], reverse=True)
+            return {
+                **self._total,
+                "paths": [
+                    {"path": p, **v, "avg": round(v["checkouts"] / v["requests"], 2) if v["requests"] else 0}
+                    for p, v in paths
+                ],
+            }
+
+
+def register_request_db(app: FastAPI, stats: CheckoutStats):
+    @app.middleware("http")
+    async def count_db_checkouts(request: Request, call_next):
+        counter = {"n": 0}
+        token = _checkouts.set(counter)
+        try:
+            response = await call_next(request)
+        finally:
+            _checkouts.reset(token)
+        route = request.scope.get("route")
+        stats.record(getattr(route, "path", None) or request.url.path, counter["n"])
+        response.headers["X-DB-Checkouts"] = str(counter["n"])
+        return response
+
+    @app.get("/api/admin/db-checkouts")
+    async def admin_db_checkouts():
+        return stats.snapshot()
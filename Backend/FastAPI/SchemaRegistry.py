@@ -0,0 +1,129 @@
+from fastapi import Request
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import os
+import time
+import threading
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(str(os.getenv(name, "") or "").strip() or default)
+    except Exception:
+        return default
+
+
+class SchemaRegistry:
+    """Registro dos blocos de DDL já aplicados em cada banco.
+
+    Cada bloco (`name`, `version`) roda uma única vez por DSN: a primeira chamada do
+    processo consulta "SchemaVersoes" sob um advisory lock e só executa `apply(cur)` se a
+    versão gravada for menor; as seguintes só consultam um dicionário em memória. Em caso
+    de falha o bloco é tentado de novo após SCHEMA_RETRY_SECONDS, sem repetir o DDL a cada
+    requisição. Subir `version` força a reaplicação no próximo deploy.
+    """
+
+    def __init__(self, get_db_connection: Callable[..., Any], db_schema: str, dsn_for_request: Optional[Callable[[Request], Optional[str]]] = None):
+        self._get_db_connection = get_db_connection
+        self._schema = str(db_schema or "captar").replace('"', '""')
+        self._dsn_for_request = dsn_for_request or (lambda request: None)
+        self.retry = max(1.0, _env_float("SCHEMA_RETRY_SECONDS", 30.0))
+        self._lock = threading.Lock()
+        self._locks: Dict[Tuple[str, str], threading.Lock] = {}
+        self._done: Dict[Tuple[str, str], int] = {}
+        self._failed: Dict[Tuple[str, str], Tuple[float, str]] = {}
+
+    def _key_lock(self, key: Tuple[str, str]) -> threading.Lock:
+        with self._lock:
+            lock = self._locks.get(key)
+            if lock is None:
+                lock = self._locks[key] = threading.Lock()
+            return lock
+
+    def _pending(self, key: Tuple[str, str], version: int) -> bool:
+        if self._done.get(key, 0) >= version:
+            return False
+        failed = self._failed.get(key)
+        return failed is None or time.monotonic() - failed[0] >= self.retry
+
+    def ensure(self, name: str, apply: Callable[[Any], None], dsn: Optional[str] = None, version: int = 1, cursor=None) -> bool:
+        """Aplica o bloco `name` no banco `dsn` se ainda não foi aplicado nesta versão.
+
+        Com `cursor` o DDL roda (e é commitado) na conexão do chamador, que deve estar sem
+        alterações pendentes; sem ele uma conexão própria é aberta. Retorna True se o
+        bloco está aplicado."""
+        key = (str(dsn or ""), str(name))
+        if not self._pending(key, version):
+            return self._done.get(key, 0) >= version
+        with self._key_lock(key):
+            if not self._pending(key, version):
+                return self._done.get(key, 0) >= version
+            try:
+                if cursor is not None:
+                    self._apply(cursor, name, version, apply)
+                else:
+                    with self._get_db_connection(dsn) as conn:
+                        self._apply(conn.cursor(), name, version, apply)
+            except Exception as e:
+                self._failed[key] = (time.monotonic(), str(e))
+                print(f"Schema registry: falha ao aplicar {name}: {e}")
+                return False
+            self._done[key] = int(version)
+            self._failed.pop(key, None)
+            return True
+
+    def _apply(self, cur, name: str, version: int, apply: Callable[[Any], None]) -> None:
+        conn = cur.connection
+        try:
+            cur.execute(
+                f"""
+                CREATE TABLE IF NOT EXISTS "{self._schema}"."SchemaVersoes" (
+                    "Nome" TEXT PRIMARY KEY,
+                    "Versao" INT NOT NULL,
+                    "AplicadoEm" TIMESTAMP DEFAULT (NOW() AT TIME ZONE 'UTC')
+                )
+                """
+            )
+            cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (f"schema:{self._schema}:{name}",))
+            cur.execute(f'SELECT "Versao" FROM "{self._schema}"."SchemaVersoes" WHERE "Nome" = %s', (name,))
+            row = cur.fetchone()
+            if not row or int(row[0] or 0) < int(version):
+                apply(cur)
+                cur.execute(
+                    f"""
+                    INSERT INTO "{self._schema}"."SchemaVersoes" ("Nome", "Versao", "AplicadoEm")
+                    VALUES (%s, %s, NOW() AT TIME ZONE 'UTC')
+                    ON CONFLICT ("Nome") DO UPDATE
+                    SET "Versao" = EXCLUDED."Versao", "AplicadoEm" = EXCLUDED."AplicadoEm"
+                    """,
+                    (name, int(version)),
+                )
+            conn.commit()
+        except Exception:
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+            raise
+
+    def ensure_for_request(self, request: Optional[Request], name: str, apply: Callable[[Any], None], version: int = 1, cursor=None) -> bool:
+        dsn = self._dsn_for_request(request) if request is not None else None
+        return self.ensure(name, apply, dsn=dsn, version=version, cursor=cursor)
+
+    def reset(self, dsn: Optional[str] = None) -> None:
+        with self._lock:
+            for key in list(self._done):
+                if dsn is None or key[0] == str(dsn or ""):
+                    self._done.pop(key, None)
+            self._failed.clear()
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        out: List[Dict[str, Any]] = []
+        for key in sorted(set(self._done) | set(self._failed)):
+            failed = self._failed.get(key)
+            out.append({
+                "name": key[1],
+                "central": not key[0],
+                "version": self._done.get(key, 0),
+                "error": failed[1] if failed else None,
+            })
+        return out
@@ -0,0 +1,219 @@
+from fastapi import FastAPI, HTTPException
+from pydantic import BaseModel
+from typing import Any, Callable, Dict, Optional, Tuple
+import os
+import time
+import asyncio
+import threading
+
+
+_TOKEN_BUCKET_LUA = """
+local key = KEYS[1]
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now_ms = tonumber(ARGV[3])
+local requested = tonumber(ARGV[4])
+local max_wait_ms = tonumber(ARGV[5])
+local state = redis.call('HMGET', key, 'tokens', 'ts')
+local tokens = tonumber(state[1])
+local ts = tonumber(state[2])
+if tokens == nil or ts == nil then
+  tokens = burst
+  ts = now_ms
+end
+if now_ms > ts then
+  tokens = math.min(burst, tokens + ((now_ms - ts) / 1000.0) * rate)
+  ts = now_ms
+end
+local wait_ms = 0
+if tokens < requested then
+  wait_ms = math.ceil(((requested - tokens) / rate) * 1000.0)
+end
+local granted = 0
+if max_wait_ms < 0 or wait_ms <= max_wait_ms then
+  tokens = tokens - requested
+  granted = 1
+end
+redis.call('HSET', key, 'tokens', tostring(tokens), 'ts', tostring(ts))
+redis.call('PEXPIRE', key, math.ceil((burst / rate) * 1000.0) + 60000)
+return {granted, wait_ms, tostring(tokens)}
+"""
+
+_DEFAULT_LIMITS: Dict[str, Tuple[float, float]] = {
+    "evolution": (1.0, 5.0),
+    "meta": (80.0, 80.0),
+    "twilio": (10.0, 20.0),
+}
+
+
+class SendRateLimitIn(BaseModel):
+    rate: float
+    burst: Optional[float] = None
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(str(os.getenv(name, "") or "").strip() or default)
+    except Exception:
+        return default
+
+
+class SendRateLimiter:
+    """Token bucket por remetente (instância, phone_number_id, número Twilio) no Redis.
+
+    `acquire` reserva os tokens numa thread (HGETALL da config + EVALSHA do script) e
+    dorme o tempo devolvido. Por padrão recusa com 429 se a espera passar de
+    SEND_RATE_MAX_WAIT_SECONDS, o que serve para envios interativos; lote e disparo
+    de campanha chamam com `capped=False` e simplesmente esperam a vez, porque reservam
+    um destinatário por vez. Com os padrões da Evolution (1/s, burst 5) um lote de N
+    mensagens numa instância leva cerca de N - 5 segundos.
+    """
+
+    def __init__(self, get_redis_client: Callable[[], Any]):
+        self._get_redis_client = get_redis_client
+        self._script = None
+        self._script_client = None
+        self._local: Dict[str, Tuple[float, float]] = {}
+        self._local_lock = threading.Lock()
+        self._max_wait = _env_float("SEND_RATE_MAX_WAIT_SECONDS", 120.0)
+
+    @staticmethod
+    def _bucket_key(provider: str, sender: str) -> str:
+        return f"ratelimit:send:{str(provider).lower()}:{str(sender or '').strip() or 'default'}"
+
+    @staticmethod
+    def _config_key(provider: str, sender: str) -> str:
+        return f"ratelimit:config:{str(provider).lower()}:{str(sender or '').strip() or 'default'}"
+
+    def _redis(self):
+        try:
+            return self._get_redis_client()
+        except Exception:
+            return None
+
+    def limits(self, provider: str, sender: str) -> Tuple[float, float]:
+        p = str(provider or "").strip().lower()
+        rate, burst = _DEFAULT_LIMITS.get(p, (1.0, 1.0))
+        rate = _env_float(f"SEND_RATE_{p.upper()}_PER_SEC", rate)
+        burst = _env_float(f"SEND_RATE_{p.upper()}_BURST", burst)
+        rc = self._redis()
+        if rc:
+            try:
+                cfg = rc.hgetall(self._config_key(p, sender)) or {}
+                if cfg.get("rate"):
+                    rate = float(cfg["rate"])
+                if cfg.get("burst"):
+                    burst = float(cfg["burst"])
+            except Exception:
+                pass
+        rate = max(0.001, float(rate))
+        burst = max(1.0, float(burst))
+        return rate, burst
+
+    def set_limits(self, provider: str, sender: str, rate: float, burst: Optional[float]) -> None:
+        rc = self._redis()
+        if not rc:
+            raise HTTPException(status_code=503, detail="Redis indisponível para configurar limites de envio.")
+        rc.hset(self._config_key(provider, sender), mapping={"rate": str(float(rate)), "burst": str(float(burst or rate))})
+
+    def _take_local(self, key: str, rate: float, burst: float, requested: float, max_wait_ms: int) -> Tuple[bool, int, float]:
+        now = time.monotonic()
+        with self._local_lock:
+            tokens, ts = self._local.get(key, (burst, now))
+            tokens = min(burst, tokens + max(0.0, now - ts) * rate)
+            wait_ms = 0
+            if tokens < requested:
+                wait_ms = int(((requested - tokens) / rate) * 1000.0 + 0.999)
+            granted = max_wait_ms < 0 or wait_ms <= max_wait_ms
+            if granted:
+                tokens -= requested
+            self._local[key] = (tokens, now)
+        return granted, wait_ms, tokens
+
+    def reserve(self, provider: str, sender: str, tokens: float = 1.0, max_wait: Optional[float] = None) -> Tuple[bool, float, float]:
+        rate, burst = self.limits(provider, sender)
+        key = self._bucket_key(provider, sender)
+        max_wait_ms = -1 if max_wait is None else int(max(0.0, max_wait) * 1000)
+        rc = self._redis()
+        if rc:
+            try:
+                if self._script is None or self._script_client is not rc:
+                    self._script = rc.register_script(_TOKEN_BUCKET_LUA)
+                    self._script_client = rc
+                granted, wait_ms, remaining = self._script(
+                    keys=[key],
+                    args=[rate, burst, int(time.time() * 1000), float(tokens), max_wait_ms],
+                )
+                return bool(int(granted)), int(wait_ms) / 1000.0, float(remaining)
+            except Exception:
+                pass
+        granted, wait_ms, remaining = self._take_local(key, rate, burst, float(tokens), max_wait_ms)
+        return granted, wait_ms / 1000.0, remaining
+
+    async def acquire(self, provider: str, sender: str, tokens: float = 1.0, capped: bool = True) -> float:
+        max_wait = self._max_wait if capped else None
+        granted, wait, _remaining = await asyncio.to_thread(self.reserve, provider, sender, tokens, max_wait)
+        if not granted:
+            raise HTTPException(
+                status_code=429,
+                detail=f"Limite de envio atingido para {provider}:{sender}. Tente novamente em {int(wait) + 1}s.",
+            )
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+    def capacity(self, provider: str, sender: str) -> Dict[str, Any]:
+        rate, burst = self.limits(provider, sender)
+        key = self._bucket_key(provider, sender)
+        tokens = None
+        ts_ms = None
+        rc = self._redis()
+        if rc:
+            try:
+                state = rc.hmget(key, "tokens", "ts")
+                if state and state[0] is not None:
+                    tokens = float(state[0])
+                    ts_ms = float(state[1] or 0)
+            except Exception:
+                tokens = None
+        if tokens is not None and ts_ms is not None:
+            elapsed = max(0.0, time.time() - ts_ms / 1000.0)
+            tokens = min(burst, tokens + elapsed * rate)
+        else:
+            with self._local_lock:
+                ent = self._local.get(key)
+            if ent:
+                tokens = min(burst, ent[0] + max(0.0, time.monotonic() - ent[1]) * rate)
+            else:
+                tokens = burst
+        return {
+            "provider": provider,
+            "sender": sender,
+            "rate_per_sec": rate,
+            "burst": burst,
+            "remaining": round(tokens, 3),
+            "wait_seconds": round(max(0.0, (1.0 - tokens) / rate), 3),
+        }
+
+
+def register_send_rate_limit_routes(app: FastAPI, rate_limiter: SendRateLimiter):
+    @app.get("/api/integracoes/rate-limit/{provider}/{sender}")
+    async def send_rate_limit_get(provider: str, sender: str):
+        try:
+            return await asyncio.to_thread(rate_limiter.capacity, provider, sender)
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+
+    @app.put("/api/integracoes/rate-limit/{provider}/{sender}")
+    async def send_rate_limit_put(provider: str, sender: str, body: SendRateLimitIn):
+        try:
+            if body.rate <= 0:
+                raise HTTPException(status_code=400, detail="rate deve ser maior que zero.")
+            await asyncio.to_thread(rate_limiter.set_limits, provider, sender, body.rate, body.burst)
+            return await asyncio.to_thread(rate_limiter.capacity, provider, sender)
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,145 @@
+from fastapi import Request
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import os
+import time
+import threading
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(str(os.getenv(name, "") or "").strip() or default)
+    except Exception:
+        return default
+
+
+def phone_key(raw: Any) -> str:
+    """Chave normalizada de telefone: remove o 9º dígito de celulares BR e usa os últimos
+    10 dígitos, de modo que 5592991234567, 92991234567 e 559291234567 caem na mesma chave."""
+    d = "".join([c for c in str(raw or "") if c.isdigit()])
+    if len(d) == 13 and d.startswith("55") and d[4] == "9":
+        d = d[:4] + d[5:]
+    elif len(d) == 11 and d[2] == "9":
+        d = d[:2] + d[3:]
+    return d[-10:]
+
+
+def phone_key_sql(expr: str) -> str:
+    """Expressão SQL equivalente a `phone_key` aplicada a `expr` (coluna ou expressão de texto)."""
+    d = f"REGEXP_REPLACE(COALESCE(({expr})::text, ''), '[^0-9]', '', 'g')"
+    return (
+        f"RIGHT(CASE"
+        f" WHEN LENGTH({d}) = 13 AND LEFT({d}, 2) = '55' AND SUBSTRING({d}, 5, 1) = '9'"
+        f" THEN LEFT({d}, 4) || SUBSTRING({d}, 6)"
+        f" WHEN LENGTH({d}) = 11 AND SUBSTRING({d}, 3, 1) = '9'"
+        f" THEN LEFT({d}, 2) || SUBSTRING({d}, 4)"
+        f" ELSE {d} END, 10)"
+    )
+
+
+class SimNaoIndex:
+    """Índice em memória, por tenant, dos destinatários de campanhas SIM_NAO ativas.
+
+    Cada chave de telefone aponta para o último disparo OUT de cada campanha. O índice é
+    carregado por completo na primeira consulta (e a cada PHONE_INDEX_TTL_SECONDS), e
+    recebe incrementos por "IdDisparo" a cada PHONE_INDEX_REFRESH_SECONDS; alterações de
+    campanha chamam `invalidate`.
+    """
+
+    def __init__(self, db_schema: str, dsn_for_request: Callable[[Request], Optional[str]]):
+        self._schema = str(db_schema or "captar").replace('"', '""')
+        self._dsn_for_request = dsn_for_request
+        self.ttl = max(30.0, _env_float("PHONE_INDEX_TTL_SECONDS", 600.0))
+        self.refresh = max(0.0, _env_float("PHONE_INDEX_REFRESH_SECONDS", 1.0))
+        self.overlap = int(max(0.0, _env_float("PHONE_INDEX_OVERLAP_IDS", 500)))
+        self._lock = threading.Lock()
+        self._tenants: Dict[Tuple[str, int], Dict[str, Any]] = {}
+
+    def _fetch(self, cursor, tid: int, after_id: int) -> List[Tuple[Any, ...]]:
+        cursor.execute(
+            f"""
+            SELECT d."IdDisparo", d."Numero", d."IdCampanha",
+                   COALESCE(d."EvolutionInstance", '') = 'META' AS is_meta,
+                   d."DataHora"
+            FROM "{self._schema}"."Disparos" d
+            JOIN "{self._schema}"."Campanhas" c
+              ON c."IdTenant" = d."IdTenant"
+             AND c."IdCampanha" = d."IdCampanha"
+            WHERE d."IdTenant" = %s
+              AND d."IdDisparo" > %s
+              AND d."Canal" = 'WHATSAPP'
+              AND d."Direcao" = 'OUT'
+              AND d."Status" IN ('ENVIADO','ENTREGUE','VISUALIZADO')
+              AND d."IdCampanha" IS NOT NULL
+              AND COALESCE(c."Status", TRUE)
+              AND COALESCE(c."AnexoJSON"->'config'->>'response_mode', '') = 'SIM_NAO'
+            """,
+            (int(tid), int(after_id)),
+        )
+        return cursor.fetchall() or []
+
+    @staticmethod
+    def _add_rows(state: Dict[str, Any], rows: List[Tuple[Any, ...]]) -> None:
+        keys: Dict[str, Dict[int, Tuple[Any, ...]]] = state["keys"]
+        for id_disparo, numero, campanha_id, is_meta, datahora in rows:
+            key = phone_key(numero)
+            if not key or campanha_id is None:
+                continue
+            entry = (int(id_disparo), str(numero or ""), int(campanha_id), bool(is_meta), datahora or datetime.min)
+            by_campanha = keys.setdefault(key, {})
+            prev = by_campanha.get(entry[2])
+            if prev is None or (entry[4], entry[0]) > (prev[4], prev[0]):
+                by_campanha[entry[2]] = entry
+            if entry[0] > state["max_id"]:
+                state["max_id"] = entry[0]
+
+    def _state(self, cursor, dsn: Optional[str], tid: int) -> Dict[str, Any]:
+        tkey = (str(dsn or ""), int(tid))
+        now = time.monotonic()
+        with self._lock:
+            state = self._tenants.get(tkey)
+        if state is None or now - state["loaded"] >= self.ttl:
+            fresh = {"keys": {}, "max_id": 0, "loaded": now, "checked": now}
+            self._add_rows(fresh, self._fetch(cursor, tid, 0))
+            with self._lock:
+                self._tenants[tkey] = fresh
+            return fresh
+        if now - state["checked"] >= self.refresh:
+            rows = self._fetch(cursor, tid, max(0, state["max_id"] - self.overlap))
+            with self._lock:
+                self._add_rows(state, rows)
+                state["checked"] = now
+        return state
+
+    def lookup(self, cursor, dsn: Optional[str], tid: int, numero: Any, meta_only: bool = False) -> List[Tuple[int, str, int]]:
+        """Candidatos (IdDisparo, Numero, IdCampanha) para a resposta, do envio mais recente ao mais antigo."""
+        key = phone_key(numero)
+        if not key:
+            return []
+        state = self._state(cursor, dsn, tid)
+        with self._lock:
+            entries = list((state["keys"].get(key) or {}).values())
+        if meta_only:
+            entries = [e for e in entries if e[3]]
+        entries.sort(key=lambda e: (e[4], e[0]), reverse=True)
+        return [(e[0], e[1], e[2]) for e in entries]
+
+    def lookup_for_request(self, request: Request, cursor, tid: int, numero: Any, meta_only: bool = False) -> List[Tuple[int, str, int]]:
+        return self.lookup(cursor, self._dsn_for_request(request), tid, numero, meta_only=meta_only)
+
+    def invalidate(self, dsn: Optional[str] = None, tid: Optional[int] = None) -> None:
+        with self._lock:
+            for tkey in list(self._tenants):
+                if tkey[0] == str(dsn or "") and (tid is None or tkey[1] == int(tid)):
+                    self._tenants.pop(tkey, None)
+
+    def invalidate_for_request(self, request: Request, tid: Optional[int] = None) -> None:
+        self.invalidate(self._dsn_for_request(request), tid)
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        now = time.monotonic()
+        with self._lock:
+            return [
+                {"tenant": k[1], "central": not k[0], "phones": len(v["keys"]), "max_id": v["max_id"], "age_s": round(now - v["loaded"], 1)}
+                for k, v in self._tenants.items()
+            ]
@@ -0,0 +1,140 @@
+from fastapi import FastAPI
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+import os
+import time
+import threading
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(str(os.getenv(name, "") or "").strip() or default)
+    except Exception:
+        return default
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(str(os.getenv(name, "") or "").strip() or default)
+    except Exception:
+        return default
+
+
+class TenantFanout:
+    """Executa a mesma consulta em vários tenants em paralelo, com prazo.
+
+    As tarefas rodam num `ThreadPoolExecutor` compartilhado (TENANT_FANOUT_WORKERS) e todas
+    têm o mesmo prazo, TENANT_FANOUT_TIMEOUT_SECONDS a partir do início do `run`. Quem não
+    responde a tempo fica de fora do resultado e entra em `timeout`; exceções entram em
+    `erros`. Um tenant que falhou é pulado por TENANT_FANOUT_COOLDOWN_SECONDS para não
+    prender workers a cada requisição. Tarefas que nem chegaram a começar (pool ocupado
+    até o prazo) entram em `nao_iniciados`, sem cooldown: o tenant não teve culpa.
+    `statement_timeout` limita as consultas também no banco.
+    """
+
+    def __init__(self, max_workers: Optional[int] = None, timeout: Optional[float] = None):
+        self.max_workers = max(1, int(max_workers or _env_int("TENANT_FANOUT_WORKERS", 16)))
+        self.timeout = max(0.1, float(timeout or _env_float("TENANT_FANOUT_TIMEOUT_SECONDS", 5.0)))
+        self.cooldown = max(0.0, _env_float("TENANT_FANOUT_COOLDOWN_SECONDS", 30.0))
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._failed: Dict[str, float] = {}
+        self._stats: Dict[str, int] = {"execucoes": 0, "tarefas": 0, "timeouts": 0, "nao_iniciados": 0, "erros": 0, "ignorados": 0}
+
+    def _pool(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="tenant-fanout")
+        return self._executor
+
+    def statement_timeout(self, cur) -> None:
+        """SET LOCAL statement_timeout com o prazo do fan-out na transação de `cur`."""
+        try:
+            cur.execute(f"SET LOCAL statement_timeout = {int(self.timeout * 1000)}")
+        except Exception:
+            pass
+
+    def _mark(self, key: str, ok: bool) -> None:
+        with self._lock:
+            if ok:
+                self._failed.pop(key, None)
+            else:
+                self._failed[key] = time.monotonic()
+
+    def run(self, items: Sequence[Any], fn: Callable[[Any], Any], key: Callable[[Any], str] = str) -> Tuple[List[Tuple[Any, Any]], Dict[str, Any]]:
+        """[(item, fn(item))] dos itens que responderam no prazo, na ordem de `items`, e o relatório."""
+        started = time.monotonic()
+        deadline = started + self.timeout
+        report: Dict[str, Any] = {"ok": [], "timeout": [], "nao_iniciados": [], "erros": {}, "ignorados": []}
+        futures: Dict[Any, Tuple[int, Any, str]] = {}
+        pool = self._pool()
+        for i, item in enumerate(items):
+            k = key(item)
+            failed_at = self._failed.get(k)
+            if failed_at is not None and started - failed_at < self.cooldown:
+                report["ignorados"].append(k)
+                continue
+            futures[pool.submit(fn, item)] = (i, item, k)
+        done_by_index: Dict[int, Tuple[Any, Any]] = {}
+        pending = set(futures)
+        while pending:
+            left = deadline - time.monotonic()
+            if left <= 0:
+                break
+            done, pending = wait(pending, timeout=left, return_when=FIRST_COMPLETED)
+            for fut in done:
+                i, item, k = futures[fut]
+                try:
+                    done_by_index[i] = (item, fut.result())
+                    report["ok"].append(k)
+                    self._mark(k, True)
+                except Exception as e:
+                    report["erros"][k] = str(e)
+                    self._mark(k, False)
+        for fut in pending:
+            k = futures[fut][2]
+            if fut.cancel():
+                report["nao_iniciados"].append(k)
+                continue
+            report["timeout"].append(k)
+            self._mark(k, False)
+        with self._lock:
+            self._stats["execucoes"] += 1
+            self._stats["tarefas"] += len(futures)
+            self._stats["timeouts"] += len(report["timeout"])
+            self._stats["nao_iniciados"] += len(report["nao_iniciados"])
+            self._stats["erros"] += len(report["erros"])
+            self._stats["ignorados"] += len(report["ignorados"])
+        report["parcial"] = bool(report["timeout"] or report["nao_iniciados"] or report["erros"] or report["ignorados"])
+        report["ms"] = round((time.monotonic() - started) * 1000.0, 1)
+        return [done_by_index[i] for i in sorted(done_by_index)], report
+
+    def shutdown(self) -> None:
+        with self._lock:
+            ex, self._executor = self._executor, None
+        if ex is not None:
+            ex.shutdown(wait=False, cancel_futures=True)
+
+    def snapshot(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            em_espera = sorted(k for k, t in self._failed.items() if now - t < self.cooldown)
+            stats = dict(self._stats)
+        return {
+            "workers": self.max_workers,
+            "timeout_s": self.timeout,
+            "cooldown_s": self.cooldown,
+            "em_espera": em_espera,
+            "stats": stats,
+        }
+
+
+def register_tenant_fanout(app: FastAPI, fanout: TenantFanout):
+    @app.on_event("shutdown")
+    async def stop_tenant_fanout():
+        fanout.shutdown()
+
+    @app.get("/api/admin/tenant-fanout")
+    async def admin_tenant_fanout():
+        return fanout.snapshot()
@@ -0,0 +1,203 @@
+from fastapi import Request
+from typing import Any, Callable, Dict, NamedTuple, Optional, Tuple
+import os
+import json
+import time
+import threading
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(str(os.getenv(name, "") or "").strip() or default)
+    except Exception:
+        return default
+
+
+class TenantContext(NamedTuple):
+    id: int
+    slug: str
+    nome: str
+    dsn: Optional[str]
+
+
+class TenantResolver:
+    """Resolução única de tenant (id, slug, nome, DSN) a partir do slug.
+
+    Ordem de consulta: cache em memória (TENANT_CACHE_TTL_SECONDS), Redis
+    (`tenant:ctx:<slug>`, DSN cifrado com DSN_SECRET_KEY quando definida) e, por fim, uma
+    única consulta ao banco central. Slugs inexistentes também ficam em cache por um
+    tempo menor. `invalidate` apaga a entrada no Redis e publica em `tenant:invalidate`;
+    cada processo escuta o canal e descarta a própria cópia.
+    """
+
+    CHANNEL = "tenant:invalidate"
+
+    def __init__(self, get_db_connection: Callable[..., Any], db_schema: str, get_redis_client: Callable[[], Any]):
+        self._get_db_connection = get_db_connection
+        self._schema = str(db_schema or "captar").replace('"', '""')
+        self._get_redis_client = get_redis_client
+        self.ttl = max(1, _env_int("TENANT_CACHE_TTL_SECONDS", 300))
+        self.missing_ttl = max(1, _env_int("TENANT_CACHE_MISSING_TTL_SECONDS", 30))
+        self._lock = threading.Lock()
+        self._cache: Dict[str, Tuple[Optional[TenantContext], float]] = {}
+        self._listener: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._stats: Dict[str, int] = {"memoria": 0, "redis": 0, "banco": 0, "invalidacoes": 0}
+
+    @staticmethod
+    def _fernet():
+        key = os.getenv("DSN_SECRET_KEY", "")
+        if not key:
+            return None
+        try:
+            from cryptography.fernet import Fernet
+            return Fernet(key.encode())
+        except Exception:
+            return None
+
+    def _encode(self, ctx: TenantContext) -> str:
+        dsn = ctx.dsn
+        f = self._fernet()
+        if dsn and f is not None:
+            dsn = "enc:" + f.encrypt(dsn.encode()).decode()
+        return json.dumps({"id": ctx.id, "slug": ctx.slug, "nome": ctx.nome, "dsn": dsn})
+
+    def _decode(self, raw: str) -> Optional[TenantContext]:
+        try:
+            d = json.loads(raw)
+            dsn = d.get("dsn") or None
+            if dsn and str(dsn).startswith("enc:"):
+                f = self._fernet()
+                if f is None:
+                    return None
+                dsn = f.decrypt(str(dsn)[4:].encode()).decode()
+            return TenantContext(int(d["id"]), str(d["slug"]), str(d.get("nome") or ""), dsn)
+        except Exception:
+            return None
+
+    def _redis(self):
+        try:
+            return self._get_redis_client()
+        except Exception:
+            return None
+
+    def _load(self, slug: str) -> Optional[TenantContext]:
+        rc = self._redis()
+        if rc is not None:
+            try:
+                raw = rc.get(f"tenant:ctx:{slug}")
+                ctx = self._decode(raw) if raw else None
+                if ctx is not None:
+                    self._stats["redis"] += 1
+                    return ctx
+            except Exception:
+                pass
+        with self._get_db_connection() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                f'SELECT "IdTenant", "Slug", "Nome", "Dsn" FROM "{self._schema}"."Tenant" WHERE LOWER("Slug") = %s LIMIT 1',
+                (slug,),
+            )
+            row = cur.fetchone()
+        self._stats["banco"] += 1
+        if not row:
+            return None
+        ctx = TenantContext(int(row[0]), str(row[1] or slug), str(row[2] or ""), str(row[3]) if row[3] else None)
+        if rc is not None:
+            try:
+                rc.setex(f"tenant:ctx:{slug}", self.ttl, self._encode(ctx))
+            except Exception:
+                pass
+        return ctx
+
+    def cached(self, slug: Any) -> Tuple[bool, Optional[TenantContext]]:
+        """(True, ctx) quando o slug está no cache em memória; não faz I/O."""
+        s = str(slug or "captar").strip().lower() or "captar"
+        ent = self._cache.get(s)
+        if ent is not None and ent[1] > time.monotonic():
+            self._stats["memoria"] += 1
+            return True, ent[0]
+        return False, None
+
+    def resolve(self, slug: Any) -> Optional[TenantContext]:
+        s = str(slug or "captar").strip().lower() or "captar"
+        hit, ctx = self.cached(s)
+        if hit:
+            return ctx
+        self._ensure_listener()
+        try:
+            ctx = self._load(s)
+        except Exception as e:
+            print(f"Tenant resolver: falha ao resolver {s}: {e}")
+            return None
+        with self._lock:
+            self._cache[s] = (ctx, time.monotonic() + (self.ttl if ctx is not None else self.missing_ttl))
+        return ctx
+
+    def for_request(self, request: Optional[Request]) -> Optional[TenantContext]:
+        return self.resolve((request and request.headers.get("X-Tenant")) or "captar")
+
+    def _drop_local(self, slug: Optional[str]) -> None:
+        with self._lock:
+            if not slug or slug == "*":
+                self._cache.clear()
+            else:
+                self._cache.pop(str(slug).lower(), None)
+
+    def invalidate(self, slug: Optional[str] = None) -> None:
+        """Descarta o tenant `slug` (ou todos) aqui, no Redis e nos demais processos."""
+        s = str(slug or "").strip().lower() or "*"
+        self._stats["invalidacoes"] += 1
+        self._drop_local(s)
+        rc = self._redis()
+        if rc is None:
+            return
+        try:
+            if s == "*":
+                for k in rc.scan_iter("tenant:ctx:*"):
+                    rc.delete(k)
+            else:
+                rc.delete(f"tenant:ctx:{s}")
+            rc.publish(self.CHANNEL, s)
+        except Exception as e:
+            print(f"Tenant resolver: falha ao publicar invalidação: {e}")
+
+    def _listen(self) -> None:
+        while not self._stop.is_set():
+            rc = self._redis()
+            if rc is None:
+                self._stop.wait(5)
+                continue
+            try:
+                ps = rc.pubsub(ignore_subscribe_messages=True)
+                ps.subscribe(self.CHANNEL)
+                # Mensagens perdidas enquanto desconectado: recomeça com cache vazio.
+                self._drop_local("*")
+                while not self._stop.is_set():
+                    msg = ps.get_message(timeout=1.0)
+                    if msg and msg.get("type") == "message":
+                        self._drop_local(str(msg.get("data") or "*"))
+            except Exception:
+                self._stop.wait(5)
+
+    def _ensure_listener(self) -> None:
+        if self._listener is not None or self._redis() is None:
+            return
+        with self._lock:
+            if self._listener is None:
+                self._listener = threading.Thread(target=self._listen, name="tenant-resolver", daemon=True)
+                self._listener.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def snapshot(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            ativos = sum(1 for _ctx, exp in self._cache.values() if exp > now)
+        return {
+            "ttl_s": self.ttl,
+            "tenants": ativos,
+            "listener": bool(self._listener and self._listener.is_alive()),
+            "stats": dict(self._stats),
+        }
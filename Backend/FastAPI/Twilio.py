@@ -1,7 +1,7 @@
 from fastapi import FastAPI, HTTPException, Request, UploadFile, File
 from fastapi.responses import Response
 from pydantic import BaseModel
-from typing import Optional, Any, Callable
+from typing import Optional, Any, Callable, List
 import base64
 import json
 import ssl
@@ -9,11 +9,32 @@ import urllib.request
 from urllib.error import HTTPError, URLError
 from urllib.parse import urlparse
 import os
+import asyncio
 from datetime import datetime
 import re
 import unicodedata
 import ipaddress
 
+try:
+    from .DisparosMessageIds import disparos_by_message_ids_sql
+except ImportError:
+    from DisparosMessageIds import disparos_by_message_ids_sql
+
+try:
+    from .SimNaoIndex import SimNaoIndex
+except ImportError:
+    from SimNaoIndex import SimNaoIndex
+
+try:
+    from .SchemaRegistry import SchemaRegistry
+except ImportError:
+    from SchemaRegistry import SchemaRegistry
+
+try:
+    from .CampanhaContatos import record_contato_resposta
+except ImportError:
+    from CampanhaContatos import record_contato_resposta
+
 
 class TwilioConfigIn(BaseModel):
     account_sid: str
@@ -55,8 +76,19 @@ def register_twilio_routes(
     get_conn_for_request: Callable[[Request], Any],
     db_schema: str,
     mask_key: Callable[[str], str],
+    rate_limiter: Optional[Any] = None,
+    disparos_writer: Optional[Any] = None,
+    webhook_queue: Optional[Any] = None,
+    sim_nao_index: Optional[SimNaoIndex] = None,
+    webhook_dedup: Optional[Any] = None,
+    schema_registry: Optional[SchemaRegistry] = None,
+    tenant_resolver: Optional[Any] = None,
 ):
     safe_schema = str(db_schema or "captar").replace('"', '""')
+    if sim_nao_index is None:
+        sim_nao_index = SimNaoIndex(db_schema, lambda request: None)
+    if schema_registry is None:
+        schema_registry = SchemaRegistry(get_db_connection, db_schema)
 
     def _get_fernet():
         try:
@@ -96,70 +128,64 @@ def register_twilio_routes(
                 return ""
         return s
 
+    def _create_twilio_table(cur) -> None:
+        cur.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS "{safe_schema}"."twilio_config" (
+                id SERIAL PRIMARY KEY,
+                tenant_slug TEXT NOT NULL,
+                account_sid TEXT NOT NULL,
+                auth_token TEXT,
+                api_key_sid TEXT,
+                api_key_secret TEXT,
+                messaging_service_sid TEXT,
+                whatsapp_from TEXT,
+                sms_from TEXT,
+                status_callback_url TEXT,
+                inbound_webhook_url TEXT,
+                validate_signature BOOLEAN DEFAULT FALSE,
+                enabled BOOLEAN DEFAULT TRUE,
+                enabled_channels TEXT,
+                created_at TIMESTAMP DEFAULT NOW(),
+                updated_at TIMESTAMP DEFAULT NOW()
+            )
+            """
+        )
+        cur.execute(f'ALTER TABLE "{safe_schema}"."twilio_config" ADD COLUMN IF NOT EXISTS auth_token TEXT')
+        cur.execute(f'ALTER TABLE "{safe_schema}"."twilio_config" ADD COLUMN IF NOT EXISTS api_key_sid TEXT')
+        cur.execute(f'ALTER TABLE "{safe_schema}"."twilio_config" ADD COLUMN IF NOT EXISTS api_key_secret TEXT')
+        cur.execute(f'ALTER TABLE "{safe_schema}"."twilio_config" ADD COLUMN IF NOT EXISTS status_callback_url TEXT')
+        cur.execute(f'ALTER TABLE "{safe_schema}"."twilio_config" ADD COLUMN IF NOT EXISTS inbound_webhook_url TEXT')
+        cur.execute(f'ALTER TABLE "{safe_schema}"."twilio_config" ADD COLUMN IF NOT EXISTS validate_signature BOOLEAN DEFAULT FALSE')
+        cur.execute(f'ALTER TABLE "{safe_schema}"."twilio_config" ADD COLUMN IF NOT EXISTS enabled_channels TEXT')
+        cur.execute(
+            f'CREATE INDEX IF NOT EXISTS "idx_twilio_config_tenant" ON "{safe_schema}"."twilio_config"(tenant_slug)'
+        )
+
+    def _create_twilio_optin_table(cur) -> None:
+        cur.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS "{safe_schema}"."whatsapp_optin" (
+                id SERIAL PRIMARY KEY,
+                "IdTenant" INT NOT NULL,
+                "Numero" TEXT NOT NULL,
+                "Provider" TEXT NOT NULL DEFAULT 'twilio',
+                "Status" TEXT NOT NULL DEFAULT 'OPT_IN',
+                "Source" TEXT,
+                "DataHora" TIMESTAMP DEFAULT (NOW() AT TIME ZONE 'UTC'),
+                UNIQUE("IdTenant","Numero","Provider")
+            )
+            """
+        )
+        cur.execute(
+            f'CREATE INDEX IF NOT EXISTS "idx_whatsapp_optin_tenant_num" ON "{safe_schema}"."whatsapp_optin"("IdTenant","Numero")'
+        )
+
     def ensure_twilio_table():
-        try:
-            with get_db_connection() as conn:
-                cur = conn.cursor()
-                cur.execute(
-                    f"""
-                    CREATE TABLE IF NOT EXISTS "{safe_schema}"."twilio_config" (
-                        id SERIAL PRIMARY KEY,
-                        tenant_slug TEXT NOT NULL,
-                        account_sid TEXT NOT NULL,
-                        auth_token TEXT,
-                        api_key_sid TEXT,
-                        api_key_secret TEXT,
-                        messaging_service_sid TEXT,
-                        whatsapp_from TEXT,
-                        sms_from TEXT,
-                        status_callback_url TEXT,
-                        inbound_webhook_url TEXT,
-                        validate_signature BOOLEAN DEFAULT FALSE,
-                        enabled BOOLEAN DEFAULT TRUE,
-                        enabled_channels TEXT,
-                        created_at TIMESTAMP DEFAULT NOW(),
-                        updated_at TIMESTAMP DEFAULT NOW()
-                    )
-                    """
-                )
-                cur.execute(f'ALTER TABLE "{safe_schema}"."twilio_config" ADD COLUMN IF NOT EXISTS auth_token TEXT')
-                cur.execute(f'ALTER TABLE "{safe_schema}"."twilio_config" ADD COLUMN IF NOT EXISTS api_key_sid TEXT')
-                cur.execute(f'ALTER TABLE "{safe_schema}"."twilio_config" ADD COLUMN IF NOT EXISTS api_key_secret TEXT')
-                cur.execute(f'ALTER TABLE "{safe_schema}"."twilio_config" ADD COLUMN IF NOT EXISTS status_callback_url TEXT')
-                cur.execute(f'ALTER TABLE "{safe_schema}"."twilio_config" ADD COLUMN IF NOT EXISTS inbound_webhook_url TEXT')
-                cur.execute(f'ALTER TABLE "{safe_schema}"."twilio_config" ADD COLUMN IF NOT EXISTS validate_signature BOOLEAN DEFAULT FALSE')
-                cur.execute(f'ALTER TABLE "{safe_schema}"."twilio_config" ADD COLUMN IF NOT EXISTS enabled_channels TEXT')
-                cur.execute(
-                    f'CREATE INDEX IF NOT EXISTS "idx_twilio_config_tenant" ON "{safe_schema}"."twilio_config"(tenant_slug)'
-                )
-                conn.commit()
-        except Exception:
-            pass
+        schema_registry.ensure("twilio:twilio_config", _create_twilio_table)
 
     def ensure_twilio_optin_table():
-        try:
-            with get_db_connection() as conn:
-                cur = conn.cursor()
-                cur.execute(
-                    f"""
-                    CREATE TABLE IF NOT EXISTS "{safe_schema}"."whatsapp_optin" (
-                        id SERIAL PRIMARY KEY,
-                        "IdTenant" INT NOT NULL,
-                        "Numero" TEXT NOT NULL,
-                        "Provider" TEXT NOT NULL DEFAULT 'twilio',
-                        "Status" TEXT NOT NULL DEFAULT 'OPT_IN',
-                        "Source" TEXT,
-                        "DataHora" TIMESTAMP DEFAULT (NOW() AT TIME ZONE 'UTC'),
-                        UNIQUE("IdTenant","Numero","Provider")
-                    )
-                    """
-                )
-                cur.execute(
-                    f'CREATE INDEX IF NOT EXISTS "idx_whatsapp_optin_tenant_num" ON "{safe_schema}"."whatsapp_optin"("IdTenant","Numero")'
-                )
-                conn.commit()
-        except Exception:
-            pass
+        schema_registry.ensure("twilio:whatsapp_optin", _create_twilio_optin_table)
 
     def _tenant_slug(request: Request) -> str:
         try:
@@ -219,7 +245,14 @@ def register_twilio_routes(
         return d
 
     def _tenant_id_from_request(conn, request: Request) -> int:
+        """IdTenant do header X-Tenant; com `tenant_resolver` não usa `conn` (pode ser None)."""
         slug = _tenant_slug(request)
+        if tenant_resolver is not None:
+            ctx = tenant_resolver.resolve(slug)
+            return ctx.id if ctx else 1
+        if conn is None:
+            with get_conn_for_request(request) as conn_t:
+                return _tenant_id_from_request(conn_t, request)
         try:
             cur = conn.cursor()
             cur.execute(f'SELECT "IdTenant" FROM "{safe_schema}"."Tenant" WHERE "Slug" = %s LIMIT 1', (slug,))
@@ -290,51 +323,6 @@ def register_twilio_routes(
         except Exception:
             return None
 
-    def _match_phone(stored: Any, incoming_digits: str) -> bool:
-        def norm_br(d: str) -> str:
-            if not d:
-                return d
-            dd = "".join([c for c in str(d) if c.isdigit()])
-            if len(dd) == 13 and dd.startswith("55") and dd[4] == "9":
-                return dd[:4] + dd[5:]
-            if len(dd) == 11 and dd[2] == "9":
-                return dd[:2] + dd[3:]
-            return dd
-
-        a = _digits_only(stored)
-        b = _digits_only(incoming_digits)
-        if not a or not b:
-            return False
-        if a == b:
-            return True
-        if len(a) >= 10 and b.endswith(a[-10:]):
-            return True
-        if len(b) >= 10 and a.endswith(b[-10:]):
-            return True
-        an = norm_br(a)
-        bn = norm_br(b)
-        if an and bn:
-            if an == bn:
-                return True
-            if len(an) >= 10 and bn.endswith(an[-10:]):
-                return True
-            if len(bn) >= 10 and an.endswith(bn[-10:]):
-                return True
-        return False
-
-    def _safe_json_obj(v: Any) -> Optional[dict]:
-        if v is None:
-            return None
-        if isinstance(v, dict):
-            return v
-        if isinstance(v, str):
-            try:
-                obj = json.loads(v)
-                return obj if isinstance(obj, dict) else None
-            except Exception:
-                return None
-        return None
-
     def _get_latest_config(conn, slug: str):
         cur = conn.cursor()
         cur.execute(
@@ -677,13 +665,124 @@ def register_twilio_routes(
         except Exception as e:
             raise HTTPException(status_code=500, detail=str(e))
 
+    def _send_config(request: Request, slug: str) -> Any:
+        ensure_twilio_table()
+        with get_conn_for_request(request) as conn:
+            return _get_latest_config(conn, slug)
+
+    def _check_twilio_optin(request: Request, payload: TwilioSendIn, to: str, body: str, cleaned_media: list[str]) -> None:
+        ensure_twilio_optin_table()
+        numero_digits = _normalize_optin_digits(_digits_only(to))
+        try:
+            with get_conn_for_request(request) as conn_chk:
+                tid_chk = _tenant_id_from_request(conn_chk, request)
+                if not _has_optin(conn_chk, tid=tid_chk, numero_digits=numero_digits, provider="twilio"):
+                    try:
+                        cur = conn_chk.cursor()
+                        cur.execute(
+                            f"""
+                            INSERT INTO "{safe_schema}"."Disparos"
+                            ("IdTenant","IdCampanha","Canal","Direcao","Numero","Nome","Mensagem","Imagem","Status","DataHora","Payload","MessageId")
+                            VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,NOW() AT TIME ZONE 'UTC',%s::jsonb,%s)
+                            """,
+                            (
+                                int(tid_chk),
+                                payload.campanha_id,
+                                "WHATSAPP",
+                                "OUT",
+                                numero_digits,
+                                (payload.contato_nome or None),
+                                (body if body else None),
+                                (cleaned_media[0] if cleaned_media else None),
+                                "FALHA",
+                                json.dumps({"provider": "twilio", "error": "SEM_OPTIN", "to": to}, ensure_ascii=False),
+                                None,
+                            ),
+                        )
+                        conn_chk.commit()
+                    except Exception:
+                        try:
+                            conn_chk.rollback()
+                        except Exception:
+                            pass
+                    raise HTTPException(status_code=400, detail=f"Número sem opt-in cadastrado: {to}")
+        except HTTPException:
+            raise
+        except Exception:
+            raise HTTPException(status_code=500, detail="Falha ao validar opt-in para Twilio.")
+
+    def _log_twilio_send(
+        request: Request,
+        payload: TwilioSendIn,
+        canal: str,
+        to: str,
+        body: str,
+        cleaned_media: list[str],
+        sid: Optional[str],
+        status: Optional[str],
+        remetente: Optional[str],
+        content_sid: str,
+    ) -> None:
+        try:
+            tid = _tenant_id_from_request(None, request)
+            log_row = {
+                "IdTenant": tid,
+                "IdCampanha": payload.campanha_id,
+                "Canal": canal,
+                "Direcao": "OUT",
+                "Numero": _digits_only(to),
+                "Nome": (payload.contato_nome or None),
+                "Mensagem": (body if body else None),
+                "Imagem": cleaned_media[0] if cleaned_media else None,
+                "Status": _map_twilio_status(status),
+                "Payload": json.dumps(
+                    {
+                        "provider": "twilio",
+                        "sid": sid,
+                        "status": status,
+                        "to": to,
+                        "from": remetente,
+                        "content_sid": (content_sid or None),
+                    },
+                    ensure_ascii=False,
+                ),
+                "MessageId": sid,
+            }
+            if disparos_writer is not None:
+                disparos_writer.add_for_request(request, [log_row])
+            else:
+                with get_conn_for_request(request) as conn_log:
+                    cur = conn_log.cursor()
+                    cur.execute(
+                        f"""
+                        INSERT INTO "{safe_schema}"."Disparos"
+                        ("IdTenant","IdCampanha","Canal","Direcao","Numero","Nome","Mensagem","Imagem","Status","DataHora","Payload","MessageId")
+                        VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,NOW() AT TIME ZONE 'UTC',%s::jsonb,%s)
+                        """,
+                        (
+                            log_row["IdTenant"],
+                            log_row["IdCampanha"],
+                            log_row["Canal"],
+                            log_row["Direcao"],
+                            log_row["Numero"],
+                            log_row["Nome"],
+                            log_row["Mensagem"],
+                            log_row["Imagem"],
+                            log_row["Status"],
+                            log_row["Payload"],
+                            log_row["MessageId"],
+                        ),
+                    )
+                    conn_log.commit()
+        except Exception:
+            pass
+
     @app.post("/api/integracoes/twilio/send")
     async def twilio_send(payload: TwilioSendIn, request: Request):
-        ensure_twilio_table()
         slug = _tenant_slug(request)
         try:
-            with get_conn_for_request(request) as conn:
-                row = _get_latest_config(conn, slug)
+            # Banco e SDK da Twilio são síncronos: rodam em threads, fora do event loop.
+            row = await asyncio.to_thread(_send_config, request, slug)
             if not row:
                 raise HTTPException(status_code=400, detail="Twilio não configurada.")
             enabled = bool(row[12]) if row[12] is not None else True
@@ -767,45 +866,7 @@ def register_twilio_routes(
             require_optin = str(os.getenv("TWILIO_REQUIRE_OPTIN", "0") or "0").strip().lower()
             require_optin = require_optin not in ("0", "false", "no", "off")
             if is_whatsapp and require_optin:
-                ensure_twilio_optin_table()
-                numero_digits = _normalize_optin_digits(_digits_only(to))
-                try:
-                    with get_conn_for_request(request) as conn_chk:
-                        tid_chk = _tenant_id_from_request(conn_chk, request)
-                        if not _has_optin(conn_chk, tid=tid_chk, numero_digits=numero_digits, provider="twilio"):
-                            try:
-                                cur = conn_chk.cursor()
-                                cur.execute(
-                                    f"""
-                                    INSERT INTO "{safe_schema}"."Disparos"
-                                    ("IdTenant","IdCampanha","Canal","Direcao","Numero","Nome","Mensagem","Imagem","Status","DataHora","Payload","MessageId")
-                                    VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,NOW() AT TIME ZONE 'UTC',%s::jsonb,%s)
-                                    """,
-                                    (
-                                        int(tid_chk),
-                                        payload.campanha_id,
-                                        "WHATSAPP",
-                                        "OUT",
-                                        numero_digits,
-                                        (payload.contato_nome or None),
-                                        (body if body else None),
-                                        (cleaned_media[0] if cleaned_media else None),
-                                        "FALHA",
-                                        json.dumps({"provider": "twilio", "error": "SEM_OPTIN", "to": to}, ensure_ascii=False),
-                                        None,
-                                    ),
-                                )
-                                conn_chk.commit()
-                            except Exception:
-                                try:
-                                    conn_chk.rollback()
-                                except Exception:
-                                    pass
-                            raise HTTPException(status_code=400, detail=f"Número sem opt-in cadastrado: {to}")
-                except HTTPException:
-                    raise
-                except Exception:
-                    raise HTTPException(status_code=500, detail="Falha ao validar opt-in para Twilio.")
+                await asyncio.to_thread(_check_twilio_optin, request, payload, to, body, cleaned_media)
 
             if str(payload.status_callback_url or "").strip():
                 msg_kwargs["status_callback"] = str(payload.status_callback_url or "").strip()
@@ -822,50 +883,27 @@ def register_twilio_routes(
                     raise HTTPException(status_code=400, detail="Remetente (From) não configurado.")
                 msg_kwargs["from_"] = from_val
 
+            if rate_limiter is not None:
+                sender_key = str(msg_kwargs.get("from_") or msg_kwargs.get("messaging_service_sid") or account_sid)
+                await rate_limiter.acquire("twilio", sender_key)
+
             try:
-                msg = client.messages.create(**msg_kwargs)
+                msg = await asyncio.to_thread(client.messages.create, **msg_kwargs)
                 sid = getattr(msg, "sid", None)
                 status = getattr(msg, "status", None)
-                try:
-                    with get_conn_for_request(request) as conn_log:
-                        cur = conn_log.cursor()
-                        tid = _tenant_id_from_request(conn_log, request)
-                        canal = "WHATSAPP" if is_whatsapp else ("MMS" if cleaned_media else "SMS")
-                        numero = _digits_only(to)
-                        imagem = cleaned_media[0] if cleaned_media else None
-                        cur.execute(
-                            f"""
-                            INSERT INTO "{safe_schema}"."Disparos"
-                            ("IdTenant","IdCampanha","Canal","Direcao","Numero","Nome","Mensagem","Imagem","Status","DataHora","Payload","MessageId")
-                            VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,NOW() AT TIME ZONE 'UTC',%s::jsonb,%s)
-                            """,
-                            (
-                                tid,
-                                payload.campanha_id,
-                                canal,
-                                "OUT",
-                                numero,
-                                (payload.contato_nome or None),
-                                (body if body else None),
-                                imagem,
-                                _map_twilio_status(status),
-                                json.dumps(
-                                    {
-                                        "provider": "twilio",
-                                        "sid": sid,
-                                        "status": status,
-                                        "to": to,
-                                        "from": msg_kwargs.get("from_") or msg_kwargs.get("messaging_service_sid"),
-                                        "content_sid": (content_sid or None),
-                                    },
-                                    ensure_ascii=False,
-                                ),
-                                sid,
-                            ),
-                        )
-                        conn_log.commit()
-                except Exception:
-                    pass
+                await asyncio.to_thread(
+                    _log_twilio_send,
+                    request,
+                    payload,
+                    channel.upper(),
+                    to,
+                    body,
+                    cleaned_media,
+                    sid,
+                    status,
+                    msg_kwargs.get("from_") or msg_kwargs.get("messaging_service_sid"),
+                    content_sid,
+                )
                 return {"ok": True, "sid": sid, "status": status}
             except Exception as tw_err:
                 try:
@@ -975,13 +1013,15 @@ def register_twilio_routes(
         except Exception as e:
             raise HTTPException(status_code=500, detail=str(e))
 
-    @app.post("/api/integracoes/twilio/webhook/inbound")
-    async def twilio_webhook_inbound(request: Request):
+    async def _twilio_form(request: Request) -> dict[str, str]:
+        form = await request.form()
+        return {str(k): str(v) for k, v in dict(form).items()}
+
+    def _twilio_webhook_inbound_sync(request: Request, raw: bytes, params: dict[str, str]):
         ensure_twilio_table()
         slug = _tenant_slug(request)
+        claimed_keys: List[str] = []
         try:
-            form = await request.form()
-            params: dict[str, str] = {str(k): str(v) for k, v in dict(form).items()}
             with get_conn_for_request(request) as conn:
                 row = _get_latest_config(conn, slug)
                 if row:
@@ -991,6 +1031,16 @@ def register_twilio_routes(
                         if not _validate_twilio_request(request, params, auth_token):
                             raise HTTPException(status_code=403, detail="Assinatura Twilio inválida.")
 
+                if webhook_queue is not None and webhook_queue.should_enqueue(request):
+                    if webhook_queue.enqueue("twilio", request, raw):
+                        return Response(content="<Response></Response>", media_type="text/xml")
+
+                message_sid = str(params.get("MessageSid") or params.get("SmsMessageSid") or params.get("SmsSid") or "").strip()
+                if webhook_dedup is not None and message_sid:
+                    claimed_keys = [f"in:{message_sid}"]
+                    if not webhook_dedup.claim("twilio", slug, claimed_keys)[0]:
+                        return Response(content="<Response></Response>", media_type="text/xml")
+
                 tid = _tenant_id_from_request(conn, request)
                 from_raw = str(params.get("From") or params.get("WaId") or "").strip()
                 is_whatsapp = from_raw.lower().startswith("whatsapp:")
@@ -1020,8 +1070,7 @@ def register_twilio_routes(
                             "RECEBIDO",
                             received_dt,
                             json.dumps({"provider": "twilio", "form": params}, ensure_ascii=False),
-                            str(params.get("MessageSid") or params.get("SmsMessageSid") or params.get("SmsSid") or "").strip()
-                            or None,
+                            message_sid or None,
                         ),
                     )
                     row_in = cur.fetchone()
@@ -1036,124 +1085,25 @@ def register_twilio_routes(
                 resposta = _parse_sim_nao_response(incoming_text) if is_whatsapp else None
                 if resposta in (1, 2):
                     try:
-                        cur2 = conn.cursor()
-                        cur2.execute(
-                            f"""
-                            SELECT d."IdDisparo", d."Numero", d."IdCampanha"
-                            FROM "{safe_schema}"."Disparos" d
-                            JOIN "{safe_schema}"."Campanhas" c
-                              ON c."IdTenant" = d."IdTenant"
-                             AND c."IdCampanha" = d."IdCampanha"
-                            WHERE d."IdTenant" = %s
-                              AND d."Canal" = 'WHATSAPP'
-                              AND d."Direcao" = 'OUT'
-                              AND d."Status" IN ('ENVIADO','ENTREGUE','VISUALIZADO')
-                              AND d."IdCampanha" IS NOT NULL
-                              AND COALESCE(c."AnexoJSON"->'config'->>'response_mode', '') = 'SIM_NAO'
-                            ORDER BY d."DataHora" DESC, d."IdDisparo" DESC
-                            LIMIT 500
-                            """,
-                            (tid,),
-                        )
-                        out_rows = cur2.fetchall() or []
+                        candidates = sim_nao_index.lookup_for_request(request, conn.cursor(), tid, incoming_digits)
                     except Exception:
-                        out_rows = []
-
-                    candidates = [
-                        (out_id_raw, out_num, campanha_id)
-                        for (out_id_raw, out_num, campanha_id) in out_rows
-                        if _match_phone(out_num, incoming_digits)
-                    ]
+                        candidates = []
+                        try:
+                            conn.rollback()
+                        except Exception:
+                            pass
 
                     applied = False
                     for out_id_raw, out_num, campanha_id in candidates:
                         try:
                             cur3 = conn.cursor()
-                            cur3.execute(
-                                f"""
-                                SELECT "AnexoJSON", "Positivos", "Negativos", "Enviados"
-                                FROM "{safe_schema}"."Campanhas"
-                                WHERE "IdCampanha" = %s AND "IdTenant" = %s
-                                FOR UPDATE
-                                """,
-                                (int(campanha_id), int(tid)),
-                            )
-                            locked = cur3.fetchone()
-                            if not locked:
+                            if not record_contato_resposta(cur3, safe_schema, tid, campanha_id, incoming_digits, resposta, received_dt):
                                 try:
                                     conn.rollback()
                                 except Exception:
                                     pass
                                 continue
 
-                            anexo_obj = _safe_json_obj(locked[0]) or {}
-                            positivos = int(locked[1] or 0)
-                            negativos = int(locked[2] or 0)
-                            enviados = int(locked[3] or 0)
-                            contacts = anexo_obj.get("contacts") if isinstance(anexo_obj, dict) else None
-                            if not isinstance(contacts, list):
-                                try:
-                                    conn.rollback()
-                                except Exception:
-                                    pass
-                                continue
-
-                            idx_match = -1
-                            for i, c in enumerate(contacts):
-                                if not isinstance(c, dict):
-                                    continue
-                                phone = c.get("whatsapp") or c.get("celular") or c.get("telefone") or c.get("phone")
-                                if _match_phone(phone, incoming_digits):
-                                    idx_match = i
-                                    break
-
-                            if idx_match < 0:
-                                try:
-                                    conn.rollback()
-                                except Exception:
-                                    pass
-                                continue
-
-                            cur_ct = contacts[idx_match]
-                            existing = cur_ct.get("resposta") if isinstance(cur_ct, dict) else None
-                            if existing in (1, 2, "1", "2"):
-                                try:
-                                    conn.rollback()
-                                except Exception:
-                                    pass
-                                continue
-
-                            cur_ct["resposta"] = resposta
-                            cur_ct["respondido_em"] = (received_dt or datetime.utcnow()).isoformat()
-                            contacts[idx_match] = cur_ct
-                            anexo_obj["contacts"] = contacts
-
-                            if resposta == 1:
-                                positivos += 1
-                            else:
-                                negativos += 1
-
-                            aguardando = max(0, enviados - (positivos + negativos))
-                            cur3.execute(
-                                f"""
-                                UPDATE "{safe_schema}"."Campanhas"
-                                SET "AnexoJSON" = %s::jsonb,
-                                    "Positivos" = %s,
-                                    "Negativos" = %s,
-                                    "Aguardando" = %s,
-                                    "Atualizacao" = NOW()
-                                WHERE "IdCampanha" = %s AND "IdTenant" = %s
-                                """,
-                                (
-                                    json.dumps(anexo_obj, ensure_ascii=False),
-                                    positivos,
-                                    negativos,
-                                    aguardando,
-                                    int(campanha_id),
-                                    int(tid),
-                                ),
-                            )
-
                             if inserted_in_id:
                                 cur3.execute(
                                     f"""
@@ -1188,15 +1138,24 @@ def register_twilio_routes(
         except HTTPException:
             raise
         except Exception as e:
+            if webhook_dedup is not None:
+                webhook_dedup.release("twilio", slug, claimed_keys)
             raise HTTPException(status_code=500, detail=str(e))
 
-    @app.post("/api/integracoes/twilio/webhook/status")
-    async def twilio_webhook_status(request: Request):
+    @app.post("/api/integracoes/twilio/webhook/inbound")
+    async def twilio_webhook_inbound(request: Request):
+        # O processamento usa psycopg síncrono: roda numa thread, fora do event loop.
+        raw = await request.body()
+        params = await _twilio_form(request)
+        return await asyncio.to_thread(_twilio_webhook_inbound_sync, request, raw, params)
+
+    if webhook_queue is not None:
+        webhook_queue.register("twilio", twilio_webhook_inbound)
+
+    def _twilio_webhook_status_sync(request: Request, params: dict[str, str]):
         ensure_twilio_table()
         slug = _tenant_slug(request)
         try:
-            form = await request.form()
-            params: dict[str, str] = {str(k): str(v) for k, v in dict(form).items()}
             with get_conn_for_request(request) as conn:
                 row = _get_latest_config(conn, slug)
             if row:
@@ -1208,7 +1167,12 @@ def register_twilio_routes(
             try:
                 message_sid = str(params.get("MessageSid") or params.get("SmsSid") or "").strip()
                 message_status = str(params.get("MessageStatus") or params.get("SmsStatus") or "").strip()
+                if message_sid and webhook_dedup is not None:
+                    if not webhook_dedup.claim("twilio", slug, [f"st:{message_sid}|{message_status.lower()}"])[0]:
+                        return {"ok": True, "duplicate": True}
                 if message_sid:
+                    if disparos_writer is not None:
+                        disparos_writer.flush_pending([message_sid])
                     with get_conn_for_request(request) as conn_log:
                         cur = conn_log.cursor()
                         tid = _tenant_id_from_request(conn_log, request)
@@ -1231,13 +1195,14 @@ def register_twilio_routes(
                                 , "Payload" = COALESCE("Payload",'{{}}'::jsonb) || %s::jsonb
                             WHERE "IdTenant" = %s
                               AND "Direcao" = 'OUT'
-                              AND COALESCE(NULLIF("MessageId",''), NULLIF("Payload"->>'sid','')) = %s
+                              AND {disparos_by_message_ids_sql(safe_schema)}
                             """,
                             (
                                 new_status,
                                 json.dumps({"twilio_status_callback": params}, ensure_ascii=False),
                                 tid,
-                                message_sid,
+                                tid,
+                                [message_sid],
                             ),
                         )
                         conn_log.commit()
@@ -1248,3 +1213,8 @@ def register_twilio_routes(
             raise
         except Exception as e:
             raise HTTPException(status_code=500, detail=str(e))
+
+    @app.post("/api/integracoes/twilio/webhook/status")
+    async def twilio_webhook_status(request: Request):
+        params = await _twilio_form(request)
+        return await asyncio.to_thread(_twilio_webhook_status_sync, request, params)
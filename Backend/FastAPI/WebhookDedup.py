@@ -0,0 +1,70 @@
+from typing import Any, Callable, Dict, List, Optional
+import os
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(str(os.getenv(name, "") or "").strip() or default)
+    except Exception:
+        return default
+
+
+class WebhookDedup:
+    """Descarte de eventos de webhook repetidos (retries de Evolution, Meta e Twilio).
+
+    Cada evento vira uma chave `webhook:seen:<provedor>:<tenant>:<id>|<status>` gravada com
+    SET NX EX; se a chave já existe o evento é descartado antes de qualquer acesso ao banco.
+    Sem Redis tudo é processado normalmente. Se o processamento falhar, `release` apaga as
+    chaves para que o retry do provedor seja aceito.
+    """
+
+    def __init__(self, get_redis_client: Callable[[], Any], prefix: str = "webhook:seen"):
+        self._get_redis_client = get_redis_client
+        self.prefix = prefix
+        self.ttl = max(60, _env_int("WEBHOOK_DEDUP_TTL_SECONDS", 86400))
+        self._stats: Dict[str, int] = {"novos": 0, "duplicados": 0, "erros": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return str(os.getenv("WEBHOOK_DEDUP_ENABLED", "1") or "1").strip().lower() not in ("0", "false", "no", "off")
+
+    def _key(self, provider: str, tenant: str, key: str) -> str:
+        return f"{self.prefix}:{provider}:{str(tenant or '').lower()}:{key}"
+
+    def claim(self, provider: str, tenant: str, keys: List[Optional[str]]) -> List[bool]:
+        """Para cada chave, True se o evento é novo (ou não tem id) e False se já foi visto."""
+        out = [True] * len(keys)
+        idx = [i for i, k in enumerate(keys) if k]
+        if not idx or not self.enabled:
+            return out
+        try:
+            rc = self._get_redis_client()
+            if rc is None:
+                return out
+            pipe = rc.pipeline(transaction=False)
+            for i in idx:
+                pipe.set(self._key(provider, tenant, str(keys[i])), "1", nx=True, ex=self.ttl)
+            for i, ok in zip(idx, pipe.execute()):
+                out[i] = bool(ok)
+        except Exception as e:
+            self._stats["erros"] += 1
+            print(f"Webhook dedup: redis indisponível ({provider}): {e}")
+            return [True] * len(keys)
+        dup = out.count(False)
+        self._stats["duplicados"] += dup
+        self._stats["novos"] += len(idx) - dup
+        return out
+
+    def release(self, provider: str, tenant: str, keys: List[Optional[str]]) -> None:
+        names = [self._key(provider, tenant, str(k)) for k in keys if k]
+        if not names:
+            return
+        try:
+            rc = self._get_redis_client()
+            if rc is not None:
+                rc.delete(*names)
+        except Exception:
+            pass
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {"enabled": self.enabled, "ttl_s": self.ttl, "stats": dict(self._stats)}
@@ -0,0 +1,314 @@
+from fastapi import FastAPI, HTTPException, Request
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+import os
+import json
+import time
+import base64
+import socket
+import asyncio
+import traceback
+from urllib.parse import parse_qsl
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(str(os.getenv(name, "") or "").strip() or default)
+    except Exception:
+        return default
+
+
+class QueuedWebhook(NamedTuple):
+    """Entrada do stream já decodificada, para handlers de lote (headers em minúsculas)."""
+
+    entry_id: str
+    headers: Dict[str, str]
+    query: Dict[str, str]
+    body: bytes
+
+
+class WebhookQueue:
+    """Ingestão assíncrona de webhooks via Redis Streams.
+
+    Com WEBHOOK_INGEST_MODE=queue o endpoint valida a assinatura, grava o evento bruto
+    (método, URL, headers e corpo) em `webhooks:<tipo>` e responde na hora. Os
+    consumidores leem em lote com XREADGROUP e reexecutam o handler original com uma
+    Request reconstruída; entradas sem ACK são reclamadas após WEBHOOK_QUEUE_MIN_IDLE_MS
+    e vão para `webhooks:<tipo>:dead` após WEBHOOK_QUEUE_MAX_DELIVERIES entregas.
+
+    Um tipo registrado com `batch_handler` recebe o lote inteiro numa thread (lista de
+    `QueuedWebhook`) e devolve os ids que podem receber ACK; assim o handler pode agrupar
+    o trabalho de banco do lote em vez de reexecutar uma requisição por evento.
+    """
+
+    def __init__(self, get_redis_client: Callable[[], Any], prefix: str = "webhooks"):
+        self._get_redis_client = get_redis_client
+        self.prefix = prefix
+        self.group = str(os.getenv("WEBHOOK_QUEUE_GROUP", "captar-webhooks") or "captar-webhooks")
+        self.consumer = f"{socket.gethostname()}:{os.getpid()}"
+        self.maxlen = max(1000, _env_int("WEBHOOK_QUEUE_MAXLEN", 1000000))
+        self.batch = max(1, _env_int("WEBHOOK_QUEUE_BATCH", 100))
+        self.block_ms = max(100, _env_int("WEBHOOK_QUEUE_BLOCK_MS", 2000))
+        self.min_idle_ms = max(1000, _env_int("WEBHOOK_QUEUE_MIN_IDLE_MS", 60000))
+        self.max_deliveries = max(1, _env_int("WEBHOOK_QUEUE_MAX_DELIVERIES", 5))
+        self.workers = max(0, _env_int("WEBHOOK_QUEUE_CONSUMERS", 2))
+        self._handlers: Dict[str, Callable[[Request], Awaitable[Any]]] = {}
+        self._batch_handlers: Dict[str, Callable[[List[QueuedWebhook]], Iterable[str]]] = {}
+        self._groups_ready: set = set()
+        self._stats: Dict[str, int] = {"enqueued": 0, "enqueue_errors": 0, "processed": 0, "failed": 0, "dead": 0, "reclaimed": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return str(os.getenv("WEBHOOK_INGEST_MODE", "sync") or "sync").strip().lower() == "queue"
+
+    def stream(self, kind: str) -> str:
+        return f"{self.prefix}:{kind}"
+
+    def register(
+        self,
+        kind: str,
+        handler: Callable[[Request], Awaitable[Any]],
+        batch_handler: Optional[Callable[[List[QueuedWebhook]], Iterable[str]]] = None,
+    ) -> None:
+        self._handlers[kind] = handler
+        if batch_handler is not None:
+            self._batch_handlers[kind] = batch_handler
+        else:
+            self._batch_handlers.pop(kind, None)
+
+    def should_enqueue(self, request: Request) -> bool:
+        return self.enabled and not request.scope.get("webhook_replay")
+
+    def enqueue(self, kind: str, request: Request, body: bytes) -> Optional[str]:
+        """Grava o evento no stream. Retorna None se o Redis falhar (o chamador processa inline)."""
+        try:
+            rc = self._get_redis_client()
+            if rc is None:
+                raise RuntimeError("redis indisponível")
+            scope = request.scope
+            server = scope.get("server") or ("localhost", 80)
+            fields = {
+                "method": str(scope.get("method") or "POST"),
+                "scheme": str(scope.get("scheme") or "http"),
+                "server": json.dumps([server[0], server[1]]),
+                "path": str(scope.get("path") or "/"),
+                "root_path": str(scope.get("root_path") or ""),
+                "query": (scope.get("query_string") or b"").decode("latin-1"),
+                "headers": json.dumps([[k.decode("latin-1"), v.decode("latin-1")] for k, v in scope.get("headers") or []]),
+                "body": base64.b64encode(body or b"").decode("ascii"),
+                "ts": str(time.time()),
+            }
+            entry_id = rc.xadd(self.stream(kind), fields, maxlen=self.maxlen, approximate=True)
+            self._stats["enqueued"] += 1
+            return str(entry_id)
+        except Exception as e:
+            self._stats["enqueue_errors"] += 1
+            print(f"Webhook queue: falha ao enfileirar {kind}: {e}")
+            return None
+
+    @staticmethod
+    def replay_request(fields: Dict[str, Any]) -> Request:
+        body = base64.b64decode(str(fields.get("body") or ""))
+        server = json.loads(fields.get("server") or "null") or ["localhost", 80]
+        scope = {
+            "type": "http",
+            "http_version": "1.1",
+            "method": str(fields.get("method") or "POST"),
+            "scheme": str(fields.get("scheme") or "http"),
+            "server": (str(server[0]), int(server[1]) if server[1] is not None else None),
+            "client": None,
+            "path": str(fields.get("path") or "/"),
+            "raw_path": str(fields.get("path") or "/").encode("latin-1"),
+            "root_path": str(fields.get("root_path") or ""),
+            "query_string": str(fields.get("query") or "").encode("latin-1"),
+            "headers": [(str(k).encode("latin-1"), str(v).encode("latin-1")) for k, v in json.loads(fields.get("headers") or "[]")],
+            "webhook_replay": True,
+        }
+        sent = {"done": False}
+
+        async def receive():
+            if sent["done"]:
+                return {"type": "http.disconnect"}
+            sent["done"] = True
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        return Request(scope, receive)
+
+    @staticmethod
+    def queued(entry_id: str, fields: Dict[str, Any]) -> QueuedWebhook:
+        query: Dict[str, str] = {}
+        for k, v in parse_qsl(str(fields.get("query") or ""), keep_blank_values=True):
+            query.setdefault(k, v)
+        headers = {str(k).lower(): str(v) for k, v in json.loads(fields.get("headers") or "[]")}
+        return QueuedWebhook(str(entry_id), headers, query, base64.b64decode(str(fields.get("body") or "")))
+
+    def _process_batch(self, kind: str, stream: str, items: List[Tuple[str, Dict[str, Any]]]) -> List[str]:
+        batch = []
+        for entry_id, fields in items:
+            try:
+                batch.append(self.queued(entry_id, fields))
+            except Exception as e:
+                print(f"Webhook queue: {stream} {entry_id} ilegível: {e}")
+        ok = set(str(i) for i in (self._batch_handlers[kind](batch) or []))
+        return [entry_id for entry_id, _fields in items if entry_id in ok]
+
+    def _ensure_groups(self, rc) -> None:
+        for kind in self._handlers:
+            stream = self.stream(kind)
+            if stream in self._groups_ready:
+                continue
+            try:
+                rc.xgroup_create(stream, self.group, id="0", mkstream=True)
+            except Exception as e:
+                if "BUSYGROUP" not in str(e):
+                    raise
+            self._groups_ready.add(stream)
+
+    def _read(self) -> List[Tuple[str, str, Dict[str, Any]]]:
+        rc = self._get_redis_client()
+        if rc is None:
+            raise RuntimeError("redis indisponível")
+        self._ensure_groups(rc)
+        streams = {self.stream(k): ">" for k in self._handlers}
+        res = rc.xreadgroup(self.group, self.consumer, streams, count=self.batch, block=self.block_ms)
+        items = res.items() if isinstance(res, dict) else (res or [])
+        out: List[Tuple[str, str, Dict[str, Any]]] = []
+        for stream, entries in items:
+            for entry_id, fields in entries or []:
+                out.append((str(stream), str(entry_id), fields or {}))
+        return out
+
+    def _reclaim(self) -> List[Tuple[str, str, Dict[str, Any]]]:
+        rc = self._get_redis_client()
+        if rc is None:
+            return []
+        self._ensure_groups(rc)
+        out: List[Tuple[str, str, Dict[str, Any]]] = []
+        for kind in self._handlers:
+            stream = self.stream(kind)
+            pend = rc.xpending_range(stream, self.group, min="-", max="+", count=self.batch, idle=self.min_idle_ms) or []
+            retry: List[str] = []
+            for p in pend:
+                entry_id = str(p.get("message_id"))
+                if int(p.get("times_delivered") or 0) < self.max_deliveries:
+                    retry.append(entry_id)
+                    continue
+                for _id, fields in rc.xrange(stream, min=entry_id, max=entry_id, count=1) or []:
+                    rc.xadd(f"{stream}:dead", {**(fields or {}), "origem": entry_id}, maxlen=self.maxlen, approximate=True)
+                rc.xack(stream, self.group, entry_id)
+                self._stats["dead"] += 1
+                print(f"Webhook queue: {stream} {entry_id} movido para dead-letter")
+            if retry:
+                for entry_id, fields in rc.xclaim(stream, self.group, self.consumer, self.min_idle_ms, retry) or []:
+                    if fields:
+                        out.append((stream, str(entry_id), fields))
+                        self._stats["reclaimed"] += 1
+        return out
+
+    def _ack(self, acks: Dict[str, List[str]]) -> None:
+        rc = self._get_redis_client()
+        if rc is None:
+            return
+        for stream, ids in acks.items():
+            if ids:
+                rc.xack(stream, self.group, *ids)
+
+    async def process(self, entries: List[Tuple[str, str, Dict[str, Any]]]) -> int:
+        acks: Dict[str, List[str]] = {}
+        kinds = {self.stream(k): k for k in self._handlers}
+        lotes: Dict[str, List[Tuple[str, Dict[str, Any]]]] = {}
+        for stream, entry_id, fields in entries:
+            kind = kinds.get(stream, "")
+            if kind in self._batch_handlers:
+                lotes.setdefault(stream, []).append((entry_id, fields))
+                continue
+            handler = self._handlers.get(kind)
+            if handler is None:
+                continue
+            try:
+                await handler(self.replay_request(fields))
+            except asyncio.CancelledError:
+                raise
+            except HTTPException as he:
+                if int(he.status_code or 0) >= 500:
+                    self._stats["failed"] += 1
+                    print(f"Webhook queue: {stream} {entry_id} falhou ({he.status_code}): {he.detail}")
+                    continue
+                print(f"Webhook queue: {stream} {entry_id} descartado ({he.status_code}): {he.detail}")
+            except Exception as e:
+                self._stats["failed"] += 1
+                print(f"Webhook queue: {stream} {entry_id} falhou: {e}")
+                continue
+            acks.setdefault(stream, []).append(entry_id)
+            self._stats["processed"] += 1
+        for stream, items in lotes.items():
+            try:
+                done = await asyncio.to_thread(self._process_batch, kinds[stream], stream, items)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Webhook queue: lote de {stream} falhou: {e}")
+                done = []
+            if done:
+                acks.setdefault(stream, []).extend(done)
+            self._stats["processed"] += len(done)
+            self._stats["failed"] += len(items) - len(done)
+        if acks:
+            await asyncio.to_thread(self._ack, acks)
+        return sum(len(v) for v in acks.values())
+
+    async def consume_loop(self, reclaim: bool = False) -> None:
+        last_reclaim = 0.0
+        while True:
+            try:
+                if reclaim and time.monotonic() - last_reclaim >= self.min_idle_ms / 1000.0:
+                    last_reclaim = time.monotonic()
+                    claimed = await asyncio.to_thread(self._reclaim)
+                    if claimed:
+                        await self.process(claimed)
+                entries = await asyncio.to_thread(self._read)
+                if entries:
+                    await self.process(entries)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                traceback.print_exc()
+                await asyncio.sleep(2.0)
+
+    def snapshot(self) -> Dict[str, Any]:
+        out: Dict[str, Any] = {"enabled": self.enabled, "group": self.group, "consumer": self.consumer, "workers": self.workers, "stats": dict(self._stats), "streams": {}}
+        try:
+            rc = self._get_redis_client()
+            for kind in self._handlers:
+                stream = self.stream(kind)
+                info: Dict[str, Any] = {"length": int(rc.xlen(stream) or 0), "dead": int(rc.xlen(f"{stream}:dead") or 0)}
+                try:
+                    pend = rc.xpending(stream, self.group) or {}
+                    info["pending"] = int(pend.get("pending") or 0)
+                except Exception:
+                    info["pending"] = None
+                out["streams"][kind] = info
+        except Exception as e:
+            out["error"] = str(e)
+        return out
+
+
+def register_webhook_queue(app: FastAPI, webhook_queue: WebhookQueue):
+    _tasks: List[asyncio.Task] = []
+
+    @app.on_event("startup")
+    async def start_webhook_queue():
+        if not webhook_queue.enabled or _tasks:
+            return
+        for i in range(webhook_queue.workers):
+            _tasks.append(asyncio.create_task(webhook_queue.consume_loop(reclaim=(i == 0))))
+
+    @app.on_event("shutdown")
+    async def stop_webhook_queue():
+        for t in _tasks:
+            t.cancel()
+        await asyncio.gather(*_tasks, return_exceptions=True)
+        _tasks.clear()
+
+    @app.get("/api/admin/webhook-queue")
+    async def admin_webhook_queue():
+        return await asyncio.to_thread(webhook_queue.snapshot)
@@ -0,0 +1,191 @@
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+import aiohttp
+
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = max(0, min(len(ordered) - 1, int(round((pct / 100.0) * (len(ordered) - 1)))))
+    return ordered[k]
+
+
+def _phone(seq: int, base: int) -> str:
+    return f"55{base + seq:011d}"[-13:]
+
+
+def _db_snapshot(dsn: str):
+    if not dsn:
+        return None
+    import psycopg
+
+    with psycopg.connect(dsn, connect_timeout=5) as conn:
+        cur = conn.cursor()
+        if conn.info.server_version >= 150000:
+            cur.execute("SELECT pg_stat_force_next_flush()")
+        cur.execute(
+            "SELECT xact_commit, tup_inserted, tup_updated FROM pg_stat_database WHERE datname = current_database()"
+        )
+        row = cur.fetchone()
+    return {"commits": int(row[0]), "inserted": int(row[1]), "updated": int(row[2])}
+
+
+async def _fake_stats(session, url: str, reset: bool = False):
+    if not url:
+        return None
+    try:
+        if reset:
+            async with session.post(f"{url.rstrip('/')}/__reset") as resp:
+                await resp.read()
+            return None
+        async with session.get(f"{url.rstrip('/')}/__stats") as resp:
+            return await resp.json()
+    except Exception as e:
+        print(f"Aviso: fake provider indisponível ({e})")
+        return None
+
+
+async def _run(args):
+    headers = {"X-Tenant": args.tenant, "Content-Type": "application/json"}
+    if args.token:
+        headers["Authorization"] = f"Bearer {args.token}"
+    latencies = []
+    status_counts = {}
+    sent_ok = 0
+    sent_fail = 0
+    sem = asyncio.Semaphore(args.concurrency)
+    timeout = aiohttp.ClientTimeout(total=args.timeout)
+    connector = aiohttp.TCPConnector(limit=max(args.concurrency * 2, 10))
+
+    async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+        await _fake_stats(session, args.fake_url, reset=True)
+        db_before = await asyncio.to_thread(_db_snapshot, args.dsn)
+
+        async def _post(path, payload, n_msgs):
+            nonlocal sent_ok, sent_fail
+            async with sem:
+                t0 = time.perf_counter()
+                try:
+                    async with session.post(f"{args.api.rstrip('/')}{path}", json=payload, headers=headers) as resp:
+                        body = await resp.read()
+                        code = resp.status
+                except Exception as e:
+                    body = str(e).encode()
+                    code = 0
+                latencies.append((time.perf_counter() - t0) * 1000.0)
+                status_counts[code] = status_counts.get(code, 0) + 1
+                if code == 200:
+                    if args.mode == "batch":
+                        try:
+                            res = json.loads(body)
+                            sent_ok += int(res.get("enviados") or 0)
+                            sent_fail += int(res.get("falhas") or 0)
+                        except Exception:
+                            sent_fail += n_msgs
+                    else:
+                        sent_ok += n_msgs
+                else:
+                    sent_fail += n_msgs
+
+        jobs = []
+        if args.mode == "batch":
+            for start in range(0, args.count, args.batch_size):
+                n = min(args.batch_size, args.count - start)
+                payload = {
+                    "recipients": [{"phone": _phone(start + i, args.phone_base)} for i in range(n)],
+                    "message": args.message,
+                    "media_url": args.media_url,
+                    "evolution_api_id": args.evolution_api_id,
+                    "evolution_api_ids": args.evolution_api_ids,
+                }
+                jobs.append(_post("/api/integrations/whatsapp/send-batch", payload, n))
+        elif args.mode == "meta":
+            for i in range(args.count):
+                payload = {"to": _phone(i, args.phone_base), "body": args.message, "media_url": args.media_url}
+                jobs.append(_post("/api/integracoes/meta/send", payload, 1))
+        else:
+            for i in range(args.count):
+                payload = {
+                    "phone": _phone(i, args.phone_base),
+                    "message": args.message,
+                    "media_url": args.media_url,
+                    "evolution_api_id": args.evolution_api_id,
+                }
+                jobs.append(_post("/api/integrations/whatsapp/send", payload, 1))
+
+        t_start = time.perf_counter()
+        await asyncio.gather(*jobs)
+        elapsed = time.perf_counter() - t_start
+        await asyncio.sleep(args.settle)
+        db_after = await asyncio.to_thread(_db_snapshot, args.dsn)
+        provider = await _fake_stats(session, args.fake_url)
+
+    total = sent_ok + sent_fail
+    report = {
+        "mode": args.mode,
+        "requests": len(latencies),
+        "messages": total,
+        "ok": sent_ok,
+        "failed": sent_fail,
+        "elapsed_s": round(elapsed, 3),
+        "messages_per_s": round(sent_ok / elapsed, 2) if elapsed > 0 else 0.0,
+        "latency_ms": {
+            "p50": round(_percentile(latencies, 50), 2),
+            "p90": round(_percentile(latencies, 90), 2),
+            "p99": round(_percentile(latencies, 99), 2),
+            "max": round(max(latencies) if latencies else 0.0, 2),
+        },
+        "status_codes": {str(k): v for k, v in sorted(status_counts.items())},
+        "provider": provider,
+    }
+    if db_before and db_after and total:
+        commits = db_after["commits"] - db_before["commits"]
+        writes = (db_after["inserted"] - db_before["inserted"]) + (db_after["updated"] - db_before["updated"])
+        report["db"] = {
+            "commits": commits,
+            "rows_written": writes,
+            "commits_per_message": round(commits / total, 3),
+            "rows_per_message": round(writes / total, 3),
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark dos endpoints de envio contra o servidor falso (scripts/fake_providers.py).")
+    parser.add_argument("--api", default="http://127.0.0.1:8000")
+    parser.add_argument("--tenant", default="captar")
+    parser.add_argument("--token", default="")
+    parser.add_argument("--mode", choices=["single", "batch", "meta"], default="batch")
+    parser.add_argument("--count", type=int, default=1000)
+    parser.add_argument("--batch-size", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--message", default="Mensagem de benchmark")
+    parser.add_argument("--media-url", default=None)
+    parser.add_argument("--evolution-api-id", default=None)
+    parser.add_argument("--evolution-api-ids", nargs="*", default=None)
+    parser.add_argument("--phone-base", type=int, default=92900000000)
+    parser.add_argument("--fake-url", default="http://127.0.0.1:8089")
+    parser.add_argument("--dsn", default="", help="DSN do Postgres para medir commits e linhas por mensagem")
+    parser.add_argument("--settle", type=float, default=1.5, help="Segundos de espera antes de medir o banco (flush do DisparosWriter)")
+    parser.add_argument("--timeout", type=float, default=600.0)
+    parser.add_argument("--min-rate", type=float, default=0.0, help="Falha (exit 1) se messages/s ficar abaixo deste valor")
+    parser.add_argument("--max-p99-ms", type=float, default=0.0, help="Falha (exit 1) se o p99 passar deste valor")
+    args = parser.parse_args()
+
+    report = asyncio.run(_run(args))
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if args.min_rate and report["messages_per_s"] < args.min_rate:
+        print(f"REGRESSÃO: {report['messages_per_s']} msg/s < {args.min_rate}")
+        sys.exit(1)
+    if args.max_p99_ms and report["latency_ms"]["p99"] > args.max_p99_ms:
+        print(f"REGRESSÃO: p99 {report['latency_ms']['p99']}ms > {args.max_p99_ms}ms")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+import argparse
+import asyncio
+import random
+import time
+import uuid
+
+from aiohttp import web
+
+
+class FakeState:
+    def __init__(self, latency_ms: float, jitter_ms: float, error_rate: float, throttle_rate: float):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.started = time.time()
+        self.counts = {"evolution_text": 0, "evolution_media": 0, "evolution_numbers": 0, "meta_messages": 0, "meta_media": 0, "errors": 0, "throttled": 0}
+
+    async def delay(self) -> None:
+        ms = max(0.0, random.gauss(self.latency_ms, self.jitter_ms) if self.jitter_ms > 0 else self.latency_ms)
+        if ms > 0:
+            await asyncio.sleep(ms / 1000.0)
+
+    def failure(self):
+        r = random.random()
+        if r < self.throttle_rate:
+            self.counts["throttled"] += 1
+            return web.json_response({"error": "rate-limited"}, status=429)
+        if r < self.throttle_rate + self.error_rate:
+            self.counts["errors"] += 1
+            return web.json_response({"error": "fake provider failure"}, status=500)
+        return None
+
+
+def _evolution_message(number: str, body: dict) -> dict:
+    return {
+        "key": {"remoteJid": f"{number}@s.whatsapp.net", "fromMe": True, "id": uuid.uuid4().hex[:20].upper()},
+        "message": body,
+        "messageTimestamp": int(time.time()),
+        "status": "PENDING",
+    }
+
+
+def build_app(state: FakeState) -> web.Application:
+    async def evolution_send_text(request: web.Request):
+        await state.delay()
+        fail = state.failure()
+        if fail is not None:
+            return fail
+        data = await request.json()
+        state.counts["evolution_text"] += 1
+        return web.json_response(_evolution_message(str(data.get("number") or ""), {"conversation": data.get("text")}), status=201)
+
+    async def evolution_send_media(request: web.Request):
+        await state.delay()
+        fail = state.failure()
+        if fail is not None:
+            return fail
+        data = await request.json()
+        state.counts["evolution_media"] += 1
+        return web.json_response(_evolution_message(str(data.get("number") or ""), {"media": data.get("media"), "caption": data.get("caption")}), status=201)
+
+    async def evolution_numbers(request: web.Request):
+        await state.delay()
+        data = await request.json()
+        state.counts["evolution_numbers"] += 1
+        numbers = [str(n) for n in (data.get("numbers") or [])]
+        return web.json_response([{"exists": True, "jid": f"{n}@s.whatsapp.net", "number": n} for n in numbers])
+
+    async def meta_messages(request: web.Request):
+        await state.delay()
+        fail = state.failure()
+        if fail is not None:
+            return fail
+        data = await request.json()
+        state.counts["meta_messages"] += 1
+        to = str(data.get("to") or "")
+        return web.json_response(
+            {
+                "messaging_product": "whatsapp",
+                "contacts": [{"input": to, "wa_id": to}],
+                "messages": [{"id": f"wamid.{uuid.uuid4().hex}"}],
+            }
+        )
+
+    async def meta_media(request: web.Request):
+        await state.delay()
+        await request.read()
+        state.counts["meta_media"] += 1
+        return web.json_response({"id": str(random.randint(10**15, 10**16 - 1))})
+
+    async def stats(request: web.Request):
+        return web.json_response({**state.counts, "uptime_s": round(time.time() - state.started, 3)})
+
+    async def reset(request: web.Request):
+        for k in state.counts:
+            state.counts[k] = 0
+        state.started = time.time()
+        return web.json_response({"ok": True})
+
+    app = web.Application(client_max_size=64 * 1024 * 1024)
+    app.router.add_post("/message/sendText/{instance}", evolution_send_text)
+    app.router.add_post("/message/sendMedia/{instance}", evolution_send_media)
+    app.router.add_post("/chat/whatsappNumbers/{instance}", evolution_numbers)
+    app.router.add_post("/{version}/{phone_number_id}/messages", meta_messages)
+    app.router.add_post("/{version}/{phone_number_id}/media", meta_media)
+    app.router.add_get("/__stats", stats)
+    app.router.add_post("/__reset", reset)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor falso da Evolution API e da Meta Graph API para testes de carga.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency-ms", type=float, default=80.0)
+    parser.add_argument("--jitter-ms", type=float, default=20.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    state = FakeState(args.latency_ms, args.jitter_ms, args.error_rate, args.throttle_rate)
+    print(f"Fake providers em http://{args.host}:{args.port} latency={args.latency_ms}ms jitter={args.jitter_ms}ms erros={args.error_rate} 429={args.throttle_rate}")
+    web.run_app(build_app(state), host=args.host, port=args.port, print=None)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,38 @@
+import os
+import sys
+import unittest
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from CampanhaContatos import contato_row, split_anexo_contacts, with_contacts
+
+
+class CampanhaContatosTests(unittest.TestCase):
+    def test_split_keeps_config_out_of_contacts(self):
+        anexo = '{"config": {"response_mode": "SIM_NAO"}, "contacts": [{"nome": "Ana"}, "x"]}'
+        rest, contatos = split_anexo_contacts(anexo)
+        self.assertEqual(rest, {"config": {"response_mode": "SIM_NAO"}})
+        self.assertEqual(contatos, [{"nome": "Ana"}])
+        self.assertEqual(split_anexo_contacts([{"nome": "Bia"}]), ({}, [{"nome": "Bia"}]))
+        self.assertEqual(split_anexo_contacts({"usar_eleitores": True}), ({"usar_eleitores": True}, None))
+        self.assertEqual(with_contacts(rest, contatos)["contacts"], [{"nome": "Ana"}])
+
+    def test_contato_row_extracts_state(self):
+        numero, chave, nome, status, enviado, resposta, respondido = contato_row({
+            "Nome": " Ana ",
+            "celular": "+55 (92) 99123-4567",
+            "status": "success",
+            "enviado_em": "2026-05-01T10:00:00Z",
+            "resposta": "2",
+            "respondido_em": "2026-05-01T10:05:00-03:00",
+        })
+        self.assertEqual((numero, chave, nome, status), ("5592991234567", "9291234567", "Ana", "success"))
+        self.assertEqual(enviado, datetime(2026, 5, 1, 10, 0, 0))
+        self.assertEqual(resposta, 2)
+        self.assertEqual(respondido, datetime(2026, 5, 1, 13, 5, 0))
+        self.assertIsNone(contato_row({"whatsapp": "92991234567", "resposta": "SIM"})[5])
+
+
+if __name__ == "__main__":
+    unittest.main()
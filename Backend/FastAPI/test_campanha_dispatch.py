@@ -0,0 +1,231 @@
+import os
+import sys
+import json
+import asyncio
+import threading
+import unittest
+
+from fastapi import FastAPI
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from CampanhaDispatch import register_campanha_dispatch_routes
+from EvolutionAPI import _normalize_shard_strategy, _pick_evolution_shard
+
+
+class _FakeDb:
+    def __init__(self, instancias, distribuicao="round_robin"):
+        self.lock = threading.Lock()
+        self.status = "EM_ANDAMENTO"
+        self.anexo = {"config": {"evolution_api_ids": list(instancias), "distribuicao": distribuicao}}
+        self.enviados_disparos = set()
+        self.cursor = {}
+        self.stale = set()
+        self.disparos = []
+
+    def connect(self, dsn=None):
+        return _FakeConn(self)
+
+
+class _FakeCursor:
+    def __init__(self, db):
+        self._db = db
+        self._rows = []
+        self.rowcount = 0
+
+    def execute(self, sql, params=None):
+        s = " ".join(str(sql).split())
+        db = self._db
+        self._rows = []
+        self.rowcount = 0
+        with db.lock:
+            if '"CampanhaContatos"' in s:
+                return
+            if s.startswith('SELECT "Texto"'):
+                self._rows = [("Olá (NOME)", None, json.dumps(db.anexo), False, 1, 500, 1, 1, 1, 0, 0)]
+            elif s.startswith('SELECT DISTINCT "Numero"'):
+                self._rows = [(n,) for n in sorted(db.enviados_disparos)]
+            elif '"CampanhaDisparoCursor"' in s and "FOR UPDATE SKIP LOCKED" in s:
+                self._rows = [(n,) for n, st in sorted(db.cursor.items()) if st == "ENVIANDO" and n in db.stale]
+            elif s.startswith('UPDATE "captar"."CampanhaDisparoCursor" SET "Status" = \'ENVIADO\''):
+                for n in params[1]:
+                    if db.cursor.get(n) == "ENVIANDO":
+                        db.cursor[n] = "ENVIADO"
+                        self.rowcount += 1
+            elif s.startswith('DELETE FROM "captar"."CampanhaDisparoCursor"'):
+                for n in params[1]:
+                    if db.cursor.get(n) == "ENVIANDO":
+                        del db.cursor[n]
+                        self.rowcount += 1
+            elif s.startswith('SELECT "Numero" FROM "captar"."CampanhaDisparoCursor"'):
+                self._rows = [(n,) for n in sorted(db.cursor)]
+            elif s.startswith('INSERT INTO "captar"."CampanhaDisparoCursor"'):
+                numero = params[1]
+                if numero not in db.cursor:
+                    db.cursor[numero] = "ENVIANDO"
+                    self.rowcount = 1
+            elif s.startswith('UPDATE "captar"."CampanhaDisparoCursor" SET "Status" = %s'):
+                db.cursor[params[2]] = params[0]
+                self.rowcount = 1
+            elif s.startswith('UPDATE "captar"."Campanhas" SET "DisparoHeartbeat"'):
+                self.rowcount = 1 if db.status == "EM_ANDAMENTO" else 0
+            elif s.startswith('UPDATE "captar"."Campanhas" SET "BlocoAtual"'):
+                if db.status == "EM_ANDAMENTO":
+                    db.status = params[3]
+                    self.rowcount = 1
+            elif s.startswith('UPDATE "captar"."Campanhas"'):
+                self.rowcount = 1
+
+    def fetchone(self):
+        return self._rows[0] if self._rows else None
+
+    def fetchall(self):
+        return list(self._rows)
+
+
+class _FakeConn:
+    def __init__(self, db):
+        self._db = db
+
+    def cursor(self):
+        return _FakeCursor(self._db)
+
+    def commit(self):
+        return None
+
+    def rollback(self):
+        return None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+def _contatos(*numeros):
+    return [{"nome": f"Contato {n[-1]}", "numero": n} for n in numeros]
+
+
+class CampanhaDispatchTests(unittest.TestCase):
+    def _build(self, db, contatos):
+        self.entregas = []
+
+        async def deliver(session, ctx, *, phone, message, media, text_position, on_sent, rate_capped=True):
+            self.entregas.append((ctx["instance"], phone))
+            on_sent({"mensagem": message, "message_id": f"ID{len(self.entregas)}", "resp": {}})
+
+        def insert_disparos(conn, tid, rows, commit=True):
+            db.disparos.extend(rows)
+
+        evolution = {
+            "shard_strategy": _normalize_shard_strategy,
+            "pick_shard": _pick_evolution_shard,
+            "send_contexts": lambda conn, ids: [{"instance": i, "base_candidates": []} for i in ids],
+            "send_context": lambda conn, eid: {"instance": eid or "padrao", "base_candidates": []},
+            "resolve_media": lambda *a, **k: None,
+            "deliver": deliver,
+            "insert_disparos": insert_disparos,
+            "retry_job": lambda *a, **k: None,
+        }
+        return register_campanha_dispatch_routes(
+            FastAPI(),
+            get_db_connection=db.connect,
+            get_conn_for_request=lambda request: db.connect(),
+            db_schema="captar",
+            tenant_id_from_header=lambda request: 1,
+            get_dsn_by_slug=lambda slug: None,
+            list_tenants_with_dsn=lambda: [],
+            campanha_contacts=lambda cur, **kw: list(contatos),
+            anexo_question=lambda anexo: "",
+            evolution=evolution,
+        )
+
+    def test_stale_claims_are_resolved_before_resume(self):
+        db = _FakeDb(["inst-a"])
+        db.cursor = {"5592000000001": "ENVIANDO", "5592000000002": "ENVIANDO", "5592000000003": "ENVIANDO"}
+        db.stale = {"5592000000001", "5592000000002"}
+        db.enviados_disparos = {"5592000000001"}
+        dispatch = self._build(db, _contatos("5592000000001", "5592000000002", "5592000000003", "5592000000004"))
+
+        plan = dispatch["load_block"]("", 10, 1)
+        self.assertEqual([c["numero"] for c in plan["lote"]], ["5592000000002", "5592000000004"])
+        self.assertEqual(db.cursor, {"5592000000001": "ENVIADO", "5592000000003": "ENVIANDO"})
+
+        asyncio.run(dispatch["run_campanha"]("", 10, 1, asyncio.Event()))
+        self.assertEqual(sorted(p for _i, p in self.entregas), ["5592000000002", "5592000000004"])
+        self.assertEqual(db.cursor["5592000000002"], "ENVIADO")
+        self.assertEqual(db.cursor["5592000000003"], "ENVIANDO")
+
+    def test_number_claimed_by_another_lane_is_skipped(self):
+        db = _FakeDb(["inst-a", "inst-b", "inst-c"])
+        dispatch = self._build(db, _contatos("5592000000001", "5592000000002", "5592000000001"))
+
+        asyncio.run(dispatch["run_campanha"]("", 10, 1, asyncio.Event()))
+        self.assertEqual(sorted(p for _i, p in self.entregas), ["5592000000001", "5592000000002"])
+        self.assertEqual(db.cursor, {"5592000000001": "ENVIADO", "5592000000002": "ENVIADO"})
+        self.assertEqual(len(db.disparos), 2)
+        self.assertEqual(db.status, "CONCLUIDO")
+
+    def test_paused_campanha_stops_before_claiming(self):
+        db = _FakeDb(["inst-a", "inst-b"])
+        db.status = "PAUSADO"
+        dispatch = self._build(db, _contatos("5592000000001", "5592000000002"))
+        stop = asyncio.Event()
+
+        asyncio.run(dispatch["run_campanha"]("", 10, 1, stop))
+        self.assertTrue(stop.is_set())
+        self.assertEqual(self.entregas, [])
+        self.assertEqual(db.cursor, {})
+        self.assertEqual(db.status, "PAUSADO")
+
+    def test_round_robin_spreads_one_contact_per_instance(self):
+        db = _FakeDb(["inst-a", "inst-b", "inst-c"])
+        dispatch = self._build(db, _contatos("5592000000001", "5592000000002", "5592000000003"))
+
+        asyncio.run(dispatch["run_campanha"]("", 10, 1, asyncio.Event()))
+        self.assertEqual(
+            sorted(self.entregas),
+            [("inst-a", "5592000000001"), ("inst-b", "5592000000002"), ("inst-c", "5592000000003")],
+        )
+
+    def test_least_loaded_delivers_each_contact_once(self):
+        db = _FakeDb(["inst-a", "inst-b"], distribuicao="least_loaded")
+        dispatch = self._build(db, _contatos("5592000000001", "5592000000002"))
+
+        asyncio.run(dispatch["run_campanha"]("", 10, 1, asyncio.Event()))
+        self.assertEqual(sorted(p for _i, p in self.entregas), ["5592000000001", "5592000000002"])
+        self.assertEqual(db.status, "CONCLUIDO")
+
+
+class ShardTests(unittest.TestCase):
+    def _ctxs(self, *ids):
+        return [{"instance": i} for i in ids]
+
+    def test_strategy_aliases(self):
+        self.assertEqual(_normalize_shard_strategy("RR"), "round_robin")
+        self.assertEqual(_normalize_shard_strategy("least-loaded"), "least_loaded")
+        self.assertEqual(_normalize_shard_strategy("Sticky"), "sticky")
+        self.assertEqual(_normalize_shard_strategy("outra"), "round_robin")
+
+    def test_round_robin_cycles_by_sequence(self):
+        ctxs = self._ctxs("a", "b", "c")
+        picks = [_pick_evolution_shard("round_robin", ctxs, seq=i)["instance"] for i in range(6)]
+        self.assertEqual(picks, ["a", "b", "c", "a", "b", "c"])
+
+    def test_sticky_is_stable_per_phone(self):
+        ctxs = self._ctxs("a", "b", "c")
+        pick = _pick_evolution_shard("sticky", ctxs, phone="5592991234567")["instance"]
+        for variante in ("+55 (92) 99123-4567", "559291234567", "92991234567"):
+            self.assertEqual(_pick_evolution_shard("sticky", ctxs, phone=variante)["instance"], pick)
+        self.assertEqual(_pick_evolution_shard("sticky", list(reversed(ctxs)), phone="5592991234567")["instance"], pick)
+        resto = [c for c in ctxs if c["instance"] != pick]
+        outro = next(f"55920000000{i:02d}" for i in range(100) if _pick_evolution_shard("sticky", ctxs, phone=f"55920000000{i:02d}")["instance"] != pick)
+        self.assertEqual(
+            _pick_evolution_shard("sticky", resto, phone=outro)["instance"],
+            _pick_evolution_shard("sticky", ctxs, phone=outro)["instance"],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
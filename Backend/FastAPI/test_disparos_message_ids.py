@@ -0,0 +1,70 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from DisparosMessageIds import disparos_by_message_ids_sql, ensure_disparos_message_ids
+
+
+class _FakeCursor:
+    def __init__(self, existe, vazia):
+        self.existe = existe
+        self.vazia = vazia
+        self.queries = []
+        self.rowcount = 0
+        self._row = None
+
+    def execute(self, sql, params=None):
+        s = " ".join(str(sql).split())
+        self.queries.append(s)
+        self._row = None
+        self.rowcount = 0
+        if "to_regclass" in s:
+            self._row = ('"captar"."DisparosMessageIds"' if self.existe else None,)
+        elif s.startswith("SELECT NOT EXISTS"):
+            self._row = (self.vazia,)
+        elif s.startswith('INSERT INTO "captar"."DisparosMessageIds"'):
+            self.rowcount = 3
+
+    def fetchone(self):
+        return self._row
+
+    def _find(self, trecho):
+        return [q for q in self.queries if trecho in q]
+
+
+class EnsureDisparosMessageIdsTests(unittest.TestCase):
+    def test_triggers_cover_insert_and_id_updates(self):
+        cur = _FakeCursor(existe=True, vazia=False)
+        ensure_disparos_message_ids(cur, "captar")
+        (ins,) = cur._find('TRIGGER "trg_disparos_message_ids_ins"')
+        self.assertIn('AFTER INSERT ON "captar"."Disparos" REFERENCING NEW TABLE AS novos FOR EACH STATEMENT', ins)
+        (upd,) = cur._find('TRIGGER "trg_disparos_message_ids_upd"')
+        self.assertIn('AFTER UPDATE OF "MessageId", "Payload", "IdTenant" ON "captar"."Disparos"', upd)
+        self.assertIn('NEW."MessageId" IS DISTINCT FROM OLD."MessageId"', upd)
+        (fn,) = cur._find('FUNCTION "captar"."disparos_message_ids"(')
+        for caminho in ("p_payload->'data'->'key'->>'id'", "p_payload->>'sid'", "p_payload->'message_ids'"):
+            self.assertIn(caminho, fn)
+        self.assertLess(cur.queries.index(cur._find("CREATE TABLE IF NOT EXISTS")[0]), cur.queries.index(ins))
+
+    def test_backfill_runs_only_while_side_table_is_empty(self):
+        for existe, vazia, backfill in ((False, None, True), (True, True, True), (True, False, False)):
+            cur = _FakeCursor(existe=existe, vazia=vazia)
+            actions = ensure_disparos_message_ids(cur, "captar")
+            fills = cur._find('INSERT INTO "captar"."DisparosMessageIds" ("IdTenant", "MessageId", "IdDisparo") SELECT d."IdTenant"')
+            self.assertEqual(len(fills), 1 if backfill else 0)
+            self.assertEqual("DisparosMessageIds backfill: 3 ids" in actions, backfill)
+            self.assertEqual(bool(cur._find("SELECT NOT EXISTS")), existe)
+
+    def test_lookup_filter_goes_through_side_table(self):
+        sql = disparos_by_message_ids_sql("captar", 'd."IdDisparo"')
+        self.assertEqual(
+            sql,
+            'd."IdDisparo" IN (SELECT m."IdDisparo" FROM "captar"."DisparosMessageIds" m '
+            'WHERE m."IdTenant" = %s AND m."MessageId" = ANY(%s))',
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,34 @@
+import os
+import sys
+import asyncio
+import unittest
+
+from fastapi import HTTPException
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from DisparosRetry import DisparosRetryQueue
+
+
+class DisparosRetryPolicyTests(unittest.TestCase):
+    def setUp(self):
+        self.queue = DisparosRetryQueue(lambda dsn=None: None, "captar", lambda request: None)
+
+    def test_only_transient_failures_are_retryable(self):
+        self.assertTrue(self.queue.retryable(HTTPException(status_code=502, detail="x")))
+        self.assertTrue(self.queue.retryable(HTTPException(status_code=429, detail="x")))
+        self.assertTrue(self.queue.retryable(asyncio.TimeoutError()))
+        self.assertFalse(self.queue.retryable(HTTPException(status_code=400, detail="x")))
+        self.assertFalse(self.queue.retryable(ValueError("x")))
+
+    def test_backoff_grows_with_jitter_and_cap(self):
+        self.queue.base_delay = 10.0
+        self.queue.max_delay = 100.0
+        for tentativas, teto in ((0, 10.0), (1, 20.0), (2, 40.0), (10, 100.0)):
+            delay = self.queue.backoff(tentativas)
+            self.assertGreaterEqual(delay, teto / 2.0)
+            self.assertLessEqual(delay, teto)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+import os
+import sys
+import unittest
+from contextlib import contextmanager
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from DisparosWriter import DisparosWriter
+
+
+class _FakeCopy:
+    def __init__(self, sink):
+        self.sink = sink
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def write_row(self, row):
+        self.sink.append(row)
+
+
+class _FakeConn:
+    def __init__(self, sink):
+        self.sink = sink
+        self.commits = 0
+
+    def cursor(self):
+        return self
+
+    def copy(self, sql):
+        return _FakeCopy(self.sink)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        pass
+
+
+class DisparosWriterTests(unittest.TestCase):
+    def setUp(self):
+        self.written = {}
+
+        @contextmanager
+        def get_db_connection(dsn=None):
+            yield _FakeConn(self.written.setdefault(dsn, []))
+
+        self.writer = DisparosWriter(get_db_connection, "captar", lambda request: None, max_rows=100)
+        self.writer._thread = object()
+
+    def test_rows_are_buffered_until_flush(self):
+        self.writer.add_many(None, [{"IdTenant": 1, "Numero": "5592999990000", "MessageId": "m1"}])
+        self.writer.add("postgresql://tenant", {"IdTenant": 2, "Numero": "5592999990001"})
+        self.assertEqual(self.written, {})
+        self.assertEqual(self.writer.flush(), 2)
+        self.assertEqual(len(self.written[None]), 1)
+        self.assertEqual(len(self.written["postgresql://tenant"]), 1)
+        self.assertEqual(self.written[None][0][2], "WHATSAPP")
+
+    def test_flush_pending_only_when_message_is_buffered(self):
+        self.writer.add(None, {"IdTenant": 1, "MessageId": "m1"})
+        self.writer.flush_pending(["other"])
+        self.assertEqual(self.written, {})
+        self.writer.flush_pending(["m1"])
+        self.assertEqual(len(self.written[None]), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,204 @@
+import os
+import sys
+import unittest
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+import EvolutionAPI
+from CampanhaContatos import phone_key
+from DisparosRetry import DisparosRetryQueue
+from EvolutionAPI import register_evolution_routes
+
+_INSTANCIAS = {"1": "inst-a", "2": "inst-b"}
+
+
+class _FakeCursor:
+    def __init__(self, db):
+        self._db = db
+        self._rows = []
+        self.rowcount = 0
+
+    def execute(self, sql, params=None):
+        s = " ".join(str(sql).split())
+        self._rows = []
+        self.rowcount = 0
+        if "information_schema.columns" in s:
+            self._rows = [("id",), ("name",), ("number",), ("token",), ("connectionStatus",)]
+        elif 'FROM "EvolutionAPI"."Instance"' in s:
+            iid = str(params[0])
+            if iid in _INSTANCIAS:
+                self._rows = [(iid, _INSTANCIAS[iid], "", f"token-{iid}", "CONNECTED")]
+        elif '"CampanhaContatos"' in s:
+            self._db.marcados.append((params[0], params[3]))
+            self.rowcount = 1
+
+    def executemany(self, sql, seq):
+        s = str(sql)
+        if '"DisparosRetry"' in s:
+            self._db.retries.extend(seq)
+        elif '"Disparos"' in s:
+            self._db.disparos.extend(seq)
+
+    def fetchone(self):
+        return self._rows[0] if self._rows else None
+
+    def fetchall(self):
+        return list(self._rows)
+
+
+class _FakeConn:
+    def __init__(self, db):
+        self._db = db
+
+    def cursor(self):
+        return _FakeCursor(self._db)
+
+    def commit(self):
+        return None
+
+    def rollback(self):
+        return None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+class _FakeDb:
+    def __init__(self):
+        self.disparos = []
+        self.retries = []
+        self.marcados = []
+
+
+class _FakeResponse:
+    def __init__(self, status, body):
+        self.status = status
+        self._body = body
+
+    async def json(self):
+        return self._body
+
+    async def text(self):
+        return str(self._body)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return False
+
+
+class _FakeSession:
+    def __init__(self, falhar):
+        self.falhar = set(falhar)
+        self.posts = []
+
+    def post(self, url, json=None, headers=None, timeout=None):
+        instance = url.rsplit("/", 1)[-1]
+        numero = json["number"]
+        self.posts.append((instance, numero))
+        if numero in self.falhar:
+            return _FakeResponse(503, "indisponível")
+        return _FakeResponse(201, {"key": {"id": f"MSG-{numero}"}})
+
+
+class SendBatchTests(unittest.TestCase):
+    def setUp(self):
+        self.db = _FakeDb()
+        self.session = _FakeSession(["5592000000002"])
+        self._env = os.environ.get("EVOLUTION_API_BASE")
+        os.environ["EVOLUTION_API_BASE"] = "http://evolution.test"
+        self._http_session = EvolutionAPI.http_session
+
+        @asynccontextmanager
+        async def http_session(name="default"):
+            yield self.session
+
+        EvolutionAPI.http_session = http_session
+        connect = lambda dsn=None: _FakeConn(self.db)
+        app = FastAPI()
+        register_evolution_routes(
+            app,
+            get_db_connection=connect,
+            get_conn_for_request=lambda request: _FakeConn(self.db),
+            db_schema="captar",
+            get_redis_client=lambda: None,
+            get_dsn_by_slug=lambda slug: None,
+            mask_key=lambda s: s,
+            retry_queue=DisparosRetryQueue(connect, "captar", lambda request: None),
+            tenant_resolver=SimpleNamespace(resolve=lambda slug: SimpleNamespace(id=7)),
+        )
+        self.client = TestClient(app)
+
+    def tearDown(self):
+        EvolutionAPI.http_session = self._http_session
+        if self._env is None:
+            os.environ.pop("EVOLUTION_API_BASE", None)
+        else:
+            os.environ["EVOLUTION_API_BASE"] = self._env
+
+    def _post(self, **body):
+        base = {
+            "recipients": [{"phone": f"559200000000{i}", "nome": f"Contato {i}"} for i in (1, 2, 3)],
+            "message": "Olá",
+            "campanha_id": 10,
+            "evolution_api_ids": ["1", "2"],
+        }
+        base.update(body)
+        return self.client.post("/api/integrations/whatsapp/send-batch", json=base, headers={"X-Tenant": "acme"})
+
+    def test_round_robin_batch_logs_sends_and_retries(self):
+        res = self._post()
+        self.assertEqual(res.status_code, 200)
+        out = res.json()
+        self.assertEqual(out["instances"], ["inst-a", "inst-b"])
+        self.assertEqual((out["total"], out["enviados"], out["falhas"]), (3, 2, 1))
+        self.assertEqual(
+            [(r["phone"], r["instance"], r["ok"], r["retry"]) for r in out["rows"]],
+            [
+                ("5592000000001", "inst-a", True, False),
+                ("5592000000002", "inst-b", False, True),
+                ("5592000000003", "inst-a", True, False),
+            ],
+        )
+        self.assertEqual(out["rows"][0]["message_id"], "MSG-5592000000001")
+        self.assertEqual(out["rows"][1]["status_code"], 502)
+
+        enviados = sorted((r[4], r[8], r[10]) for r in self.db.disparos)
+        self.assertEqual(
+            enviados,
+            [
+                ("5592000000001", "ENVIADO", "MSG-5592000000001"),
+                ("5592000000002", "FALHA", None),
+                ("5592000000003", "ENVIADO", "MSG-5592000000003"),
+            ],
+        )
+        self.assertEqual([(r[0], r[1], r[3], r[9]) for r in self.db.retries], [(7, 10, "5592000000002", "inst-b")])
+        self.assertEqual(
+            sorted(self.db.marcados),
+            [("error", phone_key("5592000000002")), ("success", phone_key("5592000000001")), ("success", phone_key("5592000000003"))],
+        )
+
+    def test_least_loaded_sends_each_recipient_once(self):
+        self.session.falhar.clear()
+        res = self._post(distribuicao="least_loaded")
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json()["enviados"], 3)
+        self.assertEqual(sorted(n for _i, n in self.session.posts), ["5592000000001", "5592000000002", "5592000000003"])
+
+    def test_empty_batch_is_rejected(self):
+        res = self._post(recipients=[])
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(self.session.posts, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,210 @@
+import os
+import sys
+import json
+import base64
+import asyncio
+import unittest
+from types import SimpleNamespace
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from EvolutionAPI import register_evolution_routes
+from WebhookDedup import WebhookDedup
+from WebhookQueue import WebhookQueue
+
+
+class _FakePipeline:
+    def __init__(self, rc):
+        self._rc = rc
+        self._ops = []
+
+    def set(self, name, value, nx=False, ex=None):
+        self._ops.append(name)
+        return self
+
+    def execute(self):
+        out = []
+        for name in self._ops:
+            out.append(name not in self._rc.keys)
+            self._rc.keys.add(name)
+        self._ops = []
+        return out
+
+
+class _FakeRedis:
+    def __init__(self):
+        self.keys = set()
+        self.added = []
+        self.acked = []
+
+    def pipeline(self, transaction=False):
+        return _FakePipeline(self)
+
+    def delete(self, *names):
+        for n in names:
+            self.keys.discard(n)
+
+    def setex(self, name, ttl, value):
+        return True
+
+    def xadd(self, name, fields, maxlen=None, approximate=True):
+        self.added.append((name, fields))
+        return f"{len(self.added)}-0"
+
+    def xack(self, name, group, *ids):
+        self.acked.extend(ids)
+        return len(ids)
+
+
+class _FakeCursor:
+    def __init__(self, db):
+        self._db = db
+        self.rowcount = 0
+
+    def execute(self, sql, params=None):
+        s = str(sql)
+        self._db.queries.append((s, params))
+        if 'UPDATE' in s and '"Disparos"' in s and 'UNNEST' in s and self._db.fail_receipts:
+            raise RuntimeError("deadlock detected")
+        if 'INSERT' in s and params and any(k in str(params[-1]) for k in self._db.fail_inserts):
+            raise RuntimeError("connection lost")
+        self.rowcount = 1
+
+    def fetchone(self):
+        return None
+
+    def fetchall(self):
+        return []
+
+
+class _FakeConn:
+    def __init__(self, db):
+        self._db = db
+
+    def cursor(self):
+        return _FakeCursor(self._db)
+
+    def commit(self):
+        self._db.commits += 1
+
+    def rollback(self):
+        self._db.rollbacks += 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+class _FakeDb:
+    def __init__(self):
+        self.queries = []
+        self.commits = 0
+        self.rollbacks = 0
+        self.fail_receipts = False
+        self.fail_inserts = set()
+
+
+def _receipt(key_id: str, status: str = "DELIVERY_ACK") -> bytes:
+    return json.dumps({"event": "messages.update", "data": {"keyId": key_id, "status": status}}).encode("utf-8")
+
+
+class EvolutionWebhookBatchTests(unittest.TestCase):
+    def setUp(self):
+        self.rc = _FakeRedis()
+        self.db = _FakeDb()
+        self.queue = WebhookQueue(lambda: self.rc)
+        self.dedup = WebhookDedup(lambda: self.rc)
+        self.app = FastAPI()
+        register_evolution_routes(
+            self.app,
+            get_db_connection=lambda dsn=None: _FakeConn(self.db),
+            get_conn_for_request=lambda request: _FakeConn(self.db),
+            db_schema="captar",
+            get_redis_client=lambda: self.rc,
+            get_dsn_by_slug=lambda slug: None,
+            mask_key=lambda s: s,
+            webhook_queue=self.queue,
+            webhook_dedup=self.dedup,
+            tenant_resolver=SimpleNamespace(resolve=lambda slug: SimpleNamespace(id=7)),
+        )
+
+    def _entries(self, bodies):
+        fields = {"query": "tenant=acme", "headers": json.dumps([["x-tenant", "acme"]])}
+        out = []
+        for i, body in enumerate(bodies):
+            f = dict(fields)
+            f["body"] = base64.b64encode(body).decode("ascii")
+            out.append(("webhooks:evolution", f"{i + 1}-0", f))
+        return out
+
+    def test_receipts_of_batch_are_applied_and_acked(self):
+        entries = self._entries([_receipt("MSG1"), _receipt("MSG2", "READ")])
+        self.assertEqual(asyncio.run(self.queue.process(entries)), 2)
+        self.assertEqual(self.rc.acked, ["1-0", "2-0"])
+        updates = [p for s, p in self.db.queries if 'UNNEST' in s]
+        self.assertEqual([p[0] for p in updates], [["MSG2"], ["MSG1"]])
+
+    def test_receipts_match_disparos_by_message_id_through_side_table(self):
+        entries = self._entries([_receipt("MSG1"), _receipt("MSG2", "READ"), _receipt("MSG3")])
+        self.assertEqual(asyncio.run(self.queue.process(entries)), 3)
+        updates = [(" ".join(s.split()), p) for s, p in self.db.queries if 'UNNEST' in s]
+        self.assertEqual(len(updates), 2)
+        for sql, _params in updates:
+            self.assertIn('FROM upd, "captar"."DisparosMessageIds" m', sql)
+            self.assertIn('WHERE m."MessageId" = upd.message_id', sql)
+            self.assertIn('AND d."IdDisparo" = m."IdDisparo"', sql)
+        (read_sql, read_params), (delivered_sql, delivered_params) = updates
+        self.assertIn("AS t(message_id, read_ts, delivered_ts)", read_sql)
+        self.assertEqual(read_params[0], ["MSG2"])
+        self.assertEqual(read_params[3], 7)
+        self.assertIn("AS t(message_id, delivered_ts)", delivered_sql)
+        self.assertEqual(delivered_params[0], ["MSG1", "MSG3"])
+        self.assertEqual(len(delivered_params[1]), 2)
+        self.assertEqual(delivered_params[2], 7)
+
+    def test_failed_receipt_update_is_not_acked_and_releases_dedup(self):
+        self.db.fail_receipts = True
+        entries = self._entries([_receipt("MSG1")])
+        self.assertEqual(asyncio.run(self.queue.process(entries)), 0)
+        self.assertEqual(self.rc.acked, [])
+        self.assertEqual(self.rc.keys, set())
+        self.assertGreaterEqual(self.db.rollbacks, 1)
+
+        self.db.fail_receipts = False
+        self.assertEqual(asyncio.run(self.queue.process(entries)), 1)
+        self.assertEqual(self.rc.acked, ["1-0"])
+
+    def test_sync_webhook_failure_releases_dedup_for_provider_retry(self):
+        client = TestClient(self.app, raise_server_exceptions=False)
+        body = {"event": "messages.update", "data": {"keyId": "MSG1", "status": "READ"}}
+        self.db.fail_receipts = True
+        res = client.post("/api/integrations/whatsapp/webhook?tenant=acme", json=body)
+        self.assertEqual(res.status_code, 500)
+        self.assertEqual(self.rc.keys, set())
+
+        self.db.fail_receipts = False
+        res = client.post("/api/integrations/whatsapp/webhook?tenant=acme", json=body)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json()["receipts_updated"], 1)
+        res = client.post("/api/integrations/whatsapp/webhook?tenant=acme", json=body)
+        self.assertEqual(res.json().get("reason"), "duplicate")
+
+    def test_failed_inbound_keeps_dedup_only_for_committed_messages(self):
+        client = TestClient(self.app, raise_server_exceptions=False)
+        msgs = [
+            {"key": {"id": "IN1", "remoteJid": "5592999990001@s.whatsapp.net"}, "message": {"conversation": "oi"}},
+            {"key": {"id": "IN2", "remoteJid": "5592999990002@s.whatsapp.net"}, "message": {"conversation": "ola"}},
+        ]
+        self.db.fail_inserts = {"IN2"}
+        res = client.post("/api/integrations/whatsapp/webhook?tenant=acme", json={"event": "messages.upsert", "data": {"messages": msgs}})
+        self.assertEqual(res.status_code, 500)
+        self.assertEqual(self.rc.keys, {"webhook:seen:evolution:acme:IN1||"})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+import json
+import os
+import sys
+import unittest
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+import GridStream
+from GridStream import csv_lines, merge_groups, ndjson_lines, stream_format
+
+
+class _Req:
+    def __init__(self, accept=""):
+        self.headers = {"accept": accept}
+
+
+class GridStreamTests(unittest.TestCase):
+    def setUp(self):
+        self.rows = [{"nome": f"N{i}", "numero": str(i), "envio_datahora": datetime(2024, 1, 1, tzinfo=timezone.utc)} for i in range(5)]
+        self._batch = GridStream.STREAM_BATCH_ROWS
+        GridStream.STREAM_BATCH_ROWS = 2
+
+    def tearDown(self):
+        GridStream.STREAM_BATCH_ROWS = self._batch
+
+    def test_format_selection(self):
+        self.assertEqual(stream_format(_Req(), "CSV"), "csv")
+        self.assertEqual(stream_format(_Req("application/x-ndjson"), None), "ndjson")
+        self.assertIsNone(stream_format(_Req("application/json"), None))
+
+    def test_ndjson_is_emitted_in_batches(self):
+        chunks = list(ndjson_lines({"columns": ["nome"]}, iter(self.rows), {"stats": {"enviados": 5}}))
+        self.assertEqual(len(chunks), 1 + 3 + 1)
+        lines = "".join(chunks).splitlines()
+        self.assertEqual(json.loads(lines[1])["envio_datahora"], "2024-01-01T00:00:00+00:00")
+        self.assertEqual(json.loads(lines[-1]), {"stats": {"enviados": 5}})
+
+    def test_csv_has_header_and_every_row(self):
+        chunks = list(csv_lines(["nome", "numero", "resposta_texto"], iter(self.rows)))
+        self.assertGreater(len(chunks), 1)
+        lines = "".join(chunks).splitlines()
+        self.assertEqual(lines[0], "nome,numero,resposta_texto")
+        self.assertEqual(lines[1:], [f"N{i},{i}," for i in range(5)])
+
+    def test_tail_callable_sees_totals_after_last_row(self):
+        totals = {"n": 0}
+
+        def rows():
+            for r in self.rows:
+                totals["n"] += 1
+                yield r
+
+        lines = "".join(ndjson_lines(None, rows(), lambda: {"stats": dict(totals)})).splitlines()
+        self.assertEqual(json.loads(lines[-1]), {"stats": {"n": 5}})
+
+    def test_merge_groups_pairs_sorted_streams_lazily(self):
+        contatos = [("1000", "a"), ("2000", "b"), ("2000", "b2"), ("4000", "d")]
+        logs = [("0500", 1), ("1000", 2), ("1000", 3), ("3000", 4), ("4000", 5), ("9000", 6)]
+        pulled = []
+
+        def log_iter():
+            for r in logs:
+                pulled.append(r[1])
+                yield r
+
+        groups = merge_groups(iter(contatos), log_iter(), lambda r: r[0], lambda r: r[0])
+        key, left, right = next(groups)
+        self.assertEqual((key, left, [r[1] for r in right]), ("1000", [("1000", "a")], [2, 3]))
+        self.assertEqual(pulled, [1, 2, 3, 4])
+        rest = [(k, [c[1] for c in lft], [r[1] for r in rgt]) for k, lft, rgt in groups]
+        self.assertEqual(rest, [("2000", ["b", "b2"], []), ("4000", ["d"], [5])])
+
+
+if __name__ == "__main__":
+    unittest.main()
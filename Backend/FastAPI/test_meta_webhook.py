@@ -7,7 +7,7 @@ from fastapi.testclient import TestClient
 
 sys.path.insert(0, os.path.dirname(__file__))
 
-from MetaWhatsApp import register_meta_whatsapp_routes
+from MetaWhatsApp import _is_media_error, register_meta_whatsapp_routes
 
 
 class _FakeCursor:
@@ -114,5 +114,14 @@ class MetaWebhookTests(unittest.TestCase):
                 os.environ["META_WHATSAPP_ACCESS_TOKEN"] = prev
 
 
+class MetaMediaErrorTests(unittest.TestCase):
+    def test_only_media_errors_invalidate_cached_id(self):
+        self.assertTrue(_is_media_error('{"error": {"code": 131053, "message": "Media upload error"}}'))
+        self.assertTrue(_is_media_error('{"error": {"code": 100, "error_subcode": 33}}'))
+        self.assertFalse(_is_media_error('{"error": {"code": 131026, "message": "Message undeliverable"}}'))
+        self.assertFalse(_is_media_error('{"error": {"code": 100, "error_subcode": 2018001}}'))
+        self.assertFalse(_is_media_error("Bad Request"))
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,50 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from fastapi import HTTPException
+
+from Pagination import decode_cursor, encode_cursor, keyset_page, page_limit
+
+
+class PaginationTests(unittest.TestCase):
+    def test_cursor_round_trip(self):
+        token = encode_cursor("id", [1234])
+        self.assertNotIn("=", token)
+        self.assertEqual(decode_cursor(token, "id"), [1234])
+        self.assertIsNone(decode_cursor(None, "id"))
+
+    def test_rejects_foreign_or_garbled_cursor(self):
+        bad = (
+            encode_cursor("datahora", ["2024-01-01", 5]),
+            "nao-e-cursor",
+            encode_cursor("id", []),
+            encode_cursor("id", ["abc"]),
+            encode_cursor("id", [1.5]),
+            encode_cursor("id", [True]),
+            encode_cursor("id", [1, 2]),
+        )
+        for token in bad:
+            with self.assertRaises(HTTPException) as ctx:
+                decode_cursor(token, "id")
+            self.assertEqual(ctx.exception.status_code, 400)
+
+    def test_page_cut_uses_extra_row(self):
+        rows = [{"id": i} for i in (9, 8, 7)]
+        page, nxt = keyset_page(list(rows), 2, "id", ["id"])
+        self.assertEqual(page, rows[:2])
+        self.assertEqual(decode_cursor(nxt, "id"), [8])
+        page, nxt = keyset_page(list(rows), 3, "id", ["id"])
+        self.assertEqual(len(page), 3)
+        self.assertIsNone(nxt)
+
+    def test_page_limit_bounds(self):
+        self.assertEqual(page_limit("abc", 500, 1000), 500)
+        self.assertEqual(page_limit(0, 500, 1000), 1)
+        self.assertEqual(page_limit(50000, 500, 1000), 1000)
+
+
+if __name__ == "__main__":
+    unittest.main()
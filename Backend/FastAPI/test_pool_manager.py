@@ -0,0 +1,91 @@
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+import PoolManager as pool_manager_module
+from PoolManager import PoolBudgetExceeded, PoolManager
+
+
+class _FakePool:
+    def __init__(self, dsn, min_size=0, max_size=10, **kwargs):
+        self.dsn = dsn
+        self.max_size = max_size
+        self.in_use = 0
+        self.closed = False
+
+    def get_stats(self):
+        return {"pool_size": self.in_use, "pool_available": 0}
+
+    def close(self, timeout=None):
+        self.closed = True
+
+
+class PoolManagerTests(unittest.TestCase):
+    def setUp(self):
+        self._orig = pool_manager_module.ConnectionPool
+        pool_manager_module.ConnectionPool = _FakePool
+        os.environ["DB_POOL_MAX_TOTAL"] = "20"
+        os.environ["DB_POOL_MAX_PER_DSN"] = "10"
+        self.manager = PoolManager("captar")
+
+    def tearDown(self):
+        pool_manager_module.ConnectionPool = self._orig
+        os.environ.pop("DB_POOL_MAX_TOTAL", None)
+        os.environ.pop("DB_POOL_MAX_PER_DSN", None)
+
+    def _age(self, dsn, seconds):
+        self.manager._pools[dsn]["last_used"] = time.monotonic() - seconds
+
+    def test_pool_is_kept_per_dsn(self):
+        a = self.manager.get("postgresql://h/a")
+        self.assertIs(self.manager.get("postgresql://h/a"), a)
+        self.assertFalse(a.closed)
+
+    def test_least_recently_used_idle_pool_is_closed_over_budget(self):
+        a = self.manager.get("postgresql://h/a")
+        b = self.manager.get("postgresql://h/b")
+        self._age("postgresql://h/a", 60)
+        self._age("postgresql://h/b", 30)
+        self.manager.get("postgresql://h/c")
+        self.assertTrue(a.closed)
+        self.assertFalse(b.closed)
+        self.assertEqual(self.manager.snapshot()["budget_used"], 20)
+
+    def test_busy_pools_are_kept_and_new_pool_is_shrunk(self):
+        a = self.manager.get("postgresql://h/a")
+        a.in_use = 1
+        self._age("postgresql://h/a", 60)
+        self.assertEqual(self.manager.reserve("async:postgresql://h/a", 6), 6)
+        c = self.manager.get("postgresql://h/c")
+        self.assertFalse(a.closed)
+        self.assertEqual(c.max_size, 4)
+        self.assertEqual(self.manager.snapshot()["budget_used"], 20)
+
+    def test_new_pool_is_refused_when_budget_is_exhausted(self):
+        self.manager.timeout = 0
+        a = self.manager.get("postgresql://h/a")
+        b = self.manager.get("postgresql://h/b")
+        a.in_use = b.in_use = 1
+        self._age("postgresql://h/a", 60)
+        self._age("postgresql://h/b", 60)
+        with self.assertRaises(PoolBudgetExceeded):
+            self.manager.get("postgresql://h/c")
+        with self.assertRaises(PoolBudgetExceeded):
+            self.manager.reserve("async:postgresql://h/c", 10)
+        self.assertEqual(self.manager.snapshot()["budget_used"], 20)
+
+    def test_async_reservations_share_the_budget(self):
+        self.manager.timeout = 0
+        self.assertEqual(self.manager.reserve("async:postgresql://h/a", 10), 10)
+        self.assertEqual(self.manager.reserve("async:postgresql://h/a", 10), 10)
+        self.manager.get("postgresql://h/a")
+        with self.assertRaises(PoolBudgetExceeded):
+            self.manager.get("postgresql://h/b")
+        self.manager.release("async:postgresql://h/a")
+        self.assertEqual(self.manager.get("postgresql://h/b").max_size, 10)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,140 @@
+import os
+import sys
+import unittest
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from fastapi import FastAPI
+
+from ReceiptSync import _FONTE, cuid_floor, is_cuid, register_receipt_sync
+
+
+class CuidFloorTests(unittest.TestCase):
+    def test_floor_encodes_timestamp_like_cuid(self):
+        dt = datetime(2026, 3, 1, 12, 30, 15, 250000)
+        floor = cuid_floor(dt)
+        self.assertEqual(len(floor), 9)
+        self.assertTrue(floor.startswith("c"))
+        self.assertEqual(int(floor[1:9], 36), int((dt - datetime(1970, 1, 1)).total_seconds() * 1000))
+
+    def test_floor_orders_with_real_ids(self):
+        dt = datetime(2026, 3, 1, 12, 0, 0)
+        earlier = cuid_floor(dt - timedelta(seconds=1)) + "0001abcdxyz12345"
+        later = cuid_floor(dt + timedelta(milliseconds=1)) + "0000aaaa00000000"
+        self.assertLess(earlier, cuid_floor(dt))
+        self.assertGreater(later, cuid_floor(dt))
+
+    def test_only_cuid_ids_are_accepted(self):
+        self.assertTrue(is_cuid("clx0k3w2e0000abcd1234efgh"))
+        self.assertFalse(is_cuid("9f1c7c0e-3c1a-4a53-9a47-2b0f0f6f9d10"))
+        self.assertFalse(is_cuid("tz4a98xxat96iws9zmbrgj3a"))
+
+
+class _FakeCursor:
+    def __init__(self, db, dsn):
+        self.db = db
+        self.dsn = dsn
+        self._result = []
+
+    def execute(self, sql, params=()):
+        if "to_regclass" in sql or "information_schema.columns" in sql:
+            self._result = [(1,)]
+        elif 'SELECT "Fonte", "UltimoId"' in sql:
+            self._result = [(f, self.db.marks[f]) for f in params[0] if f in self.db.marks]
+        elif "ORDER BY id ASC LIMIT 1" in sql:
+            ids = sorted(r[0] for r in self.db.rows)
+            self._result = [(ids[0], ids[-1])] if ids else [(None, None)]
+        elif '"MessageUpdate"' in sql:
+            after_id, until_id, limit = params
+            self._result = [r for r in self.db.rows if after_id < r[0] < until_id][:limit]
+        elif "INSERT INTO" in sql:
+            self.db.marks[params[0]] = params[1]
+        else:
+            raise AssertionError(sql)
+
+    def fetchone(self):
+        return self._result[0] if self._result else None
+
+    def fetchall(self):
+        return list(self._result)
+
+
+class _FakeConn:
+    def __init__(self, db, dsn):
+        self.db = db
+        self.dsn = dsn
+
+    def cursor(self):
+        return _FakeCursor(self.db, self.dsn)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+class _FakeDb:
+    def __init__(self):
+        self.marks = {}
+        base = cuid_floor(datetime.utcnow() - timedelta(hours=1))
+        self.rows = [(f"{base}{i:04d}abcdefghijkl", f"key{i}", None, "DELIVERY_ACK", None, None) for i in range(3)]
+        self.down = set()
+        self.applied = []
+
+    @contextmanager
+    def connect(self, dsn=None):
+        yield _FakeConn(self, dsn)
+
+    def apply(self, cur, tid=None, delivered_ts=None, read_ts=None):
+        if cur.dsn in self.down:
+            raise RuntimeError("tenant fora do ar")
+        self.applied.append((cur.dsn, sorted(delivered_ts)))
+        return len(delivered_ts)
+
+
+class SyncTickTests(unittest.TestCase):
+    def setUp(self):
+        self.db = _FakeDb()
+        self.tick = register_receipt_sync(
+            app=FastAPI(),
+            get_db_connection=self.db.connect,
+            db_schema="captar",
+            list_tenants_with_dsn=lambda: [("a", "A", "dsn-a", 2), ("b", "B", "dsn-b", 3)],
+            parse_receipts=lambda rows: ({r[1]: datetime.utcnow() for r in rows}, {}),
+            apply_receipts=self.db.apply,
+        )
+
+    def test_failed_tenant_keeps_its_watermark_and_catches_up(self):
+        self.db.down.add("dsn-b")
+        self.assertEqual(self.tick(), 3)
+        last = self.db.rows[-1][0]
+        self.assertEqual(self.db.marks[_FONTE], last)
+        self.assertEqual(self.db.marks[f"{_FONTE}@a"], last)
+        self.assertLess(self.db.marks[f"{_FONTE}@b"], self.db.rows[0][0])
+
+        self.db.down.clear()
+        self.db.applied.clear()
+        self.assertEqual(self.tick(), 3)
+        self.assertEqual(self.db.applied, [("dsn-b", ["key0", "key1", "key2"])])
+        self.assertEqual(self.db.marks[f"{_FONTE}@b"], last)
+
+    def test_healthy_targets_share_one_read(self):
+        self.tick()
+        self.assertEqual([d for d, _keys in self.db.applied], [None, "dsn-a", "dsn-b"])
+        self.db.applied.clear()
+        self.assertEqual(self.tick(), 0)
+        self.assertEqual(self.db.applied, [])
+
+    def test_non_cuid_id_stops_the_tick_without_moving_watermarks(self):
+        self.db.rows.insert(1, (self.db.rows[0][0][:9] + "0000-not-a-cuid", "keyX", None, "DELIVERY_ACK", None, None))
+        with self.assertRaises(RuntimeError):
+            self.tick()
+        self.assertEqual(self.db.applied, [])
+        self.assertTrue(all(m < self.db.rows[0][0] for m in self.db.marks.values()))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+import os
+import sys
+import asyncio
+import unittest
+from contextlib import asynccontextmanager, contextmanager
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from AsyncDb import AsyncDb
+from RequestDb import RequestDb, _checkouts, count_checkout
+
+
+class RequestDbTests(unittest.TestCase):
+    def setUp(self):
+        self.opened = []
+        self.closed = []
+
+        @contextmanager
+        def get_db_connection(dsn=None):
+            conn = object()
+            self.opened.append(dsn)
+            count_checkout()
+            try:
+                yield conn
+            finally:
+                self.closed.append(dsn)
+
+        self.get_db_connection = get_db_connection
+        self.counter = {"n": 0}
+        self.token = _checkouts.set(self.counter)
+
+    def tearDown(self):
+        _checkouts.reset(self.token)
+
+    def test_central_tenant_shares_one_checkout(self):
+        db = RequestDb(self.get_db_connection, None)
+        with db.connection() as a, db.connection(central=True) as b:
+            self.assertIs(a, b)
+        self.assertIs(db.conn, db.central)
+        self.assertEqual(self.closed, [])
+        db.close()
+        self.assertEqual(self.opened, [None])
+        self.assertEqual(self.closed, [None])
+        self.assertEqual(self.counter["n"], 1)
+
+    def test_tenant_and_central_are_opened_lazily(self):
+        db = RequestDb(self.get_db_connection, "postgresql://t1")
+        db.close()
+        self.assertEqual(self.opened, [])
+        db = RequestDb(self.get_db_connection, "postgresql://t1")
+        db.conn, db.conn, db.central
+        db.close(RuntimeError("x"))
+        self.assertEqual(self.opened, ["postgresql://t1", None])
+        self.assertEqual(sorted(self.closed, key=str), sorted(self.opened, key=str))
+
+
+class _FakeResolver:
+    def __init__(self):
+        self.calls = []
+
+    def cached(self, slug):
+        self.calls.append(str(slug).lower())
+        return True, SimpleNamespace(id=42, dsn="postgresql://t1")
+
+
+class _FakeAsyncPool:
+    def __init__(self, dsn):
+        self.dsn = dsn
+
+    @asynccontextmanager
+    async def connection(self):
+        yield self.dsn
+
+
+class AsyncTenantConnectionTests(unittest.TestCase):
+    def test_tenant_id_and_connection_come_from_one_lookup_and_checkout(self):
+        resolver = _FakeResolver()
+        db = AsyncDb("postgresql://central", "captar", resolver)
+        db._central = "postgresql://central"
+
+        async def _pool(dsn):
+            return _FakeAsyncPool(dsn)
+
+        db._pool = _pool
+        counter = {"n": 0}
+
+        async def run(slug):
+            token = _checkouts.set(counter)
+            try:
+                request = SimpleNamespace(headers={"X-Tenant": slug})
+                async with db.tenant_connection(request) as (tid, conn):
+                    return tid, conn
+            finally:
+                _checkouts.reset(token)
+
+        self.assertEqual(asyncio.run(run("Acme")), (42, "postgresql://t1"))
+        self.assertEqual(resolver.calls, ["acme"])
+        self.assertEqual(counter["n"], 1)
+        self.assertEqual(asyncio.run(run("captar")), (42, "postgresql://central"))
+
+
+if __name__ == "__main__":
+    unittest.main()
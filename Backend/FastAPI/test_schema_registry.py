@@ -0,0 +1,90 @@
+import os
+import sys
+import unittest
+from contextlib import contextmanager
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from SchemaRegistry import SchemaRegistry
+
+
+class _FakeCursor:
+    def __init__(self, conn):
+        self.connection = conn
+        self._row = None
+
+    def execute(self, sql, params=None):
+        self.connection.statements.append(sql)
+        if 'SELECT "Versao"' in sql:
+            v = self.connection.versions.get(params[0])
+            self._row = (v,) if v is not None else None
+        elif "INSERT INTO" in sql:
+            self.connection.pending[params[0]] = params[1]
+
+    def fetchone(self):
+        return self._row
+
+
+class _FakeConn:
+    def __init__(self):
+        self.statements = []
+        self.versions = {}
+        self.pending = {}
+        self.commits = 0
+
+    def cursor(self):
+        return _FakeCursor(self)
+
+    def commit(self):
+        self.versions.update(self.pending)
+        self.pending.clear()
+        self.commits += 1
+
+    def rollback(self):
+        self.pending.clear()
+
+
+class SchemaRegistryTests(unittest.TestCase):
+    def setUp(self):
+        self.conns = {}
+
+        @contextmanager
+        def get_db_connection(dsn=None):
+            yield self.conns.setdefault(dsn or "", _FakeConn())
+
+        self.registry = SchemaRegistry(get_db_connection, "captar")
+        self.calls = []
+
+    def _apply(self, cur):
+        self.calls.append(cur.connection)
+
+    def test_applies_once_per_dsn(self):
+        for _ in range(3):
+            self.assertTrue(self.registry.ensure("Metas", self._apply))
+            self.assertTrue(self.registry.ensure("Metas", self._apply, dsn="postgresql://t1"))
+        self.assertEqual(len(self.calls), 2)
+        self.assertEqual(self.conns[""].versions, {"Metas": 1})
+
+    def test_skips_apply_when_database_is_current(self):
+        conn = _FakeConn()
+        conn.versions["Metas"] = 2
+        self.assertTrue(self.registry.ensure("Metas", self._apply, dsn="x", version=2, cursor=conn.cursor()))
+        self.assertEqual(self.calls, [])
+        self.assertTrue(self.registry.ensure("Metas", self._apply, dsn="x", version=3, cursor=conn.cursor()))
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(conn.versions["Metas"], 3)
+
+    def test_failure_is_retried_after_backoff(self):
+        def boom(cur):
+            raise RuntimeError("lock timeout")
+
+        self.assertFalse(self.registry.ensure("Candidatos", boom))
+        self.assertFalse(self.registry.ensure("Candidatos", self._apply))
+        self.assertEqual(self.calls, [])
+        self.registry.retry = 0.0
+        self.assertTrue(self.registry.ensure("Candidatos", self._apply))
+        self.assertEqual(len(self.calls), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+import os
+import sys
+import asyncio
+import unittest
+
+from fastapi import HTTPException
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from SendRateLimiter import SendRateLimiter
+
+
+class SendRateLimiterTests(unittest.TestCase):
+    def setUp(self):
+        self._prev = {k: os.environ.get(k) for k in ("SEND_RATE_EVOLUTION_PER_SEC", "SEND_RATE_EVOLUTION_BURST")}
+        os.environ["SEND_RATE_EVOLUTION_PER_SEC"] = "10"
+        os.environ["SEND_RATE_EVOLUTION_BURST"] = "3"
+
+    def tearDown(self):
+        for k, v in self._prev.items():
+            if v is None:
+                os.environ.pop(k, None)
+            else:
+                os.environ[k] = v
+
+    def test_burst_then_wait_without_redis(self):
+        limiter = SendRateLimiter(lambda: None)
+        waits = [limiter.reserve("evolution", "inst-a")[1] for _ in range(4)]
+        self.assertEqual(waits[:3], [0.0, 0.0, 0.0])
+        self.assertGreater(waits[3], 0.0)
+        self.assertLessEqual(waits[3], 0.11)
+
+    def test_senders_have_independent_buckets(self):
+        limiter = SendRateLimiter(lambda: None)
+        for _ in range(3):
+            limiter.reserve("evolution", "inst-a")
+        granted, wait, _remaining = limiter.reserve("evolution", "inst-b")
+        self.assertTrue(granted)
+        self.assertEqual(wait, 0.0)
+        self.assertLess(limiter.capacity("evolution", "inst-a")["remaining"], 1.0)
+
+    def test_acquire_rejects_when_wait_exceeds_limit(self):
+        prev = os.environ.get("SEND_RATE_MAX_WAIT_SECONDS")
+        os.environ["SEND_RATE_MAX_WAIT_SECONDS"] = "0"
+        try:
+            limiter = SendRateLimiter(lambda: None)
+            for _ in range(3):
+                limiter.reserve("evolution", "inst-a")
+            with self.assertRaises(HTTPException) as ctx:
+                asyncio.run(limiter.acquire("evolution", "inst-a"))
+            self.assertEqual(ctx.exception.status_code, 429)
+            wait = asyncio.run(limiter.acquire("evolution", "inst-a", capped=False))
+            self.assertGreater(wait, 0.0)
+            self.assertLessEqual(wait, 0.21)
+        finally:
+            if prev is None:
+                os.environ.pop("SEND_RATE_MAX_WAIT_SECONDS", None)
+            else:
+                os.environ["SEND_RATE_MAX_WAIT_SECONDS"] = prev
+
+
+if __name__ == "__main__":
+    unittest.main()
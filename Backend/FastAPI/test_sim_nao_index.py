@@ -0,0 +1,55 @@
+import os
+import sys
+import unittest
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from SimNaoIndex import SimNaoIndex, phone_key
+
+
+class _FakeCursor:
+    def __init__(self, rows):
+        self.rows = rows
+        self.after_ids = []
+
+    def execute(self, sql, params):
+        self.after_ids.append(params[1])
+        self._result = [r for r in self.rows if r[0] > params[1]]
+
+    def fetchall(self):
+        return self._result
+
+
+class SimNaoIndexTests(unittest.TestCase):
+    def test_phone_key_ignores_country_code_and_ninth_digit(self):
+        key = phone_key("5592991234567")
+        self.assertEqual(key, "9291234567")
+        for raw in ("92991234567", "559291234567", "+55 (92) 99123-4567", "9291234567"):
+            self.assertEqual(phone_key(raw), key)
+        self.assertNotEqual(phone_key("5592991234568"), key)
+
+    def test_lookup_returns_newest_send_per_campaign(self):
+        t0 = datetime(2026, 5, 1, 10, 0, 0)
+        t1 = datetime(2026, 5, 1, 11, 0, 0)
+        cur = _FakeCursor([
+            (1, "5592991234567", 10, False, t0),
+            (2, "92991234567", 10, False, t1),
+            (3, "559291234567", 20, True, t0),
+            (4, "5592998887777", 10, False, t1),
+        ])
+        index = SimNaoIndex("captar", lambda request: None)
+        self.assertEqual(index.lookup(cur, None, 1, "5592991234567"), [(2, "92991234567", 10), (3, "559291234567", 20)])
+        self.assertEqual(index.lookup(cur, None, 1, "92991234567", meta_only=True), [(3, "559291234567", 20)])
+
+        index.refresh = 0.0
+        cur.rows.append((5, "5592991234567", 20, True, t1))
+        self.assertEqual(index.lookup(cur, None, 1, "5592991234567")[0], (5, "5592991234567", 20))
+        self.assertEqual(cur.after_ids[-1], 0)
+
+        index.invalidate(None, 1)
+        self.assertEqual(index.snapshot(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from TenantFanout import TenantFanout
+
+
+class TenantFanoutTests(unittest.TestCase):
+    def setUp(self):
+        self.fanout = TenantFanout(max_workers=8, timeout=0.5)
+
+    def tearDown(self):
+        self.fanout.shutdown()
+
+    def test_runs_tenants_concurrently_in_order(self):
+        def work(slug):
+            time.sleep(0.1)
+            return slug.upper()
+
+        t0 = time.monotonic()
+        results, report = self.fanout.run(["a", "b", "c", "d"], work)
+        self.assertLess(time.monotonic() - t0, 0.35)
+        self.assertEqual(results, [("a", "A"), ("b", "B"), ("c", "C"), ("d", "D")])
+        self.assertFalse(report["parcial"])
+
+    def test_slow_and_failing_tenants_are_reported(self):
+        def work(slug):
+            if slug == "lento":
+                time.sleep(1.0)
+            if slug == "quebrado":
+                raise RuntimeError("conexão recusada")
+            return 1
+
+        t0 = time.monotonic()
+        results, report = self.fanout.run(["ok", "lento", "quebrado"], work)
+        self.assertLess(time.monotonic() - t0, 0.8)
+        self.assertEqual(results, [("ok", 1)])
+        self.assertEqual(report["timeout"], ["lento"])
+        self.assertIn("quebrado", report["erros"])
+        self.assertTrue(report["parcial"])
+
+        results, report = self.fanout.run(["ok", "lento", "quebrado"], lambda slug: 2)
+        self.assertEqual(results, [("ok", 2)])
+        self.assertEqual(sorted(report["ignorados"]), ["lento", "quebrado"])
+
+    def test_tasks_that_never_started_are_not_put_on_cooldown(self):
+        fanout = TenantFanout(max_workers=1, timeout=0.2)
+        try:
+            def work(slug):
+                if slug == "lento":
+                    time.sleep(0.5)
+                return slug
+
+            results, report = fanout.run(["lento", "fila"], work)
+            self.assertEqual(results, [])
+            self.assertEqual(report["timeout"], ["lento"])
+            self.assertEqual(report["nao_iniciados"], ["fila"])
+            self.assertTrue(report["parcial"])
+
+            time.sleep(0.4)
+            results, report = fanout.run(["lento", "fila"], lambda slug: slug)
+            self.assertEqual(report["ignorados"], ["lento"])
+            self.assertEqual(results, [("fila", "fila")])
+        finally:
+            fanout.shutdown()
+
+
+if __name__ == "__main__":
+    unittest.main()
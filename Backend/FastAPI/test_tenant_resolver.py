@@ -0,0 +1,67 @@
+import os
+import sys
+import unittest
+from contextlib import contextmanager
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from TenantResolver import TenantContext, TenantResolver
+
+
+class _FakeCursor:
+    def __init__(self, db):
+        self.db = db
+        self._row = None
+
+    def execute(self, sql, params=None):
+        self.db.queries += 1
+        self._row = self.db.tenants.get(params[0])
+
+    def fetchone(self):
+        return self._row
+
+
+class _FakeDb:
+    def __init__(self):
+        self.queries = 0
+        self.tenants = {"acme": (7, "acme", "ACME", "postgresql://h/acme")}
+
+    @contextmanager
+    def connection(self, dsn=None):
+        db = self
+
+        class _Conn:
+            def cursor(self):
+                return _FakeCursor(db)
+
+        yield _Conn()
+
+
+class TenantResolverTests(unittest.TestCase):
+    def setUp(self):
+        self.db = _FakeDb()
+        self.resolver = TenantResolver(self.db.connection, "captar", lambda: None)
+
+    def test_resolves_once_and_serves_from_memory(self):
+        ctx = self.resolver.resolve("ACME")
+        self.assertEqual(ctx, TenantContext(7, "acme", "ACME", "postgresql://h/acme"))
+        for _ in range(5):
+            self.assertEqual(self.resolver.resolve("acme").dsn, "postgresql://h/acme")
+        self.assertEqual(self.db.queries, 1)
+        self.assertEqual(self.resolver.cached("acme"), (True, ctx))
+
+    def test_unknown_slug_is_negatively_cached(self):
+        self.assertIsNone(self.resolver.resolve("nope"))
+        self.assertIsNone(self.resolver.resolve("nope"))
+        self.assertEqual(self.db.queries, 1)
+
+    def test_invalidate_reloads(self):
+        self.resolver.resolve("acme")
+        self.db.tenants["acme"] = (7, "acme", "ACME", "postgresql://h/acme2")
+        self.resolver.invalidate("acme")
+        self.assertEqual(self.resolver.resolve("acme").dsn, "postgresql://h/acme2")
+        self.assertEqual(self.db.queries, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
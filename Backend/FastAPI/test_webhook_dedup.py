@@ -0,0 +1,57 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from WebhookDedup import WebhookDedup
+
+
+class _FakePipeline:
+    def __init__(self, rc):
+        self.rc = rc
+        self.ops = []
+
+    def set(self, name, value, nx=False, ex=None):
+        self.ops.append(name)
+        return self
+
+    def execute(self):
+        out = []
+        for name in self.ops:
+            out.append(None if name in self.rc.keys else True)
+            self.rc.keys.add(name)
+        return out
+
+
+class _FakeRedis:
+    def __init__(self):
+        self.keys = set()
+
+    def pipeline(self, transaction=True):
+        return _FakePipeline(self)
+
+    def delete(self, *names):
+        for n in names:
+            self.keys.discard(n)
+
+
+class WebhookDedupTests(unittest.TestCase):
+    def test_replays_are_dropped_until_released(self):
+        rc = _FakeRedis()
+        dedup = WebhookDedup(lambda: rc)
+        self.assertEqual(dedup.claim("meta", "acme", ["st:wamid.1|read", None, "st:wamid.1|read"]), [True, True, False])
+        self.assertEqual(dedup.claim("meta", "acme", ["st:wamid.1|read", "st:wamid.1|delivered"]), [False, True])
+        self.assertEqual(dedup.claim("meta", "outro", ["st:wamid.1|read"]), [True])
+        dedup.release("meta", "acme", ["st:wamid.1|delivered"])
+        self.assertEqual(dedup.claim("meta", "acme", ["st:wamid.1|delivered"]), [True])
+
+    def test_without_redis_everything_is_processed(self):
+        def broken():
+            raise ConnectionError("down")
+
+        self.assertEqual(WebhookDedup(broken).claim("twilio", "acme", ["in:SM1", "in:SM1"]), [True, True])
+
+
+if __name__ == "__main__":
+    unittest.main()
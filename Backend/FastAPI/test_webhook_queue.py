@@ -0,0 +1,101 @@
+import os
+import sys
+import asyncio
+import unittest
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from fastapi import HTTPException
+from starlette.requests import Request
+
+from WebhookQueue import WebhookQueue
+
+
+class _FakeRedis:
+    def __init__(self):
+        self.added = []
+        self.acked = []
+
+    def xadd(self, name, fields, maxlen=None, approximate=True):
+        self.added.append((name, fields))
+        return f"{len(self.added)}-0"
+
+    def xack(self, name, group, *ids):
+        self.acked.extend(ids)
+        return len(ids)
+
+
+def _request(body: bytes) -> Request:
+    scope = {
+        "type": "http",
+        "method": "POST",
+        "scheme": "https",
+        "server": ("api.captar.local", 443),
+        "path": "/api/integracoes/meta/webhook",
+        "root_path": "",
+        "query_string": b"tenant=acme",
+        "headers": [(b"x-tenant", b"acme"), (b"x-hub-signature-256", b"sha256=abc")],
+    }
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    return Request(scope, receive)
+
+
+class WebhookQueueTests(unittest.TestCase):
+    def setUp(self):
+        self.rc = _FakeRedis()
+        self.queue = WebhookQueue(lambda: self.rc)
+
+    def test_enqueued_event_replays_with_same_request(self):
+        body = b'{"entry": [{"id": "1"}]}'
+        self.assertEqual(self.queue.enqueue("meta", _request(body), body), "1-0")
+        stream, fields = self.rc.added[0]
+        self.assertEqual(stream, "webhooks:meta")
+
+        replay = self.queue.replay_request(fields)
+        self.assertTrue(replay.scope["webhook_replay"])
+        self.assertFalse(self.queue.should_enqueue(replay))
+        self.assertEqual(replay.headers["x-tenant"], "acme")
+        self.assertEqual(replay.query_params["tenant"], "acme")
+        self.assertEqual(str(replay.url), "https://api.captar.local/api/integracoes/meta/webhook?tenant=acme")
+        self.assertEqual(asyncio.run(replay.body()), body)
+
+    def test_only_handled_entries_are_acked(self):
+        async def handler(request):
+            body = await request.body()
+            if body == b"boom":
+                raise RuntimeError("db down")
+            if body == b"bad":
+                raise HTTPException(status_code=403, detail="Assinatura inválida.")
+            return {"ok": True}
+
+        self.queue.register("meta", handler)
+        for b in (b"ok", b"boom", b"bad"):
+            self.queue.enqueue("meta", _request(b), b)
+        entries = [(name, f"{i + 1}-0", fields) for i, (name, fields) in enumerate(self.rc.added)]
+        self.assertEqual(asyncio.run(self.queue.process(entries)), 2)
+        self.assertEqual(self.rc.acked, ["1-0", "3-0"])
+
+    def test_batch_handler_gets_whole_batch_in_one_call(self):
+        calls = []
+
+        async def handler(request):
+            raise AssertionError("batch kinds must not replay one request per entry")
+
+        def batch_handler(items):
+            calls.append([(i.entry_id, i.headers.get("x-tenant"), i.query.get("tenant"), i.body) for i in items])
+            return [i.entry_id for i in items if i.body != b"boom"]
+
+        self.queue.register("evolution", handler, batch_handler=batch_handler)
+        for b in (b"a", b"boom", b"c"):
+            self.queue.enqueue("evolution", _request(b), b)
+        entries = [(name, f"{i + 1}-0", fields) for i, (name, fields) in enumerate(self.rc.added)]
+        self.assertEqual(asyncio.run(self.queue.process(entries)), 2)
+        self.assertEqual(calls, [[("1-0", "acme", "acme", b"a"), ("2-0", "acme", "acme", b"boom"), ("3-0", "acme", "acme", b"c")]])
+        self.assertEqual(self.rc.acked, ["1-0", "3-0"])
+
+
+if __name__ == "__main__":
+    unittest.main()